@@ -118,7 +118,9 @@ class HttpClient(atom.http_interface.GenericHttpClient):
       http_request = atom.http_core.HttpRequest(method=operation)
       atom.http_core.Uri.parse_uri(str(url)).modify_request(http_request)
       http_request.headers = all_headers
-      if data:
+      if isinstance(data, list):
+        http_request._body_parts.extend(data)
+      elif data:
         http_request._body_parts.append(data)
       return self.v2_http_client.request(http_request=http_request)
 
@@ -193,6 +195,38 @@ class HttpClient(atom.http_interface.GenericHttpClient):
     return url.to_string()
 
 
+class KeepAliveHttpClient(HttpClient):
+  """Performs HTTP requests over connections which are kept open and reused.
+
+  Requests are sent using an atom.http_core.KeepAliveHttpClient so that
+  services built on atom.service.AtomService, such as
+  gdata.service.GDataService and its subclasses, reuse connections to the
+  server. One client may be shared by many threads. Proxy settings in the
+  environment are not used.
+
+  Usage:
+    >>> client = gdata.youtube.service.YouTubeService(
+            http_client=atom.http.KeepAliveHttpClient())
+  """
+
+  def __init__(self, headers=None, max_connections=10):
+    self.v2_http_client = atom.http_core.KeepAliveHttpClient(
+        max_connections=max_connections)
+    HttpClient.__init__(self, headers=headers)
+
+  def _get_debug(self):
+    return self.v2_http_client.debug
+
+  def _set_debug(self, value):
+    self.v2_http_client.debug = value
+
+  debug = property(_get_debug, _set_debug)
+
+  def close(self):
+    """Closes all of the open connections."""
+    self.v2_http_client.close()
+
+
 class ProxiedHttpClient(HttpClient):
   """Performs an HTTP request through a proxy.
   
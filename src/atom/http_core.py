@@ -23,7 +23,9 @@ __author__ = 'j.s@google.com (Jeff Scudder)'
 
 
 import os
+import socket
 import StringIO
+import threading
 import urlparse
 import urllib
 import httplib
@@ -585,6 +587,159 @@ class ProxiedHttpClient(HttpClient):
     return None
 
 
+class _PooledConnection(object):
+  """Tracks the state of a connection held by a KeepAliveHttpClient.
+
+  The connection is busy from the time it is handed out until the response
+  to its request has been read completely, closed or dropped.
+  """
+
+  def __init__(self, connection):
+    self.connection = connection
+    self.busy = True
+
+  def is_idle(self):
+    return not self.busy
+
+
+class _PooledResponse(object):
+  """Wraps a response so that its pooled connection is always freed.
+
+  Once the body has been read completely, the connection is free for the
+  next request. If the response is closed or garbage collected before then,
+  the unread rest of the body would be mistaken for the next response, so
+  the connection is closed instead. It is opened again when it is next used.
+  """
+
+  def __init__(self, response, pooled_connection):
+    self._response = response
+    self._pooled_connection = pooled_connection
+
+  def __getattr__(self, name):
+    return getattr(self._response, name)
+
+  def read(self, amt=None):
+    data = self._response.read(amt)
+    if self._response.isclosed():
+      self._release()
+    return data
+
+  def close(self):
+    self._release()
+    self._response.close()
+
+  def __del__(self):
+    self._release()
+
+  def _release(self):
+    pooled_connection = self._pooled_connection
+    if pooled_connection is None:
+      return
+    self._pooled_connection = None
+    if self._response.length == 0:
+      # Nothing is left to read, so the connection may be used again.
+      self._response.close()
+    elif not self._response.isclosed():
+      pooled_connection.connection.close()
+    pooled_connection.busy = False
+
+
+class KeepAliveHttpClient(HttpClient):
+  """Performs HTTP requests using httplib, reusing open connections.
+
+  Connections are kept open using HTTP/1.1 keep-alive and are reused for
+  later requests to the same scheme, host and port once the previous response
+  has been read completely. One client may be shared by many threads. At most
+  max_connections connections are remembered for each host. When all of them
+  are in use, additional requests are sent on new connections which are not
+  reused. A response which is closed or dropped before it has been read
+  completely closes its connection, so that the connection can be opened
+  again for a later request.
+
+  Unlike ProxiedHttpClient, this client ignores the http_proxy and
+  https_proxy environment variables.
+  """
+
+  def __init__(self, max_connections=10):
+    self.max_connections = max_connections
+    self._connections = {}
+    self._lock = threading.Lock()
+    self._current = threading.local()
+
+  def _get_connection(self, uri, headers=None):
+    key = (uri.scheme, uri.host, uri.port)
+    self._lock.acquire()
+    try:
+      pooled = self._connections.setdefault(key, [])
+      if not getattr(self._current, 'force_new', False):
+        for pooled_connection in pooled:
+          if pooled_connection.is_idle():
+            pooled_connection.busy = True
+            self._current.pooled_connection = pooled_connection
+            self._current.reused = True
+            return pooled_connection.connection
+      connection = HttpClient._get_connection(self, uri, headers=headers)
+      if len(pooled) < self.max_connections:
+        pooled_connection = _PooledConnection(connection)
+        pooled.append(pooled_connection)
+        self._current.pooled_connection = pooled_connection
+      return connection
+    finally:
+      self._lock.release()
+
+  def _http_request(self, method, uri, headers=None, body_parts=None):
+    self._current.force_new = False
+    try:
+      return self._pooled_http_request(method, uri, headers, body_parts)
+    except (httplib.HTTPException, socket.error):
+      # The server may have closed a connection which was idle. Try again on
+      # a new connection, unless the request body was read from a file and
+      # can not be sent again.
+      if self._current.reused and not [part for part in body_parts or []
+                                       if hasattr(part, 'read')]:
+        self._current.force_new = True
+        return self._pooled_http_request(method, uri, headers, body_parts)
+      raise
+
+  def _pooled_http_request(self, method, uri, headers, body_parts):
+    self._current.pooled_connection = None
+    self._current.reused = False
+    try:
+      response = HttpClient._http_request(self, method, uri, headers,
+                                          body_parts)
+    except:
+      if self._current.pooled_connection is not None:
+        self._discard(self._current.pooled_connection)
+      raise
+    pooled_connection = self._current.pooled_connection
+    if pooled_connection is not None:
+      response = _PooledResponse(response, pooled_connection)
+    return response
+
+  def _discard(self, pooled_connection):
+    pooled_connection.connection.close()
+    self._lock.acquire()
+    try:
+      for pooled in self._connections.itervalues():
+        if pooled_connection in pooled:
+          pooled.remove(pooled_connection)
+    finally:
+      self._lock.release()
+
+  def close(self):
+    """Closes all of the connections held by this client."""
+    self._lock.acquire()
+    try:
+      for pooled in self._connections.itervalues():
+        for pooled_connection in pooled:
+          pooled_connection.connection.close()
+      self._connections = {}
+    finally:
+      self._lock.release()
+
+  Close = close
+
+
 def _get_proxy_auth():
   import base64
   proxy_username = os.environ.get('proxy-username')
@@ -25,6 +25,8 @@ import StringIO
 import pickle
 import os.path
 import tempfile
+import threading
+import time
 import atom.http_core
 
 
@@ -303,6 +305,139 @@ class SettableHttpClient(object):
     return self.response
 
 
+class FakeHttpServer(object):
+  """Answers requests from state kept in memory, for use in tests.
+
+  Subclasses override respond, which is given each request and its body
+  and returns an atom.http_core.HttpResponse. Requests are recorded and
+  passed to respond one at a time while holding lock, so respond does not
+  have to be thread safe. Any latency is spent outside of the lock, so that
+  tests can see how many requests a client sends at the same time.
+
+  A FakeHttpServer can be used as the http_client of version 2 clients,
+  which pass an atom.http_core.HttpRequest to request, and of version 1
+  services, which pass the operation, URL, data and headers instead.
+
+  Attributes:
+    requests: list of the atom.http_core.HttpRequest objects received, in
+        order. The body parts of each are joined into one string.
+    latency: float The number of seconds to wait before each response.
+    active: int The number of requests which are being answered.
+    max_active: int The most requests which were answered at the same time.
+    lock: threading.Lock held while a request is recorded or answered.
+  """
+
+  latency = 0
+
+  def __init__(self):
+    self.requests = []
+    self.active = 0
+    self.max_active = 0
+    self.lock = threading.Lock()
+    self._failures = []
+
+  def fail_requests(self, status=503, reason='Service Unavailable',
+                    count=None, path=None, method=None):
+    """Answers matching requests with an error instead of calling respond.
+
+    The failed requests are recorded like all others. Later calls add more
+    failures, which are used after the earlier ones are used up.
+
+    Args:
+      status: int (optional) The HTTP status of the error response.
+      reason: str (optional) The reason sent with the status.
+      count: int (optional) The number of requests to fail. By default all
+          matching requests fail.
+      path: str (optional) Only fail requests for this URL path.
+      method: str (optional) Only fail requests using this HTTP method.
+    """
+    self._failures.append([status, reason, count, path, method])
+
+  FailRequests = fail_requests
+
+  def request(self, http_request, url=None, data=None, headers=None):
+    if not isinstance(http_request, atom.http_core.HttpRequest):
+      http_request = _v1_request(http_request, url, data, headers)
+    body = read_body(http_request)
+    http_request._body_parts = [body]
+    self.lock.acquire()
+    try:
+      self.requests.append(http_request)
+      self.active += 1
+      self.max_active = max(self.max_active, self.active)
+    finally:
+      self.lock.release()
+    try:
+      if self.latency:
+        time.sleep(self.latency)
+      self.lock.acquire()
+      try:
+        response = self._get_failure(http_request)
+        if response is None:
+          response = self.respond(http_request, body)
+        return response
+      finally:
+        self.lock.release()
+    finally:
+      self.lock.acquire()
+      self.active -= 1
+      self.lock.release()
+
+  def respond(self, http_request, body):
+    """Returns the atom.http_core.HttpResponse to a request.
+
+    Subclasses override this method to serve their requests. This one
+    answers every request with 501 Not Implemented, as a server does for a
+    method which it does not support.
+
+    Args:
+      http_request: atom.http_core.HttpRequest The request to answer.
+      body: str The body of the request.
+    """
+    return atom.http_core.HttpResponse(501, 'Not Implemented', body='')
+
+  def _get_failure(self, http_request):
+    for failure in self._failures:
+      status, reason, count, path, method = failure
+      if path is not None and http_request.uri.path != path:
+        continue
+      if method is not None and http_request.method != method:
+        continue
+      if count is not None:
+        failure[2] -= 1
+        if failure[2] <= 0:
+          self._failures.remove(failure)
+      return atom.http_core.HttpResponse(status, reason, body='')
+    return None
+
+
+def read_body(http_request):
+  """Returns the body parts of a request joined into one string."""
+  body = []
+  for part in http_request._body_parts:
+    if hasattr(part, 'read'):
+      part = part.read()
+    elif isinstance(part, unicode):
+      part = part.encode('utf-8')
+    body.append(part)
+  return ''.join(body)
+
+
+def _v1_request(operation, url, data, headers):
+  """Converts the arguments of a version 1 request to an HttpRequest."""
+  http_request = atom.http_core.HttpRequest(
+      uri=atom.http_core.Uri.parse_uri(str(url)), method=operation,
+      headers=dict(headers or {}))
+  if data is not None:
+    if not isinstance(data, list):
+      data = [data]
+    for part in data:
+      if not isinstance(part, basestring) and not hasattr(part, 'read'):
+        part = str(part)
+      http_request._body_parts.append(part)
+  return http_request
+
+
 class MockHttpResponse(atom.http_core.HttpResponse):
 
   def __init__(self, status=None, reason=None, headers=None, body=None):
@@ -28,17 +28,30 @@ it will not be used in future requests.
 __author__ = 'api.jscudder (Jeff Scudder)'
 
 
+import threading
 import atom.http_interface
 import atom.url
 
 
 SCOPE_ALL = 'http'
+# The maximum number of URLs for which find_token remembers the token found.
+MAX_CACHED_LOOKUPS = 1000
 
 
 class TokenStore(object):
-  """Manages Authorization tokens which will be sent in HTTP headers."""
+  """Manages Authorization tokens which will be sent in HTTP headers.
+
+  A TokenStore may be shared by several threads. The token found for each
+  URL is remembered, so the scopes of a token must not be changed after it
+  has been added. To change them, remove the token and add it again.
+  """
   def __init__(self, scoped_tokens=None):
     self._tokens = scoped_tokens or {}
+    # Maps (protocol, host, port, path) to the token found for that URL.
+    # Cleared whenever the stored tokens change.
+    self._found_tokens = {}
+    # Held while _tokens or _found_tokens is read or changed.
+    self._lock = threading.Lock()
 
   def add_token(self, token):
     """Adds a new token to the store (replaces tokens with the same scope).
@@ -56,8 +69,13 @@ class TokenStore(object):
     if not hasattr(token, 'scopes') or not token.scopes:
       return False
 
-    for scope in token.scopes:
-      self._tokens[str(scope)] = token
+    self._lock.acquire()
+    try:
+      for scope in token.scopes:
+        self._tokens[str(scope)] = token
+      self._found_tokens = {}
+    finally:
+      self._lock.release()
     return True  
 
   def find_token(self, url):
@@ -80,6 +98,24 @@ class TokenStore(object):
       return None
     if isinstance(url, (str, unicode)):
       url = atom.url.parse_url(url)
+    # Checking every token's scopes is slow, so the token found for each
+    # URL (ignoring the query parameters) is remembered.
+    lookup_key = (url.protocol, url.host, url.port, url.path)
+    self._lock.acquire()
+    try:
+      try:
+        return self._found_tokens[lookup_key]
+      except KeyError:
+        pass
+      token = self._find_token(url)
+      if len(self._found_tokens) >= MAX_CACHED_LOOKUPS:
+        self._found_tokens = {}
+      self._found_tokens[lookup_key] = token
+      return token
+    finally:
+      self._lock.release()
+
+  def _find_token(self, url):
     if url in self._tokens:
       token = self._tokens[url]
       if token.valid_for_scope(url):
@@ -105,13 +141,23 @@ class TokenStore(object):
     """
     token_found = False
     scopes_to_delete = []
-    for scope, stored_token in self._tokens.iteritems():
-      if stored_token == token:
-        scopes_to_delete.append(scope)
-        token_found = True
-    for scope in scopes_to_delete:
-      del self._tokens[scope]
+    self._lock.acquire()
+    try:
+      for scope, stored_token in self._tokens.iteritems():
+        if stored_token == token:
+          scopes_to_delete.append(scope)
+          token_found = True
+      for scope in scopes_to_delete:
+        del self._tokens[scope]
+      self._found_tokens = {}
+    finally:
+      self._lock.release()
     return token_found
 
   def remove_all_tokens(self):
-    self._tokens = {} 
+    self._lock.acquire()
+    try:
+      self._tokens = {}
+      self._found_tokens = {}
+    finally:
+      self._lock.release()
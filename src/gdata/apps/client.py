@@ -18,11 +18,42 @@
 __author__ = '<Shraddha Gupta shraddhag@google.com>'
 
 
+import csv
+import httplib
+import os
+import re
+import socket
+import threading
+import time
 import gdata.apps.data
 import gdata.client
 import gdata.service
 
 
+# The number of users UserProvisioner sends requests for at the same time.
+MAX_CONCURRENT_REQUESTS = 8
+# How many times UserProvisioner repeats a request which failed with one of
+# RETRY_STATUSES or a network error.
+MAX_RETRIES = 3
+RETRY_STATUSES = (500, 502, 503, 504)
+# The seconds to wait before the first retry. Each later retry waits twice
+# as long as the one before.
+RETRY_DELAY = 1.0
+# The errorCode of an AppsForYourDomainErrors response to the creation of a
+# user who already exists.
+ENTITY_EXISTS = 1300
+# The errorCode of an AppsForYourDomainErrors response to a request for a
+# user who does not exist.
+ENTITY_DOES_NOT_EXIST = 1301
+# The columns of a user spec, as given to UserProvisioner.run.
+USER_SPEC_FIELDS = ('action', 'user_name', 'given_name', 'family_name',
+                    'password', 'hash_function', 'admin', 'suspended',
+                    'change_password', 'quota')
+# The columns of the table written by ProvisioningReport.write_csv.
+REPORT_FIELDS = ('position', 'action', 'user_name', 'status', 'code',
+                 'attempts', 'reason')
+
+
 class AppsClient(gdata.client.GDClient):
   """Client extension for the Google Provisioning API service.
 
@@ -90,6 +121,8 @@ class AppsClient(gdata.client.GDClient):
         change_password=change_password)
     user_entry.name = gdata.apps.data.Name(family_name=family_name,
                                            given_name=given_name)
+    if quota_limit is not None:
+      user_entry.quota = gdata.apps.data.Quota(limit=str(quota_limit))
     return self.Post(user_entry, uri)
 
   def RetrieveUser(self, user_name):
@@ -201,3 +234,436 @@ class AppsClient(gdata.client.GDClient):
 
     uri = '%s/%s' % (self._nicknameURL(), nickname)
     self.Delete(uri)
+
+
+def _parse_boolean(value):
+  """Returns 'true' or 'false' for a spec value, or None if it is blank."""
+  if value is None:
+    return None
+  if isinstance(value, bool):
+    return value and 'true' or 'false'
+  value = str(value).strip().lower()
+  if not value:
+    return None
+  if value in ('true', 'yes', 'y', '1'):
+    return 'true'
+  if value in ('false', 'no', 'n', '0'):
+    return 'false'
+  raise ValueError('Not a boolean: %r' % value)
+
+
+def _normalize_spec(spec):
+  """Returns a dict with the USER_SPEC_FIELDS of a user spec.
+
+  Column names are matched without case, email, first_name, last_name and
+  is_admin are accepted for user_name, given_name, family_name and admin,
+  and blank values become None so that rows from csv.DictReader can be
+  given as they are.
+  """
+  aliases = {'email': 'user_name', 'first_name': 'given_name',
+             'last_name': 'family_name', 'is_admin': 'admin'}
+  normalized = dict.fromkeys(USER_SPEC_FIELDS)
+  for key, value in spec.items():
+    if key is None:
+      continue
+    key = key.strip().lower()
+    key = aliases.get(key, key)
+    if key not in normalized:
+      continue
+    if isinstance(value, basestring):
+      value = value.strip() or None
+    normalized[key] = value
+  normalized['action'] = (normalized['action'] or 'create').lower()
+  return normalized
+
+
+def _check_spec(spec):
+  """Raises a ValueError if a normalized spec cannot be applied.
+
+  Boolean fields are changed to 'true' or 'false' on the way.
+  """
+  if spec['action'] not in ('create', 'update', 'delete'):
+    raise ValueError('Unknown action: %r' % spec['action'])
+  if not spec['user_name']:
+    raise ValueError('The user spec has no user_name or email.')
+  for key in ('admin', 'suspended', 'change_password'):
+    spec[key] = _parse_boolean(spec[key])
+  if spec['action'] == 'create':
+    missing = [key for key in ('given_name', 'family_name', 'password')
+               if not spec[key]]
+    if missing:
+      raise ValueError('A new user needs a %s.' % ', '.join(missing))
+
+
+def _apps_error_code(error):
+  """Returns the errorCode and reason of an AppsForYourDomainErrors body."""
+  match = re.search(r'errorCode="(\d+)"[^>]*reason="([^"]*)"',
+                    error.body or '')
+  if match is None:
+    return None, None
+  return int(match.group(1)), match.group(2)
+
+
+class ProvisioningJournal(object):
+  """Remembers which user specs were applied, so a run can be restarted.
+
+  Each applied spec adds an 'action<TAB>user_name' line to the file, which
+  is flushed at once, so that the line survives if the process is killed.
+  Before the first request for a spec is sent, an
+  'action<TAB>user_name<TAB>sent' line is added, and a spec which the server
+  refused adds an 'action<TAB>user_name<TAB>failed' line. A spec which was
+  sent but neither applied nor refused may have been applied by a request
+  whose response was lost. A line which was cut short by a crash is ignored
+  when the file is read.
+  """
+
+  def __init__(self, path):
+    self.path = path
+    self._done = set()
+    self._sent = set()
+    if os.path.exists(path):
+      journal_file = open(path, 'rb')
+      try:
+        for line in journal_file:
+          if not line.endswith('\n'):
+            break
+          fields = line.rstrip('\n').split('\t')
+          if len(fields) == 2:
+            self._done.add(tuple(fields))
+          elif len(fields) == 3 and fields[2] == 'sent':
+            self._sent.add(tuple(fields[:2]))
+          elif len(fields) == 3 and fields[2] == 'failed':
+            self._sent.discard(tuple(fields[:2]))
+      finally:
+        journal_file.close()
+    self._file = None
+
+  def is_done(self, action, user_name):
+    return (action, user_name) in self._done
+
+  IsDone = is_done
+
+  def was_sent(self, action, user_name):
+    """Returns True if an earlier request for the spec may have applied it."""
+    return (action, user_name) in self._sent
+
+  WasSent = was_sent
+
+  def record(self, action, user_name):
+    self._write('%s\t%s\n' % (action, user_name))
+    self._done.add((action, user_name))
+
+  Record = record
+
+  def record_sent(self, action, user_name):
+    self._write('%s\t%s\tsent\n' % (action, user_name))
+    self._sent.add((action, user_name))
+
+  RecordSent = record_sent
+
+  def record_failed(self, action, user_name):
+    self._write('%s\t%s\tfailed\n' % (action, user_name))
+    self._sent.discard((action, user_name))
+
+  RecordFailed = record_failed
+
+  def _write(self, line):
+    if self._file is None:
+      self._file = open(self.path, 'ab')
+    self._file.write(line)
+    self._file.flush()
+
+  def close(self):
+    if self._file is not None:
+      self._file.close()
+      self._file = None
+
+  Close = close
+
+
+class ProvisioningResult(object):
+  """The outcome of one user spec given to UserProvisioner.run.
+
+  Attributes:
+    position: int The index of the spec in the iterable given to run.
+    action: string 'create', 'update' or 'delete'.
+    user_name: string The user name or email address of the user.
+    status: string 'created', 'updated' or 'deleted' if the spec was
+        applied, 'skipped' if the journal shows it was applied by an earlier
+        run, or 'failed'.
+    code: int The HTTP status of the last failed request, if any.
+    reason: string Why the spec failed, if it did.
+    attempts: int The number of times the change was requested.
+  """
+
+  def __init__(self, position, action, user_name, status=None, code=None,
+               reason=None, attempts=0):
+    self.position = position
+    self.action = action
+    self.user_name = user_name
+    self.status = status
+    self.code = code
+    self.reason = reason
+    self.attempts = attempts
+
+  def succeeded(self):
+    return self.status != 'failed'
+
+  Succeeded = succeeded
+
+
+class ProvisioningReport(object):
+  """The results of a UserProvisioner run.
+
+  Attributes:
+    results: list of ProvisioningResult, in the order of the user specs.
+    seconds: float How long the run took.
+  """
+
+  def __init__(self):
+    self.results = []
+    self.seconds = 0.0
+
+  def get_failures(self):
+    """Returns the ProvisioningResults of the specs which failed."""
+    return [result for result in self.results if not result.succeeded()]
+
+  GetFailures = get_failures
+
+  def write_csv(self, output):
+    """Writes the results as a table with the REPORT_FIELDS columns.
+
+    Args:
+      output: A file-like object to write the CSV rows to.
+    """
+    writer = csv.writer(output)
+    writer.writerow(REPORT_FIELDS)
+    for result in self.results:
+      writer.writerow([getattr(result, field) for field in REPORT_FIELDS])
+
+  WriteCsv = write_csv
+
+
+class UserProvisioner(object):
+  """Creates, updates and deletes many users with concurrent requests.
+
+  User specs are dicts with the USER_SPEC_FIELDS, such as the rows of a
+  csv.DictReader. The action column defaults to 'create'. An update only
+  changes the fields which are given. Specs are read from the iterable as
+  threads become free, so a large file need not be held in memory.
+
+  Works with an AppsClient, where user_name is the login within the
+  client's domain, and with a
+  gdata.apps.multidomain.client.MultiDomainProvisioningClient, where it is
+  the full email address.
+
+  Example:
+    provisioner = gdata.apps.client.UserProvisioner(
+        client, requests_per_second=5, journal_path='users.journal')
+    report = provisioner.run(csv.DictReader(open('users.csv', 'rb')))
+    report.write_csv(open('results.csv', 'wb'))
+  """
+
+  def __init__(self, client, max_concurrent=MAX_CONCURRENT_REQUESTS,
+               requests_per_second=None, max_retries=MAX_RETRIES,
+               journal_path=None, retry_delay=RETRY_DELAY):
+    """Creates a UserProvisioner.
+
+    Args:
+      client: AppsClient or MultiDomainProvisioningClient used to send the
+          requests.
+      max_concurrent: int (optional) The number of users to provision at the
+          same time.
+      requests_per_second: float (optional) If given, no more requests are
+          started each second, counting retries.
+      max_retries: int (optional) How many times to repeat a request which
+          failed with one of RETRY_STATUSES or a network error.
+      journal_path: string (optional) A file which records the specs which
+          were applied. Specs recorded by an earlier run are skipped. If an
+          earlier run stopped after sending a spec, a user who already
+          exists counts as created and a missing user as deleted.
+      retry_delay: float (optional) The seconds to wait before the first
+          retry. Later retries wait twice as long each time.
+    """
+    self.client = client
+    self.max_concurrent = max_concurrent
+    self.max_retries = max_retries
+    self.journal_path = journal_path
+    self.retry_delay = retry_delay
+    self._limiter = None
+    if requests_per_second:
+      self._limiter = gdata.client.RateLimiter(requests_per_second)
+
+  def run(self, specs):
+    """Applies each of the user specs.
+
+    Args:
+      specs: An iterable of dicts with the USER_SPEC_FIELDS.
+
+    Returns:
+      A ProvisioningReport.
+    """
+    journal = None
+    if self.journal_path is not None:
+      journal = ProvisioningJournal(self.journal_path)
+    client, pooled_http_client = gdata.client.keep_alive_client(
+        self.client, self.max_concurrent)
+    report = ProvisioningReport()
+    lock = threading.Lock()
+
+    def provision_user(job):
+      position, spec = job
+      spec = _normalize_spec(spec)
+      result = ProvisioningResult(position, spec['action'], spec['user_name'])
+      try:
+        _check_spec(spec)
+      except ValueError, error:
+        result.status = 'failed'
+        result.reason = str(error)
+        return result
+      if journal is not None and journal.is_done(result.action,
+                                                 result.user_name):
+        result.status = 'skipped'
+        return result
+      sent = False
+      if journal is not None:
+        lock.acquire()
+        try:
+          sent = journal.was_sent(result.action, result.user_name)
+          if not sent:
+            journal.record_sent(result.action, result.user_name)
+        finally:
+          lock.release()
+      self._provision(client, spec, result, sent)
+      if journal is not None:
+        lock.acquire()
+        try:
+          if result.status != 'failed':
+            journal.record(result.action, result.user_name)
+          elif result.code is not None and result.code not in RETRY_STATUSES:
+            # The server refused the change, so it was not applied.
+            journal.record_failed(result.action, result.user_name)
+        finally:
+          lock.release()
+      return result
+
+    start = time.time()
+    try:
+      report.results = gdata.client.run_concurrently(
+          provision_user, enumerate(specs), self.max_concurrent)
+    finally:
+      if pooled_http_client is not None:
+        pooled_http_client.close()
+      if journal is not None:
+        journal.close()
+    report.seconds = time.time() - start
+    return report
+
+  Run = run
+
+  def _provision(self, client, spec, result, sent=False):
+    """Applies one normalized spec, retrying failures which may pass.
+
+    Args:
+      client: The client to send the requests with.
+      spec: dict A user spec which was normalized and checked.
+      result: ProvisioningResult Updated with the outcome.
+      sent: boolean (optional) True if an earlier run sent a request for
+          this spec which may have been applied.
+    """
+    statuses = {'create': 'created', 'update': 'updated', 'delete': 'deleted'}
+    while True:
+      if self._limiter is not None:
+        self._limiter.wait()
+      result.attempts += 1
+      try:
+        if isinstance(client, AppsClient):
+          self._apply_apps(client, spec)
+        else:
+          self._apply_multidomain(client, spec)
+        result.status = statuses[spec['action']]
+        return
+      except gdata.client.RequestError, error:
+        result.code = error.status
+        error_code, reason = _apps_error_code(error)
+        result.reason = reason or error.reason
+        if sent or result.attempts > 1:
+          # An earlier attempt may have applied the change but its response
+          # was lost.
+          if error_code == ENTITY_EXISTS and spec['action'] == 'create':
+            result.status = 'created'
+            return
+          if (error_code == ENTITY_DOES_NOT_EXIST
+              and spec['action'] == 'delete'):
+            result.status = 'deleted'
+            return
+        retry = error.status in RETRY_STATUSES
+      except (socket.error, httplib.HTTPException), error:
+        result.code = None
+        result.reason = str(error)
+        retry = True
+      except Exception, error:
+        # Anything else, such as a response which cannot be parsed, fails
+        # this user without stopping the others.
+        result.code = None
+        result.reason = str(error)
+        retry = False
+      if not retry or result.attempts > self.max_retries:
+        result.status = 'failed'
+        return
+      time.sleep(self.retry_delay * 2 ** (result.attempts - 1))
+
+  def _apply_apps(self, client, spec):
+    user_name = spec['user_name']
+    if spec['action'] == 'create':
+      client.CreateUser(user_name, spec['family_name'], spec['given_name'],
+                        spec['password'], suspended=spec['suspended'],
+                        admin=spec['admin'], quota_limit=spec['quota'],
+                        password_hash_function=spec['hash_function'],
+                        change_password=spec['change_password'])
+    elif spec['action'] == 'delete':
+      client.DeleteUser(user_name)
+    else:
+      entry = client.RetrieveUser(user_name)
+      login = entry.login
+      for field, attribute in (('password', 'password'),
+                               ('hash_function', 'hash_function_name'),
+                               ('admin', 'admin'),
+                               ('suspended', 'suspended'),
+                               ('change_password', 'change_password')):
+        if spec[field] is not None:
+          setattr(login, attribute, spec[field])
+      if spec['given_name'] is not None:
+        entry.name.given_name = spec['given_name']
+      if spec['family_name'] is not None:
+        entry.name.family_name = spec['family_name']
+      if spec['quota'] is not None:
+        entry.quota = gdata.apps.data.Quota(limit=str(spec['quota']))
+      client.UpdateUser(user_name, entry)
+
+  def _apply_multidomain(self, client, spec):
+    email = spec['user_name']
+    if spec['action'] == 'create':
+      client.create_user(email, spec['given_name'], spec['family_name'],
+                         spec['password'], spec['admin'] or 'false',
+                         hash_function=spec['hash_function'],
+                         suspended=spec['suspended'],
+                         change_password=spec['change_password'],
+                         quota=spec['quota'])
+    elif spec['action'] == 'delete':
+      client.delete_user(email)
+    else:
+      entry = client.retrieve_user(email)
+      for field, attribute in (('given_name', 'first_name'),
+                               ('family_name', 'last_name'),
+                               ('password', 'password'),
+                               ('hash_function', 'hash_function'),
+                               ('admin', 'is_admin'),
+                               ('suspended', 'suspended'),
+                               ('change_password',
+                                'change_password_at_next_login')):
+        if spec[field] is not None:
+          setattr(entry, attribute, spec[field])
+      if spec['quota'] is not None:
+        entry.quota = str(spec['quota'])
+      client.update_user(email, entry)
@@ -17,6 +17,7 @@
 """Contains the methods to import mail via Google Apps Email Migration API.
 
   MigrationService: Provides methods to import mail.
+  MigrationEngine: Imports a stream of messages in concurrent batches.
 """
 
 __author__ = ('google-apps-apis@googlegroups.com',
@@ -24,16 +25,30 @@ __author__ = ('google-apps-apis@googlegroups.com',
 
 
 import base64
+import binascii
+import mailbox
+import os
 import threading
 import time
 from atom.service import deprecation
 from gdata.apps import migration
 from gdata.apps.migration import MailEntryProperties
 import gdata.apps.service
+import gdata.client
 import gdata.service
 
 
 API_VER = '2.0'
+# Limits for the batches sent by MigrationEngine. The size of a batch is
+# estimated from the base64 encoded messages it holds.
+MAX_BATCH_ENTRIES = 100
+MAX_BATCH_BYTES = 16 * 1024 * 1024
+MAX_CONCURRENT_BATCHES = 4
+# The estimated size of the XML around each message in a batch.
+BATCH_ENTRY_OVERHEAD = 1024
+# The number of message bytes which Base64Stream encodes at a time. A
+# multiple of 3, so that no padding is written until the end.
+ENCODE_CHUNK_SIZE = 3 * 32 * 1024
 
 
 class MigrationService(gdata.apps.service.AppsService):
@@ -43,13 +58,15 @@ class MigrationService(gdata.apps.service.AppsService):
   """
 
   def __init__(self, email=None, password=None, domain=None, source=None,
-               server='apps-apis.google.com', additional_headers=None):
+               server='apps-apis.google.com', additional_headers=None,
+               **kwargs):
     gdata.apps.service.AppsService.__init__(
         self, email=email, password=password, domain=domain, source=source,
-        server=server, additional_headers=additional_headers)
+        server=server, additional_headers=additional_headers, **kwargs)
     self.mail_batch = migration.BatchMailEventFeed()
     self.mail_entries = []
     self.exceptions = 0
+    self._exceptions_lock = threading.Lock()
 
   def _BaseURL(self):
     return '/a/feeds/migration/%s/%s' % (API_VER, self.domain)
@@ -60,7 +77,8 @@ class MigrationService(gdata.apps.service.AppsService):
 
     Args:
       user_name: The username to import messages to.
-      mail_message: An RFC822 format email message.
+      mail_message: An RFC822 format email message, as a string or a file
+          object. The message is base64 encoded as it is sent.
       mail_item_properties: A list of Gmail properties to apply to the message.
       mail_labels: A list of labels to apply to the message.
 
@@ -73,19 +91,22 @@ class MigrationService(gdata.apps.service.AppsService):
     uri = '%s/%s/mail' % (self._BaseURL(), user_name)
 
     mail_entry = migration.MailEntry()
-    mail_entry.rfc822_msg = migration.Rfc822Msg(text=(base64.b64encode(
-        mail_message)))
-    mail_entry.rfc822_msg.encoding = 'base64'
     mail_entry.mail_item_property = map(
         lambda x: migration.MailItemProperty(value=x), mail_item_properties)
     mail_entry.label = map(lambda x: migration.Label(label_name=x),
                            mail_labels)
 
     try:
-      return migration.MailEntryFromString(str(self.Post(mail_entry, uri)))
+      return self._PostStreaming(mail_entry, [(mail_entry, mail_message)],
+                                 uri, converter=migration.MailEntryFromString)
     except gdata.service.RequestError, e:
-      # Store the number of failed imports when importing several at a time 
-      self.exceptions += 1
+      # Store the number of failed imports when importing several at a time.
+      # ImportMultipleMails calls this from several threads.
+      self._exceptions_lock.acquire()
+      try:
+        self.exceptions += 1
+      finally:
+        self._exceptions_lock.release()
       raise gdata.apps.service.AppsForYourDomainException(e.args[0])
 
   def AddBatchEntry(self, mail_message, mail_item_properties,
@@ -104,17 +125,20 @@ class MigrationService(gdata.apps.service.AppsService):
     """
     deprecation("calling deprecated method AddBatchEntry")
     mail_entry = migration.BatchMailEntry()
-    mail_entry.rfc822_msg = migration.Rfc822Msg(text=(base64.b64encode(
-        mail_message)))
+    mail_entry.rfc822_msg = migration.Rfc822Msg(text='-')
     mail_entry.rfc822_msg.encoding = 'base64'
     mail_entry.mail_item_property = map(
         lambda x: migration.MailItemProperty(value=x), mail_item_properties)
     mail_entry.label = map(lambda x: migration.Label(label_name=x),
                            mail_labels)
+    # Measure the entry with a one character placeholder for the message, so
+    # that the encoded message is not serialized just to find its length.
+    entry_length = len(str(mail_entry)) - 1 + EncodedLength(len(mail_message))
+    mail_entry.rfc822_msg.text = base64.b64encode(mail_message)
 
     self.mail_batch.AddBatchEntry(mail_entry)
 
-    return len(str(mail_entry))
+    return entry_length
 
   def SubmitBatch(self, user_name):
     """Sends all the mail items you have added to the batch to the server.
@@ -167,52 +191,401 @@ class MigrationService(gdata.apps.service.AppsService):
     return len(self.mail_entries)
 
   def ImportMultipleMails(self, user_name, threads_per_batch=20):
-    """Launches separate threads to import every message added by AddMailEntry.
-    
+    """Imports every message added by AddMailEntry using a pool of threads.
+
+    The messages are removed from mail_entries before they are imported,
+    and messages which fail are not kept for another call. A failed message
+    does not stop the others; each one which the server refuses adds one to
+    the exceptions attribute.
+
     Args:
       user_name: The user account name to import messages to.
       threads_per_batch: Number of messages to import at a time.
-    
+
     Returns:
-      The number of email messages that were successfully migrated.
-    
-    Raises:
-      Exception: An error occurred while importing mails.
+      The number of email messages from this call which were successfully
+      migrated. Earlier calls do not change it.
     """
-    num_entries = len(self.mail_entries)
-
-    if not num_entries:
-      return 0
-
-    threads = []
-    for mail_entry_properties in self.mail_entries:
-      t = threading.Thread(name=mail_entry_properties.identifier,
-                           target=self.ImportMail,
-                           args=(user_name, mail_entry_properties.mail_message,
-                                 mail_entry_properties.mail_item_properties,
-                                 mail_entry_properties.mail_labels))
-      threads.append(t)
+    mail_entries = self.mail_entries
+    self.mail_entries = []
+
+    def ImportOneMail(mail_entry_properties):
+      try:
+        self.ImportMail(user_name, mail_entry_properties.mail_message,
+                        mail_entry_properties.mail_item_properties,
+                        mail_entry_properties.mail_labels)
+      except Exception:
+        return False
+      return True
+
+    return len([imported for imported in gdata.client.run_concurrently(
+        ImportOneMail, mail_entries, threads_per_batch) if imported])
+
+  def _PostStreaming(self, element, messages, uri, converter=None):
+    """Posts element with messages streamed into its rfc822Msg elements.
+
+    The XML around the messages is serialized once, and each message is
+    base64 encoded a chunk at a time while the request is sent, so the
+    encoded messages are never held in memory.
+
+    Args:
+      element: The MailEntry or BatchMailEventFeed to send.
+      messages: list of (entry, mail_message) pairs, where entry is element
+          or one of its entries and mail_message is a string or file object.
+      uri: The URI to post to.
+      converter: function (optional) Parses the response body.
+    """
+    # Each message's place in the XML is marked with a string which can not
+    # appear elsewhere in the request.
+    nonce = binascii.hexlify(os.urandom(8))
+    markers = []
+    for i, (entry, mail_message) in enumerate(messages):
+      marker = 'rfc822%s%i' % (nonce, i)
+      entry.rfc822_msg = migration.Rfc822Msg(text=marker)
+      entry.rfc822_msg.encoding = 'base64'
+      markers.append(marker)
+    remaining = str(element)
+    parts = []
+    content_length = len(remaining)
+    for marker, (entry, mail_message) in zip(markers, messages):
+      before, remaining = remaining.split(marker, 1)
+      stream = Base64Stream(mail_message)
+      parts.extend((before, stream))
+      content_length += len(stream) - len(marker)
+    parts.append(remaining)
+    return self.Post(parts, uri,
+                     extra_headers={'Content-Length': str(content_length),
+                                    'Content-Type': 'application/atom+xml'},
+                     converter=converter)
+
+  def MigrateMessages(self, user_name, messages, **kwargs):
+    """Imports a stream of messages in batches, see MigrationEngine.
+
+    Args:
+      user_name: The user account name to import messages to.
+      messages: An iterable of MailEntryProperties or RFC822 strings, for
+          example from MboxMessages or MaildirMessages.
+      **kwargs: Other parameters to pass to the MigrationEngine constructor.
+
+    Returns:
+      A MigrationReport.
+    """
+    return MigrationEngine(self, user_name, **kwargs).Migrate(messages)
+
+
+class MailImportResult(object):
+  """The outcome of importing one message with a MigrationEngine.
+
+  Attributes:
+    identifier: The message's identifier, or its position in the stream if
+        it was given without one.
+    code: int The HTTP status code for the message, 201 if it was imported.
+    reason: str The reason given by the server.
+  """
+
+  def __init__(self, identifier, code, reason=None):
+    self.identifier = identifier
+    self.code = code
+    self.reason = reason
+
+  def Succeeded(self):
+    return self.code in (200, 201)
+
+
+class MigrationReport(object):
+  """The results of MigrationEngine.Migrate.
+
+  Attributes:
+    results: list of MailImportResult objects, one for each message in the
+        order in which the messages were given.
+    imported: int The number of messages which were imported.
+    batches: int The number of batch requests sent.
+    seconds: float The time taken by the migration.
+  """
+
+  def __init__(self):
+    self.results = []
+    self.imported = 0
+    self.batches = 0
+    self.seconds = 0.0
+
+  def GetFailures(self):
+    """Returns the results for the messages which were not imported."""
+    return [result for result in self.results if not result.Succeeded()]
+
+  def GetThroughput(self):
+    """Returns the average number of messages imported per second."""
+    if not self.seconds:
+      return 0.0
+    return self.imported / self.seconds
+
+
+class MigrationEngine(object):
+  """Imports a stream of messages into a mailbox in concurrent batches.
+
+  Messages are read from an iterator as they are needed and packed into
+  BatchMailEventFeed requests of at most max_batch_entries messages and about
+  max_batch_bytes. Up to max_concurrent batches are sent at the same time by
+  a fixed pool of threads, and no more than batches_per_second requests are
+  started each second. Only the batches which are being sent are held in
+  memory, so a large mailbox can be migrated from disk.
+
+  Example:
+    service = gdata.apps.migration.service.MigrationService(
+        email=admin, password=password, domain=domain,
+        http_client=atom.http.KeepAliveHttpClient())
+    service.ProgrammaticLogin()
+    engine = gdata.apps.migration.service.MigrationEngine(service, 'liz')
+    report = engine.Migrate(
+        gdata.apps.migration.service.MboxMessages('liz.mbox', ['Imported']))
+    for result in report.GetFailures():
+      print result.identifier, result.code, result.reason
+  """
+
+  def __init__(self, service, user_name,
+               max_concurrent=MAX_CONCURRENT_BATCHES,
+               max_batch_entries=MAX_BATCH_ENTRIES,
+               max_batch_bytes=MAX_BATCH_BYTES, batches_per_second=None,
+               callback=None):
+    """Creates a MigrationEngine.
+
+    Args:
+      service: MigrationService An authenticated service used to send the
+          batches. It may use an atom.http.KeepAliveHttpClient to reuse its
+          connections.
+      user_name: The user account name to import messages to.
+      max_concurrent: int (optional) The number of batches to send at the
+          same time.
+      max_batch_entries: int (optional) The largest number of messages in
+          one batch.
+      max_batch_bytes: int (optional) The approximate largest size of one
+          batch. A message which is larger than this is sent on its own.
+      batches_per_second: float (optional) The most batch requests to start
+          each second. Unlimited if None.
+      callback: function (optional) Called with the list of MailImportResult
+          objects for each batch once it has been sent. Called from the
+          thread which sent the batch. If it raises an exception, Migrate
+          raises the first such exception once all batches have been sent.
+    """
+    self.service = service
+    self.user_name = user_name
+    self.max_concurrent = max_concurrent
+    self.max_batch_entries = max_batch_entries
+    self.max_batch_bytes = max_batch_bytes
+    self.batches_per_second = batches_per_second
+    self.callback = callback
+
+  def Migrate(self, messages):
+    """Imports the messages.
+
+    Args:
+      messages: An iterable of MailEntryProperties or RFC822 strings.
+
+    Returns:
+      A MigrationReport.
+    """
+    uri = '%s/%s/mail/batch' % (self.service._BaseURL(), self.user_name)
+    rate_limiter = None
+    if self.batches_per_second:
+      rate_limiter = gdata.client.RateLimiter(self.batches_per_second)
+    report = MigrationReport()
+    callback_errors = []
+
+    def SendBatch(batch):
+      if rate_limiter is not None:
+        rate_limiter.Wait()
+      batch_results = self._SendBatch(uri, batch)
+      if self.callback is not None:
+        try:
+          self.callback([result for position, result in batch_results])
+        except Exception, e:
+          callback_errors.append(e)
+      return batch_results
+
+    start = time.time()
+    # Batches are made from the messages only as threads become free, so
+    # that the messages are not read far ahead of the requests.
+    results = []
+    for batch_results in gdata.client.run_concurrently(
+        SendBatch, self._MakeBatches(messages), self.max_concurrent):
+      results.extend(batch_results)
+      report.batches += 1
+    if callback_errors:
+      raise callback_errors[0]
+    report.seconds = time.time() - start
+    results.sort()
+    report.results = [result for position, result in results]
+    report.imported = len([result for result in report.results
+                           if result.Succeeded()])
+    return report
+
+  def _MakeBatches(self, messages):
+    """Yields lists of (position, identifier, entry, message) tuples."""
+    batch = []
+    batch_bytes = 0
+    for position, message in enumerate(messages):
+      if not isinstance(message, MailEntryProperties):
+        message = MailEntryProperties(mail_message=message)
+      identifier = message.identifier
+      if identifier is None:
+        identifier = position
+      mail_entry = migration.BatchMailEntry()
+      mail_entry.mail_item_property = [
+          migration.MailItemProperty(value=value)
+          for value in message.mail_item_properties]
+      mail_entry.label = [migration.Label(label_name=label_name)
+                          for label_name in message.mail_labels]
+      entry_bytes = (EncodedLength(_MessageSize(message.mail_message))
+                     + BATCH_ENTRY_OVERHEAD)
+      if batch and (len(batch) >= self.max_batch_entries
+                    or batch_bytes + entry_bytes > self.max_batch_bytes):
+        yield batch
+        batch = []
+        batch_bytes = 0
+      batch.append((position, identifier, mail_entry, message.mail_message))
+      batch_bytes += entry_bytes
+    if batch:
+      yield batch
+
+  def _SendBatch(self, uri, batch):
+    """Sends one batch and returns (position, MailImportResult) tuples."""
+    feed = migration.BatchMailEventFeed()
+    for position, identifier, mail_entry, mail_message in batch:
+      feed.AddBatchEntry(mail_entry, batch_id_string=str(position),
+                         operation_string='insert')
     try:
-      # Determine the number of batches needed with threads_per_batch in each
-      batches = num_entries / threads_per_batch + (
-          0 if num_entries % threads_per_batch == 0 else 1)
-      batch_min = 0
-      # Start the threads, one batch at a time
-      for batch in range(batches):
-        batch_max = ((batch + 1) * threads_per_batch
-                     if (batch + 1) * threads_per_batch < num_entries
-                     else num_entries)
-        for i in range(batch_min, batch_max):
-          threads[i].start()
-          time.sleep(1)
-
-        for i in range(batch_min, batch_max):
-          threads[i].join()
-
-        batch_min = batch_max
-
-      self.mail_entries = []
+      result_feed = self.service._PostStreaming(
+          feed, [(mail_entry, mail_message)
+                 for position, identifier, mail_entry, mail_message in batch],
+          uri, converter=migration.BatchMailEventFeedFromString)
+    except gdata.service.RequestError, e:
+      response = e.args[0]
+      return [(position, MailImportResult(identifier, response['status'],
+                                          response['reason']))
+              for position, identifier, mail_entry, mail_message in batch]
     except Exception, e:
-      raise Exception(e.args[0])
+      return [(position, MailImportResult(identifier, None, str(e)))
+              for position, identifier, mail_entry, mail_message in batch]
+    statuses = {}
+    for entry in result_feed.entry:
+      if entry.batch_id is not None and entry.batch_status is not None:
+        statuses[entry.batch_id.text] = entry.batch_status
+    results = []
+    for position, identifier, mail_entry, mail_message in batch:
+      status = statuses.get(str(position))
+      if status is None or status.code is None:
+        result = MailImportResult(identifier, None,
+                                  'Not processed by the server')
+      else:
+        result = MailImportResult(identifier, int(status.code), status.reason)
+      results.append((position, result))
+    return results
+
+
+def EncodedLength(size):
+  """Returns the length of size bytes once they are base64 encoded."""
+  return (size + 2) // 3 * 4
+
+
+def _MessageSize(mail_message):
+  """Returns the number of bytes left in a message string or file."""
+  if isinstance(mail_message, basestring):
+    return len(mail_message)
+  position = mail_message.tell()
+  mail_message.seek(0, 2)
+  size = mail_message.tell() - position
+  mail_message.seek(position)
+  return size
+
+
+class Base64Stream(object):
+  """A file-like object which base64 encodes a message as it is read.
+
+  Only ENCODE_CHUNK_SIZE bytes of the message are encoded at a time, so a
+  message can be sent in a request without building its encoded form in
+  memory.
+  """
+
+  def __init__(self, mail_message):
+    """Creates a Base64Stream.
+
+    Args:
+      mail_message: The message to encode, as a string or a file object
+          which supports seek and tell. A file is read from its current
+          position.
+    """
+    self.mail_message = mail_message
+    self._length = EncodedLength(_MessageSize(mail_message))
+    self._offset = 0
+    self._unencoded = ''
+    self._encoded = ''
+    self._finished = False
+
+  def __len__(self):
+    return self._length
+
+  def _ReadMessage(self, size):
+    if isinstance(self.mail_message, basestring):
+      data = self.mail_message[self._offset:self._offset + size]
+      self._offset += len(data)
+      return data
+    return self.mail_message.read(size)
+
+  def read(self, size=-1):
+    """Returns up to size bytes of the encoded message, or all of the rest."""
+    while not self._finished and (size < 0 or len(self._encoded) < size):
+      data = self._ReadMessage(ENCODE_CHUNK_SIZE)
+      if data:
+        data = self._unencoded + data
+        # Bytes beyond a multiple of 3 wait for the next chunk, since
+        # encoding them now would add padding in the middle of the message.
+        end = len(data) - len(data) % 3
+        self._unencoded = data[end:]
+        data = data[:end]
+      else:
+        data = self._unencoded
+        self._unencoded = ''
+        self._finished = True
+      self._encoded += base64.b64encode(data)
+    if size < 0 or size >= len(self._encoded):
+      result = self._encoded
+      self._encoded = ''
     else:
-      return num_entries - self.exceptions
+      result = self._encoded[:size]
+      self._encoded = self._encoded[size:]
+    return result
+
+
+def MboxMessages(path, mail_labels=None, mail_item_properties=None):
+  """Yields the messages of an mbox file as MailEntryProperties.
+
+  The messages are read one at a time. Each message's identifier is its key
+  in the mailbox.
+
+  Args:
+    path: str The path of the mbox file.
+    mail_labels: list (optional) Gmail labels to apply to every message.
+    mail_item_properties: list (optional) Gmail properties to apply to every
+        message, for example ['IS_UNREAD'].
+  """
+  return _MailboxMessages(mailbox.mbox(path, factory=None, create=False),
+                          mail_labels, mail_item_properties)
+
+
+def MaildirMessages(path, mail_labels=None, mail_item_properties=None):
+  """Yields the messages of a Maildir directory as MailEntryProperties.
+
+  See MboxMessages.
+  """
+  return _MailboxMessages(mailbox.Maildir(path, factory=None, create=False),
+                          mail_labels, mail_item_properties)
+
+
+def _MailboxMessages(mail_box, mail_labels, mail_item_properties):
+  try:
+    for key in mail_box.iterkeys():
+      yield MailEntryProperties(mail_message=mail_box.get_string(key),
+                                mail_item_properties=mail_item_properties,
+                                mail_labels=mail_labels, identifier=key)
+  finally:
+    mail_box.close()
@@ -255,7 +255,7 @@ class UserEntry(gdata.apps.apps_property_entry.AppsPropertyEntry):
     """
     self._SetProperty(USER_QUOTA, value)
 
-  quota = pyproperty(GetQuota, GetQuota)
+  quota = pyproperty(GetQuota, SetQuota)
 
   def __init__(self, uri=None, email=None, first_name=None, last_name=None,
                password=None, hash_function=None, change_password=None,
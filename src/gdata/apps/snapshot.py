@@ -0,0 +1,569 @@
+#!/usr/bin/python
+#
+# Copyright (C) 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Keeps a local snapshot of the users, groups and org units of a domain.
+
+A DirectoryCrawler reads the user, group, group member and organization
+user feeds of the Provisioning APIs at the same time and fills a
+DirectorySnapshot. The snapshot indexes users by email address, members by
+group and users by org unit path, and can be saved to a file, so that
+questions such as who receives the mail sent to a group are answered
+without sending any requests.
+
+Example:
+  crawler = gdata.apps.snapshot.DirectoryCrawler(
+      apps_client=gdata.apps.client.AppsClient('example.com', token),
+      groups_client=gdata.apps.groups.client.GroupsProvisioningClient(
+          'example.com', token))
+  snapshot = crawler.crawl()
+  snapshot.save('directory.json')
+  ...
+  snapshot = gdata.apps.snapshot.DirectorySnapshot.load('directory.json')
+  recipients = snapshot.expand_group('sales@example.com')
+"""
+
+
+import os
+import Queue
+import tempfile
+import threading
+import time
+import gdata.apps.data
+import gdata.apps.groups.data
+import gdata.apps.organization.data
+import gdata.client
+
+try:
+  import simplejson
+except ImportError:
+  try:
+    # Try to import from django, should work on App Engine
+    from django.utils import simplejson
+  except ImportError:
+    # Should work for Python2.6 and higher.
+    import json as simplejson
+
+
+# The number of feeds which a DirectoryCrawler reads at the same time.
+MAX_CONCURRENT_FEEDS = 8
+SNAPSHOT_FILE_VERSION = 1
+# The member_type of group members which are groups themselves.
+GROUP_MEMBER_TYPE = 'Group'
+
+
+def _normalize_path(org_unit_path):
+  """Returns the key under which an org unit path is indexed.
+
+  The root org unit is ''. Other paths lose their leading and trailing
+  slashes, so that '/Sales/' and 'Sales' are the same org unit.
+  """
+  return (org_unit_path or '').strip('/')
+
+
+class DirectoryUser(object):
+  """The fields of a user which are kept in a DirectorySnapshot.
+
+  Attributes:
+    email: str The user's email address, in lower case.
+    given_name: str
+    family_name: str
+    admin: str 'true' if the user is an administrator of the domain.
+    suspended: str 'true' if the user's account is suspended.
+    org_unit_path: str The path of the user's organization unit.
+  """
+
+  def __init__(self, email, given_name=None, family_name=None, admin=None,
+               suspended=None, org_unit_path=None):
+    self.email = email
+    self.given_name = given_name
+    self.family_name = family_name
+    self.admin = admin
+    self.suspended = suspended
+    self.org_unit_path = org_unit_path
+
+  def _to_list(self):
+    return [self.email, self.given_name, self.family_name, self.admin,
+            self.suspended, self.org_unit_path]
+
+  def from_entry(entry, domain):
+    """Creates a DirectoryUser from a gdata.apps.data.UserEntry."""
+    user = DirectoryUser(
+        ('%s@%s' % (entry.login.user_name, domain)).lower(),
+        admin=entry.login.admin, suspended=entry.login.suspended)
+    if entry.name is not None:
+      user.given_name = entry.name.given_name
+      user.family_name = entry.name.family_name
+    return user
+
+  from_entry = staticmethod(from_entry)
+  FromEntry = from_entry
+
+
+class DirectoryGroup(object):
+  """The fields of a group which are kept in a DirectorySnapshot.
+
+  Attributes:
+    id: str The group's ID, which is its email address, in lower case.
+    name: str
+    description: str
+    email_permission: str Who may send mail to the group.
+    members: list of (member_id, member_type) tuples for the direct members
+        of the group, where member_type is 'User' or 'Group'.
+  """
+
+  def __init__(self, id, name=None, description=None, email_permission=None,
+               members=None):
+    self.id = id
+    self.name = name
+    self.description = description
+    self.email_permission = email_permission
+    self.members = members or []
+
+  def _to_list(self):
+    return [self.id, self.name, self.description, self.email_permission,
+            [list(member) for member in self.members]]
+
+  def from_entry(entry):
+    """Creates a DirectoryGroup from a gdata.apps.groups.data.GroupEntry."""
+    return DirectoryGroup(entry.group_id.lower(), name=entry.group_name,
+                          description=entry.description,
+                          email_permission=entry.email_permission)
+
+  from_entry = staticmethod(from_entry)
+  FromEntry = from_entry
+
+
+class DirectorySnapshot(object):
+  """An indexed copy of the users and groups of a domain.
+
+  Email addresses and group IDs are matched without case.
+
+  Attributes:
+    users: dict Maps email addresses to DirectoryUser objects.
+    groups: dict Maps group IDs to DirectoryGroup objects.
+    created: float When the crawl which filled the snapshot started, in
+        seconds since the epoch.
+  """
+
+  def __init__(self, created=None):
+    self.users = {}
+    self.groups = {}
+    self.created = created
+    # Maps member IDs to the set of IDs of the groups they are direct
+    # members of.
+    self._groups_by_member = {}
+    # Maps normalized org unit paths to sets of email addresses.
+    self._users_by_org_unit = {}
+
+  def add_user(self, user):
+    """Adds a DirectoryUser, replacing any user with the same email."""
+    old_user = self.users.get(user.email)
+    if old_user is not None:
+      self._unindex_org_unit(old_user)
+      if user.org_unit_path is None:
+        user.org_unit_path = old_user.org_unit_path
+    self.users[user.email] = user
+    if user.org_unit_path is not None:
+      self._users_by_org_unit.setdefault(
+          _normalize_path(user.org_unit_path), set()).add(user.email)
+
+  AddUser = add_user
+
+  def set_org_unit(self, email, org_unit_path):
+    """Records the org unit of a user, adding the user if it is unknown."""
+    email = email.lower()
+    user = self.users.get(email)
+    if user is None:
+      user = DirectoryUser(email)
+    else:
+      self._unindex_org_unit(user)
+    user.org_unit_path = org_unit_path
+    self.add_user(user)
+
+  SetOrgUnit = set_org_unit
+
+  def _unindex_org_unit(self, user):
+    if user.org_unit_path is None:
+      return
+    key = _normalize_path(user.org_unit_path)
+    emails = self._users_by_org_unit.get(key)
+    if emails is not None:
+      emails.discard(user.email)
+      if not emails:
+        del self._users_by_org_unit[key]
+
+  def add_group(self, group):
+    """Adds a DirectoryGroup, replacing any group with the same ID.
+
+    The members of the replaced group are kept unless group has members.
+    """
+    members = group.members
+    old_group = self.groups.get(group.id)
+    if old_group is not None:
+      members = members or old_group.members
+      # Lets set_members remove the old members from the index.
+      group.members = old_group.members
+    else:
+      group.members = []
+    self.groups[group.id] = group
+    self.set_members(group.id, members)
+
+  AddGroup = add_group
+
+  def set_members(self, group_id, members):
+    """Replaces the direct members of a group.
+
+    Args:
+      group_id: str The ID of the group, which is added if it is unknown.
+      members: list of (member_id, member_type) tuples.
+    """
+    group_id = group_id.lower()
+    group = self.groups.get(group_id)
+    if group is None:
+      group = DirectoryGroup(group_id)
+      self.groups[group_id] = group
+    for member_id, member_type in group.members:
+      group_ids = self._groups_by_member.get(member_id)
+      if group_ids is not None:
+        group_ids.discard(group_id)
+        if not group_ids:
+          del self._groups_by_member[member_id]
+    group.members = [(member_id.lower(), member_type)
+                     for member_id, member_type in members]
+    for member_id, member_type in group.members:
+      self._groups_by_member.setdefault(member_id, set()).add(group_id)
+
+  SetMembers = set_members
+
+  def get_user(self, email):
+    """Returns the DirectoryUser with the email address, or None."""
+    return self.users.get(email.lower())
+
+  GetUser = get_user
+
+  def get_members(self, group_id):
+    """Returns the (member_id, member_type) tuples of a group's members."""
+    group = self.groups.get(group_id.lower())
+    if group is None:
+      return []
+    return list(group.members)
+
+  GetMembers = get_members
+
+  def expand_group(self, group_id):
+    """Returns the users who belong to a group directly or through others.
+
+    Groups which are members are expanded in turn, and members which are
+    not groups of the domain, such as outside addresses, are included.
+
+    Returns:
+      A sorted list of member IDs.
+    """
+    found = set()
+    seen = set()
+    pending = [group_id.lower()]
+    while pending:
+      current = pending.pop()
+      if current in seen:
+        continue
+      seen.add(current)
+      for member_id, member_type in self.get_members(current):
+        if member_type == GROUP_MEMBER_TYPE or member_id in self.groups:
+          pending.append(member_id)
+        else:
+          found.add(member_id)
+    return sorted(found)
+
+  ExpandGroup = expand_group
+
+  def get_groups(self, member_id, direct_only=False):
+    """Returns the IDs of the groups which a user or group belongs to.
+
+    Args:
+      member_id: str An email address or group ID.
+      direct_only: boolean (optional) If True, only the groups which list
+          member_id as a member are returned, and not the groups which
+          contain those.
+
+    Returns:
+      A sorted list of group IDs.
+    """
+    found = set()
+    pending = [member_id.lower()]
+    while pending:
+      for group_id in self._groups_by_member.get(pending.pop(), ()):
+        if group_id not in found:
+          found.add(group_id)
+          if not direct_only:
+            pending.append(group_id)
+    return sorted(found)
+
+  GetGroups = get_groups
+
+  def get_org_unit_users(self, org_unit_path, include_sub_units=False):
+    """Returns the email addresses of the users in an org unit.
+
+    Args:
+      org_unit_path: str The path of the org unit, for example
+          'Engineering/Tools'. '/' is the root org unit.
+      include_sub_units: boolean (optional) If True, the users of the org
+          units below it are returned as well.
+
+    Returns:
+      A sorted list of email addresses.
+    """
+    key = _normalize_path(org_unit_path)
+    if not include_sub_units:
+      return sorted(self._users_by_org_unit.get(key, ()))
+    emails = []
+    for path, path_emails in self._users_by_org_unit.iteritems():
+      if not key or path == key or path.startswith(key + '/'):
+        emails.extend(path_emails)
+    return sorted(emails)
+
+  GetOrgUnitUsers = get_org_unit_users
+
+  def save(self, path):
+    """Writes the snapshot to a file.
+
+    A new file is written and moved into place, so that an interrupted save
+    never leaves a partially written snapshot.
+    """
+    state = {'version': SNAPSHOT_FILE_VERSION,
+             'created': self.created,
+             'users': [user._to_list() for user in self.users.itervalues()],
+             'groups': [group._to_list()
+                        for group in self.groups.itervalues()]}
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or os.curdir)
+    snapshot_file = os.fdopen(fd, 'w')
+    try:
+      simplejson.dump(state, snapshot_file, separators=(',', ':'))
+    finally:
+      snapshot_file.close()
+    gdata.client.replace_file(temp_path, path)
+
+  Save = save
+
+  def load(path):
+    """Reads a snapshot written by save.
+
+    Returns:
+      A DirectorySnapshot.
+    """
+    snapshot_file = open(path)
+    try:
+      state = simplejson.load(snapshot_file)
+    finally:
+      snapshot_file.close()
+    if state.get('version') != SNAPSHOT_FILE_VERSION:
+      raise gdata.client.Error(
+          'Unsupported snapshot file version: %s' % state.get('version'))
+    snapshot = DirectorySnapshot(state['created'])
+    for fields in state['users']:
+      snapshot.add_user(DirectoryUser(*fields))
+    for fields in state['groups']:
+      group_id, name, description, email_permission, members = fields
+      snapshot.add_group(DirectoryGroup(
+          group_id, name=name, description=description,
+          email_permission=email_permission,
+          members=[tuple(member) for member in members]))
+    return snapshot
+
+  load = staticmethod(load)
+  Load = load
+
+
+class DirectoryCrawler(object):
+  """Reads the directory feeds of a domain into a DirectorySnapshot.
+
+  The pages of each feed are read in turn, but the user, group and org user
+  feeds, and the member feeds of the groups, are read at the same time by a
+  pool of threads. Member feeds are read as soon as their group has been
+  seen, while later pages of the group feed are still being read. Unless
+  the http_client of a client has been replaced or a proxy is configured,
+  its requests share a pool of keep-alive connections.
+  """
+
+  def __init__(self, apps_client=None, groups_client=None, org_client=None,
+               customer_id=None, max_concurrent=MAX_CONCURRENT_FEEDS):
+    """Creates a DirectoryCrawler.
+
+    Args:
+      apps_client: gdata.apps.client.AppsClient (optional) Used to read the
+          users of its domain.
+      groups_client: gdata.apps.groups.client.GroupsProvisioningClient
+          (optional) Used to read the groups and their members.
+      org_client: gdata.apps.organization.client.
+          OrganizationUnitProvisioningClient (optional) Used to read the
+          org unit of each user.
+      customer_id: str (optional) The customer ID for org_client. It is
+          retrieved if not given.
+      max_concurrent: int (optional) The number of feeds to read at the
+          same time.
+    """
+    self.apps_client = apps_client
+    self.groups_client = groups_client
+    self.org_client = org_client
+    self.customer_id = customer_id
+    self.max_concurrent = max_concurrent
+
+  def crawl(self, snapshot=None):
+    """Reads all of the feeds.
+
+    Args:
+      snapshot: DirectorySnapshot (optional) The snapshot to add to. A new
+          one is made if this is not given.
+
+    Returns:
+      The DirectorySnapshot.
+
+    Raises:
+      The first error raised while reading a feed, once the other feeds
+      have stopped.
+    """
+    if snapshot is None:
+      snapshot = DirectorySnapshot()
+    snapshot.created = time.time()
+    jobs = Queue.Queue()
+    lock = threading.Lock()
+    errors = []
+    pooled_http_clients = []
+
+    def pooled(client):
+      if client is None:
+        return None
+      client, pooled_http_client = gdata.client.keep_alive_client(
+          client, self.max_concurrent)
+      if pooled_http_client is not None:
+        pooled_http_clients.append(pooled_http_client)
+      return client
+
+    apps_client = pooled(self.apps_client)
+    groups_client = pooled(self.groups_client)
+    org_client = pooled(self.org_client)
+
+    def add_users(feed):
+      users = [DirectoryUser.from_entry(entry, apps_client.domain)
+               for entry in feed.entry]
+      lock.acquire()
+      try:
+        for user in users:
+          snapshot.add_user(user)
+      finally:
+        lock.release()
+
+    def add_groups(feed):
+      groups = [DirectoryGroup.from_entry(entry) for entry in feed.entry]
+      lock.acquire()
+      try:
+        for group in groups:
+          snapshot.add_group(group)
+      finally:
+        lock.release()
+      for group in groups:
+        jobs.put((read_members, (group.id,)))
+
+    def add_org_users(feed):
+      lock.acquire()
+      try:
+        for entry in feed.entry:
+          snapshot.set_org_unit(entry.user_email, entry.org_unit_path)
+      finally:
+        lock.release()
+
+    def read_members(group_id):
+      members = []
+      for feed in self._iter_pages(
+          groups_client, groups_client.retrieve_page_of_members(group_id),
+          gdata.apps.groups.data.GroupMemberFeed):
+        members.extend([(entry.member_id, entry.member_type)
+                        for entry in feed.entry])
+      lock.acquire()
+      try:
+        snapshot.set_members(group_id, members)
+      finally:
+        lock.release()
+
+    def read_feed(client, first_page, desired_class, handle):
+      for feed in self._iter_pages(client, first_page(), desired_class):
+        handle(feed)
+
+    def read_org_users():
+      customer_id = self.customer_id
+      if customer_id is None:
+        customer_id = org_client.retrieve_customer_id().customer_id
+      read_feed(org_client,
+                lambda: org_client.retrieve_page_of_org_users(customer_id),
+                gdata.apps.organization.data.OrgUserFeed, add_org_users)
+
+    def work():
+      while True:
+        job = jobs.get()
+        try:
+          if job is None:
+            return
+          if errors:
+            # Skip the remaining jobs once a feed has failed.
+            continue
+          function, args = job
+          try:
+            function(*args)
+          except Exception, error:
+            lock.acquire()
+            try:
+              errors.append(error)
+            finally:
+              lock.release()
+        finally:
+          jobs.task_done()
+
+    if apps_client is not None:
+      jobs.put((read_feed, (apps_client, apps_client.RetrievePageOfUsers,
+                            gdata.apps.data.UserFeed, add_users)))
+    if groups_client is not None:
+      jobs.put((read_feed, (groups_client,
+                            groups_client.retrieve_page_of_groups,
+                            gdata.apps.groups.data.GroupFeed, add_groups)))
+    if org_client is not None:
+      jobs.put((read_org_users, ()))
+    threads = [threading.Thread(target=work)
+               for i in xrange(self.max_concurrent)]
+    try:
+      for thread in threads:
+        thread.start()
+      jobs.join()
+    finally:
+      for thread in threads:
+        jobs.put(None)
+      for thread in threads:
+        thread.join()
+      for pooled_http_client in pooled_http_clients:
+        pooled_http_client.close()
+    if errors:
+      raise errors[0]
+    return snapshot
+
+  Crawl = crawl
+
+  def _iter_pages(self, client, feed, desired_class):
+    """Yields feed and each of the pages which follow it."""
+    while feed is not None:
+      yield feed
+      next_link = feed.GetNextLink()
+      feed = None
+      if next_link is not None:
+        feed = client.GetFeed(next_link.href, desired_class=desired_class)
@@ -28,9 +28,15 @@
 __author__ = 'alainv (Alain Vongsouvanh)'
 
 
+import copy
+import datetime
+import heapq
+import Queue
+import threading
 import urllib
 import gdata.client
 import gdata.calendar.data
+import gdata.calendar.recurrence
 import atom.data
 import atom.http_core
 import gdata.gauth
@@ -38,6 +44,9 @@ import gdata.gauth
 
 DEFAULT_BATCH_URL = ('https://www.google.com/calendar/feeds/default/private'
                      '/full/batch')
+# The number of event feed pages which get_merged_events requests at the
+# same time.
+MAX_CONCURRENT_FEEDS = 8
 
 
 class CalendarClient(gdata.client.GDClient):
@@ -233,6 +242,124 @@ class CalendarClient(gdata.client.GDClient):
 
   GetCalendarEventFeed = get_calendar_event_feed
 
+  def get_merged_events(self, uris, query=None,
+                        max_concurrent=MAX_CONCURRENT_FEEDS, auth_token=None,
+                        **kwargs):
+    """Yields the events of many calendars as one stream ordered by start.
+
+    Each event feed is requested with singleevents=true, orderby=starttime
+    and sortorder=ascending, so that every feed is already in order and each
+    event has a single gd:when, and the feeds are merged as they are read.
+    Up to max_concurrent pages are fetched at the same time, over pooled
+    keep-alive connections unless the http_client has been replaced or a
+    proxy is configured. The next page of a calendar is requested as soon as
+    its current page is reached, so at most two pages of each calendar are
+    held in memory.
+
+    Args:
+      uris: list of event feed URIs, for example of resource calendars.
+      query: CalendarEventQuery (optional) Further parameters for the feeds,
+          such as start_min, start_max and max_results. The query is copied.
+      max_concurrent: int (optional) The number of pages to fetch at the
+          same time.
+      auth_token: (optional) The token used to authorize the requests.
+      kwargs: Other parameters to pass to get_calendar_event_feed.
+
+    Yields:
+      (uri, entry) tuples, where entry is a CalendarEventEntry, in order of
+      the events' start times. Events which start at the same time are in
+      the order of uris.
+
+    Raises:
+      RequestError: if a page could not be fetched.
+    """
+    query = copy.copy(query) or CalendarEventQuery()
+    query.singleevents = 'true'
+    query.orderby = 'starttime'
+    query.sortorder = 'ascending'
+    uris = list(uris)
+    if not uris:
+      return
+    client, pooled_http_client = gdata.client.keep_alive_client(
+        self, max_concurrent)
+    requests = Queue.Queue()
+    pages = Queue.Queue()
+
+    def fetch_pages():
+      while True:
+        request = requests.get()
+        if request is None:
+          return
+        position, uri, page_query = request
+        try:
+          feed = client.get_calendar_event_feed(
+              uri, auth_token=auth_token, query=page_query, **kwargs)
+        except Exception, error:
+          pages.put((position, None, error))
+        else:
+          pages.put((position, feed, None))
+
+    threads = [threading.Thread(target=fetch_pages)
+               for i in xrange(min(max_concurrent, len(uris)))]
+    # Maps positions in uris to pages which have been fetched but not read.
+    fetched = {}
+    # The unread entries of the current page of each calendar, last first.
+    unread = [[] for uri in uris]
+    # True for the calendars which have a page requested or fetched.
+    pending = [True] * len(uris)
+
+    def next_entry(position):
+      while not unread[position]:
+        if not pending[position]:
+          return None
+        while position not in fetched:
+          fetched_position, feed, error = pages.get()
+          if error is not None:
+            raise error
+          fetched[fetched_position] = feed
+        feed = fetched.pop(position)
+        next_link = feed.get_next_link()
+        pending[position] = next_link is not None and bool(feed.entry)
+        if pending[position]:
+          requests.put((position, next_link.href, None))
+        unread[position] = list(reversed(feed.entry))
+      return unread[position].pop()
+
+    try:
+      for thread in threads:
+        thread.setDaemon(True)
+        thread.start()
+      for position, uri in enumerate(uris):
+        requests.put((position, uri, query))
+      heap = []
+      for position in xrange(len(uris)):
+        entry = next_entry(position)
+        if entry is not None:
+          heap.append((_event_start(entry), position, entry))
+      heapq.heapify(heap)
+      while heap:
+        start, position, entry = heapq.heappop(heap)
+        yield uris[position], entry
+        entry = next_entry(position)
+        if entry is not None:
+          heapq.heappush(heap, (_event_start(entry), position, entry))
+    finally:
+      # Drop the requests which have not been started and stop the threads.
+      try:
+        while True:
+          requests.get_nowait()
+      except Queue.Empty:
+        pass
+      for thread in threads:
+        requests.put(None)
+      for thread in threads:
+        if thread.isAlive():
+          thread.join()
+      if pooled_http_client is not None:
+        pooled_http_client.close()
+
+  GetMergedEvents = get_merged_events
+
   def get_event_entry(self, uri, desired_class=gdata.calendar.data.CalendarEventEntry,
               auth_token=None, **kwargs):
     """Obtains a single event entry.
@@ -535,4 +662,9 @@ class CalendarEventQuery(gdata.client.Query):
   ModifyRequest = modify_request
 
 
-
+def _event_start(entry):
+  """Returns the start of an event's first gd:when as a UTC datetime."""
+  for when in entry.when:
+    if when.start:
+      return gdata.calendar.recurrence.parse_rfc3339(when.start)[0]
+  return datetime.datetime.min
@@ -0,0 +1,263 @@
+#!/usr/bin/python
+#
+# Copyright (C) 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Answers free/busy questions about many calendars from their event feeds.
+
+A FreeBusyIndex is filled with the entries of event feeds, for example of
+room resource calendars, and then finds the times at which a set of
+calendars is free without scanning every event. Later pulls of only the
+changed events, using updated-min and showdeleted, update the index in
+place.
+
+Example:
+  index = gdata.calendar.freebusy.FreeBusyIndex(
+      datetime.datetime(2011, 5, 1), datetime.datetime(2011, 8, 1))
+  for uri in room_calendar_uris:
+    index.update(uri, client.get_calendar_event_feed(uri))
+  rooms = index.find_free_calendars(room_calendar_uris, meeting_start,
+                                    meeting_end)
+"""
+
+
+import bisect
+import datetime
+import gdata.calendar.recurrence
+import gdata.data
+
+
+# Busy intervals longer than this are kept apart from the others, so that a
+# few long events do not make every query scan far back in time.
+LONG_INTERVAL = datetime.timedelta(days=1)
+
+
+class _Intervals(object):
+  """The busy intervals of one calendar.
+
+  Intervals are kept in a list sorted by start time. Since no interval in
+  the list is longer than LONG_INTERVAL, the intervals overlapping a window
+  are found by bisecting for the window start minus LONG_INTERVAL. Longer
+  intervals are kept in a separate list which is always scanned.
+  """
+
+  def __init__(self):
+    self._short = []
+    self._long = []
+
+  def add(self, start, end, key):
+    if end - start > LONG_INTERVAL:
+      self._long.append((start, end, key))
+    else:
+      bisect.insort(self._short, (start, end, key))
+
+  def remove(self, start, end, key):
+    interval = (start, end, key)
+    if end - start > LONG_INTERVAL:
+      self._long.remove(interval)
+      return
+    index = bisect.bisect_left(self._short, interval)
+    if index < len(self._short) and self._short[index] == interval:
+      del self._short[index]
+
+  def overlapping(self, start, end):
+    """Returns the (start, end) tuples which overlap a window."""
+    found = []
+    index = bisect.bisect_left(self._short, (start - LONG_INTERVAL,))
+    while index < len(self._short) and self._short[index][0] < end:
+      if self._short[index][1] > start:
+        found.append(self._short[index][:2])
+      index += 1
+    for interval in self._long:
+      if interval[0] < end and interval[1] > start:
+        found.append(interval[:2])
+    return found
+
+  def __len__(self):
+    return len(self._short) + len(self._long)
+
+
+class _Calendar(object):
+  """The events of one calendar and the intervals indexed for them."""
+
+  def __init__(self):
+    self.intervals = _Intervals()
+    # Maps event IDs to entries of single and recurring events.
+    self.events = {}
+    # Maps the IDs of recurring events to dicts of their exception entries.
+    self.exceptions = {}
+    # Maps event IDs to the (start, end) tuples indexed for the event and
+    # its exceptions.
+    self.indexed = {}
+
+
+class FreeBusyIndex(object):
+  """An index of the busy times of many calendars.
+
+  Recurring events are expanded between horizon_start and horizon_end, so
+  queries should fall within that horizon. Events marked as transparent,
+  which do not block time, and canceled events are not indexed. Times are
+  naive datetime objects in UTC, as in gdata.calendar.recurrence.
+  """
+
+  def __init__(self, horizon_start, horizon_end, expander=None):
+    """Creates an empty index.
+
+    Args:
+      horizon_start: datetime The earliest time which queries will ask about.
+      horizon_end: datetime The latest time which queries will ask about.
+      expander: gdata.calendar.recurrence.RecurrenceExpander (optional) Used
+          to expand recurring events, for example to share its cache.
+    """
+    self.horizon_start = horizon_start
+    self.horizon_end = horizon_end
+    self.expander = (expander
+                     or gdata.calendar.recurrence.RecurrenceExpander())
+    self._calendars = {}
+
+  def update(self, calendar, entries):
+    """Adds, changes or removes the events of a calendar.
+
+    Args:
+      calendar: A key for the calendar, for example its event feed URI or
+          the email address of a calendar resource.
+      entries: list of gdata.calendar.data.CalendarEventEntry or a
+          CalendarEventFeed, either the whole feed or only the entries
+          changed since an earlier pull. Canceled entries, as returned with
+          showdeleted=true, remove their events.
+    """
+    if hasattr(entries, 'entry'):
+      entries = entries.entry
+    state = self._calendars.setdefault(calendar, _Calendar())
+    changed = set()
+    for entry in entries:
+      event_id = gdata.calendar.recurrence.get_event_id(entry)
+      original = entry.original_event
+      if original is not None and original.id:
+        state.exceptions.setdefault(original.id, {})[event_id] = entry
+        changed.add(original.id)
+        continue
+      if gdata.calendar.recurrence.is_canceled(entry):
+        state.events.pop(event_id, None)
+        state.exceptions.pop(event_id, None)
+      else:
+        state.events[event_id] = entry
+      changed.add(event_id)
+    for event_id in changed:
+      self._reindex(state, event_id)
+
+  Update = update
+
+  def remove_calendar(self, calendar):
+    """Forgets all events of a calendar."""
+    self._calendars.pop(calendar, None)
+
+  RemoveCalendar = remove_calendar
+
+  def _reindex(self, state, event_id):
+    for start, end in state.indexed.pop(event_id, []):
+      state.intervals.remove(start, end, event_id)
+    entry = state.events.get(event_id)
+    exceptions = state.exceptions.get(event_id, {}).values()
+    if entry is not None:
+      occurrences = self.expander.expand(entry, self.horizon_start,
+                                         self.horizon_end, exceptions)
+    else:
+      # The exceptions of a recurring event which is not in the index
+      # still take up time.
+      occurrences = []
+      for exception in exceptions:
+        occurrences.extend(self.expander.expand(
+            exception, self.horizon_start, self.horizon_end))
+    indexed = []
+    for occurrence in occurrences:
+      transparency = occurrence.entry.transparency
+      if (transparency is not None and transparency.value
+          == gdata.data.TRANSPARENT_TRANSPARENCY):
+        continue
+      if occurrence.end <= occurrence.start:
+        continue
+      state.intervals.add(occurrence.start, occurrence.end, event_id)
+      indexed.append((occurrence.start, occurrence.end))
+    if indexed:
+      state.indexed[event_id] = indexed
+
+  def get_busy(self, calendars, start, end):
+    """Returns the times at which any of the calendars is busy.
+
+    Args:
+      calendars: list of calendar keys as given to update.
+      start: datetime The start of the window, in UTC.
+      end: datetime The end of the window, in UTC.
+
+    Returns:
+      A sorted list of non-overlapping (start, end) tuples, clipped to the
+      window.
+    """
+    intervals = []
+    for calendar in calendars:
+      state = self._calendars.get(calendar)
+      if state is not None:
+        intervals.extend(state.intervals.overlapping(start, end))
+    intervals.sort()
+    busy = []
+    for interval_start, interval_end in intervals:
+      interval_start = max(interval_start, start)
+      interval_end = min(interval_end, end)
+      if busy and interval_start <= busy[-1][1]:
+        if interval_end > busy[-1][1]:
+          busy[-1] = (busy[-1][0], interval_end)
+      else:
+        busy.append((interval_start, interval_end))
+    return busy
+
+  GetBusy = get_busy
+
+  def get_free_slots(self, calendars, start, end,
+                     min_duration=datetime.timedelta(0)):
+    """Returns the times at which all of the calendars are free.
+
+    Args:
+      calendars: list of calendar keys as given to update.
+      start: datetime The start of the window, in UTC.
+      end: datetime The end of the window, in UTC.
+      min_duration: timedelta (optional) Shorter free slots are left out.
+
+    Returns:
+      A sorted list of (start, end) tuples.
+    """
+    free = []
+    slot_start = start
+    for busy_start, busy_end in self.get_busy(calendars, start, end) + [
+        (end, end)]:
+      if busy_start > slot_start and busy_start - slot_start >= min_duration:
+        free.append((slot_start, busy_start))
+      slot_start = max(slot_start, busy_end)
+    return free
+
+  GetFreeSlots = get_free_slots
+
+  def find_free_calendars(self, calendars, start, end):
+    """Returns the calendars which are free for the whole window.
+
+    For example, the rooms which can be booked for a meeting. Calendars
+    which were never given to update are left out.
+    """
+    return [calendar for calendar in calendars
+            if calendar in self._calendars
+            and not self._calendars[calendar].intervals.overlapping(start,
+                                                                    end)]
+
+  FindFreeCalendars = find_free_calendars
@@ -0,0 +1,863 @@
+#!/usr/bin/python
+#
+# Copyright (C) 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Expands recurring Calendar events into their occurrences.
+
+A recurring event carries its schedule as iCalendar (RFC 2445) text in a
+gd:recurrence element, and changed or deleted instances as separate entries
+with a gd:originalEvent. This module turns those into concrete occurrences
+within a time window without asking the server for single events.
+
+Supported are DTSTART, DTEND, DURATION, RRULE, RDATE, EXRULE and EXDATE with
+DAILY, WEEKLY, MONTHLY and YEARLY rules using INTERVAL, COUNT, UNTIL,
+BYMONTH, BYMONTHDAY, BYDAY, BYSETPOS and WKST. Times with a TZID are
+converted to UTC using the VTIMEZONE components in the same text.
+
+Times are naive datetime objects in UTC. All day events start and end at
+midnight of their dates.
+
+Example:
+  expander = gdata.calendar.recurrence.RecurrenceExpander()
+  feed = client.get_calendar_event_feed()
+  for occurrence in expander.expand_feed(
+      feed.entry, datetime.datetime(2011, 5, 1), datetime.datetime(2011, 6, 1)):
+    print occurrence.start, occurrence.entry.title.text
+"""
+
+
+import bisect
+import calendar
+import datetime
+import heapq
+import re
+import atom.core
+import gdata.calendar.data
+import gdata.data
+
+
+# The number of series which a RecurrenceExpander keeps expanded.
+MAX_CACHED_SERIES = 1000
+# The number of consecutive periods without an occurrence after which a rule
+# is assumed to have none left, for rules such as 'every February 30th'.
+MAX_EMPTY_PERIODS = 4000
+
+WEEKDAYS = ['MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU']
+FREQUENCIES = ['DAILY', 'WEEKLY', 'MONTHLY', 'YEARLY']
+UNSUPPORTED_RULE_PARTS = ['BYSECOND', 'BYMINUTE', 'BYHOUR', 'BYYEARDAY',
+                          'BYWEEKNO']
+
+_ZERO = datetime.timedelta(0)
+_DURATION_PATTERN = re.compile(
+    r'^([+-])?P(?:(\d+)W)?(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$')
+_RFC3339_PATTERN = re.compile(
+    r'^(\d{4})-(\d\d)-(\d\d)(?:T(\d\d):(\d\d):(\d\d)(?:\.\d+)?'
+    r'(Z|[+-]\d\d:\d\d)?)?$')
+
+
+class Error(Exception):
+  pass
+
+
+class RecurrenceError(Error):
+  """Raised for recurrence text which cannot be parsed or is not supported."""
+  pass
+
+
+def parse_rfc3339(text):
+  """Parses a gd:when time such as '2011-05-02T09:00:00.000-07:00'.
+
+  Returns:
+    A (datetime, all_day) tuple. The datetime is in UTC, or midnight of the
+    date if the text is a date only, in which case all_day is True.
+  """
+  match = _RFC3339_PATTERN.match(text.strip())
+  if match is None:
+    raise RecurrenceError('Invalid time %r' % text)
+  (year, month, day, hour, minute, second,
+   zone) = match.groups()
+  if hour is None:
+    return datetime.datetime(int(year), int(month), int(day)), True
+  value = datetime.datetime(int(year), int(month), int(day), int(hour),
+                            int(minute), int(second))
+  if zone and zone != 'Z':
+    offset = datetime.timedelta(hours=int(zone[1:3]), minutes=int(zone[4:6]))
+    if zone[0] == '+':
+      value -= offset
+    else:
+      value += offset
+  return value, False
+
+
+ParseRfc3339 = parse_rfc3339
+
+
+def _parse_duration(text):
+  match = _DURATION_PATTERN.match(text.strip())
+  if match is None:
+    raise RecurrenceError('Invalid duration %r' % text)
+  sign, weeks, days, hours, minutes, seconds = match.groups()
+  duration = datetime.timedelta(
+      weeks=int(weeks or 0), days=int(days or 0), hours=int(hours or 0),
+      minutes=int(minutes or 0), seconds=int(seconds or 0))
+  if sign == '-':
+    return -duration
+  return duration
+
+
+def _parse_offset(text):
+  """Parses a UTC offset such as '-0700' into a timedelta."""
+  text = text.strip()
+  offset = datetime.timedelta(hours=int(text[1:3]), minutes=int(text[3:5]))
+  if text[0] == '-':
+    return -offset
+  return offset
+
+
+def _parse_ical_time(value):
+  """Parses an iCalendar DATE or DATE-TIME value.
+
+  Returns:
+    A (datetime, is_date, is_utc) tuple.
+  """
+  value = value.strip()
+  try:
+    if len(value) == 8:
+      return datetime.datetime.strptime(value, '%Y%m%d'), True, False
+    if value.endswith('Z'):
+      return (datetime.datetime.strptime(value[:-1], '%Y%m%dT%H%M%S'),
+              False, True)
+    return datetime.datetime.strptime(value, '%Y%m%dT%H%M%S'), False, False
+  except ValueError:
+    raise RecurrenceError('Invalid date or time %r' % value)
+
+
+def _read_properties(text):
+  """Splits iCalendar text into (name, params, value) tuples.
+
+  Folded lines are joined and the names of properties and parameters are
+  upper cased.
+  """
+  lines = []
+  for line in text.replace('\r\n', '\n').replace('\r', '\n').split('\n'):
+    if line[:1] in (' ', '\t') and lines:
+      lines[-1] += line[1:]
+    elif line.strip():
+      lines.append(line)
+  properties = []
+  for line in lines:
+    name_and_params, _, value = line.partition(':')
+    parts = name_and_params.split(';')
+    params = {}
+    for param in parts[1:]:
+      param_name, _, param_value = param.partition('=')
+      params[param_name.strip().upper()] = param_value.strip('"')
+    properties.append((parts[0].strip().upper(), params, value.strip()))
+  return properties
+
+
+class _Rule(object):
+  """A parsed RRULE or EXRULE."""
+
+  def __init__(self, text):
+    parts = {}
+    for part in text.split(';'):
+      if part:
+        name, _, value = part.partition('=')
+        parts[name.strip().upper()] = value.strip().upper()
+    for name in UNSUPPORTED_RULE_PARTS:
+      if name in parts:
+        raise RecurrenceError('%s is not supported in %r' % (name, text))
+    self.freq = parts.get('FREQ')
+    if self.freq not in FREQUENCIES:
+      raise RecurrenceError('Unsupported frequency in %r' % text)
+    try:
+      self.interval = int(parts.get('INTERVAL', '1'))
+      self.count = None
+      if 'COUNT' in parts:
+        self.count = int(parts['COUNT'])
+      self.until = None
+      if 'UNTIL' in parts:
+        self.until = _parse_ical_time(parts['UNTIL'])
+      self.by_month = [int(month) for month in _split(parts.get('BYMONTH'))]
+      self.by_month_day = [int(day)
+                           for day in _split(parts.get('BYMONTHDAY'))]
+      self.by_set_pos = [int(pos) for pos in _split(parts.get('BYSETPOS'))]
+      self.by_day = []
+      for day in _split(parts.get('BYDAY')):
+        n = day[:-2] and int(day[:-2]) or None
+        self.by_day.append((n, WEEKDAYS.index(day[-2:])))
+      self.week_start = WEEKDAYS.index(parts.get('WKST', 'MO'))
+    except ValueError:
+      raise RecurrenceError('Invalid rule %r' % text)
+    if self.interval < 1:
+      raise RecurrenceError('Invalid interval in %r' % text)
+
+  def iter_starts(self, dtstart, to_utc):
+    """Yields the local start times which this rule generates, in order.
+
+    DTSTART always counts as the first instance towards COUNT, even when it
+    does not match the rule itself.
+
+    Args:
+      dtstart: datetime The local start of the first instance.
+      to_utc: function which converts a local time to UTC, used to compare
+          times with an UNTIL given in UTC.
+    """
+    count = 0
+    empty_periods = 0
+    for days in self._iter_periods(dtstart):
+      starts = [datetime.datetime.combine(day, dtstart.time())
+                for day in days]
+      if self.by_set_pos:
+        starts = _pick_positions(starts, self.by_set_pos)
+      found = False
+      for start in starts:
+        if start < dtstart:
+          continue
+        if self.until is not None:
+          until, is_date, is_utc = self.until
+          if is_date and start.date() > until.date():
+            return
+          elif is_utc and to_utc(start) > until:
+            return
+          elif not is_date and not is_utc and start > until:
+            return
+        if not count and start != dtstart:
+          count = 1
+          if self.count is not None and count >= self.count:
+            return
+        found = True
+        yield start
+        count += 1
+        if self.count is not None and count >= self.count:
+          return
+      if found:
+        empty_periods = 0
+      else:
+        empty_periods += 1
+        if empty_periods > MAX_EMPTY_PERIODS:
+          return
+
+  def _iter_periods(self, dtstart):
+    """Yields the sorted candidate dates of each period of the rule."""
+    try:
+      if self.freq == 'YEARLY':
+        year = dtstart.year
+        while True:
+          yield self._yearly(year, dtstart)
+          year += self.interval
+      elif self.freq == 'MONTHLY':
+        month = dtstart.year * 12 + dtstart.month - 1
+        while True:
+          yield self._monthly(month // 12, month % 12 + 1, dtstart)
+          month += self.interval
+      elif self.freq == 'WEEKLY':
+        day = dtstart.date() - datetime.timedelta(
+            days=(dtstart.weekday() - self.week_start) % 7)
+        step = datetime.timedelta(days=7 * self.interval)
+        while True:
+          yield self._weekly(day, dtstart)
+          day += step
+      else:
+        day = dtstart.date()
+        step = datetime.timedelta(days=self.interval)
+        while True:
+          yield self._daily(day)
+          day += step
+    except (OverflowError, ValueError):
+      # Past the last year which datetime can represent.
+      return
+
+  def _yearly(self, year, dtstart):
+    if year > datetime.MAXYEAR:
+      raise OverflowError
+    if not self.by_month and not self.by_month_day and not self.by_day:
+      return _valid_dates(year, [dtstart.month], [dtstart.day])
+    if not self.by_month_day and not self.by_day:
+      return _valid_dates(year, self.by_month, [dtstart.day])
+    if self.by_month or self.by_month_day:
+      days = []
+      for month in sorted(self.by_month or range(1, 13)):
+        days.extend(self._filter_scope(_month_days(year, month)))
+      return days
+    first = datetime.date(year, 1, 1)
+    return self._filter_scope(
+        [first + datetime.timedelta(days=i)
+         for i in xrange(365 + calendar.isleap(year))])
+
+  def _monthly(self, year, month, dtstart):
+    if year > datetime.MAXYEAR:
+      raise OverflowError
+    if self.by_month and month not in self.by_month:
+      return []
+    if not self.by_month_day and not self.by_day:
+      return _valid_dates(year, [month], [dtstart.day])
+    return self._filter_scope(_month_days(year, month))
+
+  def _weekly(self, week_start, dtstart):
+    weekdays = [weekday for n, weekday in self.by_day] or [dtstart.weekday()]
+    days = []
+    for i in xrange(7):
+      day = week_start + datetime.timedelta(days=i)
+      if day.weekday() in weekdays and (not self.by_month
+                                        or day.month in self.by_month):
+        days.append(day)
+    return days
+
+  def _daily(self, day):
+    if self.by_month and day.month not in self.by_month:
+      return []
+    if self.by_month_day and not _matches_month_day(day, self.by_month_day):
+      return []
+    if self.by_day and day.weekday() not in [weekday
+                                             for n, weekday in self.by_day]:
+      return []
+    return [day]
+
+  def _filter_scope(self, scope):
+    """Applies BYMONTHDAY and BYDAY to the days of a month or year."""
+    days = scope
+    if self.by_month_day:
+      days = [day for day in days
+              if _matches_month_day(day, self.by_month_day)]
+    if self.by_day:
+      selected = set()
+      for n, weekday in self.by_day:
+        matching = [day for day in scope if day.weekday() == weekday]
+        if n is None:
+          selected.update(matching)
+        elif 0 < n <= len(matching):
+          selected.add(matching[n - 1])
+        elif 0 < -n <= len(matching):
+          selected.add(matching[n])
+      days = [day for day in days if day in selected]
+    return days
+
+
+def _split(value):
+  if not value:
+    return []
+  return [part for part in value.split(',') if part]
+
+
+def _valid_dates(year, months, days):
+  dates = []
+  for month in sorted(months):
+    for day in days:
+      if day < 0:
+        day = calendar.monthrange(year, month)[1] + day + 1
+      try:
+        dates.append(datetime.date(year, month, day))
+      except ValueError:
+        # For example February 30th, which is skipped.
+        pass
+  return dates
+
+
+def _month_days(year, month):
+  return [datetime.date(year, month, day)
+          for day in xrange(1, calendar.monthrange(year, month)[1] + 1)]
+
+
+def _matches_month_day(day, month_days):
+  length = calendar.monthrange(day.year, day.month)[1]
+  return day.day in month_days or day.day - length - 1 in month_days
+
+
+def _pick_positions(starts, positions):
+  picked = set()
+  for position in positions:
+    if 0 < position <= len(starts):
+      picked.add(starts[position - 1])
+    elif 0 < -position <= len(starts):
+      picked.add(starts[position])
+  return sorted(picked)
+
+
+class _TimeZone(object):
+  """The UTC offsets of a VTIMEZONE component."""
+
+  def __init__(self, tzid):
+    self.tzid = tzid
+    # (dtstart, offset_from, offset_to, rules, rdates) for each STANDARD or
+    # DAYLIGHT observance.
+    self.observances = []
+    # Maps a year to the sorted (local onset, offset) pairs in that year.
+    self._onsets = {}
+
+  def add_observance(self, properties):
+    dtstart = None
+    offset_from = offset_to = _ZERO
+    rules = []
+    rdates = []
+    for name, params, value in properties:
+      if name == 'DTSTART':
+        dtstart = _parse_ical_time(value)[0]
+      elif name == 'TZOFFSETFROM':
+        offset_from = _parse_offset(value)
+      elif name == 'TZOFFSETTO':
+        offset_to = _parse_offset(value)
+      elif name == 'RRULE':
+        rules.append(_Rule(value))
+      elif name == 'RDATE':
+        rdates.extend([_parse_ical_time(rdate)[0]
+                       for rdate in value.split(',')])
+    if dtstart is None:
+      raise RecurrenceError('Time zone %s has no DTSTART' % self.tzid)
+    self.observances.append((dtstart, offset_from, offset_to, rules, rdates))
+
+  def utc_offset(self, local):
+    """Returns the UTC offset in effect at a local time."""
+    onsets = self._get_onsets(local.year - 1) + self._get_onsets(local.year)
+    index = bisect.bisect_right(onsets, (local, datetime.timedelta.max))
+    if index:
+      return onsets[index - 1][1]
+    # No onset in the last two years, as in zones which dropped daylight
+    # saving time, so the latest earlier onset is in effect.
+    latest = None
+    for dtstart, offset_from, offset_to, rules, rdates in self.observances:
+      starts = [dtstart] + rdates
+      for rule in rules:
+        for start in rule.iter_starts(dtstart, lambda local: local):
+          if start > local:
+            break
+          starts.append(start)
+      starts = [start for start in starts if start <= local]
+      if starts and (latest is None or max(starts) > latest[0]):
+        latest = (max(starts), offset_to)
+    if latest is not None:
+      return latest[1]
+    # Before the first onset, the offset which the first one changes from.
+    if self.observances:
+      return min(self.observances)[1]
+    return _ZERO
+
+  def _get_onsets(self, year):
+    onsets = self._onsets.get(year)
+    if onsets is not None:
+      return onsets
+    onsets = []
+    end = datetime.datetime(year + 1, 1, 1) if year < datetime.MAXYEAR else (
+        datetime.datetime.max)
+    for dtstart, offset_from, offset_to, rules, rdates in self.observances:
+      starts = [dtstart] + rdates
+      for rule in rules:
+        for start in rule.iter_starts(dtstart, lambda local: local):
+          if start >= end:
+            break
+          if start.year == year:
+            starts.append(start)
+      for start in starts:
+        if start.year == year:
+          onsets.append((start, offset_to))
+    onsets.sort()
+    self._onsets[year] = onsets
+    return onsets
+
+
+class RecurrenceSet(object):
+  """The schedule described by the text of a gd:recurrence element.
+
+  Attributes:
+    dtstart: datetime The local start time of the first instance.
+    duration: timedelta The length of each instance.
+    all_day: boolean True if the instances are whole days.
+    tzid: str The time zone of dtstart, or None for UTC.
+  """
+
+  def __init__(self, text):
+    self.dtstart = None
+    self.duration = None
+    self.all_day = False
+    self.tzid = None
+    self.rules = []
+    self.exrules = []
+    self.rdates = []
+    self.exdates = []
+    self._utc_start = True
+    self.time_zones = {}
+    dtend = None
+    event_properties = []
+    component = []
+    time_zone = None
+    for name, params, value in _read_properties(text):
+      if name == 'BEGIN' and value.upper() == 'VTIMEZONE':
+        time_zone = _TimeZone(None)
+      elif name == 'END' and value.upper() == 'VTIMEZONE':
+        if time_zone is not None and time_zone.tzid:
+          self.time_zones[time_zone.tzid] = time_zone
+        time_zone = None
+      elif time_zone is not None:
+        if name == 'TZID':
+          time_zone.tzid = value
+        elif name == 'BEGIN':
+          component = []
+        elif name == 'END':
+          time_zone.add_observance(component)
+        else:
+          component.append((name, params, value))
+      else:
+        event_properties.append((name, params, value))
+    for name, params, value in event_properties:
+      if name == 'DTSTART':
+        self.dtstart, self.all_day, self._utc_start = _parse_ical_time(value)
+        self.tzid = params.get('TZID')
+      elif name == 'DTEND':
+        dtend = _parse_ical_time(value)[0]
+      elif name == 'DURATION':
+        self.duration = _parse_duration(value)
+      elif name == 'RRULE':
+        self.rules.append(_Rule(value))
+      elif name == 'EXRULE':
+        self.exrules.append(_Rule(value))
+      elif name in ('RDATE', 'EXDATE'):
+        if params.get('VALUE', '').upper() == 'PERIOD':
+          raise RecurrenceError('PERIOD values are not supported')
+        dates = self.rdates
+        if name == 'EXDATE':
+          dates = self.exdates
+        for date_value in value.split(','):
+          date, is_date, is_utc = _parse_ical_time(date_value)
+          if is_utc and not self._utc_start:
+            date = self._to_local(date, params.get('TZID') or self.tzid)
+          dates.append(date)
+    if self.dtstart is None:
+      raise RecurrenceError('The recurrence has no DTSTART')
+    if self.duration is None:
+      if dtend is not None:
+        self.duration = dtend - self.dtstart
+      elif self.all_day:
+        self.duration = datetime.timedelta(days=1)
+      else:
+        self.duration = _ZERO
+    self.rdates.sort()
+    self.exdates = set(self.exdates)
+
+  def to_utc(self, local):
+    """Converts a local time of this recurrence to UTC."""
+    if self.all_day or self._utc_start or self.tzid is None:
+      return local
+    time_zone = self.time_zones.get(self.tzid)
+    if time_zone is None:
+      return local
+    return local - time_zone.utc_offset(local)
+
+  ToUtc = to_utc
+
+  def _to_local(self, utc, tzid):
+    time_zone = self.time_zones.get(tzid)
+    if time_zone is None:
+      return utc
+    # The offset at the UTC time is close enough to find the one in effect
+    # at the local time, except in the hour after a transition.
+    local = utc + time_zone.utc_offset(utc)
+    return utc + time_zone.utc_offset(local)
+
+  def iter_local_starts(self):
+    """Yields the local start time of every instance, in order."""
+    sources = [iter([self.dtstart]), iter(self.rdates)]
+    for rule in self.rules:
+      sources.append(rule.iter_starts(self.dtstart, self.to_utc))
+    excluded = [rule.iter_starts(self.dtstart, self.to_utc)
+                for rule in self.exrules]
+    next_excluded = [_next(exrule) for exrule in excluded]
+    previous = None
+    for start in heapq.merge(*sources):
+      if start == previous:
+        continue
+      previous = start
+      if start in self.exdates:
+        continue
+      skip = False
+      for i, exrule in enumerate(excluded):
+        while next_excluded[i] is not None and next_excluded[i] < start:
+          next_excluded[i] = _next(exrule)
+        if next_excluded[i] == start:
+          skip = True
+      if not skip:
+        yield start
+
+  IterLocalStarts = iter_local_starts
+
+  def iter_occurrences(self):
+    """Yields a (start, end) tuple in UTC for every instance, in order."""
+    for start in self.iter_local_starts():
+      yield self.to_utc(start), self.to_utc(start + self.duration)
+
+  IterOccurrences = iter_occurrences
+
+
+def _next(iterator):
+  for value in iterator:
+    return value
+  return None
+
+
+class Occurrence(object):
+  """One instance of an event.
+
+  Attributes:
+    start: datetime The start time in UTC, or the start date of an all day
+        event.
+    end: datetime
+    all_day: boolean
+    entry: gdata.calendar.data.CalendarEventEntry The recurring event, or
+        the exception entry if this instance was changed.
+    original_start: datetime The start time which the recurrence gives for
+        this instance, or None if the event does not recur.
+  """
+
+  def __init__(self, start, end, all_day, entry, original_start=None):
+    self.start = start
+    self.end = end
+    self.all_day = all_day
+    self.entry = entry
+    self.original_start = original_start
+
+  def __cmp__(self, other):
+    return cmp((self.start, self.end), (other.start, other.end))
+
+  def __repr__(self):
+    return 'Occurrence(%s, %s)' % (self.start, self.end)
+
+
+class _Series(object):
+  """The occurrences of a RecurrenceSet which have been expanded so far."""
+
+  def __init__(self, etag, recurrence_set, exceptions):
+    self.etag = etag
+    self.recurrence_set = recurrence_set
+    self.exceptions = exceptions
+    self.starts = []
+    self.ends = []
+    self.max_duration = _ZERO
+    self._occurrences = recurrence_set.iter_occurrences()
+    self._done = False
+
+  def between(self, start, end):
+    """Returns the (start, end) tuples which overlap the window."""
+    while not self._done and (not self.starts or self.starts[-1] < end):
+      occurrence = _next(self._occurrences)
+      if occurrence is None:
+        self._done = True
+        break
+      self.starts.append(occurrence[0])
+      self.ends.append(occurrence[1])
+      self.max_duration = max(self.max_duration,
+                              occurrence[1] - occurrence[0])
+    index = bisect.bisect_left(self.starts, start - self.max_duration)
+    found = []
+    while index < len(self.starts) and self.starts[index] < end:
+      if self.ends[index] > start or (self.ends[index] == self.starts[index]
+                                      and self.starts[index] >= start):
+        found.append((self.starts[index], self.ends[index]))
+      index += 1
+    return found
+
+
+class RecurrenceExpander(object):
+  """Lists the occurrences of Calendar events within time windows.
+
+  Each recurring event's schedule is parsed once and its occurrences are
+  kept as they are expanded, keyed by the event's ID. When the event is
+  seen with a different ETag, its schedule is parsed again. Later queries
+  for the same event therefore only look up the occurrences in the window.
+  """
+
+  def __init__(self, max_series=MAX_CACHED_SERIES):
+    self.max_series = max_series
+    self._series = {}
+    self._last_used = {}
+    self._uses = 0
+
+  def expand(self, entry, start, end, exceptions=None):
+    """Returns the occurrences of an event which overlap a window.
+
+    Args:
+      entry: gdata.calendar.data.CalendarEventEntry A recurring or single
+          event.
+      start: datetime The start of the window, in UTC.
+      end: datetime The end of the window, in UTC.
+      exceptions: list of CalendarEventEntry (optional) The changed or
+          canceled instances of the event, which are entries with a
+          gd:originalEvent. Exceptions embedded in the entry's
+          gd:recurrenceException elements are used as well.
+
+    Returns:
+      A list of Occurrence objects sorted by start time. Canceled events
+      and instances have no occurrences.
+    """
+    if is_canceled(entry):
+      return []
+    if entry.recurrence is None or not entry.recurrence.text:
+      occurrences = []
+      for when in entry.when:
+        occurrence = _when_occurrence(when, entry)
+        if occurrence is not None and _overlaps(occurrence, start, end):
+          occurrences.append(occurrence)
+      occurrences.sort()
+      return occurrences
+    series = self._get_series(entry)
+    all_day = series.recurrence_set.all_day
+    changed = {}
+    for exception in series.exceptions + list(exceptions or []):
+      original = exception.original_event
+      if original is None or original.when is None or not original.when.start:
+        continue
+      changed[parse_rfc3339(original.when.start)[0]] = exception
+    # Moved instances may fall into the window from outside of it.
+    max_moved = _ZERO
+    for original_start, exception in changed.iteritems():
+      for when in exception.when:
+        occurrence = _when_occurrence(when, exception)
+        if occurrence is not None:
+          max_moved = max(max_moved, abs(occurrence.start - original_start),
+                          abs(occurrence.end - original_start))
+    occurrences = []
+    for occurrence_start, occurrence_end in series.between(start - max_moved,
+                                                           end + max_moved):
+      exception = changed.get(occurrence_start)
+      if exception is None:
+        occurrence = Occurrence(occurrence_start, occurrence_end, all_day,
+                                entry, occurrence_start)
+        if _overlaps(occurrence, start, end):
+          occurrences.append(occurrence)
+      elif not is_canceled(exception):
+        for when in exception.when:
+          occurrence = _when_occurrence(when, exception, occurrence_start)
+          if occurrence is not None and _overlaps(occurrence, start, end):
+            occurrences.append(occurrence)
+    occurrences.sort()
+    return occurrences
+
+  Expand = expand
+
+  def expand_feed(self, entries, start, end):
+    """Returns the occurrences of all events in a list which overlap a window.
+
+    Exception entries, which have a gd:originalEvent, are applied to the
+    recurring event which they belong to when it is in the list, and are
+    otherwise treated as single events.
+
+    Args:
+      entries: list of gdata.calendar.data.CalendarEventEntry, for example
+          the entries of a CalendarEventFeed.
+      start: datetime The start of the window, in UTC.
+      end: datetime The end of the window, in UTC.
+
+    Returns:
+      A list of Occurrence objects sorted by start time.
+    """
+    recurring = {}
+    for entry in entries:
+      if entry.recurrence is not None and entry.recurrence.text:
+        recurring[get_event_id(entry)] = entry
+    exceptions = {}
+    singles = []
+    for entry in entries:
+      original = entry.original_event
+      if original is not None and original.id in recurring:
+        exceptions.setdefault(original.id, []).append(entry)
+      elif get_event_id(entry) not in recurring:
+        singles.append(entry)
+    occurrences = []
+    for event_id, entry in recurring.iteritems():
+      occurrences.extend(self.expand(entry, start, end,
+                                     exceptions.get(event_id)))
+    for entry in singles:
+      occurrences.extend(self.expand(entry, start, end))
+    occurrences.sort()
+    return occurrences
+
+  ExpandFeed = expand_feed
+
+  def _get_series(self, entry):
+    key = entry.get_id() or entry.recurrence.text
+    etag = entry.etag or entry.recurrence.text
+    series = self._series.get(key)
+    if series is None or series.etag != etag:
+      series = _Series(etag, RecurrenceSet(entry.recurrence.text),
+                       _embedded_exceptions(entry))
+      self._series[key] = series
+      if len(self._series) > self.max_series:
+        self._evict()
+    self._uses += 1
+    self._last_used[key] = self._uses
+    return series
+
+  def _evict(self):
+    """Drops the least recently used quarter of the series."""
+    keys = sorted(self._last_used, key=self._last_used.get)
+    for key in keys[:max(1, len(keys) // 4)]:
+      self._series.pop(key, None)
+      del self._last_used[key]
+
+
+def get_event_id(entry):
+  """Returns the short event ID used in gd:originalEvent id attributes."""
+  entry_id = entry.get_id()
+  if entry_id is None:
+    return None
+  return entry_id.rstrip('/').split('/')[-1]
+
+
+GetEventId = get_event_id
+
+
+def is_canceled(entry):
+  """Returns True if the event entry has the canceled event status."""
+  return (entry.event_status is not None
+          and entry.event_status.value == gdata.data.CANCELED_EVENT_STATUS)
+
+
+IsCanceled = is_canceled
+
+
+def _overlaps(occurrence, start, end):
+  if occurrence.start == occurrence.end:
+    return start <= occurrence.start < end
+  return occurrence.start < end and occurrence.end > start
+
+
+def _when_occurrence(when, entry, original_start=None):
+  if not when.start:
+    return None
+  when_start, all_day = parse_rfc3339(when.start)
+  if when.end:
+    when_end = parse_rfc3339(when.end)[0]
+  elif all_day:
+    when_end = when_start + datetime.timedelta(days=1)
+  else:
+    when_end = when_start
+  return Occurrence(when_start, when_end, all_day, entry, original_start)
+
+
+def _embedded_exceptions(entry):
+  """Returns the exception entries inside gd:recurrenceException elements."""
+  exceptions = []
+  for recurrence_exception in entry.recurrence_exception:
+    entry_link = recurrence_exception.entry_link
+    if entry_link is None or entry_link.entry is None:
+      continue
+    # The nested entry is parsed as a plain GDEntry, so read it again as an
+    # event to get its gd:when and gd:originalEvent.
+    exception = atom.core.parse(entry_link.entry.to_string(),
+                                gdata.calendar.data.CalendarEventEntry)
+    if exception.original_event is None:
+      exception.original_event = recurrence_exception.original_event
+    exceptions.append(exception)
+  return exceptions
@@ -31,7 +31,14 @@ in this module is GDClient.
 __author__ = 'j.s@google.com (Jeff Scudder)'
 
 
+import copy
+import os
 import re
+import sys
+import tempfile
+import threading
+import time
+import urllib
 import atom.client
 import atom.core
 import atom.http_core
@@ -39,6 +46,13 @@ import gdata.gauth
 import gdata.data
 
 
+# The number of bytes which GDClient.download reads from the response and
+# writes to the destination at a time.
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# The number of files which ResumableUploadManager uploads at the same time.
+MAX_CONCURRENT_UPLOADS = 4
+
+
 class Error(Exception):
   pass
 
@@ -167,6 +181,18 @@ class GDClient(atom.client.AtomPubClient):
   redirect, and you will probably want to updgrade this since use token
   to a multiple use (session) token using the upgrade_token method.
 
+  Multiple Identities:
+
+  When using two legged OAuth on behalf of the users in a Google Apps
+  domain, a single client and a single token can be shared by all users.
+  Set the auth_token to a gdata.gauth.TwoLeggedOAuthHmacToken (or
+  TwoLeggedOAuthRsaToken) created with a requestor_id of None and pass the
+  user's email address as the requestor_id argument of request (or any of
+  the convenience methods built on it). The token's signing key is computed
+  once and reused for every user. To also reuse open connections, create
+  the client with an atom.http_core.KeepAliveHttpClient as its http_client.
+  Both may be shared by many threads.
+
   API Versions:
 
   This client is multi-version capable and can be used with Google Data API
@@ -186,7 +212,7 @@ class GDClient(atom.client.AtomPubClient):
 
   def request(self, method=None, uri=None, auth_token=None,
               http_request=None, converter=None, desired_class=None,
-              redirects_remaining=4, **kwargs):
+              redirects_remaining=4, requestor_id=None, **kwargs):
     """Make an HTTP request to the server.
 
     See also documentation for atom.client.AtomPubClient.request.
@@ -227,6 +253,9 @@ class GDClient(atom.client.AtomPubClient):
                            server sends a 302 redirect, the request method
                            will raise an exception. This parameter is used in
                            recursive request calls to avoid an infinite loop.
+      requestor_id: str (optional) The email address of the user on whose
+                    behalf a two legged OAuth request is made. Overrides the
+                    client's xoauth_requestor_id for this request only.
 
     Any additional arguments are passed through to
     atom.client.AtomPubClient.request.
@@ -263,13 +292,17 @@ class GDClient(atom.client.AtomPubClient):
     # performing the HTTP request.
     #http_request = self.modify_request(http_request)
 
+    if requestor_id is not None:
+      kwargs['xoauth_requestor_id'] = requestor_id
+
     response = atom.client.AtomPubClient.request(self, method=method,
         uri=uri, auth_token=auth_token, http_request=http_request, **kwargs)
     # On success, convert the response body using the desired converter
     # function if present.
     if response is None:
       return None
-    if response.status == 200 or response.status == 201:
+    # A 206 is the successful response to a request with a Range header.
+    if response.status in (200, 201, 206):
       if converter is not None:
         return converter(response)
       elif desired_class is not None:
@@ -788,10 +821,328 @@ class GDClient(atom.client.AtomPubClient):
 
   Batch = batch
 
+  def download(self, uri, destination, chunk_size=DOWNLOAD_CHUNK_SIZE,
+               resume=False, auth_token=None, **kwargs):
+    """Streams the body of the response to a GET request to a file.
+
+    The response is read and written chunk_size bytes at a time, so the
+    whole body is never held in memory.
+
+    Args:
+      uri: str or atom.http_core.Uri The URL to download from.
+      destination: str The path of the file to write to, or an object with a
+          write method such as an open file.
+      chunk_size: int (optional) The number of bytes to read from the
+          response at a time. Defaults to DOWNLOAD_CHUNK_SIZE.
+      resume: boolean (optional) If True and destination is the path of a
+          file left by an earlier interrupted download, only the rest of the
+          content is requested and appended to the file. The ETag of the
+          response is kept next to the file (destination + '.etag') until
+          the download completes and is sent in an If-Range header when
+          resuming, so a file which changed in the meantime is downloaded
+          again in full. Files without a saved ETag, and content served
+          without a strong ETag, are always downloaded in full.
+      auth_token: (optional) An object which sets the Authorization HTTP
+          header in its modify_request method.
+      kwargs: Other parameters to pass to self.request().
+
+    Returns:
+      The number of bytes in the destination file, or the number of bytes
+      written if destination is not a path.
+
+    Raises:
+      RequestError: on error response from server.
+    """
+    offset = 0
+    etag_path = None
+    if isinstance(destination, basestring) and resume:
+      etag_path = destination + '.etag'
+      if os.path.exists(destination) and os.path.exists(etag_path):
+        etag = open(etag_path, 'rb').read().strip()
+        offset = os.path.getsize(destination)
+        if etag and offset:
+          kwargs['range_header'] = atom.client.CustomHeaders(
+              **{'Range': 'bytes=%i-' % offset, 'If-Range': etag})
+        else:
+          offset = 0
+    try:
+      response = self.request('GET', uri, auth_token=auth_token, **kwargs)
+    except RequestError, error:
+      if offset and error.status == 416:
+        # The content has not changed (otherwise If-Range would have made
+        # the server send all of it) and the requested range starts at its
+        # end, so the partial download is already complete.
+        os.remove(etag_path)
+        return offset
+      raise
+    if isinstance(destination, basestring):
+      if response.status == 206:
+        output = open(destination, 'ab')
+      else:
+        offset = 0
+        output = open(destination, 'wb')
+        if etag_path is not None:
+          etag = response.getheader('ETag')
+          if etag and not etag.startswith('W/'):
+            etag_file = open(etag_path, 'wb')
+            try:
+              etag_file.write(etag)
+            finally:
+              etag_file.close()
+          elif os.path.exists(etag_path):
+            os.remove(etag_path)
+    else:
+      output = destination
+    try:
+      written = _copy_response(response, output, chunk_size)
+    finally:
+      if output is not destination:
+        output.close()
+    if etag_path is not None and os.path.exists(etag_path):
+      os.remove(etag_path)
+    return offset + written
+
+  Download = download
+
   # TODO: add a refresh method to request a conditional update to an entry
   # or feed.
 
 
+def _copy_response(response, output, chunk_size):
+  """Writes the body of response to output one chunk at a time."""
+  written = 0
+  while True:
+    chunk = response.read(chunk_size)
+    if not chunk:
+      return written
+    output.write(chunk)
+    written += len(chunk)
+
+
+# Number of seconds for which a cached ClientLogin token is used before a new
+# token is requested. The server may expire tokens sooner, in which case the
+# token is replaced when a request is rejected with a 401.
+CLIENT_LOGIN_TOKEN_TTL = 24 * 60 * 60
+
+
+class ClientLoginManager(object):
+  """Obtains, caches, and renews the ClientLogin tokens used by a GDClient.
+
+  GDClient.client_login requests a token for the client's auth_service and
+  then one for its alt_auth_service, one after the other, every time a
+  process starts. This manager requests both tokens at the same time and can
+  store them in a file so that short lived processes reuse the tokens from
+  an earlier run until the ttl has passed. If the server responds to a
+  request with a 401, the rejected token is replaced and the request is
+  sent again.
+
+  Usage:
+    >>> manager = gdata.client.ClientLoginManager(
+            'me@example.com', 'password', 'my-app',
+            cache_path='/var/cache/my-app/tokens')
+    >>> client = manager.authorize(gdata.docs.client.DocsClient())
+
+  The cache file contains auth tokens and should be protected like a
+  password. It is created readable only by the current user.
+  """
+
+  def __init__(self, email, password, source, cache_path=None,
+               ttl=CLIENT_LOGIN_TOKEN_TTL, account_type='HOSTED_OR_GOOGLE'):
+    """Creates a manager for one user's ClientLogin tokens.
+
+    Args:
+      email: str The user's email address or username.
+      password: str The password for the user's account.
+      source: str The name of your application.
+      cache_path: str (optional) File in which tokens are stored between
+                  runs. If None, tokens are only kept in memory.
+      ttl: int (optional) Number of seconds for which a token is reused.
+      account_type: str (optional) See GDClient.client_login.
+    """
+    self.email = email
+    self.password = password
+    self.source = source
+    self.cache_path = cache_path
+    self.ttl = ttl
+    self.account_type = account_type
+    # Maps service names to (token, expiration time) tuples.
+    self._tokens = {}
+    self._lock = threading.Lock()
+
+  def get_tokens(self, client, services):
+    """Returns a dict of ClientLoginTokens for the named services.
+
+    Tokens which are not cached, or have expired, are requested from the
+    server concurrently.
+
+    Args:
+      client: gdata.client.GDClient used to make the ClientLogin requests.
+      services: list of str ClientLogin service names, for example
+                ['writely', 'wise'].
+    """
+    self._lock.acquire()
+    try:
+      self._load_cache()
+      now = time.time()
+      missing = [service for service in services
+                 if service not in self._tokens
+                 or self._tokens[service][1] <= now]
+      if missing:
+        self._store_tokens(self._request_tokens(client, missing))
+      return dict([(service, self._tokens[service][0])
+                   for service in services])
+    finally:
+      self._lock.release()
+
+  GetTokens = get_tokens
+
+  def renew_token(self, client, service, rejected_token=None):
+    """Requests a new token for the service, replacing the cached one.
+
+    Args:
+      client: gdata.client.GDClient used to make the ClientLogin request.
+      service: str The ClientLogin service name.
+      rejected_token: gdata.gauth.ClientLoginToken (optional) The token
+                      which the server refused. If another thread has
+                      already replaced this token, the replacement is
+                      returned without contacting the server.
+    """
+    self._lock.acquire()
+    try:
+      current = self._tokens.get(service)
+      if (rejected_token is not None and current is not None
+          and current[0].token_string != rejected_token.token_string):
+        return current[0]
+      self._store_tokens(self._request_tokens(client, [service]))
+      return self._tokens[service][0]
+    finally:
+      self._lock.release()
+
+  RenewToken = renew_token
+
+  def authorize(self, client):
+    """Sets the client's auth tokens and renews them when they are rejected.
+
+    Sets the client's auth_token, and alt_auth_token if the client has an
+    alt_auth_service, then changes the client's http_client so that a
+    request which receives a 401 response is sent again with a new token.
+
+    Returns:
+      The client which was passed in.
+    """
+    services = [client.auth_service]
+    if client.alt_auth_service is not None:
+      services.append(client.alt_auth_service)
+    tokens = self.get_tokens(client, services)
+    client.auth_token = tokens[client.auth_service]
+    if client.alt_auth_service is not None:
+      client.alt_auth_token = tokens[client.alt_auth_service]
+    request_orig = client.http_client.request
+
+    def new_request(http_request):
+      response = request_orig(http_request)
+      if response.status != 401:
+        return response
+      authorization = http_request.headers.get('Authorization')
+      for service in services:
+        token = tokens[service]
+        if authorization != (gdata.gauth.PROGRAMMATIC_AUTH_LABEL
+                             + token.token_string):
+          continue
+        tokens[service] = self.renew_token(client, service, token)
+        if client.auth_token is token:
+          client.auth_token = tokens[service]
+        if getattr(client, 'alt_auth_token', None) is token:
+          client.alt_auth_token = tokens[service]
+        # A body read from a file has been consumed and can not be resent.
+        if [part for part in http_request._body_parts
+            if hasattr(part, 'read')]:
+          return response
+        tokens[service].modify_request(http_request)
+        return request_orig(http_request)
+      return response
+
+    client.http_client.request = new_request
+    return client
+
+  Authorize = authorize
+
+  def _request_tokens(self, client, services):
+    """Requests a token for each service, all at the same time."""
+    results = {}
+    errors = []
+
+    def request_token(service):
+      try:
+        results[service] = client.request_client_login_token(
+            self.email, self.password, self.source, service=service,
+            account_type=self.account_type)
+      except Exception, error:
+        errors.append(error)
+
+    threads = [threading.Thread(target=request_token, args=(service,))
+               for service in services[1:]]
+    for thread in threads:
+      thread.start()
+    request_token(services[0])
+    for thread in threads:
+      thread.join()
+    if errors:
+      raise errors[0]
+    return results
+
+  def _store_tokens(self, tokens):
+    expires = time.time() + self.ttl
+    for service, token in tokens.iteritems():
+      self._tokens[service] = (token, expires)
+    self._save_cache()
+
+  def _load_cache(self):
+    """Reads unexpired tokens for this user from the cache file."""
+    if self.cache_path is None or not os.path.exists(self.cache_path):
+      return
+    cache_file = open(self.cache_path)
+    try:
+      lines = cache_file.read().splitlines()
+    finally:
+      cache_file.close()
+    now = time.time()
+    for line in lines:
+      try:
+        email, service, expires, blob = line.split(' ', 3)
+        expires = float(expires)
+      except ValueError:
+        continue
+      if email == self.email and expires > now:
+        self._tokens[service] = (gdata.gauth.token_from_blob(blob), expires)
+
+  def _save_cache(self):
+    """Writes this user's tokens to the cache file, keeping other users'."""
+    if self.cache_path is None:
+      return
+    lines = []
+    if os.path.exists(self.cache_path):
+      cache_file = open(self.cache_path)
+      try:
+        lines = [line for line in cache_file.read().splitlines()
+                 if line.split(' ', 1)[0] != self.email]
+      finally:
+        cache_file.close()
+    for service, (token, expires) in self._tokens.iteritems():
+      lines.append(' '.join((self.email, service, repr(expires),
+                             gdata.gauth.token_to_blob(token))))
+    # Write a new file and then move it into place so that a process which
+    # is reading the cache never sees a partially written file.
+    fd, temp_path = tempfile.mkstemp(
+        dir=os.path.dirname(self.cache_path) or os.curdir)
+    cache_file = os.fdopen(fd, 'w')
+    try:
+      cache_file.write('\n'.join(lines) + '\n')
+    finally:
+      cache_file.close()
+    replace_file(temp_path, self.cache_path)
+
+
 def _add_query_param(param_string, value, http_request):
   if value:
     http_request.uri.query[param_string] = value
@@ -911,9 +1262,15 @@ class ResumableUploader(object):
   # Initial chunks which are smaller than 256KB might be dropped. The last
   # chunk for a file can be smaller tan this.
   MIN_CHUNK_SIZE = 262144 # 256KB
+  # Adaptive uploads never send chunks larger than this.
+  MAX_CHUNK_SIZE = 33554432 # 32MB
+  # Adaptive uploads size each chunk to take about this many seconds at the
+  # throughput measured for the previous chunk.
+  TARGET_CHUNK_SECONDS = 5
 
   def __init__(self, client, file_handle, content_type, total_file_size,
-               chunk_size=None, desired_class=None):
+               chunk_size=None, desired_class=None, adaptive=False,
+               journal=None, journal_key=None, keep_alive=False):
     """Starts a resumable upload to a service that supports the protocol.
 
     Args:
@@ -925,6 +1282,17 @@ class ResumableUploader(object):
           DEFAULT_CHUNK_SIZE will be used.
       desired_class: object (optional) The type of gdata.data.GDEntry to parse
           the completed entry as. This should be specific to the API.
+      adaptive: boolean (optional) If True, upload_file grows or shrinks the
+          chunk size, in multiples of MIN_CHUNK_SIZE, so that each chunk
+          takes about TARGET_CHUNK_SECONDS to send. Defaults to False.
+      journal: UploadJournal (optional) Records the upload session and the
+          bytes confirmed by the server, so that upload_file can continue an
+          upload which was interrupted, even in another process.
+      journal_key: str (optional) Identifies this upload in the journal, see
+          UploadJournal.make_key. Required if a journal is given.
+      keep_alive: boolean (optional) If True, upload_file sends all of the
+          chunks on one keep-alive connection, when the client's http_client
+          allows it. Defaults to False.
     """
     self.client = client
     self.file_handle = file_handle
@@ -934,6 +1302,10 @@ class ResumableUploader(object):
     if self.chunk_size < self.MIN_CHUNK_SIZE:
       self.chunk_size = self.MIN_CHUNK_SIZE
     self.desired_class = desired_class or gdata.data.GDEntry
+    self.adaptive = adaptive
+    self.journal = journal
+    self.journal_key = journal_key
+    self.keep_alive = keep_alive
     self.upload_uri = None
 
     # Send the entire file if the chunk size is less than fize's total size.
@@ -1019,10 +1391,7 @@ class ResumableUploader(object):
     if self.upload_uri is None:
       raise RequestError('Resumable upload request not initialized.')
 
-    # Adjustment if last byte range is less than defined chunk size.
-    chunk_size = self.chunk_size
-    if len(content_bytes) <= chunk_size:
-      chunk_size = len(content_bytes)
+    chunk_size = len(content_bytes)
 
     http_request = atom.http_core.HttpRequest()
     http_request.add_body_part(content_bytes, self.content_type,
@@ -1066,6 +1435,11 @@ class ResumableUploader(object):
           among others.
       kwargs: (optional) Other args to pass to self._init_session.
 
+    If the uploader has a journal which holds a session for this upload,
+    the server is asked how much of the file it has received and the upload
+    continues from there. The file handle must then support seek. A new
+    session is started if the server no longer knows the old one.
+
     Returns:
       The final Atom entry created on the server. The entry object's type will
       be the class specified in self.desired_class.
@@ -1074,21 +1448,105 @@ class ResumableUploader(object):
       RequestError if anything other than a HTTP 308 is returned
       when the request raises an exception.
     """
-    self._init_session(resumable_media_link, headers=headers,
-                       auth_token=auth_token, entry=entry, **kwargs)
-
-    start_byte = 0
-    entry = None
-
-    while not entry:
-      entry = self.upload_chunk(
-          start_byte, self.file_handle.read(self.chunk_size))
-      start_byte += self.chunk_size
+    journal = None
+    if self.journal is not None and self.journal_key is not None:
+      journal = self.journal
+    # The next chunk is read from the file while the current one is sent.
+    reader = _ChunkReader(self.file_handle)
+    client = self.client
+    pooled_http_client = None
+    if self.keep_alive:
+      self.client, pooled_http_client = keep_alive_client(client, 1)
+    try:
+      start_byte = None
+      session = None
+      if journal is not None:
+        session = journal.get(self.journal_key)
+      if session is not None:
+        self.upload_uri = session[0]
+        start_byte = self._query_session()
+        if isinstance(start_byte, gdata.data.GDEntry):
+          journal.remove(self.journal_key)
+          return start_byte
+        if start_byte:
+          self.file_handle.seek(start_byte)
+
+      reader.prefetch(self.chunk_size)
+      if start_byte is None:
+        response = self._init_session(resumable_media_link, headers=headers,
+                                      auth_token=auth_token, entry=entry,
+                                      **kwargs)
+        # Reading the response releases the connection for the first chunk.
+        response.read()
+        start_byte = 0
+        if journal is not None:
+          journal.record(self.journal_key, self.upload_uri, 0)
+
+      entry = None
+
+      while not entry:
+        content_bytes = reader.read(self.chunk_size)
+        if not content_bytes and start_byte < self.total_file_size:
+          raise RequestError('File ended after %i of %i bytes.' % (
+              start_byte, self.total_file_size))
+        reader.prefetch(self.chunk_size)
+        started = time.time()
+        entry = self.upload_chunk(start_byte, content_bytes)
+        start_byte += len(content_bytes)
+        if self.adaptive and not entry:
+          self._adapt_chunk_size(len(content_bytes), time.time() - started)
+        if journal is not None and not entry:
+          journal.record(self.journal_key, self.upload_uri, start_byte)
+      if journal is not None:
+        journal.remove(self.journal_key)
+    finally:
+      reader.close()
+      self.client = client
+      if pooled_http_client is not None:
+        pooled_http_client.close()
 
     return entry
 
   UploadFile = upload_file
 
+  def _query_session(self):
+    """Asks the server how much of the file it has received.
+
+    Returns:
+      The number of bytes received, the completed entry if the server has
+      the whole file, or None if the server does not know the session.
+    """
+    http_request = atom.http_core.HttpRequest()
+    http_request.headers['Content-Length'] = '0'
+    http_request.headers['Content-Range'] = 'bytes */%s' % self.total_file_size
+    try:
+      return self.client.request(method='PUT', uri=self.upload_uri,
+                                 http_request=http_request,
+                                 desired_class=self.desired_class)
+    except RequestError, error:
+      if error.status == 308:
+        headers = error.headers or []
+        if hasattr(headers, 'items'):
+          headers = headers.items()
+        for name, value in headers:
+          if name.lower() == 'range':
+            return int(value.split('-')[1]) + 1
+        return 0
+      elif error.status in (404, 410):
+        return None
+      raise
+
+  def _adapt_chunk_size(self, size, seconds):
+    """Sizes the next chunk from the time taken to send the last one."""
+    if size < self.chunk_size:
+      return
+    target = size * 2
+    if seconds > 0:
+      target = min(target, int(size / seconds * self.TARGET_CHUNK_SECONDS))
+    target -= target % self.MIN_CHUNK_SIZE
+    self.chunk_size = max(self.MIN_CHUNK_SIZE,
+                          min(target, self.MAX_CHUNK_SIZE))
+
   def update_file(self, entry_or_resumable_edit_link, headers=None, force=False,
                   auth_token=None, update_metadata=False, uri_params=None):
     """Updates the contents of an existing file using the resumable protocol.
@@ -1192,3 +1650,463 @@ class ResumableUploader(object):
         raise error
 
   QueryUploadStatus = query_upload_status
+
+
+class _ChunkReader(object):
+  """Reads a file in chunks, reading the next chunk in a background thread."""
+
+  def __init__(self, file_handle):
+    self.file_handle = file_handle
+    self._buffer = ''
+    self._thread = None
+    self._result = None
+    self._error = None
+
+  def prefetch(self, size):
+    """Starts reading until size bytes are buffered, without waiting."""
+    self._wait()
+    if len(self._buffer) < size:
+      self._thread = threading.Thread(target=self._read,
+                                      args=(size - len(self._buffer),))
+      self._thread.setDaemon(True)
+      self._thread.start()
+
+  def _read(self, size):
+    try:
+      self._result = self.file_handle.read(size)
+    except Exception, error:
+      self._error = error
+
+  def _wait(self):
+    if self._thread is None:
+      return
+    self._thread.join()
+    self._thread = None
+    if self._error is not None:
+      error = self._error
+      self._error = None
+      raise error
+    self._buffer += self._result
+    self._result = None
+
+  def read(self, size):
+    """Returns the next size bytes of the file, or fewer at the end."""
+    self._wait()
+    if len(self._buffer) < size:
+      self._buffer += self.file_handle.read(size - len(self._buffer))
+    if len(self._buffer) <= size:
+      content_bytes = self._buffer
+      self._buffer = ''
+    else:
+      content_bytes = self._buffer[:size]
+      self._buffer = self._buffer[size:]
+    return content_bytes
+
+  def close(self):
+    """Waits for a pending read to finish."""
+    try:
+      self._wait()
+    except Exception:
+      pass
+
+
+def keep_alive_client(client, max_connections):
+  """Returns a copy of client which reuses its connections.
+
+  Only clients which use a plain atom.http_core.HttpClient, or a
+  ProxiedHttpClient when no proxy is configured, are copied, since other
+  http clients may proxy, record or mock requests. Clients whose
+  http_client has its request method wrapped, as OAuth2Token.authorize and
+  ClientLoginManager.authorize do to renew tokens, are not copied either,
+  since the copy would lose the wrapper.
+
+  Args:
+    client: GDClient The client whose requests should share connections.
+    max_connections: int The most connections to keep open to each host.
+
+  Returns:
+    A (client, pooled_http_client) tuple. pooled_http_client is the
+    atom.http_core.KeepAliveHttpClient which the caller should close once it
+    is done with the copy, or None if client was returned unchanged.
+  """
+  if 'request' in vars(client.http_client):
+    return client, None
+  http_client_type = type(client.http_client)
+  if http_client_type is atom.http_core.ProxiedHttpClient:
+    if os.environ.get('http_proxy') or os.environ.get('https_proxy'):
+      return client, None
+  elif http_client_type is not atom.http_core.HttpClient:
+    return client, None
+  pooled_http_client = atom.http_core.KeepAliveHttpClient(
+      max_connections=max_connections)
+  pooled_http_client.debug = client.http_client.debug
+  client = copy.copy(client)
+  client.http_client = pooled_http_client
+  return client, pooled_http_client
+
+
+def replace_file(temp_path, path):
+  """Moves temp_path to path, replacing any existing file.
+
+  Files which are written to a temporary file and then moved into place
+  with this function are never left half written.
+
+  Args:
+    temp_path: str The file to move, in the same directory as path.
+    path: str The file to replace.
+  """
+  try:
+    os.rename(temp_path, path)
+  except OSError:
+    # Windows does not allow renaming over an existing file.
+    if not os.path.exists(path):
+      raise
+    os.remove(path)
+    os.rename(temp_path, path)
+
+
+class RateLimiter(object):
+  """Spaces out calls to wait so that at most rate happen each second.
+
+  One RateLimiter may be shared by many threads.
+  """
+
+  def __init__(self, rate):
+    """Creates a RateLimiter.
+
+    Args:
+      rate: float The most calls to wait which return each second.
+    """
+    self.interval = 1.0 / rate
+    self._next = 0
+    self._lock = threading.Lock()
+
+  def wait(self):
+    self._lock.acquire()
+    try:
+      now = time.time()
+      start = max(now, self._next)
+      self._next = start + self.interval
+    finally:
+      self._lock.release()
+    if start > now:
+      time.sleep(start - now)
+
+  Wait = wait
+
+
+def run_concurrently(function, jobs, max_concurrent):
+  """Calls function with each of the jobs on up to max_concurrent threads.
+
+  Jobs are taken from the iterable one at a time as threads become free, so
+  it may be a generator which reads them from a file. The calling thread
+  works on jobs as well.
+
+  Args:
+    function: The function to call with each job.
+    jobs: An iterable of the jobs.
+    max_concurrent: int The most jobs to work on at the same time.
+
+  Returns:
+    A list of the values returned by function, in the order of the jobs.
+
+  Raises:
+    The first exception raised by function or by the jobs iterable. No more
+    jobs are started after it, and it is raised once the other threads have
+    finished their current jobs.
+  """
+  thread_count = max_concurrent
+  if hasattr(jobs, '__len__'):
+    thread_count = min(max_concurrent, len(jobs))
+  jobs = enumerate(jobs)
+  results = {}
+  errors = []
+  lock = threading.Lock()
+
+  def work():
+    while True:
+      lock.acquire()
+      try:
+        if errors:
+          return
+        try:
+          position, job = jobs.next()
+        except StopIteration:
+          return
+        except:
+          errors.append(sys.exc_info())
+          return
+      finally:
+        lock.release()
+      try:
+        result = function(job)
+      except:
+        lock.acquire()
+        try:
+          errors.append(sys.exc_info())
+        finally:
+          lock.release()
+        return
+      lock.acquire()
+      try:
+        results[position] = result
+      finally:
+        lock.release()
+
+  threads = [threading.Thread(target=work)
+             for i in xrange(thread_count - 1)]
+  for thread in threads:
+    thread.start()
+  try:
+    work()
+  finally:
+    for thread in threads:
+      thread.join()
+  if errors:
+    raise errors[0][0], errors[0][1], errors[0][2]
+  return [results[position] for position in xrange(len(results))]
+
+
+class UploadJournal(object):
+  """Remembers resumable upload sessions in a file.
+
+  Each line of the file holds the key of an upload, the number of bytes which
+  the server has confirmed and the session's upload URI. The file is
+  rewritten, keeping the lines of other uploads, whenever a chunk is
+  confirmed, so that a process which crashes or is restarted can continue
+  its uploads with ResumableUploader.upload_file instead of starting again.
+
+  Example:
+    journal = gdata.client.UploadJournal('/var/lib/uploader/journal')
+    key = journal.make_key(path, create_uri)
+    uploader = gdata.client.ResumableUploader(
+        client, open(path, 'rb'), 'video/mp4', os.path.getsize(path),
+        journal=journal, journal_key=key)
+    entry = uploader.upload_file(create_uri)
+  """
+
+  def __init__(self, path):
+    self.path = path
+    self._lock = threading.Lock()
+
+  def make_key(file_path, resumable_media_link):
+    """Returns a key for uploading a file to a resumable media link.
+
+    The key includes the file's size and modification time, so an upload
+    is not continued after the file has changed.
+    """
+    file_path = os.path.abspath(file_path)
+    stat = os.stat(file_path)
+    return '%s:%i:%i:%s' % (urllib.quote(file_path, safe='/'), stat.st_size,
+                            int(stat.st_mtime),
+                            urllib.quote(resumable_media_link, safe=''))
+
+  make_key = staticmethod(make_key)
+  MakeKey = make_key
+
+  def get(self, key):
+    """Returns the (upload_uri, offset) recorded for key, or None."""
+    self._lock.acquire()
+    try:
+      return self._read().get(key)
+    finally:
+      self._lock.release()
+
+  Get = get
+
+  def record(self, key, upload_uri, offset):
+    """Records that the server has the first offset bytes of an upload."""
+    self._lock.acquire()
+    try:
+      sessions = self._read()
+      sessions[key] = (upload_uri, offset)
+      self._write(sessions)
+    finally:
+      self._lock.release()
+
+  Record = record
+
+  def remove(self, key):
+    """Forgets an upload, usually because it has completed."""
+    self._lock.acquire()
+    try:
+      sessions = self._read()
+      if key in sessions:
+        del sessions[key]
+        self._write(sessions)
+    finally:
+      self._lock.release()
+
+  Remove = remove
+
+  def _read(self):
+    sessions = {}
+    if not os.path.exists(self.path):
+      return sessions
+    journal_file = open(self.path)
+    try:
+      lines = journal_file.read().splitlines()
+    finally:
+      journal_file.close()
+    for line in lines:
+      try:
+        key, offset, upload_uri = line.split(' ', 2)
+        sessions[key] = (upload_uri, int(offset))
+      except ValueError:
+        continue
+    return sessions
+
+  def _write(self, sessions):
+    lines = ['%s %i %s\n' % (key, offset, upload_uri)
+             for key, (upload_uri, offset) in sessions.iteritems()]
+    # Write a new file and then move it into place so that a crash while
+    # writing never loses the sessions which were already recorded.
+    fd, temp_path = tempfile.mkstemp(
+        dir=os.path.dirname(self.path) or os.curdir)
+    journal_file = os.fdopen(fd, 'w')
+    try:
+      journal_file.write(''.join(lines))
+    finally:
+      journal_file.close()
+    replace_file(temp_path, self.path)
+
+
+class UploadReport(object):
+  """The results of ResumableUploadManager.run.
+
+  Attributes:
+    completed: list of (file_path, entry) tuples for the files which were
+        uploaded, in the order in which they were added.
+    failed: list of (file_path, error) tuples for the files which could not
+        be uploaded.
+    bytes_uploaded: int The total size of the files which were uploaded.
+    seconds: float The time taken by all uploads.
+  """
+
+  def __init__(self):
+    self.completed = []
+    self.failed = []
+    self.bytes_uploaded = 0
+    self.seconds = 0.0
+
+  def get_throughput(self):
+    """Returns the average number of bytes uploaded per second."""
+    if not self.seconds:
+      return 0.0
+    return self.bytes_uploaded / self.seconds
+
+  GetThroughput = get_throughput
+
+
+class ResumableUploadManager(object):
+  """Uploads many files at the same time using the resumable protocol.
+
+  Each file is sent by a ResumableUploader, up to max_concurrent at a time.
+  Unless the client's http_client has been replaced or a proxy is
+  configured, the uploads share a pool of keep-alive connections.
+
+  Example:
+    manager = gdata.client.ResumableUploadManager(client)
+    for path in paths:
+      manager.add(path, 'video/mp4', create_uri,
+                  headers={'Slug': os.path.basename(path)})
+    report = manager.run()
+  """
+
+  def __init__(self, client, max_concurrent=MAX_CONCURRENT_UPLOADS,
+               chunk_size=None, adaptive=True, journal=None):
+    """Creates a ResumableUploadManager.
+
+    Args:
+      client: gdata.client.GDClient used to upload the files.
+      max_concurrent: int (optional) The number of files to upload at the
+          same time.
+      chunk_size: int (optional) The size of the first chunk of each file.
+          Defaults to ResumableUploader.DEFAULT_CHUNK_SIZE.
+      adaptive: boolean (optional) If True, the chunk size of each upload
+          follows its measured throughput. Defaults to True.
+      journal: UploadJournal (optional) If given, uploads which were
+          interrupted in an earlier run continue where they stopped.
+    """
+    self.client = client
+    self.max_concurrent = max_concurrent
+    self.chunk_size = chunk_size
+    self.adaptive = adaptive
+    self.journal = journal
+    self._uploads = []
+
+  def add(self, file_path, content_type, resumable_media_link, entry=None,
+          headers=None, desired_class=None, **kwargs):
+    """Adds a file to upload when run is called.
+
+    Args:
+      file_path: str The path of the file to upload.
+      content_type: str The mimetype of the file.
+      resumable_media_link: str The full URL for the #resumable-create-media
+          or #resumable-edit-media link to start the upload at.
+      entry: A (optional) gdata.data.GDEntry containing metadata for the
+          file.
+      headers: dict (optional) Additional headers to send in the request
+          which starts the upload, for example {'Slug': 'MyTitle'}.
+      desired_class: object (optional) The type of gdata.data.GDEntry to
+          parse the completed entry as.
+      kwargs: (optional) Other args to pass to ResumableUploader.upload_file,
+          such as auth_token or method.
+    """
+    self._uploads.append((file_path, content_type, resumable_media_link,
+                          entry, headers, desired_class, kwargs))
+
+  Add = add
+
+  def run(self):
+    """Uploads all of the added files.
+
+    Returns:
+      An UploadReport.
+    """
+    jobs = self._uploads
+    self._uploads = []
+    client, pooled_http_client = keep_alive_client(self.client,
+                                                   self.max_concurrent)
+    report = UploadReport()
+
+    def upload_file(job):
+      (file_path, content_type, resumable_media_link, entry, headers,
+       desired_class, kwargs) = job
+      try:
+        size = os.path.getsize(file_path)
+        journal_key = None
+        if self.journal is not None:
+          journal_key = self.journal.make_key(file_path,
+                                              resumable_media_link)
+        file_handle = open(file_path, 'rb')
+        try:
+          uploader = ResumableUploader(
+              client, file_handle, content_type, size,
+              chunk_size=self.chunk_size, desired_class=desired_class,
+              adaptive=self.adaptive, journal=self.journal,
+              journal_key=journal_key)
+          result = uploader.upload_file(resumable_media_link, entry=entry,
+                                        headers=headers, **kwargs)
+        finally:
+          file_handle.close()
+      except Exception, error:
+        return file_path, None, error, 0
+      return file_path, result, None, size
+
+    start = time.time()
+    try:
+      outcomes = run_concurrently(upload_file, jobs, self.max_concurrent)
+    finally:
+      if pooled_http_client is not None:
+        pooled_http_client.close()
+    report.seconds = time.time() - start
+    for file_path, result, error, size in outcomes:
+      if error is None:
+        report.completed.append((file_path, result))
+        report.bytes_uploaded += size
+      else:
+        report.failed.append((file_path, error))
+    return report
+
+  Run = run
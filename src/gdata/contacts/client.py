@@ -25,6 +25,12 @@ http://code.google.com/apis/contatcs/
 __author__ = 'vinces1979@gmail.com (Vince Spicer)'
 
 
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import time
 import gdata.client
 import gdata.contacts.data
 import atom.client
@@ -32,10 +38,36 @@ import atom.data
 import atom.http_core
 import gdata.gauth
 
+try:
+  import simplejson
+except ImportError:
+  try:
+    # Try to import from django, should work on App Engine
+    from django.utils import simplejson
+  except ImportError:
+    # Should work for Python2.6 and higher.
+    import json as simplejson
+
 DEFAULT_BATCH_URL = ('https://www.google.com/m8/feeds/contacts/default/full'
                      '/batch')
 DEFAULT_PROFILES_BATCH_URL = ('https://www.google.com/m8/feeds/profiles/domain/'
                               '%s/full/batch')
+# The number of contacts or groups which ContactsSync requests per page.
+SYNC_PAGE_SIZE = 1000
+# The largest number of operations which the server accepts in one batch.
+MAX_BATCH_SIZE = 100
+# Version of the file format written by ContactsSync.
+CONTACTS_SYNC_FILE_VERSION = 1
+# The number of batch requests which the bulk methods send at the same time.
+MAX_CONCURRENT_BATCHES = 4
+# The number of times the bulk methods resend an entry after a conflict.
+MAX_CONFLICT_RETRIES = 1
+# Batch status codes for entries whose ETag no longer matches the server.
+CONFLICT_STATUSES = (409, 412)
+# The number of photos which PhotoManager transfers at the same time.
+MAX_CONCURRENT_PHOTOS = 8
+# Version of the file format written by PhotoManager.
+PHOTO_STATE_FILE_VERSION = 1
 
 class ContactsClient(gdata.client.GDClient):
   api_version = '3'
@@ -266,11 +298,13 @@ class ContactsClient(gdata.client.GDClient):
                       assumed that it already contains the content length.
     """
     ifmatch_header = None
-    if isinstance(contact_entry_or_url, gdata.contacts.data.ContactEntry):
+    if isinstance(contact_entry_or_url, gdata.contacts.data.PersonEntry):
       photo_link = contact_entry_or_url.GetPhotoLink()
       uri = photo_link.href
-      ifmatch_header = atom.client.CustomHeaders(
-          **{'if-match': photo_link.etag})
+      # A contact without a photo has no etag to match against.
+      if photo_link.etag:
+        ifmatch_header = atom.client.CustomHeaders(
+            **{'if-match': photo_link.etag})
     else:
       uri = contact_entry_or_url
     if isinstance(media, gdata.data.MediaSource):
@@ -289,7 +323,9 @@ class ContactsClient(gdata.client.GDClient):
 
   ChangePhoto = change_photo
 
-  def get_photo(self, contact_entry_or_url, auth_token=None, **kwargs):
+  def get_photo(self, contact_entry_or_url, auth_token=None,
+                destination=None, chunk_size=gdata.client.DOWNLOAD_CHUNK_SIZE,
+                resume=False, **kwargs):
     """Retrives the binary data for the contact's profile photo as a string.
 
     Args:
@@ -297,17 +333,26 @@ class ContactsClient(gdata.client.GDClient):
          containing the photo link's URL. If the contact entry does not
          contain a photo link, the image will not be fetched and this method
          will return None.
+      destination: str (optional) The path of a file, or an object with a
+         write method, to which the photo is streamed chunk_size bytes at a
+         time. If given, the number of bytes in the destination is returned
+         instead of the photo data.
+      chunk_size: int (optional) The number of bytes to read at a time when
+         writing to a destination.
+      resume: boolean (optional) If True, a partial file left by an
+         interrupted download is resumed if the photo has not changed
+         since, see gdata.client.GDClient.download.
     """
-    # TODO: add the ability to write out the binary image data to a file,
-    # reading and writing a chunk at a time to avoid potentially using up
-    # large amounts of memory.
     url = None
-    if isinstance(contact_entry_or_url, gdata.contacts.data.ContactEntry):
+    if isinstance(contact_entry_or_url, gdata.contacts.data.PersonEntry):
       photo_link = contact_entry_or_url.GetPhotoLink()
       if photo_link:
         url = photo_link.href
     else:
       url = contact_entry_or_url
+    if url and destination is not None:
+      return self.download(url, destination, chunk_size=chunk_size,
+                           resume=resume, auth_token=auth_token, **kwargs)
     if url:
       return self.Get(url, auth_token=auth_token, **kwargs).read()
     else:
@@ -324,7 +369,7 @@ class ContactsClient(gdata.client.GDClient):
     """
     uri = None
     ifmatch_header = None
-    if isinstance(contact_entry_or_url, gdata.contacts.data.ContactEntry):
+    if isinstance(contact_entry_or_url, gdata.contacts.data.PersonEntry):
       photo_link = contact_entry_or_url.GetPhotoLink()
       if photo_link.etag:
         uri = photo_link.href
@@ -428,7 +473,7 @@ class ContactsClient(gdata.client.GDClient):
       default converter is used, this is stored in a ContactsFeed.
     """
     return self.Post(batch_feed, url, desired_class=desired_class,
-                     auth_token=None, **kwargs)
+                     auth_token=auth_token, **kwargs)
 
   ExecuteBatch = execute_batch
 
@@ -458,6 +503,174 @@ class ContactsClient(gdata.client.GDClient):
 
   ExecuteBatchProfiles = execute_batch_profiles
 
+  def bulk_create(self, contacts, url=None,
+                  max_concurrent=MAX_CONCURRENT_BATCHES, auth_token=None,
+                  **kwargs):
+    """Creates many contacts using concurrent batch requests.
+
+    Args:
+      contacts: list of gdata.contacts.data.ContactEntry objects to insert.
+      url: str (optional) The batch URL, defaults to the batch feed of this
+          client's contact_list.
+      max_concurrent: int (optional) The number of batch requests to send at
+          the same time.
+      auth_token: (optional) The token used to authorize the requests.
+      kwargs: Other parameters to pass to execute_batch.
+
+    Returns:
+      A list with a ContactsBatchResult for each of the contacts, in the
+      same order.
+    """
+    return self._execute_bulk('insert', contacts, url, max_concurrent, 0,
+                              auth_token, **kwargs)
+
+  BulkCreate = bulk_create
+
+  def bulk_update(self, contacts, url=None,
+                  max_concurrent=MAX_CONCURRENT_BATCHES,
+                  conflict_retries=MAX_CONFLICT_RETRIES, auth_token=None,
+                  **kwargs):
+    """Updates many contacts using concurrent batch requests.
+
+    Contacts which the server rejects because they were changed since they
+    were read are fetched again and resent with the current ETag, replacing
+    the other change, up to conflict_retries times.
+
+    Args:
+      contacts: list of gdata.contacts.data.ContactEntry objects with the
+          ID and ETag which they were read with.
+      url: str (optional) The batch URL, defaults to the batch feed of this
+          client's contact_list.
+      max_concurrent: int (optional) The number of batch requests to send at
+          the same time.
+      conflict_retries: int (optional) How often to resend a conflicting
+          contact. Use 0 to report conflicts as failures instead.
+      auth_token: (optional) The token used to authorize the requests.
+      kwargs: Other parameters to pass to execute_batch.
+
+    Returns:
+      A list with a ContactsBatchResult for each of the contacts, in the
+      same order.
+    """
+    return self._execute_bulk('update', contacts, url, max_concurrent,
+                              conflict_retries, auth_token, **kwargs)
+
+  BulkUpdate = bulk_update
+
+  def bulk_delete(self, contacts, url=None,
+                  max_concurrent=MAX_CONCURRENT_BATCHES,
+                  conflict_retries=MAX_CONFLICT_RETRIES, auth_token=None,
+                  **kwargs):
+    """Deletes many contacts using concurrent batch requests.
+
+    Conflicts are retried as in bulk_update.
+
+    Args:
+      contacts: list of gdata.contacts.data.ContactEntry objects to delete.
+      url: str (optional) The batch URL, defaults to the batch feed of this
+          client's contact_list.
+      max_concurrent: int (optional) The number of batch requests to send at
+          the same time.
+      conflict_retries: int (optional) How often to resend a conflicting
+          contact. Use 0 to report conflicts as failures instead.
+      auth_token: (optional) The token used to authorize the requests.
+      kwargs: Other parameters to pass to execute_batch.
+
+    Returns:
+      A list with a ContactsBatchResult for each of the contacts, in the
+      same order.
+    """
+    return self._execute_bulk('delete', contacts, url, max_concurrent,
+                              conflict_retries, auth_token, **kwargs)
+
+  BulkDelete = bulk_delete
+
+  def _execute_bulk(self, operation, contacts, url, max_concurrent,
+                    conflict_retries, auth_token, **kwargs):
+    url = url or self.get_feed_uri(projection='full/batch')
+    results = [ContactsBatchResult(operation, entry) for entry in contacts]
+    client, pooled_http_client = gdata.client.keep_alive_client(
+        self, max_concurrent)
+    try:
+      positions = range(len(results))
+      retries = 0
+      while positions:
+        client._send_batches(
+            [(results[i], operation, results[i].entry) for i in positions],
+            url, max_concurrent, auth_token, **kwargs)
+        positions = [i for i in positions
+                     if results[i].status in CONFLICT_STATUSES]
+        if not positions or retries >= conflict_retries:
+          break
+        retries += 1
+        # Read the current version of each conflicting contact in one batch
+        # query per MAX_BATCH_SIZE contacts, and resend it with that ETag.
+        queries = [(ContactsBatchResult('query', results[i].entry), 'query',
+                    results[i].entry) for i in positions]
+        client._send_batches(queries, url, max_concurrent, auth_token,
+                             **kwargs)
+        resend = []
+        for i, (query, _, _) in zip(positions, queries):
+          if query.succeeded() and query.result is not None:
+            results[i].entry.etag = query.result.etag
+            results[i].retries = retries
+            resend.append(i)
+          elif query.status is not None:
+            results[i].status = query.status
+            results[i].reason = query.reason
+        positions = resend
+    finally:
+      if pooled_http_client is not None:
+        pooled_http_client.close()
+    return results
+
+  def _send_batches(self, jobs, url, max_concurrent, auth_token, **kwargs):
+    """Sends (result, operation, entry) jobs in batches of MAX_BATCH_SIZE.
+
+    The status of each job is stored in its ContactsBatchResult.
+    """
+    chunks = [jobs[start:start + MAX_BATCH_SIZE]
+              for start in xrange(0, len(jobs), MAX_BATCH_SIZE)]
+
+    def send_chunk(chunk):
+      feed = gdata.contacts.data.ContactsFeed()
+      for i, (result, operation, entry) in enumerate(chunk):
+        if operation == 'query':
+          feed.add_query(url_string=entry.get_id(), batch_id_string=str(i))
+        else:
+          feed.add_batch_entry(entry=entry, batch_id_string=str(i),
+                               operation_string=operation)
+      try:
+        result_feed = self.execute_batch(
+            feed, url=url, desired_class=gdata.contacts.data.ContactsFeed,
+            auth_token=auth_token, **kwargs)
+      except gdata.client.RequestError, error:
+        for result, operation, entry in chunk:
+          result.status = error.status
+          result.reason = error.reason
+        return
+      except Exception, error:
+        for result, operation, entry in chunk:
+          result.status = None
+          result.reason = str(error)
+        return
+      result_entries = {}
+      for result_entry in result_feed.entry:
+        if result_entry.batch_id is not None:
+          result_entries[result_entry.batch_id.text] = result_entry
+      for i, (result, operation, entry) in enumerate(chunk):
+        result_entry = result_entries.get(str(i))
+        if result_entry is None or result_entry.batch_status is None:
+          result.status = None
+          result.reason = 'Not processed by the server'
+          continue
+        result.status = int(result_entry.batch_status.code)
+        result.reason = result_entry.batch_status.reason
+        if result.status < 300 and operation != 'delete':
+          result.result = result_entry
+
+    gdata.client.run_concurrently(send_chunk, chunks, max_concurrent)
+
   def _CleanUri(self, uri):
     """Sanitizes a feed URI.
 
@@ -506,6 +719,7 @@ class ContactsQuery(gdata.client.Query):
     self.orderby = orderby
     self.sortorder = sortorder
     self.showdeleted = showdeleted
+    self.requirealldeleted = requirealldeleted
 
   def modify_request(self, http_request):
     if self.group:
@@ -516,6 +730,9 @@ class ContactsQuery(gdata.client.Query):
       gdata.client._add_query_param('sortorder', self.sortorder, http_request)
     if self.showdeleted:
       gdata.client._add_query_param('showdeleted', self.showdeleted, http_request)
+    if self.requirealldeleted:
+      gdata.client._add_query_param('requirealldeleted',
+                                    self.requirealldeleted, http_request)
     gdata.client.Query.modify_request(self, http_request)
 
   ModifyRequest = modify_request
@@ -545,3 +762,756 @@ class ProfilesQuery(gdata.client.Query):
     gdata.client.Query.modify_request(self, http_request)
 
   ModifyRequest = modify_request
+
+
+class ContactsBatchResult(object):
+  """The outcome of one contact in a bulk operation or ContactsSync.push.
+
+  Attributes:
+    operation: str The batch operation, 'insert', 'update' or 'delete'.
+    entry: gdata.contacts.data.ContactEntry The contact which was given.
+    status: int The batch status code, for example 201 for a created contact
+        or 412 for a conflict, or None if the server did not process it.
+    reason: str The reason given with the status.
+    result: gdata.contacts.data.ContactEntry The contact returned by the
+        server for successful inserts and updates, otherwise None.
+    retries: int The number of times the contact was resent after a
+        conflict.
+  """
+
+  def __init__(self, operation, entry):
+    self.operation = operation
+    self.entry = entry
+    self.status = None
+    self.reason = None
+    self.result = None
+    self.retries = 0
+
+  def succeeded(self):
+    return self.status is not None and self.status < 300
+
+  Succeeded = succeeded
+
+
+class PhotoReport(object):
+  """The results of PhotoManager.run.
+
+  Attributes:
+    downloaded: list of (entry, file_path, size) tuples for the photos which
+        were saved, in the order in which they were added.
+    uploaded: list of (entry, file_path, size) tuples for the photos which
+        were sent.
+    skipped: list of (entry, file_path) tuples for the photos which had not
+        changed since they were last transferred, and for downloads of
+        contacts which have no photo.
+    removed: list of (entry, file_path) tuples for downloaded photos which
+        were deleted on the server. The local file is removed.
+    failed: list of (entry, file_path, error) tuples.
+    bytes_downloaded: int
+    bytes_uploaded: int
+    seconds: float The time taken by all transfers.
+  """
+
+  def __init__(self):
+    self.downloaded = []
+    self.uploaded = []
+    self.skipped = []
+    self.removed = []
+    self.failed = []
+    self.bytes_downloaded = 0
+    self.bytes_uploaded = 0
+    self.seconds = 0.0
+
+
+class PhotoManager(object):
+  """Downloads and uploads the photos of many contacts or profiles at once.
+
+  Photos are streamed between files and the server by up to max_concurrent
+  threads which, unless the client's http_client has been replaced or a
+  proxy is configured, share a pool of keep-alive connections.
+
+  If a state_path is given, the ETag, size and MD5 digest of each photo are
+  remembered there after it is transferred. A later run skips downloads
+  whose photo link still has the same ETag and whose file is still in place,
+  and uploads whose file is unchanged and whose photo has not been replaced
+  on the server since.
+
+  Example:
+    manager = gdata.contacts.client.PhotoManager(client, '/photos/state')
+    manager.add_downloads(client.get_profiles_feed().entry, '/photos')
+    report = manager.run()
+  """
+
+  def __init__(self, client, state_path=None,
+               max_concurrent=MAX_CONCURRENT_PHOTOS,
+               chunk_size=gdata.client.DOWNLOAD_CHUNK_SIZE):
+    """Creates a PhotoManager.
+
+    Args:
+      client: gdata.contacts.client.ContactsClient used for the transfers.
+      state_path: str (optional) The file in which to remember the photos
+          which have been transferred.
+      max_concurrent: int (optional) The number of photos to transfer at the
+          same time.
+      chunk_size: int (optional) The number of bytes read at a time.
+    """
+    self.client = client
+    self.state_path = state_path
+    self.max_concurrent = max_concurrent
+    self.chunk_size = chunk_size
+    self._jobs = []
+    # Maps photo URLs to [etag, size, md5] lists.
+    self._photos = {}
+    if state_path is not None and os.path.exists(state_path):
+      state_file = open(state_path)
+      try:
+        state = simplejson.load(state_file)
+      finally:
+        state_file.close()
+      if state.get('version') == PHOTO_STATE_FILE_VERSION:
+        self._photos = state['photos']
+
+  def add_download(self, entry, file_path):
+    """Adds the photo of a ContactEntry or ProfileEntry to save to a file."""
+    self._jobs.append(('download', entry, file_path, None))
+
+  AddDownload = add_download
+
+  def add_downloads(self, entries, directory):
+    """Adds the photos of many entries to save into a directory.
+
+    Each file is named after the last part of the entry's ID, so that later
+    runs find the same files.
+    """
+    for entry in entries:
+      file_name = entry.get_id().rstrip('/').split('/')[-1]
+      self.add_download(entry, os.path.join(directory, file_name))
+
+  AddDownloads = add_downloads
+
+  def add_upload(self, entry, file_path, content_type='image/jpeg'):
+    """Adds a file to send as the photo of a ContactEntry or ProfileEntry."""
+    self._jobs.append(('upload', entry, file_path, content_type))
+
+  AddUpload = add_upload
+
+  def run(self):
+    """Transfers all of the added photos.
+
+    Returns:
+      A PhotoReport.
+    """
+    jobs = self._jobs
+    self._jobs = []
+    client, pooled_http_client = gdata.client.keep_alive_client(
+        self.client, self.max_concurrent)
+    report = PhotoReport()
+    results = {'downloaded': [], 'uploaded': [], 'skipped': [],
+               'removed': [], 'failed': []}
+    lock = threading.Lock()
+
+    def transfer_photo(job):
+      kind, entry, file_path, content_type = job
+      try:
+        if kind == 'download':
+          outcome, size = self._download(client, entry, file_path, lock)
+        else:
+          outcome, size = self._upload(client, entry, file_path,
+                                       content_type, lock)
+      except Exception, error:
+        outcome, size = 'failed', error
+      return outcome, entry, file_path, size
+
+    start = time.time()
+    try:
+      outcomes = gdata.client.run_concurrently(transfer_photo, jobs,
+                                               self.max_concurrent)
+    finally:
+      if pooled_http_client is not None:
+        pooled_http_client.close()
+      self.save()
+    report.seconds = time.time() - start
+    for outcome, entry, file_path, size in outcomes:
+      if outcome == 'downloaded':
+        report.bytes_downloaded += size
+      elif outcome == 'uploaded':
+        report.bytes_uploaded += size
+      if size is None:
+        results[outcome].append((entry, file_path))
+      else:
+        results[outcome].append((entry, file_path, size))
+    for outcome, outcome_results in results.iteritems():
+      setattr(report, outcome, outcome_results)
+    return report
+
+  Run = run
+
+  def _download(self, client, entry, file_path, lock):
+    photo_link = _get_photo_link(entry)
+    lock.acquire()
+    try:
+      saved = self._photos.get(photo_link.href)
+    finally:
+      lock.release()
+    if photo_link.etag is None:
+      # The contact has no photo. Remove the one saved by an earlier run.
+      if saved is None:
+        return 'skipped', None
+      if os.path.exists(file_path):
+        os.remove(file_path)
+      self._forget(photo_link.href, lock)
+      return 'removed', None
+    if (saved is not None and saved[0] == photo_link.etag
+        and os.path.exists(file_path)
+        and os.path.getsize(file_path) == saved[1]):
+      return 'skipped', None
+    # Download to a temporary file so that a failed download never replaces
+    # a good photo or leaves a partial file which a later run would keep.
+    temp_path = '%s.%i.%i.tmp' % (file_path, os.getpid(), id(entry))
+    output = _DigestFile(open(temp_path, 'wb'))
+    try:
+      size = client.get_photo(photo_link.href, destination=output,
+                              chunk_size=self.chunk_size)
+    except:
+      output.close()
+      os.remove(temp_path)
+      raise
+    output.close()
+    gdata.client.replace_file(temp_path, file_path)
+    self._remember(photo_link.href,
+                   [photo_link.etag, size, output.hexdigest()], lock)
+    return 'downloaded', size
+
+  def _upload(self, client, entry, file_path, content_type, lock):
+    photo_link = _get_photo_link(entry)
+    size, digest = _file_digest(file_path, self.chunk_size)
+    lock.acquire()
+    try:
+      saved = self._photos.get(photo_link.href)
+    finally:
+      lock.release()
+    if (saved is not None and photo_link.etag is not None
+        and saved[0] == photo_link.etag and saved[2] == digest):
+      return 'skipped', None
+    response = client.change_photo(file_path, entry,
+                                   content_type=content_type,
+                                   content_length=size)
+    # Read the response so that its connection can be reused.
+    response.read()
+    self._remember(photo_link.href,
+                   [response.getheader('ETag'), size, digest], lock)
+    return 'uploaded', size
+
+  def _remember(self, photo_url, photo, lock):
+    lock.acquire()
+    try:
+      self._photos[photo_url] = photo
+    finally:
+      lock.release()
+
+  def _forget(self, photo_url, lock):
+    lock.acquire()
+    try:
+      self._photos.pop(photo_url, None)
+    finally:
+      lock.release()
+
+  def save(self):
+    """Writes the ETags and digests of the transferred photos to state_path.
+    """
+    if self.state_path is None:
+      return
+    fd, temp_path = tempfile.mkstemp(
+        dir=os.path.dirname(self.state_path) or os.curdir)
+    state_file = os.fdopen(fd, 'w')
+    try:
+      simplejson.dump({'version': PHOTO_STATE_FILE_VERSION,
+                       'photos': self._photos}, state_file,
+                      separators=(',', ':'))
+    finally:
+      state_file.close()
+    gdata.client.replace_file(temp_path, self.state_path)
+
+  Save = save
+
+
+class _DigestFile(object):
+  """Writes to a file while computing the MD5 digest of what was written."""
+
+  def __init__(self, output):
+    self._output = output
+    self._md5 = hashlib.md5()
+
+  def write(self, data):
+    self._output.write(data)
+    self._md5.update(data)
+
+  def close(self):
+    self._output.close()
+
+  def hexdigest(self):
+    return self._md5.hexdigest()
+
+
+def _get_photo_link(entry):
+  photo_link = entry.GetPhotoLink()
+  if photo_link is None:
+    raise gdata.client.Error('Entry %s has no photo link' % entry.get_id())
+  return photo_link
+
+
+def _file_digest(file_path, chunk_size):
+  """Returns the size and MD5 hex digest of a file."""
+  md5 = hashlib.md5()
+  size = 0
+  photo_file = open(file_path, 'rb')
+  try:
+    while True:
+      data = photo_file.read(chunk_size)
+      if not data:
+        break
+      size += len(data)
+      md5.update(data)
+  finally:
+    photo_file.close()
+  return size, md5.hexdigest()
+
+
+class SyncedContact(object):
+  """The fields of a contact which are kept in a ContactsSync's index.
+
+  Attributes:
+    id: str The contact's atom ID.
+    etag: str Changes whenever the contact is modified.
+    edit_uri: str The URI used to update or delete the contact.
+    name: str The contact's title, usually the full name.
+    emails: list of str The contact's email addresses.
+    phone_numbers: list of str The contact's phone numbers.
+    groups: list of str The IDs of the groups the contact belongs to.
+  """
+
+  def __init__(self, id, etag=None, edit_uri=None, name=None, emails=None,
+               phone_numbers=None, groups=None):
+    self.id = id
+    self.etag = etag
+    self.edit_uri = edit_uri
+    self.name = name
+    self.emails = emails or []
+    self.phone_numbers = phone_numbers or []
+    self.groups = groups or []
+
+  def _to_list(self):
+    return [self.id, self.etag, self.edit_uri, self.name, self.emails,
+            self.phone_numbers, self.groups]
+
+  def from_entry(entry):
+    """Creates a SyncedContact from a gdata.contacts.data.ContactEntry."""
+    edit_link = entry.get_edit_link()
+    name = None
+    if entry.title is not None:
+      name = entry.title.text
+    return SyncedContact(
+        entry.get_id(), etag=entry.etag,
+        edit_uri=edit_link and edit_link.href or None, name=name,
+        emails=[email.address for email in entry.email if email.address],
+        phone_numbers=[phone_number.text for phone_number in entry.phone_number
+                       if phone_number.text],
+        groups=[membership.href
+                for membership in entry.group_membership_info
+                if membership.href and membership.deleted != 'true'])
+
+  from_entry = staticmethod(from_entry)
+  FromEntry = from_entry
+
+
+class SyncedGroup(object):
+  """The fields of a contact group which are kept in a ContactsSync's index.
+
+  Attributes:
+    id: str The group's atom ID.
+    etag: str Changes whenever the group is modified.
+    edit_uri: str The URI used to update or delete the group.
+    title: str
+    system_group: str The ID of the system group, such as 'Contacts' or
+        'Friends', or None for groups created by the user.
+  """
+
+  def __init__(self, id, etag=None, edit_uri=None, title=None,
+               system_group=None):
+    self.id = id
+    self.etag = etag
+    self.edit_uri = edit_uri
+    self.title = title
+    self.system_group = system_group
+
+  def _to_list(self):
+    return [self.id, self.etag, self.edit_uri, self.title, self.system_group]
+
+  def from_entry(entry):
+    """Creates a SyncedGroup from a gdata.contacts.data.GroupEntry."""
+    edit_link = entry.get_edit_link()
+    title = None
+    if entry.title is not None:
+      title = entry.title.text
+    system_group = None
+    if entry.system_group is not None:
+      system_group = entry.system_group.id
+    return SyncedGroup(entry.get_id(), etag=entry.etag,
+                       edit_uri=edit_link and edit_link.href or None,
+                       title=title, system_group=system_group)
+
+  from_entry = staticmethod(from_entry)
+  FromEntry = from_entry
+
+
+class ContactsSyncResult(object):
+  """The contacts and groups which changed during one ContactsSync.sync call.
+
+  Attributes:
+    added: list of the IDs of contacts which were not in the index before.
+    changed: list of the IDs of contacts which were modified.
+    removed: list of the IDs of contacts which were deleted.
+    added_groups: list of the IDs of new groups.
+    changed_groups: list of the IDs of modified groups.
+    removed_groups: list of the IDs of deleted groups.
+    full: boolean True if every contact and group was read, either because
+        this was the first sync or because the server could no longer list
+        everything deleted since the last one.
+  """
+
+  def __init__(self):
+    self.added = []
+    self.changed = []
+    self.removed = []
+    self.added_groups = []
+    self.changed_groups = []
+    self.removed_groups = []
+    self.full = False
+
+
+class ContactsSync(object):
+  """Keeps a local index of an account's contacts and groups up to date.
+
+  The first sync reads every contact and group. Later syncs only request
+  the entries updated since the previous sync, including placeholders for
+  deleted entries, using the feed's updated time as reported by the server
+  as the cursor. If the server has discarded some of the placeholders it
+  responds with 410 Gone and everything is read again.
+
+  Contacts can be looked up by ID, email address or phone number. Local
+  changes are queued with create_contact, update_contact and delete_contact
+  and sent by push in batches of MAX_BATCH_SIZE operations.
+
+  If a state_path is given, the index and cursors are saved there after each
+  sync or push. One file can hold the state for several accounts.
+
+  Example:
+    sync = gdata.contacts.client.ContactsSync(client, '/var/lib/app/contacts')
+    result = sync.sync()
+    for contact_id in result.added + result.changed:
+      print sync.contacts[contact_id].name
+    print [contact.name for contact in sync.find_by_email('liz@example.com')]
+
+  Attributes:
+    contacts: dict mapping contact IDs to SyncedContact objects.
+    groups: dict mapping group IDs to SyncedGroup objects.
+    contacts_updated: str The server time of the last contacts sync, None
+        before the first sync.
+    groups_updated: str The server time of the last groups sync.
+  """
+
+  def __init__(self, client, state_path=None, account=None):
+    """Creates a ContactsSync, loading its state if state_path exists.
+
+    Args:
+      client: gdata.contacts.client.ContactsClient used to talk to the
+          server.
+      state_path: str (optional) The file in which the index is saved.
+      account: str (optional) The contact list to synchronize, usually an
+          email address. Defaults to the client's contact_list.
+    """
+    self.client = client
+    self.state_path = state_path
+    self.account = account or client.contact_list
+    self.contacts = {}
+    self.groups = {}
+    self.contacts_updated = None
+    self.groups_updated = None
+    self._emails = {}
+    self._phone_numbers = {}
+    self._pending = []
+    self.load()
+
+  def sync(self, **kwargs):
+    """Applies all changes made on the server since the last sync.
+
+    Args:
+      kwargs: Other parameters to pass to ContactsClient.get_feed, such as
+          auth_token.
+
+    Returns:
+      A ContactsSyncResult.
+    """
+    result = ContactsSyncResult()
+    result.added, result.changed, result.removed, contacts_full = (
+        self._sync_feed('contacts', gdata.contacts.data.ContactsFeed,
+                        self.contacts, SyncedContact.from_entry, **kwargs))
+    (result.added_groups, result.changed_groups, result.removed_groups,
+     groups_full) = self._sync_feed('groups', gdata.contacts.data.GroupsFeed,
+                                    self.groups, SyncedGroup.from_entry,
+                                    **kwargs)
+    result.full = contacts_full or groups_full
+    self.save()
+    return result
+
+  Sync = sync
+
+  def _sync_feed(self, kind, desired_class, index, from_entry, **kwargs):
+    """Reads the changes to one feed into its index.
+
+    Returns:
+      A tuple of the added, changed and removed IDs, and whether every entry
+      was read.
+    """
+    updated = getattr(self, '%s_updated' % kind)
+    full = updated is None
+    try:
+      changes, updated = self._read_feed(kind, desired_class, updated,
+                                         **kwargs)
+    except gdata.client.RequestError, error:
+      if error.status != 410 or full:
+        raise
+      # Some deletions since the last sync are no longer known, so every
+      # entry is read again.
+      full = True
+      changes, updated = self._read_feed(kind, desired_class, None, **kwargs)
+    added = []
+    changed = []
+    removed = []
+    if full:
+      seen = set([entry.get_id() for entry in changes])
+      for entry_id in sorted(index.keys()):
+        if entry_id not in seen:
+          self._remove(index, entry_id)
+          removed.append(entry_id)
+    for entry in changes:
+      entry_id = entry.get_id()
+      if entry_id is None:
+        continue
+      before = index.get(entry_id)
+      if entry.deleted is not None:
+        if before is not None:
+          self._remove(index, entry_id)
+          removed.append(entry_id)
+        continue
+      after = from_entry(entry)
+      self._add(index, after)
+      if before is None:
+        added.append(entry_id)
+      elif before._to_list() != after._to_list():
+        changed.append(entry_id)
+    setattr(self, '%s_updated' % kind, updated)
+    return added, changed, removed, full
+
+  def _read_feed(self, kind, desired_class, updated_min, **kwargs):
+    """Returns the entries updated since updated_min and the server time."""
+    if updated_min is None:
+      query = ContactsQuery(max_results=SYNC_PAGE_SIZE)
+    else:
+      query = ContactsQuery(updated_min=updated_min, showdeleted='true',
+                            requirealldeleted='true',
+                            max_results=SYNC_PAGE_SIZE)
+    feed = self.client.get_feed(
+        self.client.get_feed_uri(kind, contact_list=self.account),
+        desired_class=desired_class, query=query, **kwargs)
+    # The feed's updated time is taken from the first page, so that entries
+    # changed while later pages are read are requested again next time.
+    updated = feed.updated.text
+    entries = []
+    while True:
+      entries.extend(feed.entry)
+      next_link = feed.get_next_link()
+      if next_link is None or not feed.entry:
+        break
+      feed = self.client.get_feed(next_link.href, desired_class=desired_class,
+                                  **kwargs)
+    return entries, updated
+
+  def _add(self, index, synced):
+    if synced.id in index:
+      self._remove(index, synced.id)
+    index[synced.id] = synced
+    if index is self.contacts:
+      for email in synced.emails:
+        self._emails.setdefault(email.lower(), set()).add(synced.id)
+      for phone_number in synced.phone_numbers:
+        digits = _normalize_phone_number(phone_number)
+        if digits:
+          self._phone_numbers.setdefault(digits, set()).add(synced.id)
+
+  def _remove(self, index, entry_id):
+    synced = index.pop(entry_id)
+    if index is self.contacts:
+      for email in synced.emails:
+        _discard(self._emails, email.lower(), entry_id)
+      for phone_number in synced.phone_numbers:
+        _discard(self._phone_numbers, _normalize_phone_number(phone_number),
+                 entry_id)
+
+  def find_by_email(self, email):
+    """Returns the contacts with an email address, ignoring case."""
+    return [self.contacts[contact_id]
+            for contact_id in sorted(self._emails.get(email.lower(), ()))]
+
+  FindByEmail = find_by_email
+
+  def find_by_phone_number(self, phone_number):
+    """Returns the contacts with a phone number.
+
+    Only the digits of the numbers are compared, so '+1 (555) 010-9999'
+    matches '+15550109999'.
+    """
+    return [self.contacts[contact_id]
+            for contact_id in sorted(self._phone_numbers.get(
+                _normalize_phone_number(phone_number), ()))]
+
+  FindByPhoneNumber = find_by_phone_number
+
+  def create_contact(self, entry):
+    """Queues a new gdata.contacts.data.ContactEntry to be sent by push."""
+    self._pending.append(('insert', entry))
+
+  CreateContact = create_contact
+
+  def update_contact(self, entry):
+    """Queues a changed ContactEntry to be sent by push.
+
+    The entry must have the ID and etag which it was read with, so that the
+    server rejects it if the contact has been changed since.
+    """
+    self._pending.append(('update', entry))
+
+  UpdateContact = update_contact
+
+  def delete_contact(self, entry):
+    """Queues the deletion of a ContactEntry to be sent by push."""
+    self._pending.append(('delete', entry))
+
+  DeleteContact = delete_contact
+
+  def push(self, max_concurrent=1, auth_token=None, **kwargs):
+    """Sends the queued changes and applies the accepted ones to the index.
+
+    Args:
+      max_concurrent: int (optional) The number of batch requests to send at
+          the same time. Defaults to 1, so that several changes to the same
+          contact are applied in the order in which they were queued.
+      auth_token: (optional) The token used to authorize the requests.
+      kwargs: Other parameters to pass to ContactsClient.execute_batch.
+
+    Returns:
+      A list of (operation, entry, status_code, reason) tuples for the
+      operations which the server rejected, such as 409 or 412 for updates to
+      contacts which were changed by someone else, or which were in a batch
+      request that failed as a whole. Rejected operations are not queued
+      again.
+    """
+    pending = self._pending
+    self._pending = []
+    url = self.client.get_feed_uri('contacts', contact_list=self.account,
+                                   projection='full/batch')
+    results = [ContactsBatchResult(operation, entry)
+               for operation, entry in pending]
+    self.client._send_batches(
+        [(result, result.operation, result.entry) for result in results],
+        url, max_concurrent, auth_token, **kwargs)
+    failed = []
+    for result in results:
+      if not result.succeeded():
+        failed.append((result.operation, result.entry, result.status,
+                       result.reason))
+      elif result.operation == 'delete':
+        if result.entry.get_id() in self.contacts:
+          self._remove(self.contacts, result.entry.get_id())
+      else:
+        self._add(self.contacts, SyncedContact.from_entry(result.result))
+    self.save()
+    return failed
+
+  Push = push
+
+  def load(self):
+    """Reads this account's index and cursors from the state_path file."""
+    if self.state_path is None or not os.path.exists(self.state_path):
+      return
+    state = self._read_state()
+    account = state['accounts'].get(self.account)
+    if account is None:
+      return
+    self.contacts_updated = account['contacts_updated']
+    self.groups_updated = account['groups_updated']
+    self.contacts = {}
+    self.groups = {}
+    self._emails = {}
+    self._phone_numbers = {}
+    for fields in account['contacts']:
+      self._add(self.contacts, SyncedContact(*fields))
+    for fields in account['groups']:
+      self._add(self.groups, SyncedGroup(*fields))
+
+  Load = load
+
+  def save(self):
+    """Writes this account's state to the state_path file.
+
+    The state of other accounts in the file is kept.
+    """
+    if self.state_path is None:
+      return
+    state = {'version': CONTACTS_SYNC_FILE_VERSION, 'accounts': {}}
+    if os.path.exists(self.state_path):
+      state = self._read_state()
+    state['accounts'][self.account] = {
+        'contacts_updated': self.contacts_updated,
+        'groups_updated': self.groups_updated,
+        'contacts': [contact._to_list()
+                     for contact in self.contacts.itervalues()],
+        'groups': [group._to_list() for group in self.groups.itervalues()]}
+    # Write a new file and then move it into place so that an interrupted
+    # save never leaves a partially written file.
+    fd, temp_path = tempfile.mkstemp(
+        dir=os.path.dirname(self.state_path) or os.curdir)
+    state_file = os.fdopen(fd, 'w')
+    try:
+      simplejson.dump(state, state_file, separators=(',', ':'))
+    finally:
+      state_file.close()
+    gdata.client.replace_file(temp_path, self.state_path)
+
+  Save = save
+
+  def _read_state(self):
+    state_file = open(self.state_path)
+    try:
+      state = simplejson.load(state_file)
+    finally:
+      state_file.close()
+    if state.get('version') != CONTACTS_SYNC_FILE_VERSION:
+      raise gdata.client.Error(
+          'Unsupported sync file version: %s' % state.get('version'))
+    return state
+
+
+_NON_DIGITS = re.compile('[^0-9]')
+
+
+def _normalize_phone_number(phone_number):
+  return _NON_DIGITS.sub('', phone_number)
+
+
+def _discard(index, key, entry_id):
+  entry_ids = index.get(key)
+  if entry_ids is not None:
+    entry_ids.discard(entry_id)
+    if not entry_ids:
+      del index[key]
@@ -395,6 +395,18 @@ class PersonEntry(gdata.data.BatchEntry):
 
   status = Status
 
+  def GetPhotoLink(self):
+    for a_link in self.link:
+      if a_link.rel == PHOTO_LINK_REL:
+        return a_link
+    return None
+
+  def GetPhotoEditLink(self):
+    for a_link in self.link:
+      if a_link.rel == PHOTO_EDIT_LINK_REL:
+        return a_link
+    return None
+
 
 class Deleted(atom.core.XmlElement):
   """If present, indicates that this contact has been deleted."""
@@ -420,18 +432,6 @@ class ContactEntry(PersonEntry):
   group_membership_info = [GroupMembershipInfo]
   organization = gdata.data.Organization
 
-  def GetPhotoLink(self):
-    for a_link in self.link:
-      if a_link.rel == PHOTO_LINK_REL:
-        return a_link
-    return None
-
-  def GetPhotoEditLink(self):
-    for a_link in self.link:
-      if a_link.rel == PHOTO_EDIT_LINK_REL:
-        return a_link
-    return None
-
 
 class ContactsFeed(gdata.data.BatchFeed):
   """A collection of Contacts."""
@@ -452,6 +452,7 @@ class GroupEntry(gdata.data.BatchEntry):
   """Represents a contact group."""
   extended_property = [gdata.data.ExtendedProperty]
   system_group = SystemGroup
+  deleted = Deleted
 
 
 class GroupsFeed(gdata.data.BatchFeed):
@@ -20,7 +20,12 @@ __author__ = 'vicfryzel@google.com (Vic Fryzel)'
 
 import copy
 import mimetypes
+import os
 import re
+import shutil
+import tempfile
+import threading
+import time
 import urllib
 import atom.data
 import atom.http_core
@@ -28,6 +33,16 @@ import gdata.client
 import gdata.docs.data
 import gdata.gauth
 
+try:
+  import simplejson
+except ImportError:
+  try:
+    # Try to import from django, should work on App Engine
+    from django.utils import simplejson
+  except ImportError:
+    # Should work for Python2.6 and higher.
+    import json as simplejson
+
 
 # Feed URIs that are given by the API, but cannot be obtained without
 # making a mostly unnecessary HTTP request.
@@ -37,6 +52,12 @@ RESOURCE_UPLOAD_URI = '/feeds/upload/create-session/default/private/full'
 ARCHIVE_FEED_URI = '/feeds/default/private/archive'
 METADATA_URI = '/feeds/metadata/default'
 CHANGE_FEED_URI = '/feeds/default/private/changes'
+# The largest page of changes the API returns.
+MAX_CHANGES_PER_PAGE = 100
+# Version of the file format written by ResourceSync.
+RESOURCE_SYNC_FILE_VERSION = 1
+# The number of files which a DownloadManager downloads at the same time.
+MAX_CONCURRENT_DOWNLOADS = 4
 
 
 class DocsClient(gdata.client.GDClient):
@@ -353,11 +374,17 @@ class DocsClient(gdata.client.GDClient):
 
     Args:
       entry: gdata.docs.data.Resource whose contents to fetch.
-      file_path: str Full path to which to save file.
+      file_path: str Full path to which to save file, or an object with a
+          write method to which the contents are written.
       extra_params: dict (optional) A map of any further parameters to control
           how the document is downloaded/exported. For example, exporting a
           spreadsheet as a .csv: extra_params={'gid': 0, 'exportFormat': 'csv'}
-      kwargs: Other parameters to pass to self._download_file().
+      kwargs: Other parameters to pass to self._download_file(). The content
+          is streamed chunk_size bytes at a time and resume=True continues
+          a partial download of file_path, see gdata.client.GDClient.download.
+
+    Returns:
+      The number of bytes in the downloaded file.
 
     Raises:
       gdata.client.RequestError if the download URL is malformed or the server's
@@ -366,7 +393,7 @@ class DocsClient(gdata.client.GDClient):
     self._check_entry_is_not_collection(entry)
     self._check_entry_has_content(entry)
     uri = self._get_download_uri(entry.content.src, extra_params)
-    self._download_file(uri, file_path, **kwargs)
+    return self._download_file(uri, file_path, **kwargs)
 
   DownloadResource = download_resource
 
@@ -419,8 +446,8 @@ class DocsClient(gdata.client.GDClient):
     is only different from Download() in that you will probably retain an
     open reference to the data returned from this method, where as the data
     from Download() will be immediately written to disk and the memory
-    freed.  This client library currently doesn't support reading server
-    responses into a buffer or yielding an open file pointer to responses.
+    freed.  To write the content to a file-like object without holding all
+    of it in memory, pass the object to download_resource instead.
 
     Args:
       entry: Resource to fetch.
@@ -450,27 +477,31 @@ class DocsClient(gdata.client.GDClient):
                                         'body': server_response.read()}
     return server_response.read()
 
-  def _download_file(self, uri, file_path, **kwargs):
-    """Downloads a file to disk from the specified URI.
+  def _download_file(self, uri, file_path, auth_token=None, **kwargs):
+    """Streams a file to disk from the specified URI.
 
     Note: to download a file in memory, use the GetContent() method.
 
     Args:
       uri: str The full URL to download the file from.
-      file_path: str The full path to save the file to.
-      kwargs: Other parameters to pass to self.get_content().
+      file_path: str The full path to save the file to, or an object with a
+          write method to which the content is written.
+      auth_token: (optional) gdata.gauth.ClientLoginToken, AuthSubToken, or
+          OAuthToken which authorizes this client to edit the user's data.
+      kwargs: Other parameters to pass to self.download(), such as
+          chunk_size and resume.
+
+    Returns:
+      The number of bytes in the downloaded file.
 
     Raises:
       gdata.client.RequestError: on error response from server.
     """
-    f = open(file_path, 'wb')
-    try:
-      f.write(self._get_content(uri, **kwargs))
-    except gdata.client.RequestError, e:
-      f.close()
-      raise e
-    f.flush()
-    f.close()
+    token = auth_token
+    if 'spreadsheets' in uri and token is None \
+        and self.alt_auth_token is not None:
+      token = self.alt_auth_token
+    return self.download(uri, file_path, auth_token=token, **kwargs)
 
   _DownloadFile = _download_file
 
@@ -793,10 +824,16 @@ class DocsClient(gdata.client.GDClient):
 
     Args:
       entry: gdata.docs.data.Revision whose contents to fetch.
-      file_path: str Full path to which to save file.
+      file_path: str Full path to which to save file, or an object with a
+          write method to which the contents are written.
       extra_params: dict (optional) A map of any further parameters to control
           how the document is downloaded.
-      kwargs: Other parameters to pass to self._download_file().
+      kwargs: Other parameters to pass to self._download_file(). The content
+          is streamed chunk_size bytes at a time and resume=True continues
+          a partial download of file_path, see gdata.client.GDClient.download.
+
+    Returns:
+      The number of bytes in the downloaded file.
 
     Raises:
       gdata.client.RequestError if the download URL is malformed or the server's
@@ -805,7 +842,7 @@ class DocsClient(gdata.client.GDClient):
     self._check_entry_is_not_collection(entry)
     self._check_entry_has_content(entry)
     uri = self._get_download_uri(entry.content.src, extra_params)
-    self._download_file(uri, file_path, **kwargs)
+    return self._download_file(uri, file_path, **kwargs)
 
   DownloadRevision = download_revision
 
@@ -985,6 +1022,383 @@ class DocsClient(gdata.client.GDClient):
   DeleteArchive = delete_archive
 
 
+class DownloadReport(object):
+  """The results of DownloadManager.run.
+
+  Attributes:
+    completed: list of (file_path, size) tuples for the files which were
+        downloaded, in the order in which they were added.
+    failed: list of (entry, file_path, error) tuples for the files which
+        could not be downloaded.
+    bytes_downloaded: int The number of bytes received from the server.
+    seconds: float The time taken by all downloads.
+  """
+
+  def __init__(self):
+    self.completed = []
+    self.failed = []
+    self.bytes_downloaded = 0
+    self.seconds = 0.0
+
+  def get_throughput(self):
+    """Returns the average number of bytes downloaded per second."""
+    if not self.seconds:
+      return 0.0
+    return self.bytes_downloaded / self.seconds
+
+  GetThroughput = get_throughput
+
+
+class DownloadManager(object):
+  """Downloads or exports many resources at the same time.
+
+  Files are streamed to disk by up to max_concurrent threads. Unless the
+  client's http_client has been replaced or a proxy is configured, the
+  downloads share a pool of keep-alive connections instead of opening a
+  connection per file. Resources which are added more than once with the
+  same export URL are only downloaded once. With resume=True, files left
+  by an interrupted run are resumed, see GDClient.download. Exports are
+  generated on request and are always downloaded in full.
+
+  Only Documents List resources are supported; Sites attachments can be
+  fetched with gdata.sites.client.SitesClient.download_attachment.
+
+  Example:
+    manager = gdata.docs.client.DownloadManager(client)
+    manager.add_resources(client.get_all_resources(), '/backup',
+                          {'document': 'pdf', 'spreadsheet': 'xls'})
+    report = manager.run()
+    for entry, file_path, error in report.failed:
+      ...
+  """
+
+  def __init__(self, client, max_concurrent=MAX_CONCURRENT_DOWNLOADS,
+               chunk_size=gdata.client.DOWNLOAD_CHUNK_SIZE, resume=False):
+    """Creates a DownloadManager.
+
+    Args:
+      client: gdata.docs.client.DocsClient used to download the files.
+      max_concurrent: int (optional) The number of files to download at the
+          same time.
+      chunk_size: int (optional) The number of bytes read at a time.
+      resume: boolean (optional) If True, files left by an interrupted
+          download are resumed if their content has not changed since.
+          Defaults to False, in which case existing files are overwritten.
+    """
+    self.client = client
+    self.max_concurrent = max_concurrent
+    self.chunk_size = chunk_size
+    self.resume = resume
+    self._downloads = []
+
+  def add(self, entry, file_path, export_format=None, extra_params=None):
+    """Adds a resource to download when run is called.
+
+    Args:
+      entry: gdata.docs.data.Resource whose contents to fetch.
+      file_path: str Full path to which to save the file.
+      export_format: str (optional) The format to export the resource to,
+          for example 'pdf'.
+      extra_params: dict (optional) Further parameters to control how the
+          resource is exported, see DocsClient.download_resource.
+    """
+    self.client._check_entry_is_not_collection(entry)
+    self.client._check_entry_has_content(entry)
+    if export_format is not None:
+      extra_params = dict(extra_params or {})
+      extra_params['exportFormat'] = export_format
+    uri = self.client._get_download_uri(entry.content.src, extra_params)
+    self._downloads.append((entry, file_path, uri))
+
+  Add = add
+
+  def add_resources(self, entries, directory, export_formats=None):
+    """Adds each of the resources in a list to download into a directory.
+
+    Collections are skipped. Each file is named after the resource ID, with
+    the export format as its extension, so that a later run resumes the
+    same files.
+
+    Args:
+      entries: list of gdata.docs.data.Resource objects.
+      directory: str The directory in which to save the files.
+      export_formats: dict (optional) Maps resource types such as 'document'
+          or 'spreadsheet' to the format to export them to. Resources whose
+          type is not listed are downloaded in their original format.
+    """
+    export_formats = export_formats or {}
+    for entry in entries:
+      resource_type = entry.get_resource_type()
+      if (resource_type == gdata.docs.data.COLLECTION_LABEL
+          or entry.content is None or entry.content.src is None):
+        continue
+      export_format = export_formats.get(resource_type)
+      file_name = entry.resource_id.text.replace(':', '_')
+      if export_format is not None:
+        file_name = '%s.%s' % (file_name, export_format)
+      self.add(entry, os.path.join(directory, file_name), export_format)
+
+  AddResources = add_resources
+
+  def run(self):
+    """Downloads all of the added resources.
+
+    Returns:
+      A DownloadReport.
+    """
+    downloads = self._downloads
+    self._downloads = []
+    # Resources with the same download URI are only downloaded once and then
+    # copied to their other paths.
+    jobs = []
+    copies = {}
+    for position, (entry, file_path, uri) in enumerate(downloads):
+      if uri in copies:
+        copies[uri].append((position, entry, file_path))
+      else:
+        copies[uri] = []
+        jobs.append((position, entry, file_path, uri))
+
+    client, pooled_http_client = gdata.client.keep_alive_client(
+        self.client, self.max_concurrent)
+
+    report = DownloadReport()
+
+    def download_file(job):
+      position, entry, file_path, uri = job
+      resume = self.resume and '/Export?' not in uri
+      existing = 0
+      if (resume and os.path.exists(file_path)
+          and os.path.exists(file_path + '.etag')):
+        existing = os.path.getsize(file_path)
+      try:
+        size = client._download_file(uri, file_path,
+                                     chunk_size=self.chunk_size,
+                                     resume=resume)
+        completed = [(position, file_path, size)]
+        for copy_position, copy_entry, copy_path in copies[uri]:
+          if copy_path != file_path:
+            shutil.copyfile(file_path, copy_path)
+          completed.append((copy_position, copy_path, size))
+      except Exception, error:
+        failed = [(position, entry, file_path, error)]
+        for copy_position, copy_entry, copy_path in copies[uri]:
+          failed.append((copy_position, copy_entry, copy_path, error))
+        return [], failed, 0
+      return completed, [], max(size - existing, 0)
+
+    start = time.time()
+    try:
+      outcomes = gdata.client.run_concurrently(download_file, jobs,
+                                               self.max_concurrent)
+    finally:
+      if pooled_http_client is not None:
+        pooled_http_client.close()
+    report.seconds = time.time() - start
+    completed = []
+    failed = []
+    for job_completed, job_failed, bytes_downloaded in outcomes:
+      completed.extend(job_completed)
+      failed.extend(job_failed)
+      report.bytes_downloaded += bytes_downloaded
+    completed.sort()
+    failed.sort()
+    report.completed = [(file_path, size)
+                        for position, file_path, size in completed]
+    report.failed = [(entry, file_path, error)
+                     for position, entry, file_path, error in failed]
+    return report
+
+  Run = run
+
+
+class SyncedResource(object):
+  """The fields of a resource which are kept in a ResourceSync's index.
+
+  Attributes:
+    resource_id: str The typed resource ID, for example 'document:abc'.
+    etag: str The resource's ETag, which changes whenever it is modified.
+    title: str
+    parents: list of str The resource IDs of the collections which contain
+        this resource.
+    resource_type: str The type of the resource, for example 'document' or
+        'folder'.
+    trashed: boolean True if the resource is in the trash.
+  """
+
+  def __init__(self, resource_id, etag=None, title=None, parents=None,
+               resource_type=None, trashed=False):
+    self.resource_id = resource_id
+    self.etag = etag
+    self.title = title
+    self.parents = parents or []
+    self.resource_type = resource_type
+    self.trashed = trashed
+
+  def _to_list(self):
+    return [self.resource_id, self.etag, self.title, self.parents,
+            self.resource_type, self.trashed]
+
+
+class SyncResult(object):
+  """The resources which changed during one ResourceSync.sync call.
+
+  Attributes:
+    added: list of the resource IDs which were not in the index before.
+    changed: list of the resource IDs whose etag, title, parents, type or
+        trashed state changed.
+    removed: list of the resource IDs which were removed from the index
+        because they were deleted or are no longer shared with the user.
+    changestamp: int The largest changestamp in the index after the sync.
+  """
+
+  def __init__(self, added=None, changed=None, removed=None,
+               changestamp=None):
+    self.added = added or []
+    self.changed = changed or []
+    self.removed = removed or []
+    self.changestamp = changestamp
+
+
+class ResourceSync(object):
+  """Keeps a local index of a user's resources up to date from the changes.
+
+  The first sync reads the whole changes feed, which lists the latest change
+  to every resource. After that each sync only requests the changes with a
+  larger changestamp than the largest one seen so far. If a state_path is
+  given, the index and the changestamp are saved there after each sync so
+  that the next run of the program continues where this one stopped.
+
+  Example:
+    sync = gdata.docs.client.ResourceSync(client, '/var/lib/app/docs.json')
+    result = sync.sync()
+    for resource_id in result.added + result.changed:
+      print sync.resources[resource_id].title
+
+  Attributes:
+    resources: dict mapping resource IDs to SyncedResource objects.
+    changestamp: int The largest changestamp which was applied to the index,
+        None before the first sync.
+  """
+
+  def __init__(self, client, state_path=None):
+    """Creates a ResourceSync, loading its state if state_path exists.
+
+    Args:
+      client: gdata.docs.client.DocsClient used to read the changes feed.
+      state_path: str (optional) The file in which the index is saved.
+    """
+    self.client = client
+    self.state_path = state_path
+    self.resources = {}
+    self.changestamp = None
+    self.load()
+
+  def sync(self, **kwargs):
+    """Applies all changes made since the last sync to the index.
+
+    Args:
+      kwargs: Other parameters to pass to DocsClient.get_changes.
+
+    Returns:
+      A SyncResult listing the resources which changed.
+    """
+    start = None
+    if self.changestamp is not None:
+      start = str(self.changestamp + 1)
+    # The state of each changed resource before this sync.
+    previous = {}
+    feed = self.client.get_changes(changestamp=start,
+                                   max_results=MAX_CHANGES_PER_PAGE, **kwargs)
+    while True:
+      for change in feed.entry:
+        self._apply_change(change, previous)
+      next_link = feed.get_next_link()
+      if next_link is None or not feed.entry:
+        break
+      feed = self.client.get_feed(next_link.href,
+                                  desired_class=gdata.docs.data.ChangeFeed,
+                                  **kwargs)
+    result = SyncResult(changestamp=self.changestamp)
+    for resource_id, before in sorted(previous.iteritems()):
+      after = self.resources.get(resource_id)
+      if before is None and after is not None:
+        result.added.append(resource_id)
+      elif before is not None and after is None:
+        result.removed.append(resource_id)
+      elif before is not None and before._to_list() != after._to_list():
+        result.changed.append(resource_id)
+    self.save()
+    return result
+
+  Sync = sync
+
+  def _apply_change(self, change, previous):
+    if change.changestamp is not None and change.changestamp.value:
+      changestamp = int(change.changestamp.value)
+      if self.changestamp is None or changestamp > self.changestamp:
+        self.changestamp = changestamp
+    if change.resource_id is None or not change.resource_id.text:
+      return
+    resource_id = change.resource_id.text
+    if resource_id not in previous:
+      previous[resource_id] = self.resources.get(resource_id)
+    if change.removed is not None:
+      self.resources.pop(resource_id, None)
+      return
+    parents = []
+    for link in change.in_collections():
+      parents.append(urllib.unquote(link.href.rstrip('/').split('/')[-1]))
+    title = None
+    if change.title is not None:
+      title = change.title.text
+    self.resources[resource_id] = SyncedResource(
+        resource_id, etag=change.etag, title=title, parents=parents,
+        resource_type=change.get_resource_type(),
+        trashed=change.deleted is not None)
+
+  def load(self):
+    """Reads the index and changestamp from the state_path file."""
+    if self.state_path is None or not os.path.exists(self.state_path):
+      return
+    state_file = open(self.state_path)
+    try:
+      state = simplejson.load(state_file)
+    finally:
+      state_file.close()
+    if state.get('version') != RESOURCE_SYNC_FILE_VERSION:
+      raise gdata.client.Error(
+          'Unsupported sync file version: %s' % state.get('version'))
+    self.changestamp = state['changestamp']
+    self.resources = {}
+    for fields in state['resources']:
+      resource = SyncedResource(*fields)
+      self.resources[resource.resource_id] = resource
+
+  Load = load
+
+  def save(self):
+    """Writes the index and changestamp to the state_path file."""
+    if self.state_path is None:
+      return
+    state = {'version': RESOURCE_SYNC_FILE_VERSION,
+             'changestamp': self.changestamp,
+             'resources': [resource._to_list()
+                           for resource in self.resources.itervalues()]}
+    # Write a new file and then move it into place so that an interrupted
+    # save never leaves a partially written file.
+    fd, temp_path = tempfile.mkstemp(
+        dir=os.path.dirname(self.state_path) or os.curdir)
+    state_file = os.fdopen(fd, 'w')
+    try:
+      simplejson.dump(state, state_file, separators=(',', ':'))
+    finally:
+      state_file.close()
+    gdata.client.replace_file(temp_path, self.state_path)
+
+  Save = save
+
+
 class DocsQuery(gdata.client.Query):
 
   def __init__(self, title=None, title_exact=None, opened_min=None,
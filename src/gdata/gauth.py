@@ -46,13 +46,22 @@ ae_save
 """
 
 
+import base64
 import datetime
+import hmac
 import time
 import random
 import urllib
 import urlparse
 import atom.http_core
 
+try:
+  import hashlib
+  _sha1 = hashlib.sha1
+except ImportError:
+  # Python2.4 and lower do not have hashlib.
+  import sha as _sha1
+
 try:
   import simplejson
   from simplejson.decoder import JSONDecodeError
@@ -623,12 +632,19 @@ def build_oauth_base_string(http_request, consumer_key, nonce, signaure_type,
   except NameError:
     sorted_keys = params.keys()
     sorted_keys.sort()
+  # The parameter string is escaped twice: once for each key and value and
+  # once more as a whole. Since the escaped keys and values only contain
+  # unreserved characters and '%', the second pass only needs to escape the
+  # '%' signs along with the '=' and '&' separators.
   pairs = []
   for key in sorted_keys:
-    pairs.append('%s=%s' % (urllib.quote(key, safe='~'),
-                            urllib.quote(params[key], safe='~')))
-  # We want to escape /'s too, so use safe='~'
-  all_parameters = urllib.quote('&'.join(pairs), safe='~')
+    if key in _UNIQUE_OAUTH_PARAMS:
+      value = urllib.quote(params[key], safe='~')
+    else:
+      value = _oauth_escape(params[key])
+    pairs.append('%s%%3D%s' % (_oauth_escape(key).replace('%', '%25'),
+                               value.replace('%', '%25')))
+  all_parameters = '%26'.join(pairs)
   normailzed_host = http_request.uri.host.lower()
   normalized_scheme = (http_request.uri.scheme or 'http').lower()
   non_default_port = None
@@ -643,13 +659,13 @@ def build_oauth_base_string(http_request, consumer_key, nonce, signaure_type,
   if non_default_port is not None:
     # Set the only safe char in url encoding to ~ since we want to escape /
     # as well.
-    request_path = urllib.quote('%s://%s:%s%s' % (
-        normalized_scheme, normailzed_host, non_default_port, path), safe='~')
+    request_path = _oauth_escape('%s://%s:%s%s' % (
+        normalized_scheme, normailzed_host, non_default_port, path))
   else:
     # Set the only safe char in url encoding to ~ since we want to escape /
     # as well.
-    request_path = urllib.quote('%s://%s%s' % (
-        normalized_scheme, normailzed_host, path), safe='~')
+    request_path = _oauth_escape('%s://%s%s' % (
+        normalized_scheme, normailzed_host, path))
   # TODO: ensure that token escaping logic is correct, not sure if the token
   # value should be double escaped instead of single.
   base_string = '&'.join((http_request.method.upper(), request_path,
@@ -658,27 +674,65 @@ def build_oauth_base_string(http_request, consumer_key, nonce, signaure_type,
   return base_string
 
 
-def generate_hmac_signature(http_request, consumer_key, consumer_secret,
-                            timestamp, nonce, version, next='oob',
-                            token=None, token_secret=None, verifier=None):
-  import hmac
-  import base64
-  base_string = build_oauth_base_string(
-      http_request, consumer_key, nonce, HMAC_SHA1, timestamp, version,
-      next, token, verifier=verifier)
-  hash_key = None
-  hashed = None
+# OAuth parameters which are different for every request. These are not worth
+# remembering in the escaped value cache.
+_UNIQUE_OAUTH_PARAMS = ('oauth_nonce', 'oauth_timestamp')
+# Maximum number of escaped strings kept by _oauth_escape.
+_OAUTH_ESCAPE_CACHE_SIZE = 1024
+_oauth_escape_cache = {}
+
+
+def _oauth_escape(value):
+  """Percent encodes a string using the OAuth rules, only ~ is left as is.
+
+  Parameter names, consumer keys, tokens, scopes and request URLs repeat
+  across many requests, so the escaped values are remembered in a bounded
+  cache.
+  """
+  try:
+    return _oauth_escape_cache[value]
+  except KeyError:
+    escaped = urllib.quote(value, safe='~')
+    if len(_oauth_escape_cache) >= _OAUTH_ESCAPE_CACHE_SIZE:
+      _oauth_escape_cache.clear()
+    _oauth_escape_cache[value] = escaped
+    return escaped
+
+
+def _generate_oauth_nonce():
+  """Creates a random 15 digit string to be used as the oauth_nonce."""
+  return '%015d' % random.randrange(10 ** 15)
+
+
+def _generate_hmac_key(consumer_secret, token_secret=None):
+  """Builds the key used to calculate an OAuth HMAC-SHA1 signature.
+
+  Args:
+    consumer_secret: str The consumer secret for this application.
+    token_secret: str (optional) The OAuth token secret. Omitted when
+        requesting a request token or when using two legged OAuth.
+
+  Returns:
+    A str in the form escaped_consumer_secret&escaped_token_secret
+  """
   if token_secret is not None:
-    hash_key = '%s&%s' % (urllib.quote(consumer_secret, safe='~'),
-                          urllib.quote(token_secret, safe='~'))
+    return '%s&%s' % (urllib.quote(consumer_secret, safe='~'),
+                      urllib.quote(token_secret, safe='~'))
   else:
-    hash_key = '%s&' % urllib.quote(consumer_secret, safe='~')
-  try:
-    import hashlib
-    hashed = hmac.new(hash_key, base_string, hashlib.sha1)
-  except ImportError:
-    import sha
-    hashed = hmac.new(hash_key, base_string, sha)
+    return '%s&' % urllib.quote(consumer_secret, safe='~')
+
+
+def _sign_with_hmac(hmac_template, base_string):
+  """Calculates the base64 encoded signature for the base string.
+
+  Args:
+    hmac_template: An hmac object which was created using the signing key
+        but has not yet been given any data. It is copied so that the
+        template can be reused for later requests.
+    base_string: str The OAuth base string built by build_oauth_base_string.
+  """
+  hashed = hmac_template.copy()
+  hashed.update(base_string)
   # Python2.3 does not have base64.b64encode.
   if hasattr(base64, 'b64encode'):
     return base64.b64encode(hashed.digest())
@@ -686,10 +740,17 @@ def generate_hmac_signature(http_request, consumer_key, consumer_secret,
     return base64.encodestring(hashed.digest()).replace('\n', '')
 
 
-def generate_rsa_signature(http_request, consumer_key, rsa_key,
-                           timestamp, nonce, version, next='oob',
-                           token=None, token_secret=None, verifier=None):
-  import base64
+def generate_hmac_signature(http_request, consumer_key, consumer_secret,
+                            timestamp, nonce, version, next='oob',
+                            token=None, token_secret=None, verifier=None):
+  base_string = build_oauth_base_string(
+      http_request, consumer_key, nonce, HMAC_SHA1, timestamp, version,
+      next, token, verifier=verifier)
+  hash_key = _generate_hmac_key(consumer_secret, token_secret)
+  return _sign_with_hmac(hmac.new(hash_key, digestmod=_sha1), base_string)
+
+
+def _parse_rsa_private_key(rsa_key):
   try:
     from tlslite.utils import keyfactory
   except ImportError:
@@ -697,10 +758,10 @@ def generate_rsa_signature(http_request, consumer_key, rsa_key,
       from gdata.tlslite.utils import keyfactory
     except ImportError:
       from tlslite.tlslite.utils import keyfactory
-  base_string = build_oauth_base_string(
-      http_request, consumer_key, nonce, RSA_SHA1, timestamp, version,
-      next, token, verifier=verifier)
-  private_key = keyfactory.parsePrivateKey(rsa_key)
+  return keyfactory.parsePrivateKey(rsa_key)
+
+
+def _sign_with_rsa(private_key, base_string):
   # Sign using the key
   signed = private_key.hashAndSign(base_string)
   # Python2.3 does not have base64.b64encode.
@@ -710,6 +771,15 @@ def generate_rsa_signature(http_request, consumer_key, rsa_key,
     return base64.encodestring(signed).replace('\n', '')
 
 
+def generate_rsa_signature(http_request, consumer_key, rsa_key,
+                           timestamp, nonce, version, next='oob',
+                           token=None, token_secret=None, verifier=None):
+  base_string = build_oauth_base_string(
+      http_request, consumer_key, nonce, RSA_SHA1, timestamp, version,
+      next, token, verifier=verifier)
+  return _sign_with_rsa(_parse_rsa_private_key(rsa_key), base_string)
+
+
 def generate_auth_header(consumer_key, timestamp, nonce, signature_type,
                          signature, version='1.0', next=None, token=None,
                          verifier=None):
@@ -789,7 +859,7 @@ def generate_request_for_request_token(
     request.uri.query['scope'] = ' '.join(scopes)
 
   timestamp = str(int(time.time()))
-  nonce = ''.join([str(random.randint(0, 9)) for i in xrange(15)])
+  nonce = _generate_oauth_nonce()
   signature = None
   if signature_type == HMAC_SHA1:
     signature = generate_hmac_signature(
@@ -1001,6 +1071,22 @@ class OAuthHmacToken(object):
     self.auth_state = auth_state
     self.next = next
     self.verifier = verifier # Used to convert request token to access token.
+    self._hmac_secrets = None
+    self._hmac_template = None
+
+  def _get_hmac_template(self):
+    """Returns an unused hmac object keyed with this token's secrets.
+
+    The escaped signing key is derived once and reused for every request
+    which this token signs. If the secrets are changed, a new key is built.
+    """
+    secrets = (self.consumer_secret, self.token_secret)
+    if getattr(self, '_hmac_secrets', None) != secrets:
+      self._hmac_template = hmac.new(
+          _generate_hmac_key(self.consumer_secret, self.token_secret),
+          digestmod=_sha1)
+      self._hmac_secrets = secrets
+    return self._hmac_template
 
   def generate_authorization_url(
       self, google_apps_domain=DEFAULT_DOMAIN, language=None, btmpl=None,
@@ -1040,11 +1126,11 @@ class OAuthHmacToken(object):
       The same HTTP request object which was passed in.
     """
     timestamp = str(int(time.time()))
-    nonce = ''.join([str(random.randint(0, 9)) for i in xrange(15)])
-    signature = generate_hmac_signature(
-        http_request, self.consumer_key, self.consumer_secret, timestamp,
-        nonce, version='1.0', next=self.next, token=self.token,
-        token_secret=self.token_secret, verifier=self.verifier)
+    nonce = _generate_oauth_nonce()
+    base_string = build_oauth_base_string(
+        http_request, self.consumer_key, nonce, HMAC_SHA1, timestamp, '1.0',
+        self.next, self.token, verifier=self.verifier)
+    signature = _sign_with_hmac(self._get_hmac_template(), base_string)
     http_request.headers['Authorization'] = generate_auth_header(
         self.consumer_key, timestamp, nonce, HMAC_SHA1, signature,
         version='1.0', next=self.next, token=self.token,
@@ -1066,6 +1152,15 @@ class OAuthRsaToken(OAuthHmacToken):
     self.auth_state = auth_state
     self.next = next
     self.verifier = verifier # Used to convert request token to access token.
+    self._parsed_key_source = None
+    self._parsed_key = None
+
+  def _get_private_key(self):
+    """Returns the parsed RSA key, parsing the PEM string only once."""
+    if getattr(self, '_parsed_key_source', None) != self.rsa_private_key:
+      self._parsed_key = _parse_rsa_private_key(self.rsa_private_key)
+      self._parsed_key_source = self.rsa_private_key
+    return self._parsed_key
 
   def modify_request(self, http_request):
     """Sets the Authorization header in the HTTP request using the token.
@@ -1078,11 +1173,11 @@ class OAuthRsaToken(OAuthHmacToken):
       The same HTTP request object which was passed in.
     """
     timestamp = str(int(time.time()))
-    nonce = ''.join([str(random.randint(0, 9)) for i in xrange(15)])
-    signature = generate_rsa_signature(
-        http_request, self.consumer_key, self.rsa_private_key, timestamp,
-        nonce, version='1.0', next=self.next, token=self.token,
-        token_secret=self.token_secret, verifier=self.verifier)
+    nonce = _generate_oauth_nonce()
+    base_string = build_oauth_base_string(
+        http_request, self.consumer_key, nonce, RSA_SHA1, timestamp, '1.0',
+        self.next, self.token, verifier=self.verifier)
+    signature = _sign_with_rsa(self._get_private_key(), base_string)
     http_request.headers['Authorization'] = generate_auth_header(
         self.consumer_key, timestamp, nonce, RSA_SHA1, signature,
         version='1.0', next=self.next, token=self.token,
@@ -1093,8 +1188,15 @@ class OAuthRsaToken(OAuthHmacToken):
 
 
 class TwoLeggedOAuthHmacToken(OAuthHmacToken):
+  """Signs requests using two legged OAuth on behalf of a user.
 
-  def __init__(self, consumer_key, consumer_secret, requestor_id):
+  If requestor_id is None, requests are made on behalf of the user named in
+  the xoauth_requestor_id URL parameter already present in each request.
+  This allows a single token to be shared when making requests for many
+  users in a Google Apps domain.
+  """
+
+  def __init__(self, consumer_key, consumer_secret, requestor_id=None):
     self.requestor_id = requestor_id
     OAuthHmacToken.__init__(
         self, consumer_key, consumer_secret, None, None, ACCESS_TOKEN,
@@ -1110,15 +1212,23 @@ class TwoLeggedOAuthHmacToken(OAuthHmacToken):
     Returns:
       The same HTTP request object which was passed in.
     """
-    http_request.uri.query['xoauth_requestor_id'] = self.requestor_id
+    if self.requestor_id is not None:
+      http_request.uri.query['xoauth_requestor_id'] = self.requestor_id
     return OAuthHmacToken.modify_request(self, http_request)
 
   ModifyRequest = modify_request
 
 
 class TwoLeggedOAuthRsaToken(OAuthRsaToken):
+  """Signs requests using two legged OAuth on behalf of a user.
+
+  If requestor_id is None, requests are made on behalf of the user named in
+  the xoauth_requestor_id URL parameter already present in each request.
+  This allows a single token to be shared when making requests for many
+  users in a Google Apps domain.
+  """
 
-  def __init__(self, consumer_key, rsa_private_key, requestor_id):
+  def __init__(self, consumer_key, rsa_private_key, requestor_id=None):
     self.requestor_id = requestor_id
     OAuthRsaToken.__init__(
         self, consumer_key, rsa_private_key, None, None, ACCESS_TOKEN,
@@ -1134,7 +1244,8 @@ class TwoLeggedOAuthRsaToken(OAuthRsaToken):
     Returns:
       The same HTTP request object which was passed in.
     """
-    http_request.uri.query['xoauth_requestor_id'] = self.requestor_id
+    if self.requestor_id is not None:
+      http_request.uri.query['xoauth_requestor_id'] = self.requestor_id
     return OAuthRsaToken.modify_request(self, http_request)
 
   ModifyRequest = modify_request
@@ -1428,6 +1539,103 @@ def _split_token_parts(blob):
   return [urllib.unquote_plus(part) or None for part in blob.split('|')]
 
 
+def _client_login_to_parts(token):
+  return ['1c', token.token_string]
+
+
+def _secure_auth_sub_to_parts(token):
+  return ['1s', token.token_string, token.rsa_private_key] + token.scopes
+
+
+def _auth_sub_to_parts(token):
+  return ['1a', token.token_string] + token.scopes
+
+
+def _two_legged_rsa_to_parts(token):
+  return ['1rtl', token.consumer_key, token.rsa_private_key,
+          token.requestor_id]
+
+
+def _two_legged_hmac_to_parts(token):
+  return ['1htl', token.consumer_key, token.consumer_secret,
+          token.requestor_id]
+
+
+def _oauth_rsa_to_parts(token):
+  return ['1r', token.consumer_key, token.rsa_private_key, token.token,
+          token.token_secret, str(token.auth_state), token.next,
+          token.verifier]
+
+
+def _oauth_hmac_to_parts(token):
+  return ['1h', token.consumer_key, token.consumer_secret, token.token,
+          token.token_secret, str(token.auth_state), token.next,
+          token.verifier]
+
+
+def _oauth2_to_parts(token):
+  return ['2o', token.client_id, token.client_secret, token.scope,
+          token.user_agent, token.auth_uri, token.token_uri,
+          token.access_token, token.refresh_token]
+
+
+# Subclasses must be listed before the classes they extend since the first
+# class which the token is an instance of is used.
+_TOKEN_SERIALIZERS = (
+    (ClientLoginToken, _client_login_to_parts),
+    (SecureAuthSubToken, _secure_auth_sub_to_parts),
+    (AuthSubToken, _auth_sub_to_parts),
+    (TwoLeggedOAuthRsaToken, _two_legged_rsa_to_parts),
+    (TwoLeggedOAuthHmacToken, _two_legged_hmac_to_parts),
+    (OAuthRsaToken, _oauth_rsa_to_parts),
+    (OAuthHmacToken, _oauth_hmac_to_parts),
+    (OAuth2Token, _oauth2_to_parts))
+# Remembers which of the _TOKEN_SERIALIZERS is used for each token class so
+# that the list only needs to be searched once per class.
+_serializers_by_class = {}
+
+
+def _token_to_parts(token):
+  """Lists the type marker and the members of the token to be serialized."""
+  try:
+    return _serializers_by_class[token.__class__](token)
+  except KeyError:
+    pass
+  for token_class, to_parts in _TOKEN_SERIALIZERS:
+    if isinstance(token, token_class):
+      _serializers_by_class[token.__class__] = to_parts
+      return to_parts(token)
+  raise UnsupportedTokenType(
+      'Unable to serialize token of type %s' % type(token))
+
+
+# Functions which create a token from the parts of a blob, by type marker.
+_TOKEN_DESERIALIZERS = {
+    '1c': lambda parts: ClientLoginToken(parts[1]),
+    '1a': lambda parts: AuthSubToken(parts[1], parts[2:]),
+    '1s': lambda parts: SecureAuthSubToken(parts[1], parts[2], parts[3:]),
+    '1rtl': lambda parts: TwoLeggedOAuthRsaToken(parts[1], parts[2],
+                                                 parts[3]),
+    '1htl': lambda parts: TwoLeggedOAuthHmacToken(parts[1], parts[2],
+                                                  parts[3]),
+    '1r': lambda parts: OAuthRsaToken(parts[1], parts[2], parts[3], parts[4],
+                                      int(parts[5]), parts[6], parts[7]),
+    '1h': lambda parts: OAuthHmacToken(parts[1], parts[2], parts[3],
+                                       parts[4], int(parts[5]), parts[6],
+                                       parts[7]),
+    '2o': lambda parts: OAuth2Token(parts[1], parts[2], parts[3], parts[4],
+                                    parts[5], parts[6], parts[7], parts[8])}
+
+
+def _token_from_parts(parts):
+  try:
+    from_parts = _TOKEN_DESERIALIZERS[parts[0]]
+  except KeyError:
+    raise UnsupportedTokenType(
+        'Unable to deserialize token with type marker of %s' % parts[0])
+  return from_parts(parts)
+
+
 def token_to_blob(token):
   """Serializes the token data as a string for storage in a datastore.
 
@@ -1448,41 +1656,7 @@ def token_to_blob(token):
     which are set to '' will be set to None when the token is deserialized
     by token_from_blob.
   """
-  if isinstance(token, ClientLoginToken):
-    return _join_token_parts('1c', token.token_string)
-  # Check for secure auth sub type first since it is a subclass of
-  # AuthSubToken.
-  elif isinstance(token, SecureAuthSubToken):
-    return _join_token_parts('1s', token.token_string, token.rsa_private_key,
-                             *token.scopes)
-  elif isinstance(token, AuthSubToken):
-    return _join_token_parts('1a', token.token_string, *token.scopes)
-  elif isinstance(token, TwoLeggedOAuthRsaToken):
-    return _join_token_parts(
-        '1rtl', token.consumer_key, token.rsa_private_key, token.requestor_id)
-  elif isinstance(token, TwoLeggedOAuthHmacToken):
-    return _join_token_parts(
-        '1htl', token.consumer_key, token.consumer_secret, token.requestor_id)
-  # Check RSA OAuth token first since the OAuthRsaToken is a subclass of
-  # OAuthHmacToken.
-  elif isinstance(token, OAuthRsaToken):
-    return _join_token_parts(
-        '1r', token.consumer_key, token.rsa_private_key, token.token,
-        token.token_secret, str(token.auth_state), token.next,
-        token.verifier)
-  elif isinstance(token, OAuthHmacToken):
-    return _join_token_parts(
-        '1h', token.consumer_key, token.consumer_secret, token.token,
-        token.token_secret, str(token.auth_state), token.next,
-        token.verifier)
-  elif isinstance(token, OAuth2Token):
-    return _join_token_parts(
-        '2o', token.client_id, token.client_secret, token.scope,
-        token.user_agent, token.auth_uri, token.token_uri,
-        token.access_token, token.refresh_token)
-  else:
-    raise UnsupportedTokenType(
-        'Unable to serialize token of type %s' % type(token))
+  return _join_token_parts(*_token_to_parts(token))
 
 
 TokenToBlob = token_to_blob
@@ -1507,42 +1681,86 @@ def token_from_blob(blob):
     blob string. Note that any members which were set to '' in the original
     token will now be None.
   """
-  parts = _split_token_parts(blob)
-  if parts[0] == '1c':
-    return ClientLoginToken(parts[1])
-  elif parts[0] == '1a':
-    return AuthSubToken(parts[1], parts[2:])
-  elif parts[0] == '1s':
-    return SecureAuthSubToken(parts[1], parts[2], parts[3:])
-  elif parts[0] == '1rtl':
-    return TwoLeggedOAuthRsaToken(parts[1], parts[2], parts[3])
-  elif parts[0] == '1htl':
-    return TwoLeggedOAuthHmacToken(parts[1], parts[2], parts[3])
-  elif parts[0] == '1r':
-    auth_state = int(parts[5])
-    return OAuthRsaToken(parts[1], parts[2], parts[3], parts[4], auth_state,
-                         parts[6], parts[7])
-  elif parts[0] == '1h':
-    auth_state = int(parts[5])
-    return OAuthHmacToken(parts[1], parts[2], parts[3], parts[4], auth_state,
-                          parts[6], parts[7])
-  elif parts[0] == '2o':
-    return OAuth2Token(parts[1], parts[2], parts[3], parts[4], parts[5],
-                       parts[6], parts[7], parts[8])
-  else:
-    raise UnsupportedTokenType(
-        'Unable to deserialize token with type marker of %s' % parts[0])
+  return _token_from_parts(_split_token_parts(blob))
 
 
 TokenFromBlob = token_from_blob
 
 
-def dump_tokens(tokens):
-  return ','.join([token_to_blob(t) for t in tokens])
+# The version written by dump_tokens unless another is requested.
+TOKENS_BLOB_VERSION = 2
+
+
+def dump_tokens(tokens, version=TOKENS_BLOB_VERSION):
+  """Serializes a list of tokens into a single string.
+
+  Version 1 joins the token_to_blob strings of the tokens with commas.
+  Version 2 is a JSON array of the form
+  [2, [string1, string2, ...], [[index1, index2, ...], ...]]
+  in which each token is a list of indexes into the table of strings. Tokens
+  for the users in a Google Apps domain usually share a consumer key and
+  secret, which are only stored once. Members which are None are stored as
+  -1, and unlike token_to_blob, members which are '' remain '' when loaded.
+
+  Args:
+    tokens: list of token objects of the classes supported by token_to_blob.
+    version: int (optional) The blob format to write. Use 1 if the string
+             will be read by an older version of this library.
+
+  Returns:
+    A string which load_tokens converts back into a list of tokens.
+  """
+  if version == 1:
+    return ','.join([token_to_blob(t) for t in tokens])
+  string_indexes = {}
+  strings = []
+  serialized = []
+  for token in tokens:
+    indexes = []
+    for part in _token_to_parts(token):
+      if part is None:
+        indexes.append(-1)
+        continue
+      try:
+        indexes.append(string_indexes[part])
+      except KeyError:
+        string_indexes[part] = len(strings)
+        indexes.append(len(strings))
+        strings.append(part)
+    serialized.append(indexes)
+  return simplejson.dumps([2, strings, serialized], separators=(',', ':'))
+
+
+DumpTokens = dump_tokens
 
 
 def load_tokens(blob):
-  return [token_from_blob(s) for s in blob.split(',')]
+  """Deserializes a string created by dump_tokens into a list of tokens.
+
+  Both the current format and the comma separated format written by earlier
+  versions of this library (version 1) are supported.
+  """
+  if not blob.startswith('['):
+    return [token_from_blob(s) for s in blob.split(',')]
+  version, strings, serialized = simplejson.loads(blob)
+  if version != 2:
+    raise UnsupportedTokenType(
+        'Unable to load tokens blob with version %s' % version)
+  # JSON strings are decoded as unicode, convert ASCII strings back to str.
+  for i, string in enumerate(strings):
+    try:
+      strings[i] = str(string)
+    except UnicodeEncodeError:
+      pass
+  # The index -1 refers to None.
+  strings.append(None)
+  tokens = []
+  for indexes in serialized:
+    tokens.append(_token_from_parts([strings[i] for i in indexes]))
+  return tokens
+
+
+LoadTokens = load_tokens
 
 
 def find_scopes_for_services(service_names=None):
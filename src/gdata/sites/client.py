@@ -436,12 +436,26 @@ class SitesClient(gdata.client.GDClient):
 
   UploadAttachment = upload_attachment
 
-  def download_attachment(self, uri_or_entry, file_path):
+  def download_attachment(self, uri_or_entry, file_path,
+                          chunk_size=gdata.client.DOWNLOAD_CHUNK_SIZE,
+                          resume=False, **kwargs):
     """Downloads an attachment file to disk.
 
+    The file is streamed chunk_size bytes at a time rather than read into
+    memory.
+
     Args:
       uri_or_entry: string The full URL to download the file from.
-      file_path: string The full path to save the file to.
+      file_path: string The full path to save the file to, or an object with
+                 a write method to which the file is written.
+      chunk_size: int (optional) The number of bytes to read at a time.
+      resume: boolean (optional) If True, a partial file left by an
+              interrupted download is resumed if the attachment has not
+              changed since, see gdata.client.GDClient.download.
+      kwargs: Other parameters to pass to self.download().
+
+    Returns:
+      The number of bytes in the downloaded file.
 
     Raises:
       gdata.client.RequestError: on error response from server.
@@ -450,13 +464,7 @@ class SitesClient(gdata.client.GDClient):
     if isinstance(uri_or_entry, gdata.sites.data.ContentEntry):
       uri = uri_or_entry.content.src
 
-    f = open(file_path, 'wb')
-    try:
-      f.write(self._get_file_content(uri))
-    except gdata.client.RequestError, e:
-      f.close()
-      raise e
-    f.flush()
-    f.close()
+    return self.download(uri, file_path, chunk_size=chunk_size, resume=resume,
+                         **kwargs)
 
   DownloadAttachment = download_attachment
@@ -15,8 +15,11 @@
 # limitations under the License.
 
 
+import bisect
+import re
 import StringIO
 import gdata
+import gdata.client
 import gdata.service
 import gdata.spreadsheet
 import gdata.spreadsheet.service
@@ -64,6 +67,9 @@ The intended use case is to allow easy storage of text data in a spreadsheet.
   Table: Represents a worksheet and interacts with records.
   RecordResultSet: A list of records in a table.
   Record: Represents a row in a worksheet allows manipulation of text data.
+  TableSnapshot: A local copy of a table which can be queried without
+      contacting the server.
+  Session: Buffers changes to records and sends them when committed.
 """
 
 
@@ -260,6 +266,19 @@ class Database(object):
             spreadsheet_key=self.spreadsheet_key))
       return matching_tables
 
+  def StartSession(self, max_concurrent=None):
+    """Creates a Session which buffers changes to records in this database.
+
+    Args:
+      max_concurrent: int (optional) The number of requests the session
+          sends at the same time when it is committed. Defaults to
+          MAX_CONCURRENT_REQUESTS.
+
+    Returns:
+      A new Session.
+    """
+    return Session(self.client, max_concurrent=max_concurrent)
+
   def Delete(self):
     """Deletes the entire database spreadsheet from Google Spreadsheets."""
     entry = self.client._GetDocsClient().Get(
@@ -422,6 +441,32 @@ class Table(object):
     return RecordResultSet(matching_feed, self.client, 
         self.spreadsheet_key, self.worksheet_id)
 
+  def StartSession(self, max_concurrent=None):
+    """Creates a Session which adds records to this table by default.
+
+    Args:
+      max_concurrent: int (optional) The number of requests the session
+          sends at the same time when it is committed. Defaults to
+          MAX_CONCURRENT_REQUESTS.
+
+    Returns:
+      A new Session.
+    """
+    return Session(self.client, table=self, max_concurrent=max_concurrent)
+
+  def Snapshot(self, indexed_fields=None):
+    """Loads all records in this table into a TableSnapshot.
+
+    Args:
+      indexed_fields: list of strings (optional) The fields which are used
+          most often in queries. Comparisons on these fields are answered
+          using an index instead of checking every record.
+
+    Returns:
+      TableSnapshot which can be queried locally.
+    """
+    return TableSnapshot(self, indexed_fields)
+
 
 class RecordResultSet(list):
   """A collection of rows which allows fetching of the next set of results.
@@ -531,6 +576,512 @@ class Record(object):
     self.client._GetSpreadsheetsClient().DeleteRow(self.entry)
 
 
+# The number of requests which a Session sends at the same time on Commit.
+MAX_CONCURRENT_REQUESTS = 4
+
+INSERT = 'insert'
+UPDATE = 'update'
+DELETE = 'delete'
+
+
+class Session(object):
+  """Buffers record inserts, updates and deletes until they are committed.
+
+  Changes are not sent when they are made, instead Commit sends all of them
+  at once using several requests at the same time. Several changes to the
+  same record are combined, so a record which is updated many times is only
+  sent once, with its content at the time of the commit, and a record which
+  is added and then deleted is never sent.
+
+  The rows added to each table are inserted in the order in which they were
+  added to the session. Updates and deletes are sent in parallel with the
+  inserts and with each other.
+
+  Each row's edit link includes the version of the row which was read, so
+  if the row was changed on the server after the record was read, the
+  update or delete fails with a conflict (HTTP status 409) rather than
+  overwriting the other change. Failures are returned by Commit.
+
+  Example:
+    session = table.StartSession()
+    for data in rows:
+      session.AddRecord(data)
+    record.content['email'] = 'bob2@example.com'
+    session.UpdateRecord(record)
+    for operation, record, error in session.Commit():
+      ...
+  """
+
+  def __init__(self, database_client, table=None, max_concurrent=None):
+    """Constructor for a Session.
+
+    Args:
+      database_client: DatabaseClient The client used to send the changes.
+      table: Table (optional) The table to which AddRecord adds records if
+          no table is given.
+      max_concurrent: int (optional) The number of requests sent at the
+          same time on Commit. Defaults to MAX_CONCURRENT_REQUESTS.
+    """
+    self.client = database_client
+    self.table = table
+    self.max_concurrent = max_concurrent or MAX_CONCURRENT_REQUESTS
+    self._operations = []
+    self._pending = {}
+
+  def AddRecord(self, data, table=None):
+    """Adds a new row to a table when this session is committed.
+
+    Args:
+      data: dict of strings Mapping of string values to column names.
+      table: Table (optional) The table to add the row to. Defaults to the
+          session's table.
+
+    Returns:
+      Record which represents the new row. The record's entry and row_id
+      are set when the session has been committed.
+    """
+    table = table or self.table
+    if table is None:
+      raise Error('No table was given for the new record.')
+    record = Record(content=data, spreadsheet_key=table.spreadsheet_key,
+        worksheet_id=table.worksheet_id, database_client=self.client)
+    self._AddOperation(INSERT, record, table)
+    return record
+
+  def UpdateRecord(self, record):
+    """Sends the record's content to the server when this session is committed.
+
+    The content is read when the session is committed, so later changes to
+    the record's content are included.
+
+    Args:
+      record: Record A record which was read from the server or added to
+          this session.
+    """
+    operation = self._pending.get(id(record))
+    if operation is None:
+      if record.entry is None:
+        raise Error('The record has not been added to a table.')
+      self._AddOperation(UPDATE, record)
+    elif operation[0] == DELETE:
+      raise Error('The record was deleted in this session.')
+
+  def DeleteRecord(self, record):
+    """Deletes the record's row when this session is committed.
+
+    Args:
+      record: Record A record which was read from the server or added to
+          this session.
+    """
+    operation = self._pending.get(id(record))
+    if operation is None:
+      if record.entry is None:
+        raise Error('The record has not been added to a table.')
+      self._AddOperation(DELETE, record)
+    elif operation[0] == INSERT:
+      # The row was never sent, so there is nothing to delete.
+      self._operations.remove(operation)
+      del self._pending[id(record)]
+    else:
+      operation[0] = DELETE
+
+  def Discard(self):
+    """Forgets all changes which have not been committed."""
+    self._operations = []
+    self._pending = {}
+
+  def Commit(self):
+    """Sends all buffered changes to the server.
+
+    Returns:
+      A list of (operation, record, error) tuples for the changes which
+      failed, in the order in which they were made. The operation is
+      INSERT, UPDATE or DELETE and the error is usually a
+      gdata.service.RequestError, in which error.args[0]['status'] is 409
+      if the row was changed on the server since the record was read. The
+      list is empty if all changes were made.
+    """
+    operations = self._operations
+    self.Discard()
+    # Each job is a list of operations which are sent one after the other.
+    jobs = []
+    inserts = {}
+    for position, operation in enumerate(operations):
+      if operation[0] == INSERT:
+        table_key = (operation[2].spreadsheet_key, operation[2].worksheet_id)
+        if table_key not in inserts:
+          inserts[table_key] = []
+          jobs.append(inserts[table_key])
+        inserts[table_key].append((position, operation))
+      else:
+        jobs.append([(position, operation)])
+    def RunJob(job):
+      failures = []
+      for position, operation in job:
+        try:
+          self._Send(operation)
+        except Exception, error:
+          failures.append((position, (operation[0], operation[1], error)))
+      return failures
+
+    failures = []
+    for job_failures in gdata.client.run_concurrently(RunJob, jobs,
+                                                      self.max_concurrent):
+      failures.extend(job_failures)
+    failures.sort()
+    return [failure for position, failure in failures]
+
+  def _AddOperation(self, operation_type, record, table=None):
+    operation = [operation_type, record, table]
+    self._operations.append(operation)
+    self._pending[id(record)] = operation
+
+  def _Send(self, operation):
+    operation_type, record, table = operation
+    spreadsheets_client = self.client._GetSpreadsheetsClient()
+    if operation_type == INSERT:
+      record.entry = spreadsheets_client.InsertRow(record.content,
+          record.spreadsheet_key, wksht_id=record.worksheet_id)
+      record.row_id = record.entry.id.text.split('/')[-1]
+    elif operation_type == UPDATE:
+      record.entry = spreadsheets_client.UpdateRow(record.entry,
+          record.content)
+    else:
+      spreadsheets_client.DeleteRow(record.entry)
+
+
+class TableSnapshot(object):
+  """A local copy of all records in a table.
+
+  The records are loaded once and queries are answered from memory, which
+  suits tables that are read much more often than they are changed. Call
+  Refresh to fetch the rows which changed on the server since the snapshot
+  was taken. Changes made to the records in a snapshot are not reflected in
+  its indexes until the next Refresh.
+
+  Attributes:
+    table: Table The table which this snapshot copies.
+    records: list of Records in the order of the rows in the worksheet.
+    updated: str The time on the server when the snapshot was last loaded
+        or refreshed.
+  """
+
+  def __init__(self, table, indexed_fields=None):
+    self.table = table
+    self.indexed_fields = list(indexed_fields or [])
+    self.records = []
+    self.updated = None
+    self._positions = {}
+    self._hash_indexes = {}
+    self._sorted_indexes = {}
+    self._queries = {}
+    self.Load()
+
+  def Load(self):
+    """Replaces the contents of this snapshot with all rows in the table."""
+    self.updated, entries = self._GetRows()
+    self.records = []
+    self._positions = {}
+    for entry in entries:
+      self._AddRecord(entry)
+    self._BuildIndexes()
+
+  def Refresh(self):
+    """Updates this snapshot with the rows which changed since it was loaded.
+
+    Only the rows which were added or changed since the last Load or Refresh
+    are requested. The list feed does not give the position of a row, so if
+    a row was added, possibly between existing rows, all rows are loaded
+    again. Deleted rows are not listed in the list feed either. Once no rows
+    have been added, the table holds fewer rows than the snapshot only if
+    rows were deleted, and then all rows are loaded again as well.
+    """
+    query = gdata.spreadsheet.service.ListQuery()
+    if self.updated:
+      query.updated_min = self.updated
+    updated, entries = self._GetRows(query)
+    for entry in entries:
+      if entry.id.text.split('/')[-1] not in self._positions:
+        self.Load()
+        return
+    for entry in entries:
+      self._AddRecord(entry)
+    self.updated = updated or self.updated
+    count_query = gdata.spreadsheet.service.ListQuery()
+    count_query.max_results = '1'
+    count_feed = self.table.client._GetSpreadsheetsClient().GetListFeed(
+        self.table.spreadsheet_key, wksht_id=self.table.worksheet_id,
+        query=count_query)
+    if (count_feed.total_results is not None
+        and int(count_feed.total_results.text) != len(self.records)):
+      self.Load()
+    elif entries:
+      self._BuildIndexes()
+
+  def GetRecord(self, row_id=None, row_number=None):
+    """Finds a single record based on row ID or number.
+
+    Args:
+      row_id: The ID for the individual row.
+      row_number: str or int The position of the desired row. Numbering
+          begins at 1, which refers to the second row in the worksheet since
+          the first row is used for column names.
+
+    Returns:
+      Record for the desired row or None if there is no such row.
+    """
+    if row_id:
+      position = self._positions.get(row_id)
+    else:
+      position = int(row_number) - 1
+    if position is None or position < 0 or position >= len(self.records):
+      return None
+    return self.records[position]
+
+  def GetRecords(self, start_row, end_row):
+    """Gets all records between the start and end row numbers inclusive.
+
+    Args:
+      start_row: str or int
+      end_row: str or int
+
+    Returns:
+      list of Records for the desired rows.
+    """
+    return self.records[int(start_row) - 1:int(end_row)]
+
+  def FindRecords(self, query_string):
+    """Finds the records which match a query without contacting the server.
+
+    The query syntax is a subset of the sq parameter accepted by the list
+    feed. A query compares fields to values using ==, !=, <, <=, > and >=,
+    and comparisons can be combined using and (&&), or (||) and brackets.
+    Values are compared as numbers if both are numeric, otherwise numbers
+    sort before text and text is compared as strings.
+
+    Args:
+      query_string: str Examples: 'name == john' to find all rows with john
+          in the name column, '(cost < 19.50 and name != toy) or cost > 500'
+
+    Returns:
+      list of matching Records in row order.
+    """
+    query = self._queries.get(query_string)
+    if query is None:
+      query = _ParseQuery(query_string)
+      if len(self._queries) >= MAX_CACHED_QUERIES:
+        self._queries.clear()
+      self._queries[query_string] = query
+    candidates = self._FindCandidates(query)
+    if candidates is None:
+      candidates = xrange(len(self.records))
+    else:
+      candidates = sorted(candidates)
+    return [self.records[position] for position in candidates
+            if _QueryMatches(query, self.records[position].content)]
+
+  def _GetRows(self, query=None):
+    """Requests all pages of the list feed.
+
+    Returns:
+      A tuple of the feed's updated time and a list of its entries.
+    """
+    client = self.table.client._GetSpreadsheetsClient()
+    feed = client.GetListFeed(self.table.spreadsheet_key,
+        wksht_id=self.table.worksheet_id, query=query)
+    updated = None
+    if feed.updated is not None:
+      updated = feed.updated.text
+    entries = list(feed.entry)
+    next_link = feed.GetNextLink()
+    while next_link and next_link.href:
+      feed = client.Get(next_link.href,
+          converter=gdata.spreadsheet.SpreadsheetsListFeedFromString)
+      entries.extend(feed.entry)
+      next_link = feed.GetNextLink()
+    return updated, entries
+
+  def _AddRecord(self, entry):
+    record = Record(content=None, row_entry=entry,
+        spreadsheet_key=self.table.spreadsheet_key,
+        worksheet_id=self.table.worksheet_id, database_client=self.table.client)
+    position = self._positions.get(record.row_id)
+    if position is None:
+      self._positions[record.row_id] = len(self.records)
+      self.records.append(record)
+    else:
+      self.records[position] = record
+
+  def _BuildIndexes(self):
+    self._hash_indexes = {}
+    self._sorted_indexes = {}
+    for field in self.indexed_fields:
+      hash_index = {}
+      keyed = []
+      for position, record in enumerate(self.records):
+        key = _ValueKey(record.content.get(field))
+        hash_index.setdefault(key, []).append(position)
+        keyed.append((key, position))
+      keyed.sort()
+      self._hash_indexes[field] = hash_index
+      self._sorted_indexes[field] = ([key for key, position in keyed],
+                                     [position for key, position in keyed])
+
+  def _FindCandidates(self, query):
+    """Uses the indexes to find the positions of records which may match.
+
+    Returns:
+      A set of positions or None if every record must be checked.
+    """
+    if query[0] == 'and':
+      result = None
+      for part in query[1]:
+        candidates = self._FindCandidates(part)
+        if candidates is not None:
+          if result is None:
+            result = candidates
+          else:
+            result = result & candidates
+      return result
+    if query[0] == 'or':
+      result = set()
+      for part in query[1]:
+        candidates = self._FindCandidates(part)
+        if candidates is None:
+          return None
+        result |= candidates
+      return result
+    ignored, field, operator, key = query
+    if field not in self._hash_indexes or operator == '!=':
+      return None
+    if operator == '==':
+      return set(self._hash_indexes[field].get(key, ()))
+    keys, positions = self._sorted_indexes[field]
+    if operator == '<':
+      return set(positions[:bisect.bisect_left(keys, key)])
+    if operator == '<=':
+      return set(positions[:bisect.bisect_right(keys, key)])
+    if operator == '>':
+      return set(positions[bisect.bisect_right(keys, key):])
+    return set(positions[bisect.bisect_left(keys, key):])
+
+
+# The number of parsed queries kept by each TableSnapshot.
+MAX_CACHED_QUERIES = 100
+
+_NUMBER_PATTERN = re.compile(
+    r'^\s*[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?\s*$')
+_QUERY_TOKEN_PATTERN = re.compile(
+    r'\s*(?:(==|=|!=|<>|<=|>=|<|>|&&|\|\||\(|\))|"([^"]*)"|([^\s()=!<>&|"]+))')
+_OPERATORS = {'==': '==', '=': '==', '!=': '!=', '<>': '!=', '<': '<',
+              '<=': '<=', '>': '>', '>=': '>='}
+
+
+def _ValueKey(value):
+  """Converts a field value to a key which orders numbers before text."""
+  if value is None:
+    value = ''
+  if _NUMBER_PATTERN.match(value):
+    return (0, float(value))
+  return (1, value)
+
+
+def _ParseQuery(query_string):
+  """Converts a query string to a tree of tuples.
+
+  The tree contains ('or', [parts]), ('and', [parts]) and
+  ('compare', field, operator, value_key) tuples.
+  """
+  tokens = []
+  position = 0
+  query_string = query_string.strip()
+  while position < len(query_string):
+    match = _QUERY_TOKEN_PATTERN.match(query_string, position)
+    if not match or match.end() == position:
+      raise Error('Invalid query: %s' % query_string)
+    symbol, quoted, word = match.groups()
+    if symbol:
+      tokens.append(('symbol', symbol))
+    elif quoted is not None:
+      tokens.append(('value', quoted))
+    elif word.lower() in ('and', 'or'):
+      tokens.append(('symbol', {'and': '&&', 'or': '||'}[word.lower()]))
+    else:
+      tokens.append(('word', word))
+    position = match.end()
+  tokens.reverse()
+
+  def next_token():
+    if tokens:
+      return tokens.pop()
+    return (None, None)
+
+  def peek():
+    if tokens:
+      return tokens[-1]
+    return (None, None)
+
+  def parse_expression(join_symbol, parse_part, node_type):
+    parts = [parse_part()]
+    while peek() == ('symbol', join_symbol):
+      next_token()
+      parts.append(parse_part())
+    if len(parts) == 1:
+      return parts[0]
+    return (node_type, parts)
+
+  def parse_or():
+    return parse_expression('||', parse_and, 'or')
+
+  def parse_and():
+    return parse_expression('&&', parse_comparison, 'and')
+
+  def parse_comparison():
+    kind, text = next_token()
+    if (kind, text) == ('symbol', '('):
+      node = parse_or()
+      if next_token() != ('symbol', ')'):
+        raise Error('Invalid query: %s' % query_string)
+      return node
+    operator = next_token()
+    value = next_token()
+    if (kind != 'word' or operator[1] not in _OPERATORS
+        or value[0] not in ('word', 'value')):
+      raise Error('Invalid query: %s' % query_string)
+    return ('compare', text, _OPERATORS[operator[1]], _ValueKey(value[1]))
+
+  tree = parse_or()
+  if tokens:
+    raise Error('Invalid query: %s' % query_string)
+  return tree
+
+
+def _QueryMatches(query, content):
+  if query[0] == 'and':
+    for part in query[1]:
+      if not _QueryMatches(part, content):
+        return False
+    return True
+  if query[0] == 'or':
+    for part in query[1]:
+      if _QueryMatches(part, content):
+        return True
+    return False
+  ignored, field, operator, key = query
+  value = _ValueKey(content.get(field))
+  if operator == '==':
+    return value == key
+  elif operator == '!=':
+    return value != key
+  elif operator == '<':
+    return value < key
+  elif operator == '<=':
+    return value <= key
+  elif operator == '>':
+    return value > key
+  return value >= key
+
+
 def ConvertStringsToColumnHeaders(proposed_headers):
   """Converts a list of strings to column names which spreadsheets accepts.
 
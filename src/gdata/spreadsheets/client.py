@@ -25,7 +25,9 @@ http://code.google.com/apis/spreadsheets/
 __author__ = 'j.s@google.com (Jeff Scudder)'
 
 
+import re
 import gdata.client
+import gdata.data
 import gdata.gauth
 import gdata.spreadsheets.data
 import atom.data
@@ -46,6 +48,14 @@ CELL_URL = ('https://spreadsheets.google.com/feeds/cells/%s/%s/private/full/'
             'R%sC%s')
 LISTS_URL = 'https://spreadsheets.google.com/feeds/list/%s/%s/private/full'
 
+# The largest number of cells which write_range sends in one batch request.
+MAX_BATCH_CELLS = 1000
+# The number of batch requests which write_range sends at the same time.
+MAX_CONCURRENT_BATCHES = 4
+
+_A1_PATTERN = re.compile('^([A-Za-z]+)([0-9]+)$')
+_R1C1_PATTERN = re.compile('^[Rr]([0-9]+)[Cc]([0-9]+)$')
+
 
 class SpreadsheetsClient(gdata.client.GDClient):
   api_version = '3'
@@ -377,6 +387,85 @@ class SpreadsheetsClient(gdata.client.GDClient):
 
   GetCells = get_cells
 
+  def get_worksheet_values(self, spreadsheet_key, worksheet_id,
+                           value_type=gdata.spreadsheets.data.INPUT_VALUE,
+                           query=None, use_numpy=False, auth_token=None,
+                           **kwargs):
+    """Reads the values of a worksheet's cells into a list of rows.
+
+    The cells feed is streamed and only the values are kept, which uses far
+    less memory than get_cells for large worksheets since no CellEntry
+    objects are created. All pages of the cells feed are read.
+
+    Args:
+      spreadsheet_key: str, The unique ID of this containing spreadsheet. This
+                       can be the ID from the URL or as provided in a
+                       Spreadsheet entry.
+      worksheet_id: str, The unique ID of the worksheet in this spreadsheet
+                    whose cells we want. This can be obtained using
+                    WorksheetEntry's get_worksheet_id method.
+      value_type: str (optional) Which value to read from each cell, one of
+                  gdata.spreadsheets.data.INPUT_VALUE (the default),
+                  DISPLAYED_VALUE or NUMERIC_VALUE.
+      query: gdata.spreadsheets.client.CellQuery (optional) Limits the
+             cells which are read, for example to a range. Row and column
+             numbers in the result still start at the top left of the
+             worksheet.
+      use_numpy: boolean (optional) If True, the values are returned as a
+                 two dimensional numpy array. Requires numpy. Numeric values
+                 are stored as floats with NaN for empty cells, other values
+                 are stored as objects with None for empty cells.
+      auth_token: An object which sets the Authorization HTTP header in its
+                  modify_request method. Recommended classes include
+                  gdata.gauth.ClientLoginToken and gdata.gauth.AuthSubToken
+                  among others. Represents the current user. Defaults to None
+                  and if None, this method will look for a value in the
+                  auth_token member of SpreadsheetsClient.
+
+    Returns:
+      A list of rows in which rows[r - 1][c - 1] is the value of the cell
+      in row r and column c. All rows have the same length. Rows of str
+      (None for empty cells) are lists, rows of NUMERIC_VALUEs are
+      array.array('d') with NaN for empty cells. If use_numpy is True, a
+      numpy.ndarray is returned instead.
+    """
+    rows = []
+    next_uri = [CELLS_URL % (spreadsheet_key, worksheet_id)]
+
+    def read_values(response):
+      next_uri[0] = gdata.spreadsheets.data.parse_cell_values(
+          response, rows, value_type)
+
+    while next_uri[0] is not None:
+      uri = next_uri[0]
+      next_uri[0] = None
+      self.request('GET', uri, auth_token=auth_token, converter=read_values,
+                   query=query, **kwargs)
+      # The next link already contains the query parameters.
+      query = None
+    width = 0
+    for row in rows:
+      width = max(width, len(row))
+    if value_type == gdata.spreadsheets.data.NUMERIC_VALUE:
+      missing = float('nan')
+    else:
+      missing = None
+    for row in rows:
+      if len(row) < width:
+        row.extend([missing] * (width - len(row)))
+    if use_numpy:
+      import numpy
+      if value_type == gdata.spreadsheets.data.NUMERIC_VALUE:
+        result = numpy.empty((len(rows), width), dtype=float)
+      else:
+        result = numpy.empty((len(rows), width), dtype=object)
+      for i, row in enumerate(rows):
+        result[i] = row
+      return result
+    return rows
+
+  GetWorksheetValues = get_worksheet_values
+
   def get_cell(self, spreadsheet_key, worksheet_id, row_num, col_num,
                desired_class=gdata.spreadsheets.data.CellEntry,
                auth_token=None, **kwargs):
@@ -414,6 +503,103 @@ class SpreadsheetsClient(gdata.client.GDClient):
 
   GetCell = get_cell
 
+  def write_range(self, spreadsheet_key, worksheet_id, top_left, rows,
+                  compare=True, batch_size=MAX_BATCH_CELLS,
+                  max_concurrent=MAX_CONCURRENT_BATCHES, auth_token=None,
+                  **kwargs):
+    """Sets the contents of a rectangle of cells using batch requests.
+
+    The current input values of the cells are read first and only the cells
+    whose contents change are sent. The changes are split into batches of
+    at most batch_size cells which are sent at the same time. A cell which
+    could not be set does not prevent the others from being set, instead
+    it is included in the returned list of failures.
+
+    Args:
+      spreadsheet_key: str, The unique ID of this containing spreadsheet. This
+                       can be the ID from the URL or as provided in a
+                       Spreadsheet entry.
+      worksheet_id: str, The unique ID of the worksheet in this spreadsheet
+                    whose cells we want to set. This can be obtained using
+                    WorksheetEntry's get_worksheet_id method.
+      top_left: The cell in which the first value of the first row is
+                written. Either a (row, col) tuple of ints starting at 1, or
+                a str such as 'B3' or 'R3C2'.
+      rows: list of lists, The values for each row of the range. A value of
+            None or '' clears the cell and other values are converted to
+            str. Rows may have different lengths.
+      compare: boolean (optional) If False, every cell in the range is sent
+               without reading the current values first. Defaults to True.
+      batch_size: int (optional) The largest number of cells to set in one
+                  batch request. Defaults to MAX_BATCH_CELLS.
+      max_concurrent: int (optional) The number of batch requests to send at
+                      the same time. Defaults to MAX_CONCURRENT_BATCHES.
+      auth_token: An object which sets the Authorization HTTP header in its
+                  modify_request method. Recommended classes include
+                  gdata.gauth.ClientLoginToken and gdata.gauth.AuthSubToken
+                  among others. Represents the current user. Defaults to None
+                  and if None, this method will look for a value in the
+                  auth_token member of SpreadsheetsClient.
+
+    Returns:
+      A list of gdata.spreadsheets.data.CellEntry, one for each cell which
+      could not be set. The cell member gives the cell's row, col and
+      desired input_value and the batch_status member gives the code and
+      reason for the failure. The list is empty if all cells were set.
+    """
+    first_row, first_col = _cell_position(top_left)
+    changes = []
+    for row_offset, row in enumerate(rows):
+      for col_offset, value in enumerate(row):
+        changes.append((first_row + row_offset, first_col + col_offset,
+                        _cell_input(value)))
+    if not changes:
+      return []
+    if compare:
+      last_row = max([change[0] for change in changes])
+      last_col = max([change[1] for change in changes])
+      current = self.get_worksheet_values(
+          spreadsheet_key, worksheet_id,
+          query=CellQuery(min_row=first_row, max_row=last_row,
+                          min_col=first_col, max_col=last_col),
+          auth_token=auth_token, **kwargs)
+      changed = []
+      for row_num, col_num, value in changes:
+        current_value = None
+        if row_num <= len(current) and col_num <= len(current[row_num - 1]):
+          current_value = current[row_num - 1][col_num - 1]
+        if value != (current_value or ''):
+          changed.append((row_num, col_num, value))
+      changes = changed
+
+    batches = []
+    for start in xrange(0, len(changes), batch_size):
+      feed = gdata.spreadsheets.data.build_batch_cells_update(
+          spreadsheet_key, worksheet_id)
+      for row_num, col_num, value in changes[start:start + batch_size]:
+        feed.add_set_cell(row_num, col_num, value)
+      batches.append(feed)
+
+    def send_batch(feed):
+      try:
+        result = self.batch(feed, force=True, auth_token=auth_token,
+                            **kwargs)
+        return _failed_cells(feed, result)
+      except Exception, error:
+        # The request failed as a whole, for example with an HTTP error
+        # status or a lost connection, so none of its cells were set.
+        return _failed_cells(feed, None, getattr(error, 'status', None),
+                             str(error))
+
+    failures = []
+    for failed in gdata.client.run_concurrently(send_batch, batches,
+                                                max_concurrent):
+      failures.extend(failed)
+    failures.sort(key=lambda entry: (int(entry.cell.row), int(entry.cell.col)))
+    return failures
+
+  WriteRange = write_range
+
   def get_list_feed(self, spreadsheet_key, worksheet_id,
                     desired_class=gdata.spreadsheets.data.ListsFeed,
                     auth_token=None, **kwargs):
@@ -478,6 +664,66 @@ class SpreadsheetsClient(gdata.client.GDClient):
   AddListEntry = add_list_entry
 
 
+def _cell_position(cell):
+  """Converts a (row, col) tuple or an 'A1' or 'R1C1' str to (row, col)."""
+  if not isinstance(cell, basestring):
+    return int(cell[0]), int(cell[1])
+  match = _R1C1_PATTERN.match(cell)
+  if match:
+    return int(match.group(1)), int(match.group(2))
+  match = _A1_PATTERN.match(cell)
+  if not match:
+    raise ValueError('Invalid cell reference: %s' % cell)
+  col = 0
+  for letter in match.group(1).upper():
+    col = col * 26 + ord(letter) - ord('A') + 1
+  return int(match.group(2)), col
+
+
+def _cell_input(value):
+  if value is None:
+    return ''
+  if isinstance(value, basestring):
+    return value
+  return str(value)
+
+
+def _failed_cells(request_feed, result_feed, code=None, reason=None):
+  """Finds the cells in a batch request which were not set.
+
+  Args:
+    request_feed: gdata.spreadsheets.data.CellsFeed The batch request.
+    result_feed: gdata.spreadsheets.data.CellsFeed The server's response or
+                 None if the request failed, in which case every cell in the
+                 request failed with the code and reason.
+
+  Returns:
+    A list of the request's CellEntry objects which failed with their
+    batch_status set.
+  """
+  results = {}
+  if result_feed is not None:
+    for entry in result_feed.entry:
+      if entry.batch_id is not None:
+        results[entry.batch_id.text] = entry
+    if result_feed.interrupted is not None:
+      code = '500'
+      reason = result_feed.interrupted.reason or 'Batch interrupted'
+  failed = []
+  for entry in request_feed.entry:
+    result = results.get(entry.batch_id.text)
+    if result is not None and result.batch_status is not None:
+      if result.batch_status.code == '200':
+        continue
+      entry.batch_status = result.batch_status
+    else:
+      entry.batch_status = gdata.data.BatchStatus(
+          code=str(code or 500),
+          reason=reason or 'Missing from batch response')
+    failed.append(entry)
+  return failed
+
+
 class SpreadsheetQuery(gdata.client.Query):
 
   def __init__(self, title=None, title_exact=None, **kwargs):
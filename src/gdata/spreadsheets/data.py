@@ -28,6 +28,7 @@ http://code.google.com/apis/spreadsheets/docs/3.0/reference.html#Elements
 __author__ = 'j.s@google.com (Jeff Scudder)'
 
 
+import array
 import atom.core
 import gdata.data
 
@@ -47,6 +48,11 @@ BATCH_POST_ID_TEMPLATE = ('https://spreadsheets.google.com/feeds/cells'
 BATCH_ENTRY_ID_TEMPLATE = '%s/R%sC%s'
 BATCH_EDIT_LINK_TEMPLATE = '%s/batch'
 
+# The values of a cell which can be read using parse_cell_values.
+DISPLAYED_VALUE = 'displayed'
+INPUT_VALUE = 'input'
+NUMERIC_VALUE = 'numeric'
+
 
 class Error(Exception):
   pass
@@ -254,6 +260,23 @@ class ListEntry(gdata.data.GDEntry):
   x.get_value('columnheader') and x.set_value('columnheader', 'value').
   See also the explanation of column names in the ListFeed class.
   """
+  # _other_elements is a _RowElements list, which indexes the gsx elements by
+  # column name so that get_value and set_value do not search the row. The
+  # index is built when the entry is parsed.
+
+  def _get_row_elements(self):
+    return self._row_elements
+
+  def _set_row_elements(self, elements):
+    if not isinstance(elements, _RowElements):
+      elements = _RowElements(elements)
+    self._row_elements = elements
+
+  _other_elements = property(_get_row_elements, _set_row_elements)
+
+  def _harvest_tree(self, tree, version=1):
+    gdata.data.GDEntry._harvest_tree(self, tree, version)
+    self._other_elements.get_column_index()
 
   def get_value(self, column_name):
     """Returns the displayed text for the desired column in this row.
@@ -264,10 +287,10 @@ class ListEntry(gdata.data.GDEntry):
     If a column is not present in this spreadsheet, or there is no value
     for a column in this row, this method will return None.
     """
-    values = self.get_elements(column_name, GSX_NAMESPACE)
-    if len(values) == 0:
+    value = self._other_elements.get_column_index().get(column_name)
+    if value is None:
       return None
-    return values[0].text
+    return value.text
 
   def set_value(self, column_name, value):
     """Changes the value of cell in this row under the desired column name.
@@ -282,22 +305,25 @@ class ListEntry(gdata.data.GDEntry):
     spaces, uppercase letters, etc.
     """
     # Try to find the column in this row to change an existing value.
-    values = self.get_elements(column_name, GSX_NAMESPACE)
-    if len(values) > 0:
-      values[0].text = value
+    index = self._other_elements.get_column_index()
+    if column_name in index:
+      index[column_name].text = value
     else:
       # There is no value in this row for the desired column, so add a new
       # gsx:column_name element.
       new_value = ListRow(text=value)
       new_value._qname = new_value._qname % (column_name,)
-      self._other_elements.append(new_value)
+      self._other_elements.add_column(column_name, new_value)
 
   def to_dict(self):
-    """Converts this row to a mapping of column names to their values."""
+    """Converts this row to a mapping of column names to their values.
+
+    As in get_value, the first element for a column gives its value.
+    """
     result = {}
-    values = self.get_elements(namespace=GSX_NAMESPACE)
-    for item in values:
-      result[item._get_tag()] = item.text
+    index = self._other_elements.get_column_index()
+    for column_name, element in index.iteritems():
+      result[column_name] = element.text
     return result
 
   def from_dict(self, values):
@@ -310,6 +336,59 @@ class ListEntry(gdata.data.GDEntry):
       self.set_value(column, value)
 
 
+_GSX_PREFIX = '{%s}' % GSX_NAMESPACE
+
+
+class _RowElements(list):
+  """The extension elements of a ListEntry, indexed by gsx column name.
+
+  The index is built when it is first needed and is dropped whenever the
+  list is changed, so it is only rebuilt after elements are added, removed
+  or replaced other than by ListEntry.set_value.
+  """
+
+  _column_index = None
+
+  def get_column_index(self):
+    """Maps column names to the first gsx element for each column."""
+    if self._column_index is None:
+      index = {}
+      for element in self:
+        column_name = _gsx_column_name(element)
+        if column_name is not None and column_name not in index:
+          index[column_name] = element
+      self._column_index = index
+    return self._column_index
+
+  def add_column(self, column_name, element):
+    """Appends the gsx element for a column which is not in the list."""
+    index = self.get_column_index()
+    list.append(self, element)
+    index[column_name] = element
+
+
+def _drop_column_index(method):
+  def changed(self, *args, **kwargs):
+    self._column_index = None
+    return method(self, *args, **kwargs)
+  return changed
+
+
+for _method_name in ('__setitem__', '__delitem__', '__setslice__',
+                     '__delslice__', '__iadd__', '__imul__', 'append',
+                     'extend', 'insert', 'pop', 'remove', 'reverse', 'sort'):
+  setattr(_RowElements, _method_name,
+          _drop_column_index(getattr(list, _method_name)))
+
+
+def _gsx_column_name(element):
+  """Returns the column name of a gsx element or None for other elements."""
+  qname = element._qname
+  if isinstance(qname, basestring) and qname.startswith(_GSX_PREFIX):
+    return qname[len(_GSX_PREFIX):]
+  return None
+
+
 class ListsFeed(gdata.data.GDFeed):
   """An Atom feed in which each entry represents a row in a worksheet.
 
@@ -332,6 +411,34 @@ class ListsFeed(gdata.data.GDFeed):
   """
   entry = [ListEntry]
 
+  def to_rows(self, columns=None):
+    """Converts every row in this feed to plain Python values in one pass.
+
+    Args:
+      columns: list of str (optional) The column names to read. If None, each
+               row is converted to a dict as in ListEntry.to_dict.
+
+    Returns:
+      A list with one item per entry. If columns were given each item is a
+      tuple of the values for those columns, with None for the columns which
+      have no value in that row, otherwise each item is a dict mapping
+      column names to values.
+    """
+    rows = []
+    for entry in self.entry:
+      if columns is None:
+        rows.append(entry.to_dict())
+        continue
+      values = {}
+      for element in entry._other_elements:
+        column_name = _gsx_column_name(element)
+        if column_name is not None and column_name not in values:
+          values[column_name] = element.text
+      rows.append(tuple([values.get(column) for column in columns]))
+    return rows
+
+  ToRows = to_rows
+
 
 class CellEntry(gdata.data.BatchEntry):
   """An Atom entry representing a single cell in a worksheet."""
@@ -381,3 +488,76 @@ def build_batch_cells_update(spreadsheet_key, worksheet_id):
 
 
 BuildBatchCellsUpdate = build_batch_cells_update
+
+
+def parse_cell_values(stream, rows, value_type=INPUT_VALUE):
+  """Reads the cell values from a cells feed into a list of rows.
+
+  The feed is parsed incrementally and each entry is discarded as soon as
+  its gs:cell has been read, so the whole feed is never held in memory as
+  CellEntry objects.
+
+  Args:
+    stream: A file-like object (such as an HTTP response) from which the
+            cells feed XML is read.
+    rows: list which is extended so that rows[r - 1][c - 1] is the value of
+          the cell in row r and column c. Each row is a list of str, with
+          None for the cells which were not in the feed, or an
+          array.array('d') with NaN for missing cells if value_type is
+          NUMERIC_VALUE. Rows are only as long as their last cell.
+    value_type: str (optional) One of DISPLAYED_VALUE (the text shown in the
+                cell), INPUT_VALUE (the formula or text the user entered)
+                or NUMERIC_VALUE (the numeric value of the cell, NaN if the
+                cell has none). Defaults to INPUT_VALUE.
+
+  Returns:
+    The URL of the next page of the cells feed, or None if this is the
+    last page.
+  """
+  cell_tag = Cell._qname
+  link_tag = atom.data.Link._qname
+  entry_tag = CellEntry._qname
+  numeric = value_type == NUMERIC_VALUE
+  if numeric:
+    missing = float('nan')
+  else:
+    missing = None
+  next_uri = None
+  feed = None
+  for event, element in atom.core.ElementTree.iterparse(
+      stream, events=('start', 'end')):
+    if event == 'start':
+      if feed is None:
+        feed = element
+      continue
+    tag = element.tag
+    if tag == cell_tag:
+      row_num = int(element.get('row'))
+      col_num = int(element.get('col'))
+      if value_type == INPUT_VALUE:
+        value = element.get('inputValue')
+      elif numeric:
+        value = element.get('numericValue')
+        if value is None:
+          value = missing
+        else:
+          value = float(value)
+      else:
+        value = element.text
+      while len(rows) < row_num:
+        if numeric:
+          rows.append(array.array('d'))
+        else:
+          rows.append([])
+      row = rows[row_num - 1]
+      if len(row) < col_num:
+        row.extend([missing] * (col_num - len(row)))
+      row[col_num - 1] = value
+    elif tag == entry_tag and element is not feed:
+      feed.remove(element)
+    elif tag == link_tag and element.get('rel') == 'next':
+      next_uri = element.get('href')
+  return next_uri
+
+
+ParseCellValues = parse_cell_values
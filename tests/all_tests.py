@@ -37,8 +37,10 @@ import gdata_tests.live_client_test
 import gdata_tests.gauth_test
 import gdata_tests.blogger.data_test
 import gdata_tests.blogger.live_client_test
+import gdata_tests.spreadsheets.client_test
 import gdata_tests.spreadsheets.data_test
 import gdata_tests.spreadsheets.live_client_test
+import gdata_tests.spreadsheet.text_db_local_test
 import gdata_tests.projecthosting.data_test
 import gdata_tests.projecthosting.live_client_test
 import gdata_tests.sites.data_test
@@ -46,9 +48,16 @@ import gdata_tests.sites.live_client_test
 import gdata_tests.analytics.data_test
 import gdata_tests.analytics.live_client_test
 import gdata_tests.contacts.live_client_test
+import gdata_tests.contacts.client_test
 import gdata_tests.contacts.profiles.live_client_test
 import gdata_tests.calendar_resource.live_client_test
 import gdata_tests.calendar_resource.data_test
+import gdata_tests.calendar.recurrence_test
+import gdata_tests.calendar.freebusy_test
+import gdata_tests.calendar.client_test
+import gdata_tests.apps.client_test
+import gdata_tests.apps.snapshot_test
+import gdata_tests.apps.migration.service_local_test
 import gdata_tests.apps.emailsettings.data_test
 import gdata_tests.apps.emailsettings.live_client_test
 import gdata_tests.apps.multidomain.data_test
@@ -74,8 +83,10 @@ def suite():
       gdata_tests.gauth_test.suite(),
       gdata_tests.blogger.data_test.suite(),
       gdata_tests.blogger.live_client_test.suite(),
+      gdata_tests.spreadsheets.client_test.suite(),
       gdata_tests.spreadsheets.data_test.suite(),
       gdata_tests.spreadsheets.live_client_test.suite(),
+      gdata_tests.spreadsheet.text_db_local_test.suite(),
       gdata_tests.projecthosting.data_test.suite(),
       gdata_tests.projecthosting.live_client_test.suite(),
       gdata_tests.sites.data_test.suite(),
@@ -83,8 +94,15 @@ def suite():
       gdata_tests.analytics.data_test.suite(),
       gdata_tests.analytics.live_client_test.suite(),
       gdata_tests.contacts.live_client_test.suite(),
+      gdata_tests.contacts.client_test.suite(),
       gdata_tests.calendar_resource.live_client_test.suite(),
       gdata_tests.calendar_resource.data_test.suite(),
+      gdata_tests.calendar.recurrence_test.suite(),
+      gdata_tests.calendar.freebusy_test.suite(),
+      gdata_tests.calendar.client_test.suite(),
+      gdata_tests.apps.client_test.suite(),
+      gdata_tests.apps.snapshot_test.suite(),
+      gdata_tests.apps.migration.service_local_test.suite(),
       gdata_tests.apps.emailsettings.live_client_test.suite(),
       gdata_tests.apps.emailsettings.data_test.suite(),
       gdata_tests.apps.multidomain.live_client_test.suite(),
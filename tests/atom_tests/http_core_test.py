@@ -22,8 +22,13 @@ __author__ = 'j.s@google.com (Jeff Scudder)'
 
 
 import unittest
+import atom.http
 import atom.http_core
+import BaseHTTPServer
+import socket
+import SocketServer
 import StringIO
+import threading
 
 
 class UriTest(unittest.TestCase):
@@ -149,9 +154,97 @@ class HttpRequestTest(unittest.TestCase):
     self.assert_(request._body_parts != copied._body_parts)
 
 
+class _KeepAliveHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'
+
+  def do_GET(self):
+    body = '%s %i' % (self.path, self.server.connection_count)
+    self.send_response(200)
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def setup(self):
+    self.server.connection_count += 1
+    BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+
+  def log_message(self, *args):
+    pass
+
+
+class KeepAliveHttpClientTest(unittest.TestCase):
+
+  def setUp(self):
+    self.server = SocketServer.ThreadingTCPServer(('127.0.0.1', 0),
+                                                  _KeepAliveHandler)
+    self.server.daemon_threads = True
+    # Connections closed by the client while the server waits on them are
+    # expected.
+    self.server.handle_error = lambda request, client_address: None
+    self.server.connection_count = 0
+    server_thread = threading.Thread(target=self.server.serve_forever)
+    server_thread.setDaemon(True)
+    server_thread.start()
+    self.port = self.server.server_address[1]
+
+  def tearDown(self):
+    self.server.shutdown()
+    self.server.server_close()
+
+  def _request(self, client, path):
+    return client.request(atom.http_core.HttpRequest(
+        'http://127.0.0.1:%i%s' % (self.port, path), 'GET'))
+
+  def test_reuses_connection(self):
+    client = atom.http_core.KeepAliveHttpClient()
+    for i in xrange(5):
+      self.assertEqual(self._request(client, '/%i' % i).read(), '/%i 1' % i)
+    self.assertEqual(self.server.connection_count, 1)
+    client.close()
+
+  def test_unread_response_uses_new_connection(self):
+    client = atom.http_core.KeepAliveHttpClient()
+    first = self._request(client, '/a')
+    second = self._request(client, '/b')
+    self.assertEqual(second.read(), '/b 2')
+    self.assertEqual(first.read(), '/a 1')
+    self.assertEqual(self._request(client, '/c').read(), '/c 2')
+    self.assertEqual(self.server.connection_count, 2)
+    client.close()
+
+  def test_abandoned_response_frees_connection(self):
+    client = atom.http_core.KeepAliveHttpClient(max_connections=1)
+    first = self._request(client, '/a')
+    first.close()
+    self.assertEqual(self._request(client, '/b').read(), '/b 2')
+    self._request(client, '/c')
+    self.assertEqual(self._request(client, '/d').read(), '/d 3')
+    self.assertEqual(self._request(client, '/e').read(), '/e 3')
+    self.assertEqual(len(client._connections.values()[0]), 1)
+    client.close()
+
+  def test_reconnects_after_close(self):
+    client = atom.http_core.KeepAliveHttpClient(max_connections=1)
+    self.assertEqual(self._request(client, '/a').read(), '/a 1')
+    for pooled in client._connections.itervalues():
+      pooled[0].connection.sock.shutdown(socket.SHUT_RDWR)
+    self.assertEqual(self._request(client, '/b').read(), '/b 2')
+
+  def test_v1_client_reuses_connection(self):
+    client = atom.http.KeepAliveHttpClient()
+    for i in xrange(3):
+      response = client.request(
+          'GET', 'http://127.0.0.1:%i/v1/%i' % (self.port, i))
+      self.assertEqual(response.read(), '/v1/%i 1' % i)
+    self.assertEqual(self.server.connection_count, 1)
+    client.close()
+
+
 def suite():
   return unittest.TestSuite((unittest.makeSuite(UriTest,'test'),
-                             unittest.makeSuite(HttpRequestTest,'test')))
+                             unittest.makeSuite(HttpRequestTest,'test'),
+                             unittest.makeSuite(KeepAliveHttpClientTest,
+                                                'test')))
 
  
 if __name__ == '__main__':
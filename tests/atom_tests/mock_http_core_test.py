@@ -22,6 +22,7 @@
 __author__ = 'j.s@google.com (Jeff Scudder)'
 
 
+import threading
 import unittest
 import StringIO
 import os.path
@@ -190,9 +191,74 @@ class MockHttpClientTest(unittest.TestCase):
     self.assertEqual(response.getheader('Cache-Marker'), '1')
 
 
+class EchoPathServer(atom.mock_http_core.FakeHttpServer):
+
+  def respond(self, http_request, body):
+    return atom.http_core.HttpResponse(
+        200, 'OK', body='%s %s %s' % (http_request.method,
+                                      http_request.uri.path, body))
+
+
+class FakeHttpServerTest(unittest.TestCase):
+
+  def test_requests_are_recorded(self):
+    server = EchoPathServer()
+    request = atom.http_core.HttpRequest(
+        method='POST', uri=atom.http_core.Uri(host='example.com', path='/a'))
+    request.add_body_part('hello ', 'text/plain')
+    request._body_parts.append(StringIO.StringIO('world'))
+    self.assertEqual(server.request(request).read(), 'POST /a hello world')
+    self.assertEqual(server.requests, [request])
+    self.assertEqual(request._body_parts, ['hello world'])
+    # Version 1 services pass the parts of the request separately.
+    response = server.request('PUT', 'http://example.com/b?x=1',
+                              data=['1', StringIO.StringIO('2')],
+                              headers={'If-Match': '*'})
+    self.assertEqual(response.read(), 'PUT /b 12')
+    self.assertEqual(server.requests[1].uri.query, {'x': '1'})
+    self.assertEqual(server.requests[1].headers, {'If-Match': '*'})
+
+  def test_unhandled_requests(self):
+    server = atom.mock_http_core.FakeHttpServer()
+    response = server.request('GET', 'http://example.com/a')
+    self.assertEqual((response.status, response.reason),
+                     (501, 'Not Implemented'))
+    self.assertEqual(len(server.requests), 1)
+
+  def test_fail_requests(self):
+    server = EchoPathServer()
+    server.fail_requests(count=2, path='/a')
+    server.fail_requests(500, 'Server Error', method='DELETE')
+
+    def status(method, path):
+      return server.request(method, 'http://example.com' + path).status
+
+    self.assertEqual([status('GET', '/b'), status('GET', '/a'),
+                      status('GET', '/a'), status('GET', '/a')],
+                     [200, 503, 503, 200])
+    self.assertEqual([status('DELETE', '/a'), status('DELETE', '/b')],
+                     [500, 500])
+    self.assertEqual(len(server.requests), 6)
+
+  def test_concurrent_requests(self):
+    server = EchoPathServer()
+    server.latency = 0.05
+    threads = [threading.Thread(target=server.request,
+                                args=('GET', 'http://example.com/'))
+               for i in xrange(3)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertEqual(len(server.requests), 3)
+    self.assertEqual(server.active, 0)
+    self.assert_(server.max_active > 1)
+
+
 def suite():
   return unittest.TestSuite((unittest.makeSuite(MockHttpClientTest, 'test'),
-                             unittest.makeSuite(EchoClientTest, 'test')))
+                             unittest.makeSuite(EchoClientTest, 'test'),
+                             unittest.makeSuite(FakeHttpServerTest, 'test')))
 
 
 if __name__ == '__main__':
@@ -18,6 +18,7 @@
 __author__ = 'j.s@google.com (Jeff Scudder)'
 
 
+import threading
 import unittest
 import atom.token_store
 import atom.http_interface
@@ -69,6 +70,40 @@ class TokenStoreTest(unittest.TestCase):
     self.assert_(isinstance(token_store.find_token('http://example.org/'), 
         atom.http_interface.GenericToken))
 
+  def testFindTokenAfterTokensChange(self):
+    self.assert_(self.tokens.find_token('http://example.com/a') == self.token)
+    self.assert_(self.tokens.find_token('http://example.com/a?x=2') == (
+        self.token))
+    self.tokens.remove_token(self.token)
+    self.assert_(isinstance(self.tokens.find_token('http://example.com/a'),
+        atom.http_interface.GenericToken))
+    other_token = atom.service.BasicAuthToken('bbb2', scopes=[
+        'http://example.com/'])
+    self.tokens.add_token(other_token)
+    self.assert_(self.tokens.find_token('http://example.com/a') == (
+        other_token))
+    self.tokens.remove_all_tokens()
+    self.assert_(isinstance(self.tokens.find_token('http://example.com/a'),
+        atom.http_interface.GenericToken))
+
+  def testConcurrentLookups(self):
+    urls = ['http://example.com/%i' % i for i in xrange(2000)]
+    found = []
+
+    def FindTokens():
+      for url in urls:
+        found.append(self.tokens.find_token(url))
+        if url.endswith('0'):
+          self.tokens.add_token(self.token)
+
+    threads = [threading.Thread(target=FindTokens) for i in xrange(4)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertEqual(len(found), 8000)
+    self.assert_(self.tokens.find_token(urls[-1]) == self.token)
+
 
 def suite():
   return unittest.TestSuite((unittest.makeSuite(TokenStoreTest,'test'),))
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2009 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Compares the time taken to create many contacts with batch requests.
+
+Contacts are sent to a mock HTTP client which answers each batch request
+after a fixed delay, standing in for the server's latency. Usage:
+
+  python contacts_benchmark.py [--contacts=2000] [--latency=0.25]
+"""
+
+
+import getopt
+import sys
+import time
+import atom.core
+import atom.data
+import atom.http_core
+import atom.mock_http_core
+import gdata.contacts.client
+import gdata.contacts.data
+import gdata.data
+
+
+class DelayedBatchServer(atom.mock_http_core.FakeHttpServer):
+  """Answers batch requests as if every operation succeeded."""
+
+  def __init__(self, latency):
+    atom.mock_http_core.FakeHttpServer.__init__(self)
+    self.latency = latency
+
+  def respond(self, http_request, body):
+    request_feed = atom.core.parse(body, gdata.contacts.data.ContactsFeed)
+    for i, entry in enumerate(request_feed.entry):
+      entry.id = atom.data.Id(text='contact%i' % i)
+      entry.batch_status = gdata.data.BatchStatus(code='201',
+                                                  reason='Created')
+    return atom.http_core.HttpResponse(200, 'OK', body=str(request_feed))
+
+
+def run(contact_count, latency, max_concurrent):
+  server = DelayedBatchServer(latency)
+  client = gdata.contacts.client.ContactsClient(http_client=server)
+  contacts = [gdata.contacts.data.ContactEntry(
+                  title=atom.data.Title(text='Person %i' % i),
+                  email=[gdata.data.Email(address='p%i@example.com' % i)])
+              for i in xrange(contact_count)]
+  start = time.time()
+  results = client.bulk_create(contacts, max_concurrent=max_concurrent)
+  elapsed = time.time() - start
+  created = len([result for result in results if result.succeeded()])
+  print '%2i concurrent %8.2fs %6i created %4i requests' % (
+      max_concurrent, elapsed, created, len(server.requests))
+
+
+def main():
+  contact_count = 2000
+  latency = 0.25
+  opts, args = getopt.getopt(sys.argv[1:], '', ['contacts=', 'latency='])
+  for option, value in opts:
+    if option == '--contacts':
+      contact_count = int(value)
+    elif option == '--latency':
+      latency = float(value)
+  print '%i contacts, %.2fs per batch request' % (contact_count, latency)
+  for max_concurrent in (1, 2, gdata.contacts.client.MAX_CONCURRENT_BATCHES,
+                         8):
+    run(contact_count, latency, max_concurrent)
+
+
+if __name__ == '__main__':
+  main()
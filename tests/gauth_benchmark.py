@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2009 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Measures how many requests per second can be signed using 2 legged OAuth.
+
+Simulates a Google Apps domain wide job which signs requests on behalf of
+many users. Usage:
+
+  python gauth_benchmark.py [--users=1000] [--requests=20000]
+"""
+
+
+import getopt
+import sys
+import time
+import atom.http_core
+import gdata.gauth
+
+
+def sign_requests(tokens, request_count):
+  """Signs request_count feed requests, cycling through the tokens."""
+  start = time.time()
+  for i in xrange(request_count):
+    token = tokens[i % len(tokens)]
+    request = atom.http_core.HttpRequest(
+        'https://www.google.com/m8/feeds/contacts/default/full?'
+        'max-results=100&start-index=%i' % (i % 10 * 100 + 1), 'GET')
+    token.modify_request(request)
+  return request_count / (time.time() - start)
+
+
+def main():
+  user_count = 1000
+  request_count = 20000
+  opts, args = getopt.getopt(sys.argv[1:], '', ['users=', 'requests='])
+  for option, value in opts:
+    if option == '--users':
+      user_count = int(value)
+    elif option == '--requests':
+      request_count = int(value)
+  tokens = [gdata.gauth.TwoLeggedOAuthHmacToken(
+                'example.com', 'consumer-secret', 'user%i@example.com' % i)
+            for i in xrange(user_count)]
+  rate = sign_requests(tokens, request_count)
+  print '%i users, %i requests: %.0f signed requests/sec' % (
+      user_count, request_count, rate)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests for the Provisioning API clients which do not need a server."""
+
+
+import csv
+import os
+import shutil
+import StringIO
+import tempfile
+import unittest
+import atom.core
+import atom.http_core
+import atom.mock_http_core
+import gdata.apps.client
+import gdata.apps.data
+import gdata.apps.multidomain.client
+import gdata.apps.multidomain.data
+
+
+ERROR_TEMPLATE = ('<AppsForYourDomainErrors><error errorCode="%i" '
+                  'invalidInput="%s" reason="%s" /></AppsForYourDomainErrors>')
+
+
+class ProvisioningServer(atom.mock_http_core.FakeHttpServer):
+  """Serves the user feeds of the Provisioning APIs from memory.
+
+  Handles the single domain user feed at /a/feeds/<domain>/user/2.0 and the
+  multidomain user feed at /a/feeds/user/2.0/<domain>.
+  """
+
+  def __init__(self):
+    atom.mock_http_core.FakeHttpServer.__init__(self)
+    # Maps user names or email addresses to serialized entries.
+    self.users = {}
+    # User names whose creation or deletion is carried out but answered with
+    # 503.
+    self.lost_responses = set()
+
+  def error(self, status, error_code, user_name, reason):
+    return atom.http_core.HttpResponse(
+        status, reason, body=ERROR_TEMPLATE % (error_code, user_name, reason))
+
+  def respond(self, http_request, body):
+    parts = http_request.uri.path.split('/')
+    multidomain = parts[3] == 'user'
+    entry_class = gdata.apps.data.UserEntry
+    if multidomain:
+      entry_class = gdata.apps.multidomain.data.UserEntry
+    if http_request.method == 'POST':
+      entry = atom.core.parse(body, entry_class)
+      if multidomain:
+        user_name = entry.email
+      else:
+        user_name = entry.login.user_name
+      if user_name in self.users:
+        return self.error(400, 1300, user_name, 'EntityExists')
+      self.users[user_name] = str(entry)
+      if user_name in self.lost_responses:
+        self.lost_responses.remove(user_name)
+        return atom.http_core.HttpResponse(503, 'Service Unavailable',
+                                           body='')
+      return atom.http_core.HttpResponse(201, 'Created', body=str(entry))
+    user_name = parts[-1]
+    if user_name not in self.users:
+      return self.error(400, 1301, user_name, 'EntityDoesNotExist')
+    if http_request.method == 'DELETE':
+      del self.users[user_name]
+      if user_name in self.lost_responses:
+        self.lost_responses.remove(user_name)
+        return atom.http_core.HttpResponse(503, 'Service Unavailable',
+                                           body='')
+      return atom.http_core.HttpResponse(200, 'OK', body='')
+    if http_request.method == 'PUT':
+      self.users[user_name] = body
+    return atom.http_core.HttpResponse(200, 'OK', body=self.users[user_name])
+
+  def get_user(self, user_name, entry_class=gdata.apps.data.UserEntry):
+    return atom.core.parse(self.users[user_name], entry_class)
+
+
+USERS_CSV = """action,user_name,given_name,family_name,password,admin,quota
+,liz,Liz,Smith,secret1,yes,
+create,bob,Bob,Jones,secret2,,2048
+create,ann,,Lee,secret3,,
+"""
+
+
+class UserProvisionerTest(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+    self.journal_path = os.path.join(self.temp_dir, 'users.journal')
+    self.server = ProvisioningServer()
+    self.client = gdata.apps.client.AppsClient('example.com',
+                                               http_client=self.server)
+
+  def tearDown(self):
+    shutil.rmtree(self.temp_dir)
+
+  def test_create_from_csv(self):
+    provisioner = gdata.apps.client.UserProvisioner(self.client,
+                                                    max_concurrent=2)
+    report = provisioner.run(csv.DictReader(StringIO.StringIO(USERS_CSV)))
+    self.assertEqual([(r.position, r.action, r.user_name, r.status)
+                      for r in report.results],
+                     [(0, 'create', 'liz', 'created'),
+                      (1, 'create', 'bob', 'created'),
+                      (2, 'create', 'ann', 'failed')])
+    self.assertEqual(report.results[2].reason, 'A new user needs a given_name.')
+    self.assertEqual([r.user_name for r in report.get_failures()], ['ann'])
+    liz = self.server.get_user('liz')
+    self.assertEqual(liz.login.admin, 'true')
+    self.assertEqual(liz.name.given_name, 'Liz')
+    self.assertEqual(self.server.get_user('bob').quota.limit, '2048')
+    output = StringIO.StringIO()
+    report.write_csv(output)
+    rows = list(csv.reader(StringIO.StringIO(output.getvalue())))
+    self.assertEqual(rows[0], list(gdata.apps.client.REPORT_FIELDS))
+    self.assertEqual(rows[1], ['0', 'create', 'liz', 'created', '', '1', ''])
+
+  def test_update_and_delete(self):
+    self.client.CreateUser('liz', 'Smith', 'Liz', 'secret')
+    self.client.CreateUser('bob', 'Jones', 'Bob', 'secret')
+    provisioner = gdata.apps.client.UserProvisioner(self.client)
+    report = provisioner.run([
+        {'action': 'update', 'email': 'liz', 'last_name': 'Jones',
+         'suspended': True},
+        {'action': 'delete', 'user_name': 'bob'},
+        {'action': 'delete', 'user_name': 'nobody'}])
+    self.assertEqual([r.status for r in report.results],
+                     ['updated', 'deleted', 'failed'])
+    self.assertEqual(report.results[2].code, 400)
+    self.assertEqual(report.results[2].reason, 'EntityDoesNotExist')
+    liz = self.server.get_user('liz')
+    self.assertEqual(liz.name.family_name, 'Jones')
+    self.assertEqual(liz.name.given_name, 'Liz')
+    self.assertEqual(liz.login.suspended, 'true')
+    self.assert_('bob' not in self.server.users)
+
+  def test_retries(self):
+    self.server.fail_requests(count=2)
+    self.server.lost_responses.add('bob')
+    provisioner = gdata.apps.client.UserProvisioner(
+        self.client, max_concurrent=1, retry_delay=0)
+    report = provisioner.run([
+        {'user_name': 'liz', 'given_name': 'Liz', 'family_name': 'Smith',
+         'password': 'secret'},
+        {'user_name': 'bob', 'given_name': 'Bob', 'family_name': 'Jones',
+         'password': 'secret'},
+        {'user_name': 'liz', 'given_name': 'Liz', 'family_name': 'Smith',
+         'password': 'secret'}])
+    self.assertEqual([(r.status, r.attempts) for r in report.results],
+                     [('created', 3), ('created', 2), ('failed', 1)])
+    self.assertEqual(report.results[2].reason, 'EntityExists')
+    self.server.fail_requests(count=10)
+    report = provisioner.run([{'action': 'delete', 'user_name': 'liz'}])
+    self.assertEqual(report.results[0].status, 'failed')
+    self.assertEqual(report.results[0].code, 503)
+    self.assertEqual(report.results[0].attempts,
+                     gdata.apps.client.MAX_RETRIES + 1)
+
+  def test_lost_delete_response(self):
+    self.client.CreateUser('liz', 'Smith', 'Liz', 'secret')
+    self.server.lost_responses.add('liz')
+    provisioner = gdata.apps.client.UserProvisioner(self.client,
+                                                    retry_delay=0)
+    report = provisioner.run([{'action': 'delete', 'user_name': 'liz'},
+                              {'action': 'delete', 'user_name': 'bob'}])
+    self.assertEqual([(r.status, r.attempts) for r in report.results],
+                     [('deleted', 2), ('failed', 1)])
+
+  def test_journal_restart_after_crash(self):
+    self.client.CreateUser('liz', 'Smith', 'Liz', 'secret')
+    self.client.CreateUser('bob', 'Jones', 'Bob', 'secret')
+    specs = [{'user_name': name, 'given_name': 'Test',
+              'family_name': 'Smith', 'password': 'secret'}
+             for name in ('liz', 'bob')]
+    # The process stopped after liz was created but before it was recorded.
+    journal_file = open(self.journal_path, 'wb')
+    journal_file.write('create\tliz\tsent\n')
+    journal_file.close()
+    provisioner = gdata.apps.client.UserProvisioner(
+        self.client, journal_path=self.journal_path)
+    report = provisioner.run(specs)
+    self.assertEqual([(r.status, r.attempts) for r in report.results],
+                     [('created', 1), ('failed', 1)])
+    # bob was refused, so it is not taken as created by the next run.
+    report = provisioner.run(specs)
+    self.assertEqual([r.status for r in report.results],
+                     ['skipped', 'failed'])
+    journal = gdata.apps.client.ProvisioningJournal(self.journal_path)
+    self.assertFalse(journal.was_sent('create', 'bob'))
+
+  def test_unexpected_errors_fail_one_user(self):
+    self.client.CreateUser('liz', 'Smith', 'Liz', 'secret')
+    self.client.CreateUser('bob', 'Jones', 'Bob', 'secret')
+    retrieve_user = self.client.RetrieveUser
+
+    def broken_retrieve_user(user_name, **kwargs):
+      if user_name == 'liz':
+        raise ValueError('Unreadable entry')
+      return retrieve_user(user_name, **kwargs)
+
+    self.client.RetrieveUser = broken_retrieve_user
+    provisioner = gdata.apps.client.UserProvisioner(
+        self.client, max_concurrent=2, journal_path=self.journal_path)
+    report = provisioner.run([
+        {'action': 'update', 'user_name': 'liz', 'suspended': True},
+        {'action': 'update', 'user_name': 'bob', 'suspended': True}])
+    self.assertEqual([(r.status, r.attempts, r.reason)
+                      for r in report.results],
+                     [('failed', 1, 'Unreadable entry'),
+                      ('updated', 1, None)])
+    self.assertEqual(self.server.get_user('bob').login.suspended, 'true')
+
+  def test_journal_restart(self):
+    specs = [{'action': 'delete', 'user_name': name}
+             for name in ('liz', 'bob', 'ann')]
+    for name in ('liz', 'ann'):
+      self.client.CreateUser(name, 'Smith', 'Test', 'secret')
+    provisioner = gdata.apps.client.UserProvisioner(
+        self.client, journal_path=self.journal_path)
+    report = provisioner.run(specs)
+    self.assertEqual([r.status for r in report.results],
+                     ['deleted', 'failed', 'deleted'])
+    self.client.CreateUser('bob', 'Smith', 'Test', 'secret')
+    # A line cut short by a crash is ignored.
+    journal_file = open(self.journal_path, 'ab')
+    journal_file.write('delete\tbo')
+    journal_file.close()
+    self.server.requests = []
+    report = provisioner.run(specs)
+    self.assertEqual([r.status for r in report.results],
+                     ['skipped', 'deleted', 'skipped'])
+    self.assertEqual([(http_request.method, http_request.uri.path)
+                      for http_request in self.server.requests],
+                     [('DELETE', '/a/feeds/example.com/user/2.0/bob')])
+
+  def test_multidomain(self):
+    client = gdata.apps.multidomain.client.MultiDomainProvisioningClient(
+        'example.com', http_client=self.server)
+    provisioner = gdata.apps.client.UserProvisioner(client)
+    report = provisioner.run([
+        {'email': 'liz@example.org', 'first_name': 'Liz',
+         'last_name': 'Smith', 'password': 'secret', 'quota': '25'}])
+    self.assertEqual(report.results[0].status, 'created')
+    report = provisioner.run([
+        {'action': 'update', 'email': 'liz@example.org', 'is_admin': 'true',
+         'quota': '50'}])
+    self.assertEqual(report.results[0].status, 'updated')
+    liz = self.server.get_user('liz@example.org',
+                               gdata.apps.multidomain.data.UserEntry)
+    self.assertEqual(liz.first_name, 'Liz')
+    self.assertEqual(liz.is_admin, 'true')
+    self.assertEqual(liz.quota, '50')
+
+
+def suite():
+  return unittest.TestSuite((unittest.makeSuite(UserProvisionerTest, 'test'),))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,254 @@
+#!/usr/bin/python
+#
+# Copyright (C) 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests for the Email Migration service which do not need a server."""
+
+
+import base64
+import mailbox
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import StringIO
+import atom.http_core
+import atom.mock_http_core
+import gdata
+import gdata.apps.migration
+import gdata.apps.migration.service
+
+
+MESSAGE = """From: joe@blow.com
+To: jane@doe.com
+Date: Mon, 29 Sep 2008 20:00:34 -0500 (CDT)
+Subject: %s
+
+%s"""
+
+
+class MigrationServer(atom.mock_http_core.FakeHttpServer):
+  """Answers Email Migration requests.
+
+  Messages containing REJECT are refused and a batch containing FAIL_BATCH
+  fails as a whole.
+  """
+
+  latency = 0.01
+
+  def __init__(self):
+    atom.mock_http_core.FakeHttpServer.__init__(self)
+    self.batches = []
+    self.messages = []
+
+  def respond(self, http_request, body):
+    assert len(body) == int(http_request.headers['Content-Length'])
+    if not http_request.uri.path.endswith('/batch'):
+      entry = gdata.apps.migration.MailEntryFromString(body)
+      message = entry.rfc822_msg.text.decode('base64')
+      self.messages.append(message)
+      if 'REJECT' in message:
+        return atom.http_core.HttpResponse(400, 'Bad', body='')
+      return atom.http_core.HttpResponse(201, 'Created', body=str(entry))
+    feed = gdata.apps.migration.BatchMailEventFeedFromString(body)
+    self.batches.append((http_request.uri.path, feed))
+    messages = [entry.rfc822_msg.text.decode('base64') for entry in feed.entry]
+    if [message for message in messages if 'FAIL_BATCH' in message]:
+      return atom.http_core.HttpResponse(503, 'Busy', body='')
+    result = gdata.apps.migration.BatchMailEventFeed()
+    for entry, message in zip(feed.entry, messages):
+      if 'REJECT' in message:
+        status = gdata.BatchStatus(code='400', reason='Bad message')
+      else:
+        status = gdata.BatchStatus(code='201', reason='Created')
+      result.entry.append(gdata.apps.migration.BatchMailEntry(
+          batch_id=entry.batch_id, batch_status=status))
+    return atom.http_core.HttpResponse(200, 'OK', body=str(result))
+
+
+class MigrationEngineTest(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+    self.server = MigrationServer()
+    self.service = gdata.apps.migration.service.MigrationService(
+        domain='example.com', http_client=self.server)
+
+  def tearDown(self):
+    shutil.rmtree(self.temp_dir)
+
+  def testMigrateInBatches(self):
+    service = self.service
+    messages = [MESSAGE % ('Message %i' % i, 'x' * 100) for i in xrange(250)]
+    messages[7] = MESSAGE % ('REJECT', 'body')
+    report = service.MigrateMessages('liz', iter(messages), max_concurrent=3)
+    self.assertEqual(len(self.server.batches), 3)
+    self.assertEqual(sorted([len(feed.entry)
+                             for uri, feed in self.server.batches]),
+                     [50, 100, 100])
+    self.assertEqual(self.server.batches[0][0],
+                     '/a/feeds/migration/2.0/example.com/liz/mail/batch')
+    self.assert_(self.server.max_active <= 3)
+    self.assertEqual(report.batches, 3)
+    self.assertEqual(report.imported, 249)
+    self.assertEqual([result.identifier for result in report.results],
+                     range(250))
+    failures = report.GetFailures()
+    self.assertEqual(len(failures), 1)
+    self.assertEqual((failures[0].identifier, failures[0].code,
+                      failures[0].reason), (7, 400, 'Bad message'))
+
+  def testBatchSizeLimit(self):
+    service = self.service
+    engine = gdata.apps.migration.service.MigrationEngine(
+        service, 'liz', max_batch_bytes=7000)
+    messages = [gdata.apps.migration.MailEntryProperties(
+        mail_message='y' * 1500, mail_labels=['Old'], identifier='m%i' % i)
+        for i in xrange(5)]
+    messages.append('z' * 10000)
+    report = engine.Migrate(messages)
+    self.assertEqual(sorted([len(feed.entry)
+                             for uri, feed in self.server.batches]),
+                     [1, 1, 2, 2])
+    self.assertEqual(report.results[0].identifier, 'm0')
+    self.assertEqual(report.results[-1].identifier, 5)
+    self.assertEqual(report.imported, 6)
+    labels = [label.label_name for uri, feed in self.server.batches
+              for entry in feed.entry for label in entry.label]
+    self.assertEqual(labels, ['Old'] * 5)
+
+  def testFailedBatchAndCallback(self):
+    service = self.service
+    seen = []
+    engine = gdata.apps.migration.service.MigrationEngine(
+        service, 'liz', max_batch_entries=2, callback=seen.extend)
+    report = engine.Migrate(['a', 'FAIL_BATCH', 'b', 'c'])
+    self.assertEqual([result.code for result in report.results],
+                     [503, 503, 201, 201])
+    self.assertEqual(report.results[0].reason, 'Busy')
+    self.assertEqual(sorted([result.identifier for result in seen]),
+                     [0, 1, 2, 3])
+
+  def testRateLimit(self):
+    service = self.service
+    engine = gdata.apps.migration.service.MigrationEngine(
+        service, 'liz', max_batch_entries=1, batches_per_second=50)
+    start = time.time()
+    report = engine.Migrate(['a', 'b', 'c', 'd', 'e', 'f'])
+    self.assert_(time.time() - start >= 0.1)
+    self.assertEqual(report.imported, 6)
+
+  def testMailboxMessages(self):
+    path = os.path.join(self.temp_dir, 'mbox')
+    mbox = mailbox.mbox(path)
+    mbox.add(MESSAGE % ('First', 'Hello'))
+    mbox.add(MESSAGE % ('Second', 'World'))
+    mbox.close()
+    messages = list(gdata.apps.migration.service.MboxMessages(
+        path, mail_labels=['Imported']))
+    self.assertEqual(len(messages), 2)
+    self.assert_('Subject: Second' in messages[1].mail_message)
+    self.assertEqual(messages[0].mail_labels, ['Imported'])
+    self.assertEqual(messages[0].identifier, 0)
+    maildir_path = os.path.join(self.temp_dir, 'maildir')
+    maildir = mailbox.Maildir(maildir_path)
+    key = maildir.add(MESSAGE % ('Third', 'Maildir'))
+    messages = list(gdata.apps.migration.service.MaildirMessages(
+        maildir_path, mail_item_properties=['IS_UNREAD']))
+    self.assertEqual(messages[0].identifier, key)
+    self.assertEqual(messages[0].mail_item_properties, ['IS_UNREAD'])
+    self.assert_('Subject: Third' in messages[0].mail_message)
+
+  def testImportMultipleMails(self):
+    service = self.service
+    for i in xrange(9):
+      service.AddMailEntry(MESSAGE % ('Message %i' % i, 'body'))
+    for i in xrange(5):
+      service.AddMailEntry(MESSAGE % ('REJECT', 'body'))
+    start = time.time()
+    self.assertEqual(service.ImportMultipleMails('liz', threads_per_batch=4),
+                     9)
+    self.assert_(time.time() - start < 1)
+    self.assertEqual(len(self.server.messages), 14)
+    self.assertEqual(service.mail_entries, [])
+    self.assertEqual(service.exceptions, 5)
+    # Failures from an earlier call do not reduce the count.
+    service.AddMailEntry(MESSAGE % ('Message', 'body'))
+    self.assertEqual(service.ImportMultipleMails('liz'), 1)
+
+
+class StreamingTest(unittest.TestCase):
+
+  def testBase64Stream(self):
+    message = ''.join([chr(i % 256) for i in xrange(250000)])
+    stream = gdata.apps.migration.service.Base64Stream(message)
+    self.assertEqual(len(stream), len(base64.b64encode(message)))
+    parts = []
+    for size in (1, 7, 100000, 5):
+      parts.append(stream.read(size))
+    self.assertEqual([len(part) for part in parts], [1, 7, 100000, 5])
+    parts.append(stream.read())
+    self.assertEqual(stream.read(10), '')
+    self.assertEqual(''.join(parts), base64.b64encode(message))
+
+  def testBase64StreamFromFile(self):
+    for size in (0, 1, 2, 3, 98305):
+      message = 'm' * size
+      message_file = StringIO.StringIO('skip' + message)
+      message_file.read(4)
+      stream = gdata.apps.migration.service.Base64Stream(message_file)
+      self.assertEqual(len(stream),
+                       gdata.apps.migration.service.EncodedLength(size))
+      self.assertEqual(''.join(iter(lambda: stream.read(1000), '')),
+                       base64.b64encode(message))
+
+  def testImportMailStreamsMessage(self):
+    server = MigrationServer()
+    service = gdata.apps.migration.service.MigrationService(
+        domain='example.com', http_client=server)
+    message = MESSAGE % ('Streamed', 'z' * 200001)
+    entry = service.ImportMail('liz', StringIO.StringIO(message),
+                               ['IS_STARRED'], ['Work'])
+    self.assert_(isinstance(entry, gdata.apps.migration.MailEntry))
+    http_request = server.requests[0]
+    self.assertEqual(http_request.method, 'POST')
+    self.assertEqual(str(http_request.uri),
+                     'https://apps-apis.google.com/a/feeds/migration/'
+                     '2.0/example.com/liz/mail')
+    body = atom.mock_http_core.read_body(http_request)
+    sent = gdata.apps.migration.MailEntryFromString(body)
+    self.assertEqual(sent.rfc822_msg.encoding, 'base64')
+    self.assertEqual(sent.rfc822_msg.text.decode('base64'), message)
+    self.assertEqual(sent.label[0].label_name, 'Work')
+    self.assertEqual(sent.mail_item_property[0].value, 'IS_STARRED')
+
+  def testAddBatchEntryLength(self):
+    service = gdata.apps.migration.service.MigrationService()
+    length = service.AddBatchEntry(MESSAGE % ('Batch', 'body'), [], ['Old'])
+    entry = service.mail_batch.entry[0]
+    entry.batch_id = None
+    self.assertEqual(length, len(str(entry)))
+
+
+def suite():
+  return unittest.TestSuite((
+      unittest.makeSuite(MigrationEngineTest, 'test'),
+      unittest.makeSuite(StreamingTest, 'test')))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests for the directory snapshot which do not need a server."""
+
+
+import os
+import shutil
+import tempfile
+import unittest
+import atom.data
+import atom.http_core
+import atom.mock_http_core
+import gdata.apps.client
+import gdata.apps.data
+import gdata.apps.groups.client
+import gdata.apps.groups.data
+import gdata.apps.organization.client
+import gdata.apps.organization.data
+import gdata.apps.snapshot
+import gdata.client
+
+
+PAGE_SIZE = 2
+
+
+class DirectoryServer(atom.mock_http_core.FakeHttpServer):
+  """Serves paged user, group, member and org user feeds from memory."""
+
+  def __init__(self):
+    atom.mock_http_core.FakeHttpServer.__init__(self)
+    self.users = []
+    self.groups = []
+    # Maps group IDs to lists of (member_id, member_type) tuples.
+    self.members = {}
+    # Lists (email, org_unit_path) tuples.
+    self.org_users = []
+
+  def respond(self, http_request, body):
+    path = http_request.uri.path
+    parts = path.split('/')
+    if parts[3] == 'group':
+      if parts[-1] == 'member':
+        feed = gdata.apps.groups.data.GroupMemberFeed(entry=[
+            gdata.apps.groups.data.GroupMemberEntry(
+                member_id=member_id, member_type=member_type)
+            for member_id, member_type in self.members.get(parts[-2], [])])
+      else:
+        feed = gdata.apps.groups.data.GroupFeed(entry=[
+            gdata.apps.groups.data.GroupEntry(group_id=group_id,
+                                              group_name=name)
+            for group_id, name in self.groups])
+    elif parts[3] == 'orguser':
+      feed = gdata.apps.organization.data.OrgUserFeed(entry=[
+          gdata.apps.organization.data.OrgUserEntry(
+              user_email=email, org_unit_path=org_unit_path)
+          for email, org_unit_path in self.org_users])
+    else:
+      feed = gdata.apps.data.UserFeed(entry=[
+          gdata.apps.data.UserEntry(
+              login=gdata.apps.data.Login(user_name=user_name,
+                                          admin=admin),
+              name=gdata.apps.data.Name(given_name=given_name,
+                                        family_name=family_name))
+          for user_name, given_name, family_name, admin in self.users])
+    start = int(http_request.uri.query.get('start', '0'))
+    if start + PAGE_SIZE < len(feed.entry):
+      query = dict(http_request.uri.query)
+      query['start'] = str(start + PAGE_SIZE)
+      next_uri = atom.http_core.Uri(scheme='https',
+                                    host='apps-apis.google.com', path=path,
+                                    query=query)
+      feed.link.append(atom.data.Link(rel='next', href=str(next_uri)))
+    feed.entry = feed.entry[start:start + PAGE_SIZE]
+    return atom.http_core.HttpResponse(200, 'OK', body=str(feed))
+
+
+class DirectorySnapshotTest(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+    self.server = DirectoryServer()
+    self.server.users = [('liz', 'Liz', 'Smith', 'true'),
+                         ('bob', 'Bob', 'Jones', 'false'),
+                         ('Ann', 'Ann', 'Lee', 'false')]
+    self.server.groups = [('sales@example.com', 'Sales'),
+                          ('all@example.com', 'Everyone'),
+                          ('eng@example.com', 'Engineering')]
+    self.server.members = {
+        'sales@example.com': [('liz@example.com', 'User'),
+                              ('partner@example.org', 'User')],
+        'eng@example.com': [('bob@example.com', 'User'),
+                            ('ann@example.com', 'User'),
+                            ('all@example.com', 'Group')],
+        'all@example.com': [('sales@example.com', 'Group'),
+                            ('eng@example.com', 'Group')]}
+    self.server.org_users = [('liz@example.com', 'Sales'),
+                             ('bob@example.com', 'Engineering/Tools'),
+                             ('ann@example.com', 'Engineering'),
+                             ('guest@example.com', '/')]
+    self.crawler = gdata.apps.snapshot.DirectoryCrawler(
+        apps_client=gdata.apps.client.AppsClient(
+            'example.com', http_client=self.server),
+        groups_client=gdata.apps.groups.client.GroupsProvisioningClient(
+            'example.com', http_client=self.server),
+        org_client=(
+            gdata.apps.organization.client.OrganizationUnitProvisioningClient(
+                'example.com', http_client=self.server)),
+        customer_id='C123', max_concurrent=3)
+
+  def tearDown(self):
+    shutil.rmtree(self.temp_dir)
+
+  def check_snapshot(self, snapshot):
+    self.assertEqual(sorted(snapshot.users),
+                     ['ann@example.com', 'bob@example.com',
+                      'guest@example.com', 'liz@example.com'])
+    liz = snapshot.get_user('Liz@Example.com')
+    self.assertEqual((liz.given_name, liz.family_name, liz.admin,
+                      liz.org_unit_path),
+                     ('Liz', 'Smith', 'true', 'Sales'))
+    self.assertEqual(snapshot.get_members('sales@example.com'),
+                     [('liz@example.com', 'User'),
+                      ('partner@example.org', 'User')])
+    self.assertEqual(snapshot.expand_group('ALL@example.com'),
+                     ['ann@example.com', 'bob@example.com',
+                      'liz@example.com', 'partner@example.org'])
+    self.assertEqual(snapshot.get_groups('liz@example.com', direct_only=True),
+                     ['sales@example.com'])
+    self.assertEqual(snapshot.get_groups('liz@example.com'),
+                     ['all@example.com', 'eng@example.com',
+                      'sales@example.com'])
+    self.assertEqual(snapshot.get_org_unit_users('/Engineering'),
+                     ['ann@example.com'])
+    self.assertEqual(snapshot.get_org_unit_users('Engineering',
+                                                 include_sub_units=True),
+                     ['ann@example.com', 'bob@example.com'])
+    self.assertEqual(snapshot.get_org_unit_users('/'),
+                     ['guest@example.com'])
+    self.assertEqual(len(snapshot.get_org_unit_users('/', True)), 4)
+
+  def test_crawl_save_and_load(self):
+    snapshot = self.crawler.crawl()
+    self.check_snapshot(snapshot)
+    self.assertEqual(snapshot.groups['all@example.com'].name, 'Everyone')
+    # Two pages of users, groups and org users, and of the members of
+    # eng@example.com, and one page of members for the other groups.
+    self.assertEqual(len(self.server.requests), 10)
+    path = os.path.join(self.temp_dir, 'directory.json')
+    snapshot.save(path)
+    snapshot.save(path)
+    loaded = gdata.apps.snapshot.DirectorySnapshot.load(path)
+    self.check_snapshot(loaded)
+    self.assertEqual(loaded.created, snapshot.created)
+    self.assertEqual(os.listdir(self.temp_dir), ['directory.json'])
+
+  def test_update_indexes(self):
+    snapshot = self.crawler.Crawl()
+    snapshot.set_org_unit('ann@example.com', 'Sales')
+    self.assertEqual(snapshot.get_org_unit_users('Engineering'), [])
+    self.assertEqual(snapshot.get_org_unit_users('Sales'),
+                     ['ann@example.com', 'liz@example.com'])
+    snapshot.add_user(gdata.apps.snapshot.DirectoryUser('ann@example.com',
+                                                        given_name='Anne'))
+    self.assertEqual(snapshot.get_user('ann@example.com').org_unit_path,
+                     'Sales')
+    snapshot.set_members('eng@example.com', [('liz@example.com', 'User')])
+    self.assertEqual(snapshot.get_groups('bob@example.com'), [])
+    self.assertEqual(snapshot.get_groups('all@example.com'), [])
+    self.assertEqual(snapshot.get_groups('liz@example.com'),
+                     ['all@example.com', 'eng@example.com',
+                      'sales@example.com'])
+    snapshot.add_group(gdata.apps.snapshot.DirectoryGroup(
+        'sales@example.com', name='Sales team'))
+    self.assertEqual(len(snapshot.get_members('sales@example.com')), 2)
+
+  def test_failed_feed(self):
+    self.server.fail_requests(
+        500, 'Server Error',
+        path='/a/feeds/group/2.0/example.com/eng@example.com/member')
+    try:
+      self.crawler.crawl()
+      self.fail('The failed member feed should raise an error.')
+    except gdata.client.RequestError, error:
+      self.assertEqual(error.status, 500)
+
+
+def suite():
+  return unittest.TestSuite((
+      unittest.makeSuite(DirectorySnapshotTest, 'test'),))
+
+
+if __name__ == '__main__':
+  unittest.main()
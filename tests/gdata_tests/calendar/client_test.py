@@ -0,0 +1,125 @@
+#!/usr/bin/python
+#
+# Copyright (C) 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests for the Calendar client which do not need a server."""
+
+
+import time
+import unittest
+import atom.data
+import atom.http_core
+import atom.mock_http_core
+import gdata.calendar.client
+import gdata.calendar.data
+import gdata.client
+import gdata.test_config as conf
+
+
+class EventFeedServer(atom.mock_http_core.FakeHttpServer):
+  """Serves paged event feeds of calendars whose events start every hour.
+
+  Calendar number n has an event at each hour h for which h % (n + 2) == 0.
+  """
+
+  def __init__(self, calendar_count, event_count, latency=0.0):
+    atom.mock_http_core.FakeHttpServer.__init__(self)
+    self.calendars = {}
+    for n in xrange(calendar_count):
+      self.calendars['/calendar/feeds/room%i/private/full' % n] = [
+          hour for hour in xrange(event_count) if hour % (n + 2) == 0]
+    self.latency = latency
+
+  def respond(self, http_request, body):
+    path = http_request.uri.path
+    query = http_request.uri.query
+    assert query['singleevents'] == 'true'
+    assert query['orderby'] == 'starttime'
+    assert query['sortorder'] == 'ascending'
+    hours = self.calendars[path]
+    start = int(query.get('start-index', '1'))
+    page_size = int(query.get('max-results', '25'))
+    feed = gdata.calendar.data.CalendarEventFeed()
+    for hour in hours[start - 1:start - 1 + page_size]:
+      feed.entry.append(gdata.calendar.data.CalendarEventEntry(
+          title=atom.data.Title(text='%s %i' % (path, hour)),
+          when=[gdata.calendar.data.When(
+              start='2011-05-%02dT%02d:00:00.000Z' % (hour // 24 + 1,
+                                                       hour % 24))]))
+    if start - 1 + page_size < len(hours):
+      next_query = dict(query)
+      next_query['start-index'] = str(start + page_size)
+      feed.link.append(atom.data.Link(rel='next', href=str(
+          atom.http_core.Uri(scheme='https', host='www.google.com', path=path,
+                             query=next_query))))
+    return atom.http_core.HttpResponse(200, 'OK', body=str(feed))
+
+
+class MergedEventsTest(unittest.TestCase):
+
+  def setUp(self):
+    self.server = EventFeedServer(12, 200, latency=0.01)
+    self.client = gdata.calendar.client.CalendarClient(
+        http_client=self.server)
+    self.uris = ['https://www.google.com%s' % path
+                 for path in sorted(self.server.calendars.keys())]
+
+  def test_merged_events(self):
+    query = gdata.calendar.client.CalendarEventQuery(
+        max_results=10, start_min='2011-05-01T00:00:00Z')
+    merged = list(self.client.get_merged_events(self.uris, query,
+                                                max_concurrent=4))
+    expected = []
+    for uri in self.uris:
+      path = uri[len('https://www.google.com'):]
+      expected.extend([(hour, self.uris.index(uri), uri, path)
+                       for hour in self.server.calendars[path]])
+    expected.sort()
+    self.assertEqual([(uri, entry.title.text) for uri, entry in merged],
+                     [(uri, '%s %i' % (path, hour))
+                      for hour, position, uri, path in expected])
+    self.assert_(1 < self.server.max_active <= 4)
+    self.assertEqual(self.server.requests[0].uri.query['start-min'],
+                     '2011-05-01T00:00:00Z')
+    # The given query is not changed.
+    self.assertEqual(query.singleevents, None)
+
+  def test_bounded_pages(self):
+    query = gdata.calendar.client.CalendarEventQuery(max_results=5)
+    events = self.client.get_merged_events(self.uris, query)
+    for i in xrange(3):
+      events.next()
+    # Each calendar has at most its first two pages requested.
+    self.assert_(len(self.server.requests) <= 2 * len(self.uris))
+    events.close()
+    requests = len(self.server.requests)
+    time.sleep(0.05)
+    self.assertEqual(len(self.server.requests), requests)
+
+  def test_error(self):
+    self.server.fail_requests(500, 'Internal Server Error',
+                              path='/calendar/feeds/room3/private/full')
+    events = self.client.get_merged_events(self.uris)
+    self.assertRaises(gdata.client.RequestError, list, events)
+    self.assertEqual(list(self.client.get_merged_events([])), [])
+
+
+def suite():
+  return conf.build_suite([MergedEventsTest])
+
+
+if __name__ == '__main__':
+  unittest.main()
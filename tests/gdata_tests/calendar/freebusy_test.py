@@ -0,0 +1,134 @@
+#!/usr/bin/python
+#
+# Copyright (C) 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import datetime
+import unittest
+import gdata.calendar.data
+import gdata.calendar.freebusy
+import gdata.data
+import gdata.test_config as conf
+from gdata_tests.calendar.recurrence_test import event
+
+
+def dt(*args):
+  return datetime.datetime(*args)
+
+
+def hour(day, hour):
+  return '2011-05-%02dT%02d:00:00.000Z' % (day, hour)
+
+
+class FreeBusyIndexTest(unittest.TestCase):
+
+  def setUp(self):
+    self.index = gdata.calendar.freebusy.FreeBusyIndex(dt(2011, 5, 1),
+                                                       dt(2011, 6, 1))
+    self.index.update('room1', [
+        event('a', when=(hour(2, 9), hour(2, 10))),
+        event('b', when=(hour(2, 9), hour(2, 11))),
+        event('standup', 'DTSTART:20110502T150000Z\nDURATION:PT30M\n'
+              'RRULE:FREQ=DAILY;BYDAY=MO,TU,WE,TH,FR')])
+    feed = gdata.calendar.data.CalendarEventFeed(entry=[
+        event('c', when=(hour(2, 12), hour(2, 13))),
+        event('offsite', when=('2011-05-01', '2011-05-04'))])
+    self.index.update('room2', feed)
+    self.index.update('room3', [
+        event('lunch', when=(hour(2, 12), hour(2, 13)))])
+    transparent = event('reminder', when=(hour(2, 9), hour(2, 17)))
+    transparent.transparency = gdata.data.Transparency(
+        value=gdata.data.TRANSPARENT_TRANSPARENCY)
+    self.index.update('room4', [transparent])
+
+  def test_busy_and_free(self):
+    self.assertEqual(self.index.get_busy(['room1'], dt(2011, 5, 2, 8),
+                                         dt(2011, 5, 2, 18)),
+                     [(dt(2011, 5, 2, 9), dt(2011, 5, 2, 11)),
+                      (dt(2011, 5, 2, 15), dt(2011, 5, 2, 15, 30))])
+    self.assertEqual(
+        self.index.get_free_slots(['room1', 'room3', 'room4'],
+                                  dt(2011, 5, 2, 8), dt(2011, 5, 2, 18)),
+        [(dt(2011, 5, 2, 8), dt(2011, 5, 2, 9)),
+         (dt(2011, 5, 2, 11), dt(2011, 5, 2, 12)),
+         (dt(2011, 5, 2, 13), dt(2011, 5, 2, 15)),
+         (dt(2011, 5, 2, 15, 30), dt(2011, 5, 2, 18))])
+    self.assertEqual(
+        self.index.get_free_slots(['room1', 'room3'], dt(2011, 5, 2, 8),
+                                  dt(2011, 5, 2, 18),
+                                  min_duration=datetime.timedelta(hours=2)),
+        [(dt(2011, 5, 2, 13), dt(2011, 5, 2, 15)),
+         (dt(2011, 5, 2, 15, 30), dt(2011, 5, 2, 18))])
+    self.assertEqual(self.index.get_free_slots(['room2'], dt(2011, 5, 2),
+                                               dt(2011, 5, 3)), [])
+    self.assertEqual(
+        self.index.find_free_calendars(['room1', 'room2', 'room3', 'room4',
+                                        'unknown'],
+                                       dt(2011, 5, 2, 12), dt(2011, 5, 2, 13)),
+        ['room1', 'room4'])
+    # The daily stand up does not happen on weekends.
+    self.assertEqual(
+        self.index.find_free_calendars(['room1'], dt(2011, 5, 7, 15),
+                                       dt(2011, 5, 7, 16)), ['room1'])
+
+  def test_delta_updates(self):
+    self.index.update('room1', [
+        event('a', status=gdata.data.CANCELED_EVENT_STATUS),
+        event('b', when=(hour(2, 10), hour(2, 11))),
+        event('standup_1', status=gdata.data.CANCELED_EVENT_STATUS,
+              original=('standup', '2011-05-03T15:00:00.000Z')),
+        event('standup_2', when=(hour(4, 16), hour(4, 17)),
+              original=('standup', '2011-05-04T15:00:00.000Z'))])
+    self.assertEqual(self.index.get_busy(['room1'], dt(2011, 5, 2),
+                                         dt(2011, 5, 5)),
+                     [(dt(2011, 5, 2, 10), dt(2011, 5, 2, 11)),
+                      (dt(2011, 5, 2, 15), dt(2011, 5, 2, 15, 30)),
+                      (dt(2011, 5, 4, 16), dt(2011, 5, 4, 17))])
+    self.index.update('room1', [
+        event('standup', status=gdata.data.CANCELED_EVENT_STATUS)])
+    self.assertEqual(self.index.get_busy(['room1'], dt(2011, 5, 2),
+                                         dt(2011, 5, 31)),
+                     [(dt(2011, 5, 2, 10), dt(2011, 5, 2, 11))])
+    self.index.update('room2', [
+        event('offsite', status=gdata.data.CANCELED_EVENT_STATUS)])
+    self.assertEqual(self.index.get_busy(['room2'], dt(2011, 5, 1),
+                                         dt(2011, 5, 31)),
+                     [(dt(2011, 5, 2, 12), dt(2011, 5, 2, 13))])
+    self.index.remove_calendar('room2')
+    self.assertEqual(self.index.find_free_calendars(['room2'], dt(2011, 5, 1),
+                                                    dt(2011, 5, 2)), [])
+
+  def test_long_intervals(self):
+    intervals = gdata.calendar.freebusy._Intervals()
+    for day in xrange(1, 29):
+      intervals.add(dt(2011, 2, day, 9), dt(2011, 2, day, 10), 'daily')
+    intervals.add(dt(2011, 1, 1), dt(2011, 12, 31), 'year')
+    self.assertEqual(len(intervals), 29)
+    self.assertEqual(intervals.overlapping(dt(2011, 2, 10, 9, 30),
+                                           dt(2011, 2, 10, 11)),
+                     [(dt(2011, 2, 10, 9), dt(2011, 2, 10, 10)),
+                      (dt(2011, 1, 1), dt(2011, 12, 31))])
+    intervals.remove(dt(2011, 1, 1), dt(2011, 12, 31), 'year')
+    intervals.remove(dt(2011, 2, 10, 9), dt(2011, 2, 10, 10), 'daily')
+    self.assertEqual(intervals.overlapping(dt(2011, 2, 10),
+                                           dt(2011, 2, 11)), [])
+
+
+def suite():
+  return conf.build_suite([FreeBusyIndexTest])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,337 @@
+#!/usr/bin/python
+#
+# Copyright (C) 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import datetime
+import unittest
+import atom.core
+import atom.data
+import gdata.calendar.data
+import gdata.calendar.recurrence
+import gdata.data
+import gdata.test_config as conf
+
+
+LOS_ANGELES = """BEGIN:VTIMEZONE
+TZID:America/Los_Angeles
+X-LIC-LOCATION:America/Los_Angeles
+BEGIN:DAYLIGHT
+TZOFFSETFROM:-0800
+TZOFFSETTO:-0700
+TZNAME:PDT
+DTSTART:19700308T020000
+RRULE:FREQ=YEARLY;BYMONTH=3;BYDAY=2SU
+END:DAYLIGHT
+BEGIN:STANDARD
+TZOFFSETFROM:-0700
+TZOFFSETTO:-0800
+TZNAME:PST
+DTSTART:19701101T020000
+RRULE:FREQ=YEARLY;BYMONTH=11;BYDAY=1SU
+END:STANDARD
+END:VTIMEZONE
+"""
+
+WEEKLY = """DTSTART;TZID=America/Los_Angeles:20110301T090000
+DTEND;TZID=America/Los_Angeles:20110301T100000
+RRULE:FREQ=WEEKLY;BYDAY=TU,TH;UNTIL=20110331T170000Z
+""" + LOS_ANGELES
+
+EVENT_URL = 'https://www.google.com/calendar/feeds/default/private/full/%s'
+
+
+def dt(*args):
+  return datetime.datetime(*args)
+
+
+def starts(recurrence_text, count=None, start=None, end=None):
+  recurrence_set = gdata.calendar.recurrence.RecurrenceSet(recurrence_text)
+  found = []
+  for occurrence_start, occurrence_end in recurrence_set.iter_occurrences():
+    if end is not None and occurrence_start >= end:
+      break
+    if start is None or occurrence_start >= start:
+      found.append(occurrence_start)
+    if count is not None and len(found) >= count:
+      break
+  return found
+
+
+def event(event_id, recurrence=None, when=None, etag=None, status=None,
+          original=None):
+  entry = gdata.calendar.data.CalendarEventEntry(
+      id=atom.data.Id(text=EVENT_URL % event_id), etag=etag)
+  if recurrence is not None:
+    entry.recurrence = gdata.data.Recurrence(text=recurrence)
+  if when is not None:
+    entry.when.append(gdata.calendar.data.When(start=when[0], end=when[1]))
+  if status is not None:
+    entry.event_status = gdata.data.EventStatus(value=status)
+  if original is not None:
+    entry.original_event = gdata.data.OriginalEvent(
+        id=original[0], href=EVENT_URL % original[0],
+        when=gdata.data.When(start=original[1]))
+  return entry
+
+
+class RecurrenceSetTest(unittest.TestCase):
+
+  def test_weekly_with_time_zone(self):
+    recurrence_set = gdata.calendar.recurrence.RecurrenceSet(WEEKLY)
+    occurrences = list(recurrence_set.iter_occurrences())
+    # Daylight saving time starts on March 13th 2011.
+    self.assertEqual(occurrences[:5], [
+        (dt(2011, 3, 1, 17), dt(2011, 3, 1, 18)),
+        (dt(2011, 3, 3, 17), dt(2011, 3, 3, 18)),
+        (dt(2011, 3, 8, 17), dt(2011, 3, 8, 18)),
+        (dt(2011, 3, 10, 17), dt(2011, 3, 10, 18)),
+        (dt(2011, 3, 15, 16), dt(2011, 3, 15, 17))])
+    self.assertEqual(len(occurrences), 10)
+    self.assertEqual(occurrences[-1][0], dt(2011, 3, 31, 16))
+    self.assertEqual(recurrence_set.tzid, 'America/Los_Angeles')
+
+  def test_zones_without_daylight_saving_time(self):
+    fixed = """DTSTART;TZID=Europe/Moscow:20110502T090000
+DTEND;TZID=Europe/Moscow:20110502T100000
+RRULE:FREQ=DAILY;COUNT=2
+BEGIN:VTIMEZONE
+TZID:Europe/Moscow
+BEGIN:STANDARD
+TZOFFSETFROM:+0400
+TZOFFSETTO:+0300
+DTSTART:19700101T000000
+END:STANDARD
+END:VTIMEZONE
+"""
+    self.assertEqual(starts(fixed), [dt(2011, 5, 2, 6), dt(2011, 5, 3, 6)])
+    # Daylight saving time which ended in 1999 is still in standard time.
+    ended = """DTSTART;TZID=Asia/Example:20110702T090000
+DTEND;TZID=Asia/Example:20110702T100000
+BEGIN:VTIMEZONE
+TZID:Asia/Example
+BEGIN:DAYLIGHT
+TZOFFSETFROM:+0500
+TZOFFSETTO:+0600
+DTSTART:19900325T020000
+RRULE:FREQ=YEARLY;BYMONTH=3;BYDAY=-1SU;UNTIL=19990328T020000
+END:DAYLIGHT
+BEGIN:STANDARD
+TZOFFSETFROM:+0600
+TZOFFSETTO:+0500
+DTSTART:19901028T030000
+RRULE:FREQ=YEARLY;BYMONTH=10;BYDAY=-1SU;UNTIL=19991031T030000
+END:STANDARD
+END:VTIMEZONE
+"""
+    self.assertEqual(starts(ended), [dt(2011, 7, 2, 4)])
+
+  def test_monthly_and_yearly_rules(self):
+    # The last Friday of each month.
+    self.assertEqual(
+        starts('DTSTART:20110128T120000Z\nRRULE:FREQ=MONTHLY;BYDAY=-1FR',
+               count=3),
+        [dt(2011, 1, 28, 12), dt(2011, 2, 25, 12), dt(2011, 3, 25, 12)])
+    # The 31st, skipping shorter months.
+    self.assertEqual(
+        starts('DTSTART:20110131T120000Z\nRRULE:FREQ=MONTHLY;COUNT=3'),
+        [dt(2011, 1, 31, 12), dt(2011, 3, 31, 12), dt(2011, 5, 31, 12)])
+    # The last working day of each month.
+    self.assertEqual(
+        starts('DTSTART:20110429T080000Z\nRRULE:FREQ=MONTHLY;'
+               'BYDAY=MO,TU,WE,TH,FR;BYSETPOS=-1', count=3),
+        [dt(2011, 4, 29, 8), dt(2011, 5, 31, 8), dt(2011, 6, 30, 8)])
+    # US Thanksgiving, every other year.
+    self.assertEqual(
+        starts('DTSTART:20111124T000000Z\nRRULE:FREQ=YEARLY;INTERVAL=2;'
+               'BYMONTH=11;BYDAY=4TH', count=3),
+        [dt(2011, 11, 24), dt(2013, 11, 28), dt(2015, 11, 26)])
+    # Leap days.
+    self.assertEqual(
+        starts('DTSTART;VALUE=DATE:20120229\nRRULE:FREQ=YEARLY', count=3),
+        [dt(2012, 2, 29), dt(2016, 2, 29), dt(2020, 2, 29)])
+    # Friday the 13th.
+    self.assertEqual(
+        starts('DTSTART:20110513T000000Z\nRRULE:FREQ=YEARLY;BYDAY=FR;'
+               'BYMONTHDAY=13', count=2),
+        [dt(2011, 5, 13), dt(2012, 1, 13)])
+    # A DTSTART which the rule does not generate counts towards COUNT.
+    self.assertEqual(
+        starts('DTSTART;VALUE=DATE:20110101\nRRULE:FREQ=MONTHLY;'
+               'BYDAY=-1FR;COUNT=3'),
+        [dt(2011, 1, 1), dt(2011, 1, 28), dt(2011, 2, 25)])
+    self.assertEqual(
+        starts('DTSTART;VALUE=DATE:20110101\nRRULE:FREQ=MONTHLY;'
+               'BYDAY=-1FR;COUNT=1'), [dt(2011, 1, 1)])
+
+  def test_daily_weekly_and_exclusions(self):
+    self.assertEqual(
+        starts('DTSTART:20110101T100000Z\nRRULE:FREQ=DAILY;INTERVAL=10;'
+               'COUNT=3'),
+        [dt(2011, 1, 1, 10), dt(2011, 1, 11, 10), dt(2011, 1, 21, 10)])
+    self.assertEqual(
+        starts('DTSTART:20110103T100000Z\nRRULE:FREQ=WEEKLY;INTERVAL=2;'
+               'BYDAY=MO,FR;COUNT=4\nEXDATE:20110107T100000Z\n'
+               'RDATE:20110104T100000Z'),
+        [dt(2011, 1, 3, 10), dt(2011, 1, 4, 10), dt(2011, 1, 17, 10),
+         dt(2011, 1, 21, 10)])
+    self.assertEqual(
+        starts('DTSTART:20110103T100000Z\nRRULE:FREQ=DAILY;COUNT=7\n'
+               'EXRULE:FREQ=WEEKLY;BYDAY=SA,SU'),
+        [dt(2011, 1, d, 10) for d in (3, 4, 5, 6, 7)])
+
+  def test_all_day_and_duration(self):
+    recurrence_set = gdata.calendar.recurrence.RecurrenceSet(
+        'DTSTART;VALUE=DATE:20110501\nDTEND;VALUE=DATE:20110503\n'
+        'RRULE:FREQ=WEEKLY;COUNT=2')
+    self.assert_(recurrence_set.all_day)
+    self.assertEqual(list(recurrence_set.iter_occurrences()),
+                     [(dt(2011, 5, 1), dt(2011, 5, 3)),
+                      (dt(2011, 5, 8), dt(2011, 5, 10))])
+    recurrence_set = gdata.calendar.recurrence.RecurrenceSet(
+        'DTSTART:20110501T100000Z\nDURATION:PT1H30M\nRRULE:FREQ=DAILY;'
+        'COUNT=1')
+    self.assertEqual(list(recurrence_set.iter_occurrences()),
+                     [(dt(2011, 5, 1, 10), dt(2011, 5, 1, 11, 30))])
+
+  def test_impossible_and_unsupported_rules(self):
+    # DTSTART is always the first instance.
+    self.assertEqual(
+        starts('DTSTART:20110101T000000Z\nRRULE:FREQ=YEARLY;BYMONTH=2;'
+               'BYMONTHDAY=30'), [dt(2011, 1, 1)])
+    self.assertRaises(gdata.calendar.recurrence.RecurrenceError,
+                      gdata.calendar.recurrence.RecurrenceSet,
+                      'DTSTART:20110101T000000Z\nRRULE:FREQ=HOURLY')
+    self.assertRaises(gdata.calendar.recurrence.RecurrenceError,
+                      gdata.calendar.recurrence.RecurrenceSet,
+                      'DTSTART:20110101T000000Z\nRRULE:FREQ=YEARLY;'
+                      'BYWEEKNO=20')
+    self.assertRaises(gdata.calendar.recurrence.RecurrenceError,
+                      gdata.calendar.recurrence.RecurrenceSet,
+                      'RRULE:FREQ=DAILY')
+
+  def test_parse_rfc3339(self):
+    self.assertEqual(
+        gdata.calendar.recurrence.parse_rfc3339(
+            '2011-05-02T09:00:00.000-07:00'),
+        (dt(2011, 5, 2, 16), False))
+    self.assertEqual(
+        gdata.calendar.recurrence.parse_rfc3339('2011-05-02'),
+        (dt(2011, 5, 2), True))
+
+
+class RecurrenceExpanderTest(unittest.TestCase):
+
+  def setUp(self):
+    self.expander = gdata.calendar.recurrence.RecurrenceExpander()
+
+  def test_expand_with_exceptions(self):
+    series = event('series', WEEKLY, etag='"1"')
+    moved = event('series_20110308T170000Z',
+                  when=('2011-03-09T09:00:00.000-08:00',
+                        '2011-03-09T10:00:00.000-08:00'),
+                  original=('series', '2011-03-08T09:00:00.000-08:00'))
+    canceled = event('series_20110310T170000Z',
+                     status=gdata.data.CANCELED_EVENT_STATUS,
+                     original=('series', '2011-03-10T17:00:00.000Z'))
+    occurrences = self.expander.expand(series, dt(2011, 3, 5), dt(2011, 3, 12),
+                                       [moved, canceled])
+    self.assertEqual([(o.start, o.end) for o in occurrences],
+                     [(dt(2011, 3, 9, 17), dt(2011, 3, 9, 18))])
+    self.assert_(occurrences[0].entry is moved)
+    self.assertEqual(occurrences[0].original_start, dt(2011, 3, 8, 17))
+    # An instance moved into the window from outside of it.
+    occurrences = self.expander.expand(series, dt(2011, 3, 9), dt(2011, 3, 10),
+                                       [moved])
+    self.assertEqual([o.start for o in occurrences], [dt(2011, 3, 9, 17)])
+
+  def test_embedded_exceptions(self):
+    series = event('series', WEEKLY)
+    exception_entry = event('series_20110301T170000Z',
+                            when=('2011-03-02T17:00:00.000Z',
+                                  '2011-03-02T18:00:00.000Z'))
+    exception = gdata.calendar.data.CalendarRecurrenceException(
+        entry_link=gdata.data.EntryLink(entry=atom.core.parse(
+            exception_entry.to_string(), gdata.data.GDEntry)),
+        original_event=gdata.data.OriginalEvent(
+            id='series', when=gdata.data.When(start='2011-03-01T17:00:00Z')))
+    series.recurrence_exception.append(exception)
+    series = atom.core.parse(series.to_string(),
+                             gdata.calendar.data.CalendarEventEntry)
+    occurrences = self.expander.expand(series, dt(2011, 3, 1), dt(2011, 3, 4))
+    self.assertEqual([o.start for o in occurrences],
+                     [dt(2011, 3, 2, 17), dt(2011, 3, 3, 17)])
+
+  def test_cache_keyed_by_etag(self):
+    series = event('series', 'DTSTART:20000101T100000Z\nDURATION:PT1H\n'
+                   'RRULE:FREQ=DAILY', etag='"1"')
+    occurrences = self.expander.expand(series, dt(2011, 1, 1), dt(2011, 1, 3))
+    self.assertEqual([o.start for o in occurrences],
+                     [dt(2011, 1, 1, 10), dt(2011, 1, 2, 10)])
+    cached = self.expander._series[series.get_id()]
+    self.assertEqual(len(cached.starts), 4021)
+    # Earlier windows are answered from the expanded occurrences.
+    self.expander.expand(series, dt(2005, 1, 1), dt(2005, 1, 2))
+    self.assert_(self.expander._series[series.get_id()] is cached)
+    self.assertEqual(len(cached.starts), 4021)
+    changed = event('series', 'DTSTART:20000101T120000Z\nDURATION:PT1H\n'
+                    'RRULE:FREQ=DAILY', etag='"2"')
+    occurrences = self.expander.expand(changed, dt(2011, 1, 1),
+                                       dt(2011, 1, 2))
+    self.assertEqual([o.start for o in occurrences], [dt(2011, 1, 1, 12)])
+    self.assert_(self.expander._series[series.get_id()] is not cached)
+
+  def test_eviction(self):
+    expander = gdata.calendar.recurrence.RecurrenceExpander(max_series=4)
+    for i in xrange(10):
+      expander.expand(event('e%i' % i, 'DTSTART:20110101T100000Z\n'
+                            'RRULE:FREQ=DAILY'), dt(2011, 1, 1),
+                      dt(2011, 1, 2))
+    self.assert_(len(expander._series) <= 4)
+    self.assert_(EVENT_URL % 'e9' in expander._series)
+
+  def test_expand_feed(self):
+    entries = [
+        event('single', when=('2011-03-02T12:00:00.000Z',
+                              '2011-03-02T13:00:00.000Z')),
+        event('allday', when=('2011-03-03', '2011-03-04')),
+        event('gone', when=('2011-03-02T08:00:00.000Z',
+                            '2011-03-02T09:00:00.000Z'),
+              status=gdata.data.CANCELED_EVENT_STATUS),
+        event('series', WEEKLY),
+        event('series_20110301T170000Z', status=gdata.data.CANCELED_EVENT_STATUS,
+              original=('series', '2011-03-01T17:00:00.000Z')),
+        event('orphan_1', when=('2011-03-04T12:00:00.000Z',
+                                '2011-03-04T13:00:00.000Z'),
+              original=('orphan', '2011-03-04T12:00:00.000Z')),
+        event('later', when=('2011-04-02T12:00:00.000Z',
+                             '2011-04-02T13:00:00.000Z'))]
+    occurrences = self.expander.expand_feed(entries, dt(2011, 3, 1),
+                                            dt(2011, 3, 5))
+    self.assertEqual([(o.start, o.entry.get_id().split('/')[-1])
+                      for o in occurrences],
+                     [(dt(2011, 3, 2, 12), 'single'),
+                      (dt(2011, 3, 3), 'allday'),
+                      (dt(2011, 3, 3, 17), 'series'),
+                      (dt(2011, 3, 4, 12), 'orphan_1')])
+    self.assert_(occurrences[1].all_day)
+
+
+def suite():
+  return conf.build_suite([RecurrenceSetTest, RecurrenceExpanderTest])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -21,10 +21,15 @@
 __author__ = 'j.s@google.com (Jeff Scudder)'
 
 
+import os
+import shutil
+import tempfile
 import unittest
+import urllib
 import gdata.client
 import gdata.gauth
 import gdata.data
+import atom.http_core
 import atom.mock_http_core
 import StringIO
 
@@ -86,6 +91,85 @@ class ClientLoginTest(unittest.TestCase):
     self.assertEqual(client.auth_token.token_string, 'DQAAAGgA...dk3fA5N')
 
 
+class ClientLoginServer(atom.mock_http_core.FakeHttpServer):
+  """Issues numbered ClientLogin tokens and rejects the expired ones."""
+
+  def __init__(self):
+    atom.mock_http_core.FakeHttpServer.__init__(self)
+    self.issued = []
+    self.rejected = set()
+
+  def respond(self, http_request, body):
+    if http_request.uri.path == '/accounts/ClientLogin':
+      service = body.split('service=')[1].split('&')[0]
+      self.issued.append(service)
+      return atom.http_core.HttpResponse(
+          200, 'OK', body='Auth=%s%i' % (service, len(self.issued)))
+    if http_request.headers.get('Authorization') in self.rejected:
+      return atom.http_core.HttpResponse(401, 'Unauthorized', body='')
+    return atom.http_core.HttpResponse(200, 'OK', body='')
+
+
+class ClientLoginManagerTest(unittest.TestCase):
+
+  def setUp(self):
+    self.cache_dir = tempfile.mkdtemp()
+    self.cache_path = os.path.join(self.cache_dir, 'tokens')
+
+  def tearDown(self):
+    shutil.rmtree(self.cache_dir)
+
+  def create_client(self, server):
+    client = gdata.client.GDClient(http_client=server)
+    client.auth_service = 'writely'
+    client.alt_auth_service = 'wise'
+    return client
+
+  def test_tokens_are_cached(self):
+    server = ClientLoginServer()
+    manager = gdata.client.ClientLoginManager(
+        'me@example.com', 'pw', 'test', cache_path=self.cache_path)
+    client = manager.authorize(self.create_client(server))
+    self.assertEqual(sorted(server.issued), ['wise', 'writely'])
+    self.assertEqual(client.auth_token.token_string[:7], 'writely')
+    self.assertEqual(client.alt_auth_token.token_string[:4], 'wise')
+
+    # A new process reads the tokens from the cache file.
+    manager = gdata.client.ClientLoginManager(
+        'me@example.com', 'pw', 'test', cache_path=self.cache_path)
+    second_client = manager.authorize(self.create_client(server))
+    self.assertEqual(len(server.issued), 2)
+    self.assertEqual(second_client.auth_token.token_string,
+                     client.auth_token.token_string)
+
+    # Expired tokens are requested again.
+    expired_path = os.path.join(self.cache_dir, 'expired')
+    manager = gdata.client.ClientLoginManager(
+        'me@example.com', 'pw', 'test', cache_path=expired_path, ttl=0)
+    manager.authorize(self.create_client(server))
+    manager = gdata.client.ClientLoginManager(
+        'me@example.com', 'pw', 'test', cache_path=expired_path)
+    manager.authorize(self.create_client(server))
+    self.assertEqual(len(server.issued), 6)
+
+  def test_renew_on_unauthorized(self):
+    server = ClientLoginServer()
+    manager = gdata.client.ClientLoginManager('me@example.com', 'pw', 'test')
+    client = manager.authorize(self.create_client(server))
+    old_token = client.auth_token
+    server.rejected.add('GoogleLogin auth=%s' % old_token.token_string)
+    response = client.request('GET', 'https://docs.google.com/feeds/')
+    self.assertEqual(response.status, 200)
+    self.assertEqual(len(server.issued), 3)
+    self.assertNotEqual(client.auth_token.token_string,
+                        old_token.token_string)
+    self.assertEqual(server.requests[-1].headers['Authorization'],
+                     'GoogleLogin auth=%s' % client.auth_token.token_string)
+    # Renewing a token which was already replaced does not contact the server.
+    manager.renew_token(client, 'writely', old_token)
+    self.assertEqual(len(server.issued), 3)
+
+
 class AuthSubTest(unittest.TestCase):
 
   def test_get_and_upgrade_token(self):
@@ -309,6 +393,44 @@ class RequestTest(unittest.TestCase):
     self.assert_(isinstance(result, TestClass))
 
 
+class MultipleIdentityTest(unittest.TestCase):
+
+  def test_requestor_id_per_request(self):
+    client = gdata.client.GDClient()
+    client.http_client = atom.mock_http_core.SettableHttpClient(
+        200, 'OK', '', {})
+    client.auth_token = gdata.gauth.TwoLeggedOAuthHmacToken(
+        'example.com', 'secret', None)
+    for user in ('liz@example.com', 'jo@example.com'):
+      client.request('GET', 'https://www.google.com/m8/feeds/contacts/'
+                     'default/full', requestor_id=user)
+      request = client.http_client.last_request
+      self.assertEqual(request.uri.query['xoauth_requestor_id'], user)
+      header = request.headers['Authorization']
+      nonce = header.split('oauth_nonce="')[1].split('"')[0]
+      timestamp = header.split('oauth_timestamp="')[1].split('"')[0]
+      signature = gdata.gauth.generate_hmac_signature(
+          request, 'example.com', 'secret', timestamp, nonce, '1.0',
+          next=None)
+      self.assert_(
+          'oauth_signature="%s"' % urllib.quote(signature, safe='~')
+          in header)
+
+  def test_requestor_id_overrides_client_default(self):
+    client = gdata.client.GDClient(xoauth_requestor_id='admin@example.com')
+    client.http_client = atom.mock_http_core.SettableHttpClient(
+        200, 'OK', '', {})
+    client.request('GET', 'http://example.com/feed')
+    self.assertEqual(
+        client.http_client.last_request.uri.query['xoauth_requestor_id'],
+        'admin@example.com')
+    client.request('GET', 'http://example.com/feed',
+                   requestor_id='user@example.com')
+    self.assertEqual(
+        client.http_client.last_request.uri.query['xoauth_requestor_id'],
+        'user@example.com')
+
+
 class QueryTest(unittest.TestCase):
 
   def test_query_modifies_request(self):
@@ -370,12 +492,414 @@ class UpdateTest(unittest.TestCase):
                      'https://example.com/test')
 
 
+class ContentServer(atom.mock_http_core.FakeHttpServer):
+  """Serves a file, supporting Range requests unless ranges is False."""
+
+  def __init__(self, content, ranges=True, etag='"v1"'):
+    atom.mock_http_core.FakeHttpServer.__init__(self)
+    self.content = content
+    self.ranges = ranges
+    self.etag = etag
+    self.reads = []
+
+  def range_headers(self):
+    return [http_request.headers.get('Range')
+            for http_request in self.requests]
+
+  def respond(self, http_request, request_body):
+    range_header = http_request.headers.get('Range')
+    body = self.content
+    status = 200
+    if (range_header and self.ranges
+        and http_request.headers.get('If-Range') == self.etag):
+      start = int(range_header[len('bytes='):-1])
+      if start >= len(self.content):
+        return atom.http_core.HttpResponse(416, 'Not satisfiable', body='')
+      body = self.content[start:]
+      status = 206
+    headers = {}
+    if self.etag:
+      headers['ETag'] = self.etag
+    response = atom.http_core.HttpResponse(status, 'OK', headers,
+                                           StringIO.StringIO(body))
+    read = response.read
+
+    def counted_read(amt=None):
+      self.reads.append(amt)
+      return read(amt)
+
+    response.read = counted_read
+    return response
+
+
+class DownloadTest(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+    self.path = os.path.join(self.temp_dir, 'download')
+
+  def tearDown(self):
+    shutil.rmtree(self.temp_dir)
+
+  def test_download_in_chunks(self):
+    server = ContentServer('0123456789' * 100)
+    client = gdata.client.GDClient(http_client=server)
+    self.assertEqual(client.download('http://example.com/f', self.path,
+                                     chunk_size=300), 1000)
+    self.assertEqual(open(self.path, 'rb').read(), '0123456789' * 100)
+    self.assertEqual(server.reads, [300] * 5)
+    self.assertEqual(server.range_headers(), [None])
+
+  def test_download_to_writer(self):
+    server = ContentServer('abc' * 10)
+    client = gdata.client.GDClient(http_client=server)
+    output = StringIO.StringIO()
+    self.assertEqual(client.Download('http://example.com/f', output,
+                                     resume=True), 30)
+    self.assertEqual(output.getvalue(), 'abc' * 10)
+    self.assertEqual(server.range_headers(), [None])
+
+  def write_partial(self, content, etag):
+    open(self.path, 'wb').write(content)
+    if etag is not None:
+      open(self.path + '.etag', 'wb').write(etag)
+
+  def test_resume(self):
+    server = ContentServer('0123456789')
+    client = gdata.client.GDClient(http_client=server)
+    self.write_partial('0123', '"v1"')
+    self.assertEqual(client.download('http://example.com/f', self.path,
+                                     resume=True), 10)
+    self.assertEqual(server.range_headers(), ['bytes=4-'])
+    self.assertEqual(open(self.path, 'rb').read(), '0123456789')
+    self.assertFalse(os.path.exists(self.path + '.etag'))
+    # Without a saved ETag the file is downloaded again.
+    self.assertEqual(client.download('http://example.com/f', self.path,
+                                     resume=True), 10)
+    self.assertEqual(server.range_headers(), ['bytes=4-', None])
+    self.assertEqual(open(self.path, 'rb').read(), '0123456789')
+
+  def test_resume_complete_file(self):
+    server = ContentServer('0123456789')
+    client = gdata.client.GDClient(http_client=server)
+    self.write_partial('0123456789', '"v1"')
+    self.assertEqual(client.download('http://example.com/f', self.path,
+                                     resume=True), 10)
+    self.assertEqual(server.range_headers(), ['bytes=10-'])
+    self.assertFalse(os.path.exists(self.path + '.etag'))
+
+  def test_resume_changed_content(self):
+    for content in ('012', '0123456789'):
+      server = ContentServer(content, etag='"v2"')
+      client = gdata.client.GDClient(http_client=server)
+      self.write_partial('abcd', '"v1"')
+      self.assertEqual(client.download('http://example.com/f', self.path,
+                                       resume=True), len(content))
+      self.assertEqual(open(self.path, 'rb').read(), content)
+
+  def test_interrupted_download_keeps_etag(self):
+    server = ContentServer('0123456789')
+    client = gdata.client.GDClient(http_client=server)
+    open(self.path, 'wb').write('stale')
+
+    def failing_copy(response, output, chunk_size):
+      output.write(response.read(4))
+      raise IOError('connection lost')
+
+    original_copy = gdata.client._copy_response
+    gdata.client._copy_response = failing_copy
+    try:
+      self.assertRaises(IOError, client.download, 'http://example.com/f',
+                        self.path, resume=True)
+    finally:
+      gdata.client._copy_response = original_copy
+    self.assertEqual(open(self.path, 'rb').read(), '0123')
+    self.assertEqual(open(self.path + '.etag', 'rb').read(), '"v1"')
+    self.assertEqual(client.download('http://example.com/f', self.path,
+                                     resume=True), 10)
+    self.assertEqual(server.range_headers(), [None, 'bytes=4-'])
+    self.assertEqual(open(self.path, 'rb').read(), '0123456789')
+
+  def test_resume_without_range_support(self):
+    server = ContentServer('0123456789', ranges=False)
+    client = gdata.client.GDClient(http_client=server)
+    self.write_partial('0123', '"v1"')
+    self.assertEqual(client.download('http://example.com/f', self.path,
+                                     resume=True), 10)
+    self.assertEqual(open(self.path, 'rb').read(), '0123456789')
+
+
+class UploadServer(atom.mock_http_core.FakeHttpServer):
+  """Accepts resumable uploads and records the chunks of each file."""
+
+  def __init__(self, fail_paths=(), fail_after=None):
+    atom.mock_http_core.FakeHttpServer.__init__(self)
+    for path in fail_paths:
+      self.fail_requests(500, 'Server Error', path=path)
+    self.fail_after = fail_after
+    self.files = {}
+    self.chunks = []
+
+  def respond(self, http_request, body):
+    path = http_request.uri.path
+    if http_request.method == 'POST':
+      upload_path = '/upload/%i' % len(self.files)
+      self.files[upload_path] = ''
+      return atom.http_core.HttpResponse(
+          200, 'OK', headers={'Location': 'http://example.com' + upload_path},
+          body='')
+    if path not in self.files:
+      return atom.http_core.HttpResponse(404, 'Not Found', body='')
+    content_range = http_request.headers['Content-Range']
+    total = int(content_range.split('/')[1])
+    if not content_range.startswith('bytes */'):
+      if self.fail_after is not None and len(self.chunks) >= self.fail_after:
+        return atom.http_core.HttpResponse(503, 'Unavailable', body='')
+      self.chunks.append((path, content_range))
+      self.files[path] += body
+    received = len(self.files[path])
+    if received < total:
+      headers = {}
+      if received:
+        headers['Range'] = 'bytes=0-%i' % (received - 1)
+      return atom.http_core.HttpResponse(308, 'Resume Incomplete',
+                                         headers=headers, body='')
+    return atom.http_core.HttpResponse(
+        201, 'Created', body='<entry xmlns="http://www.w3.org/2005/Atom">'
+                             '<id>%s</id></entry>' % path)
+
+
+class ResumableUploadTest(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.temp_dir)
+
+  def write_file(self, name, content):
+    path = os.path.join(self.temp_dir, name)
+    open(path, 'wb').write(content)
+    return path
+
+  def test_upload_file_in_chunks(self):
+    server = UploadServer()
+    client = gdata.client.GDClient(http_client=server)
+    content = ''.join([chr(i % 256) for i in xrange(600000)])
+    uploader = gdata.client.ResumableUploader(
+        client, StringIO.StringIO(content), 'application/octet-stream',
+        len(content), chunk_size=262144)
+    entry = uploader.upload_file('http://example.com/create')
+    self.assertEqual(entry.id.text, '/upload/0')
+    self.assertEqual(server.files['/upload/0'], content)
+    self.assertEqual([content_range for path, content_range in server.chunks],
+                     ['bytes 0-262143/600000', 'bytes 262144-524287/600000',
+                      'bytes 524288-599999/600000'])
+    self.assertTrue(uploader.client is client)
+
+  def test_short_file_raises_error(self):
+    client = gdata.client.GDClient(http_client=UploadServer())
+    uploader = gdata.client.ResumableUploader(
+        client, StringIO.StringIO('x' * 300000), 'text/plain', 600000,
+        chunk_size=262144)
+    self.assertRaises(gdata.client.RequestError, uploader.upload_file,
+                      'http://example.com/create')
+
+  def test_adapt_chunk_size(self):
+    uploader = gdata.client.ResumableUploader(
+        None, None, 'text/plain', 10 ** 9, chunk_size=262144)
+    # A fast connection at most doubles the chunk size each time.
+    uploader._adapt_chunk_size(262144, 0.01)
+    self.assertEqual(uploader.chunk_size, 524288)
+    # At 100KB/s a five second chunk is rounded down to 256KB.
+    uploader._adapt_chunk_size(524288, 5.24288)
+    self.assertEqual(uploader.chunk_size, 262144)
+    uploader.chunk_size = uploader.MAX_CHUNK_SIZE
+    uploader._adapt_chunk_size(uploader.MAX_CHUNK_SIZE, 0.01)
+    self.assertEqual(uploader.chunk_size, uploader.MAX_CHUNK_SIZE)
+    # The last, short chunk of a file says nothing about the throughput.
+    uploader._adapt_chunk_size(1000, 60)
+    self.assertEqual(uploader.chunk_size, uploader.MAX_CHUNK_SIZE)
+
+  def test_keep_alive_client(self):
+    environ = dict(os.environ)
+    try:
+      os.environ.pop('http_proxy', None)
+      os.environ.pop('https_proxy', None)
+      client = gdata.client.GDClient()
+      pooled_client, pooled_http_client = gdata.client.keep_alive_client(
+          client, 2)
+      self.assertTrue(isinstance(pooled_http_client,
+                                 atom.http_core.KeepAliveHttpClient))
+      self.assertTrue(pooled_client.http_client is pooled_http_client)
+      self.assertTrue(isinstance(client.http_client,
+                                 atom.http_core.ProxiedHttpClient))
+      # Requests through a proxy or a custom http client are left alone.
+      # A copy would lose the request wrapper which renews OAuth 2.0 tokens.
+      token = gdata.gauth.OAuth2Token('id', 'secret', 'scope', 'agent',
+                                      access_token='access')
+      authorized = token.authorize(gdata.client.GDClient())
+      self.assertEqual(gdata.client.keep_alive_client(authorized, 2),
+                       (authorized, None))
+      os.environ['http_proxy'] = 'http://proxy.example.com:3128'
+      self.assertEqual(gdata.client.keep_alive_client(client, 2),
+                       (client, None))
+    finally:
+      os.environ.clear()
+      os.environ.update(environ)
+    client.http_client = UploadServer()
+    self.assertEqual(gdata.client.keep_alive_client(client, 2),
+                     (client, None))
+
+  def test_journal_resumes_upload(self):
+    server = UploadServer(fail_after=2)
+    client = gdata.client.GDClient(http_client=server)
+    content = ''.join([chr(i % 256) for i in xrange(600000)])
+    path = self.write_file('large', content)
+    journal = gdata.client.UploadJournal(os.path.join(self.temp_dir, 'j'))
+    key = journal.make_key(path, 'http://example.com/create')
+    uploader = gdata.client.ResumableUploader(
+        client, open(path, 'rb'), 'application/octet-stream', len(content),
+        chunk_size=262144, journal=journal, journal_key=key)
+    self.assertRaises(gdata.client.RequestError, uploader.upload_file,
+                      'http://example.com/create')
+    self.assertEqual(journal.get(key),
+                     ('http://example.com/upload/0', 524288))
+    # A new process continues the upload from the journal.
+    server.fail_after = None
+    journal = gdata.client.UploadJournal(os.path.join(self.temp_dir, 'j'))
+    uploader = gdata.client.ResumableUploader(
+        client, open(path, 'rb'), 'application/octet-stream', len(content),
+        chunk_size=262144, journal=journal, journal_key=key)
+    entry = uploader.upload_file('http://example.com/create')
+    self.assertEqual(entry.id.text, '/upload/0')
+    self.assertEqual(server.files['/upload/0'], content)
+    self.assertEqual(server.chunks[-1][1], 'bytes 524288-599999/600000')
+    self.assertEqual(len(server.files), 1)
+    self.assertEqual(journal.get(key), None)
+
+  def test_journal_with_completed_or_expired_session(self):
+    server = UploadServer()
+    client = gdata.client.GDClient(http_client=server)
+    path = self.write_file('small', 'abc')
+    journal = gdata.client.UploadJournal(os.path.join(self.temp_dir, 'j'))
+    key = journal.make_key(path, 'http://example.com/create')
+    server.files['/upload/done'] = 'abc'
+    journal.record(key, 'http://example.com/upload/done', 0)
+    journal.record('other', 'http://example.com/upload/gone', 5)
+    uploader = gdata.client.ResumableUploader(
+        client, open(path, 'rb'), 'text/plain', 3, journal=journal,
+        journal_key=key)
+    self.assertEqual(uploader.upload_file('http://example.com/create').id.text,
+                     '/upload/done')
+    self.assertEqual(server.chunks, [])
+    self.assertEqual(journal.get(key), None)
+    self.assertEqual(journal.Get('other'),
+                     ('http://example.com/upload/gone', 5))
+    # The server has forgotten this session, so a new one is started.
+    uploader = gdata.client.ResumableUploader(
+        client, open(path, 'rb'), 'text/plain', 3, journal=journal,
+        journal_key='other')
+    entry = uploader.upload_file('http://example.com/create')
+    self.assertEqual(server.files[entry.id.text], 'abc')
+    self.assertEqual(journal.get('other'), None)
+
+  def test_journal_key_changes_with_file(self):
+    path = self.write_file('data', 'abc')
+    key = gdata.client.UploadJournal.make_key(path, 'http://example.com/c')
+    self.assertEqual(key.split(':')[-2:],
+                     [str(int(os.stat(path).st_mtime)),
+                      'http%3A%2F%2Fexample.com%2Fc'])
+    self.write_file('data', 'abcd')
+    self.assertNotEqual(
+        gdata.client.UploadJournal.make_key(path, 'http://example.com/c'),
+        key)
+
+  def test_chunk_reader(self):
+    reader = gdata.client._ChunkReader(StringIO.StringIO('0123456789'))
+    reader.prefetch(4)
+    self.assertEqual(reader.read(3), '012')
+    reader.prefetch(3)
+    self.assertEqual(reader.read(5), '34567')
+    reader.prefetch(5)
+    self.assertEqual(reader.read(5), '89')
+    self.assertEqual(reader.read(5), '')
+    reader.close()
+
+  def test_upload_manager(self):
+    server = UploadServer(fail_paths=('/broken',))
+    client = gdata.client.GDClient(http_client=server)
+    manager = gdata.client.ResumableUploadManager(client, max_concurrent=3)
+    paths = [self.write_file('f%i' % i, str(i) * (1000 * (i + 1)))
+             for i in xrange(5)]
+    for path in paths:
+      manager.add(path, 'text/plain', 'http://example.com/create')
+    manager.Add(paths[0], 'text/plain', 'http://example.com/broken')
+    manager.add(os.path.join(self.temp_dir, 'missing'), 'text/plain',
+                'http://example.com/create')
+    report = manager.run()
+    self.assertEqual([path for path, entry in report.completed], paths)
+    self.assertEqual(sorted(server.files.values()),
+                     [str(i) * (1000 * (i + 1)) for i in xrange(5)])
+    for path, entry in report.completed:
+      self.assertEqual(server.files[entry.id.text],
+                       open(path, 'rb').read())
+    self.assertEqual(report.bytes_uploaded, 15000)
+    self.assertEqual([path for path, error in report.failed],
+                     [paths[0], os.path.join(self.temp_dir, 'missing')])
+    self.assertEqual(report.failed[0][1].status, 500)
+    self.assertTrue(report.get_throughput() > 0)
+
+
+class ReplaceFileTest(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+    self.path = os.path.join(self.temp_dir, 'state')
+    self.temp_path = self.path + '.tmp'
+    self.rename = os.rename
+
+  def tearDown(self):
+    os.rename = self.rename
+    shutil.rmtree(self.temp_dir)
+
+  def refuse_existing_targets(self, source, target):
+    # Renames the way Windows does.
+    if os.path.exists(target):
+      raise OSError('File exists')
+    self.rename(source, target)
+
+  def test_replace_existing_file(self):
+    open(self.path, 'wb').write('old')
+    open(self.temp_path, 'wb').write('new')
+    os.rename = self.refuse_existing_targets
+    gdata.client.replace_file(self.temp_path, self.path)
+    self.assertEqual(open(self.path, 'rb').read(), 'new')
+    self.assertFalse(os.path.exists(self.temp_path))
+
+  def test_failed_rename_is_raised(self):
+    open(self.temp_path, 'wb').write('new')
+
+    def failing_rename(source, target):
+      raise OSError('Permission denied')
+
+    os.rename = failing_rename
+    self.assertRaises(OSError, gdata.client.replace_file, self.temp_path,
+                      self.path)
+    self.assertTrue(os.path.exists(self.temp_path))
+
+
 def suite():
   return unittest.TestSuite((unittest.makeSuite(ClientLoginTest, 'test'),
+                             unittest.makeSuite(ClientLoginManagerTest, 'test'),
                              unittest.makeSuite(AuthSubTest, 'test'),
                              unittest.makeSuite(OAuthTest, 'test'),
                              unittest.makeSuite(RequestTest, 'test'),
                              unittest.makeSuite(VersionConversionTest, 'test'),
+                             unittest.makeSuite(MultipleIdentityTest, 'test'),
+                             unittest.makeSuite(DownloadTest, 'test'),
+                             unittest.makeSuite(ReplaceFileTest, 'test'),
+                             unittest.makeSuite(ResumableUploadTest, 'test'),
                              unittest.makeSuite(QueryTest, 'test'),
                              unittest.makeSuite(UpdateTest, 'test')))
 
@@ -0,0 +1,540 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2009 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests for the Contacts client which do not need a server."""
+
+
+import os
+import shutil
+import tempfile
+import unittest
+import atom.core
+import atom.data
+import atom.http_core
+import atom.mock_http_core
+import gdata.contacts.client
+import gdata.contacts.data
+import gdata.data
+import gdata.gauth
+import gdata.test_config as conf
+
+
+class ContactsServer(atom.mock_http_core.FakeHttpServer):
+  """Serves the contacts and groups feeds of one account from memory.
+
+  Supports updated-min, showdeleted, requirealldeleted, paging and batch
+  requests to the contacts feed.
+  """
+
+  def __init__(self):
+    atom.mock_http_core.FakeHttpServer.__init__(self)
+    self.clock = 0
+    # Maps kind to a dict of entry ID to (entry, updated) pairs.
+    self.entries = {'contacts': {}, 'groups': {}}
+    self.lost_deletions = False
+
+  def tick(self):
+    self.clock += 1
+    return '2011-01-01T00:00:%02d.000Z' % self.clock
+
+  def put(self, kind, entry_id, **fields):
+    updated = self.tick()
+    entry_class = gdata.contacts.data.ContactEntry
+    if kind == 'groups':
+      entry_class = gdata.contacts.data.GroupEntry
+    entry = entry_class(id=atom.data.Id(text=entry_id),
+                        updated=atom.data.Updated(text=updated),
+                        etag='"%s"' % updated,
+                        link=[atom.data.Link(rel='edit', href=entry_id)],
+                        **fields)
+    self.entries[kind][entry_id] = (entry, updated)
+    return entry
+
+  def add_contact(self, entry_id, name, emails=(), phone_numbers=()):
+    return self.put('contacts', entry_id, title=atom.data.Title(text=name),
+                    email=[gdata.data.Email(address=email)
+                           for email in emails],
+                    phone_number=[gdata.data.PhoneNumber(text=phone_number)
+                                  for phone_number in phone_numbers])
+
+  def delete(self, kind, entry_id):
+    self.put(kind, entry_id, deleted=gdata.contacts.data.Deleted())
+
+  def fail_batches(self, count):
+    self.fail_requests(503, 'Unavailable', count=count,
+                       path='/m8/feeds/contacts/default/full/batch')
+
+  def respond(self, http_request, body):
+    path = http_request.uri.path
+    query = http_request.uri.query
+    kind = path.split('/')[3]
+    if path.endswith('/batch'):
+      return self.batch(body)
+    if query.get('requirealldeleted') == 'true' and self.lost_deletions:
+      return atom.http_core.HttpResponse(410, 'Gone', body='')
+    entries = []
+    for entry, updated in sorted(self.entries[kind].values(),
+                                 key=lambda pair: pair[1]):
+      if updated < query.get('updated-min', ''):
+        continue
+      if entry.deleted is not None and query.get('showdeleted') != 'true':
+        continue
+      entries.append(entry)
+    start = int(query.get('start-index', '1'))
+    page_size = int(query.get('max-results', '25'))
+    feed_class = gdata.contacts.data.ContactsFeed
+    if kind == 'groups':
+      feed_class = gdata.contacts.data.GroupsFeed
+    feed = feed_class(updated=atom.data.Updated(text=self.tick()),
+                      entry=entries[start - 1:start - 1 + page_size])
+    if start - 1 + page_size < len(entries):
+      next_query = dict(query)
+      next_query['start-index'] = str(start + page_size)
+      next_uri = atom.http_core.Uri(scheme='https', host='www.google.com',
+                                    path=path, query=next_query)
+      feed.link.append(atom.data.Link(rel='next', href=str(next_uri)))
+    return atom.http_core.HttpResponse(200, 'OK', body=str(feed))
+
+  def batch(self, body):
+    request_feed = atom.core.parse(body, gdata.contacts.data.ContactsFeed)
+    result = gdata.contacts.data.ContactsFeed()
+    for entry in request_feed.entry:
+      operation = entry.batch_operation.type
+      code = 200
+      if operation == 'insert':
+        entry_id = 'contact%i' % (len(self.entries['contacts']) + 1)
+        code = 201
+      else:
+        entry_id = entry.get_id()
+        current = self.entries['contacts'].get(entry_id)
+        if current is None:
+          code = 404
+        elif current[0].deleted is not None:
+          code = 404
+        elif operation != 'query' and current[0].etag != entry.etag:
+          code = 412
+      if code < 300:
+        if operation == 'query':
+          entry = atom.core.parse(str(current[0]),
+                                  gdata.contacts.data.ContactEntry)
+        elif operation == 'delete':
+          self.delete('contacts', entry_id)
+          entry = gdata.contacts.data.ContactEntry(
+              id=atom.data.Id(text=entry_id))
+        else:
+          entry = self.put('contacts', entry_id, title=entry.title,
+                           email=entry.email,
+                           phone_number=entry.phone_number)
+      else:
+        entry = gdata.contacts.data.ContactEntry(
+            id=atom.data.Id(text=entry_id))
+      entry.batch_id = request_feed.entry[len(result.entry)].batch_id
+      entry.batch_status = gdata.data.BatchStatus(code=str(code),
+                                                  reason='Reason %i' % code)
+      result.entry.append(entry)
+    return atom.http_core.HttpResponse(200, 'OK', body=str(result))
+
+
+class ContactsSyncTest(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+    self.state_path = os.path.join(self.temp_dir, 'contacts.json')
+    self.server = ContactsServer()
+    self.client = gdata.contacts.client.ContactsClient(
+        http_client=self.server)
+    self.server.add_contact('c1', 'Liz', ['Liz@Example.com'],
+                            ['+1 (555) 010-0001'])
+    self.server.add_contact('c2', 'Bob', ['bob@example.com'])
+    self.server.put('groups', 'g1', title=atom.data.Title(text='Friends'),
+                    system_group=gdata.contacts.data.SystemGroup(id='Friends'))
+
+  def tearDown(self):
+    shutil.rmtree(self.temp_dir)
+
+  def test_full_then_delta_sync(self):
+    sync = gdata.contacts.client.ContactsSync(self.client, self.state_path)
+    result = sync.sync()
+    self.assert_(result.full)
+    self.assertEqual(result.added, ['c1', 'c2'])
+    self.assertEqual(result.added_groups, ['g1'])
+    self.assertEqual(sync.groups['g1'].system_group, 'Friends')
+    self.assertEqual([c.id for c in sync.find_by_email('liz@example.COM')],
+                     ['c1'])
+    self.assertEqual([c.id for c in sync.find_by_phone_number('15550100001')],
+                     ['c1'])
+    self.server.add_contact('c1', 'Liz', ['liz@new.example.com'])
+    self.server.delete('contacts', 'c2')
+    self.server.add_contact('c3', 'Ann', ['ann@example.com'])
+    self.server.delete('groups', 'g1')
+    requests = len(self.server.requests)
+    result = sync.Sync()
+    self.assertFalse(result.full)
+    self.assertEqual(result.added, ['c3'])
+    self.assertEqual(result.changed, ['c1'])
+    self.assertEqual(result.removed, ['c2'])
+    self.assertEqual(result.removed_groups, ['g1'])
+    self.assertEqual(sorted(sync.contacts.keys()), ['c1', 'c3'])
+    self.assertEqual(sync.find_by_email('liz@example.com'), [])
+    self.assertEqual(sync.find_by_phone_number('+1 555 010 0001'), [])
+    self.assertEqual(sync.find_by_email('bob@example.com'), [])
+    # Only the entries changed since the first sync were sent.
+    query = self.server.requests[requests].uri.query
+    self.assertEqual(query['showdeleted'], 'true')
+    self.assertEqual(query['requirealldeleted'], 'true')
+    self.assert_('updated-min' in query)
+
+  def test_paging_and_saved_state(self):
+    for i in xrange(2500):
+      self.server.add_contact('p%04i' % i, 'Person %i' % i)
+    sync = gdata.contacts.client.ContactsSync(self.client, self.state_path)
+    result = sync.sync()
+    self.assertEqual(len(result.added), 2502)
+    other = gdata.contacts.client.ContactsSync(self.client, self.state_path,
+                                               account='other@example.com')
+    other.save()
+    loaded = gdata.contacts.client.ContactsSync(self.client, self.state_path)
+    self.assertEqual(len(loaded.contacts), 2502)
+    self.assertEqual(loaded.contacts_updated, sync.contacts_updated)
+    self.assertEqual([c.name for c in loaded.find_by_email('bob@example.com')],
+                     ['Bob'])
+    self.assertEqual(
+        gdata.contacts.client.ContactsSync(
+            self.client, self.state_path,
+            account='other@example.com').contacts, {})
+    self.server.add_contact('p0001', 'Renamed')
+    result = loaded.sync()
+    self.assertEqual(result.changed, ['p0001'])
+    self.assertEqual(result.added, [])
+
+  def test_lost_deletions_trigger_full_sync(self):
+    sync = gdata.contacts.client.ContactsSync(self.client)
+    sync.sync()
+    self.server.entries['contacts'].pop('c2')
+    self.server.lost_deletions = True
+    result = sync.sync()
+    self.assert_(result.full)
+    self.assertEqual(result.removed, ['c2'])
+    self.assertEqual(sorted(sync.contacts.keys()), ['c1'])
+
+  def test_push(self):
+    sync = gdata.contacts.client.ContactsSync(self.client, self.state_path)
+    sync.sync()
+    for i in xrange(150):
+      sync.create_contact(gdata.contacts.data.ContactEntry(
+          title=atom.data.Title(text='New %i' % i),
+          email=[gdata.data.Email(address='new%i@example.com' % i)]))
+    liz = self.server.entries['contacts']['c1'][0]
+    liz.title.text = 'Elizabeth'
+    sync.update_contact(liz)
+    stale = gdata.contacts.data.ContactEntry(
+        id=atom.data.Id(text='c2'), etag='"old"',
+        title=atom.data.Title(text='Robert'))
+    sync.update_contact(stale)
+    sync.delete_contact(self.server.entries['contacts']['c2'][0])
+    batches = len(self.server.requests)
+    failed = sync.push()
+    self.assertEqual(len(self.server.requests) - batches, 2)
+    self.assertEqual(self.server.requests[-1].uri.path,
+                     '/m8/feeds/contacts/default/full/batch')
+    self.assertEqual([(operation, entry.get_id(), code)
+                      for operation, entry, code, reason in failed],
+                     [('update', 'c2', 412)])
+    self.assertEqual(sync.contacts['c1'].name, 'Elizabeth')
+    self.assert_('c2' not in sync.contacts)
+    self.assertEqual(len(sync.contacts), 151)
+    self.assertEqual(len(sync.find_by_email('new149@example.com')), 1)
+    loaded = gdata.contacts.client.ContactsSync(self.client, self.state_path)
+    self.assertEqual(len(loaded.contacts), 151)
+    # Syncing afterwards sees the pushed changes as already applied.
+    result = sync.sync()
+    self.assertEqual(result.added + result.changed + result.removed, [])
+
+
+  def test_push_failed_batch(self):
+    sync = gdata.contacts.client.ContactsSync(self.client)
+    sync.sync()
+    sync.create_contact(gdata.contacts.data.ContactEntry(
+        title=atom.data.Title(text='New')))
+    sync.delete_contact(self.server.entries['contacts']['c2'][0])
+    self.server.fail_batches(1)
+    failed = sync.push()
+    self.assertEqual([(operation, code, reason)
+                      for operation, entry, code, reason in failed],
+                     [('insert', 503, 'Unavailable'),
+                      ('delete', 503, 'Unavailable')])
+    self.assertEqual(sorted(sync.contacts.keys()), ['c1', 'c2'])
+    self.assertEqual(sync.push(), [])
+
+
+class BulkContactsTest(unittest.TestCase):
+
+  def setUp(self):
+    self.server = ContactsServer()
+    self.client = gdata.contacts.client.ContactsClient(
+        http_client=self.server)
+
+  def new_contacts(self, count):
+    return [gdata.contacts.data.ContactEntry(
+                title=atom.data.Title(text='Person %i' % i),
+                email=[gdata.data.Email(address='p%i@example.com' % i)])
+            for i in xrange(count)]
+
+  def test_bulk_create(self):
+    token = gdata.gauth.ClientLoginToken('secret')
+    results = self.client.bulk_create(self.new_contacts(250),
+                                      max_concurrent=3, auth_token=token)
+    self.assertEqual(len(self.server.requests), 3)
+    for http_request in self.server.requests:
+      self.assertEqual(http_request.uri.path,
+                       '/m8/feeds/contacts/default/full/batch')
+      self.assertEqual(http_request.headers['Authorization'],
+                       'GoogleLogin auth=secret')
+    self.assertEqual([result.status for result in results], [201] * 250)
+    self.assert_(results[0].succeeded())
+    # Results are in the order of the given contacts.
+    self.assertEqual([result.result.title.text for result in results],
+                     ['Person %i' % i for i in xrange(250)])
+    self.assertEqual([result.entry.title.text for result in results],
+                     ['Person %i' % i for i in xrange(250)])
+    self.assertEqual(len(self.server.entries['contacts']), 250)
+
+  def test_execute_batch_sends_auth_token(self):
+    feed = gdata.contacts.data.ContactsFeed()
+    feed.add_insert(self.new_contacts(1)[0])
+    self.client.execute_batch(feed,
+                              auth_token=gdata.gauth.ClientLoginToken('x'))
+    self.assertEqual(self.server.requests[0].headers['Authorization'],
+                     'GoogleLogin auth=x')
+
+  def test_bulk_update_retries_conflicts(self):
+    for i in xrange(3):
+      self.server.add_contact('c%i' % i, 'Person %i' % i)
+    contacts = [atom.core.parse(str(self.server.entries['contacts'][id][0]),
+                                gdata.contacts.data.ContactEntry)
+                for id in ('c0', 'c1', 'c2')]
+    # Someone else changes c1 after it was read.
+    self.server.add_contact('c1', 'Changed elsewhere')
+    for contact in contacts:
+      contact.title.text += ' (updated)'
+    results = self.client.bulk_update(contacts)
+    self.assertEqual([result.status for result in results], [200] * 3)
+    self.assertEqual([result.retries for result in results], [0, 1, 0])
+    self.assertEqual(
+        self.server.entries['contacts']['c1'][0].title.text,
+        'Person 1 (updated)')
+    # An update, a query for the conflicting contact and its retry.
+    self.assertEqual(len(self.server.requests), 3)
+
+    contacts[0].etag = '"stale"'
+    results = self.client.bulk_update(contacts[:1], conflict_retries=0)
+    self.assertEqual(results[0].status, 412)
+    self.assertFalse(results[0].succeeded())
+    self.assertEqual(results[0].reason, 'Reason 412')
+
+  def test_bulk_delete(self):
+    for i in xrange(3):
+      self.server.add_contact('c%i' % i, 'Person %i' % i)
+    contacts = [self.server.entries['contacts'][id][0]
+                for id in ('c0', 'c1', 'c2')]
+    self.server.delete('contacts', 'c2')
+    self.server.add_contact('c1', 'Changed elsewhere')
+    results = self.client.bulk_delete(contacts)
+    self.assertEqual([result.status for result in results], [200, 200, 404])
+    self.assertEqual([result.result for result in results], [None] * 3)
+    self.assert_(self.server.entries['contacts']['c1'][0].deleted is not None)
+
+  def test_failed_batch(self):
+    self.server.fail_batches(1)
+    results = self.client.bulk_create(self.new_contacts(150),
+                                      max_concurrent=1)
+    self.assertEqual([result.status for result in results],
+                     [503] * 100 + [201] * 50)
+    self.assertEqual(results[0].reason, 'Unavailable')
+
+
+PHOTO_URL = 'https://www.google.com/m8/feeds/photos/media/default/%s'
+
+
+class PhotoServer(atom.mock_http_core.FakeHttpServer):
+  """Serves contact photos from memory, honoring If-Match on uploads."""
+
+  def __init__(self):
+    atom.mock_http_core.FakeHttpServer.__init__(self)
+    # Maps contact IDs to (etag, data) pairs.
+    self.photos = {}
+    self.version = 0
+
+  def set_photo(self, contact_id, data):
+    self.version += 1
+    self.photos[contact_id] = ('"photo%i"' % self.version, data)
+
+  def entry(self, contact_id):
+    """Returns a ContactEntry with a photo link for the contact."""
+    etag = self.photos.get(contact_id, (None, None))[0]
+    return gdata.contacts.data.ContactEntry(
+        id=atom.data.Id(text='http://www.google.com/m8/feeds/contacts/'
+                             'default/base/%s' % contact_id),
+        link=[gdata.contacts.data.ContactLink(
+            rel=gdata.contacts.data.PHOTO_LINK_REL, etag=etag,
+            href=PHOTO_URL % contact_id)])
+
+  def respond(self, http_request, body):
+    contact_id = http_request.uri.path.split('/')[-1]
+    if http_request.method == 'GET':
+      if contact_id not in self.photos:
+        return atom.http_core.HttpResponse(404, 'Not Found', body='')
+      etag, data = self.photos[contact_id]
+      return atom.http_core.HttpResponse(200, 'OK', body=data,
+                                         headers={'ETag': etag})
+    if_match = http_request.headers.get('if-match')
+    if (if_match is not None
+        and if_match != self.photos.get(contact_id, (None,))[0]):
+      return atom.http_core.HttpResponse(412, 'Precondition Failed',
+                                         body='')
+    self.set_photo(contact_id, body)
+    return atom.http_core.HttpResponse(
+        200, 'OK', body='', headers={'ETag': self.photos[contact_id][0]})
+
+
+class PhotoManagerTest(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+    self.state_path = os.path.join(self.temp_dir, 'photos.json')
+    self.server = PhotoServer()
+    self.client = gdata.contacts.client.ContactsClient(
+        http_client=self.server)
+    for i in xrange(20):
+      self.server.set_photo('c%i' % i, 'photo data %i' % i * 1000)
+
+  def tearDown(self):
+    shutil.rmtree(self.temp_dir)
+
+  def manager(self):
+    return gdata.contacts.client.PhotoManager(
+        self.client, self.state_path, max_concurrent=4, chunk_size=1000)
+
+  def entries(self):
+    return [self.server.entry('c%i' % i) for i in xrange(20)]
+
+  def test_download_skips_unchanged_photos(self):
+    manager = self.manager()
+    manager.add_downloads(self.entries(), self.temp_dir)
+    report = manager.run()
+    self.assertEqual([os.path.basename(file_path)
+                      for entry, file_path, size in report.downloaded],
+                     ['c%i' % i for i in xrange(20)])
+    self.assertEqual(report.bytes_downloaded,
+                     sum([len(data) for etag, data
+                          in self.server.photos.values()]))
+    self.assertEqual(open(os.path.join(self.temp_dir, 'c3')).read(),
+                     self.server.photos['c3'][1])
+    self.assertEqual(report.failed, [])
+
+    self.server.set_photo('c3', 'new photo')
+    del self.server.photos['c4']
+    os.remove(os.path.join(self.temp_dir, 'c5'))
+    requests = len(self.server.requests)
+    manager = self.manager()
+    manager.add_downloads(self.entries(), self.temp_dir)
+    report = manager.run()
+    self.assertEqual([os.path.basename(file_path)
+                      for entry, file_path, size in report.downloaded],
+                     ['c3', 'c5'])
+    self.assertEqual(len(self.server.requests) - requests, 2)
+    self.assertEqual(len(report.skipped), 17)
+    self.assertEqual([os.path.basename(file_path)
+                      for entry, file_path in report.removed], ['c4'])
+    self.assertFalse(os.path.exists(os.path.join(self.temp_dir, 'c4')))
+    self.assertEqual(open(os.path.join(self.temp_dir, 'c3')).read(),
+                     'new photo')
+
+  def test_failed_download_keeps_old_photo(self):
+    file_path = os.path.join(self.temp_dir, 'c1')
+    open(file_path, 'w').write('old photo')
+    entry = self.server.entry('c1')
+    del self.server.photos['c1']
+    manager = self.manager()
+    manager.add_download(entry, file_path)
+    manager.add_download(gdata.contacts.data.ContactEntry(), file_path)
+    report = manager.run()
+    self.assertEqual([error.status for entry, path, error in report.failed
+                      if hasattr(error, 'status')], [404])
+    self.assertEqual(len(report.failed), 2)
+    self.assertEqual(open(file_path).read(), 'old photo')
+    self.assertEqual(sorted(os.listdir(self.temp_dir)), ['c1', 'photos.json'])
+
+  def test_upload_skips_unchanged_files(self):
+    for i in xrange(3):
+      open(os.path.join(self.temp_dir, 'u%i' % i), 'wb').write('upload %i' % i)
+    self.server.set_photo('u0', 'server photo')
+    manager = self.manager()
+    for i in xrange(3):
+      manager.add_upload(self.server.entry('u%i' % i),
+                         os.path.join(self.temp_dir, 'u%i' % i))
+    report = manager.run()
+    self.assertEqual(len(report.uploaded), 3)
+    self.assertEqual(report.bytes_uploaded, 24)
+    self.assertEqual(self.server.photos['u0'][1], 'upload 0')
+    self.assertEqual(self.server.photos['u2'][1], 'upload 2')
+
+    open(os.path.join(self.temp_dir, 'u1'), 'wb').write('changed')
+    self.server.set_photo('u2', 'replaced on the server')
+    manager = self.manager()
+    for i in xrange(3):
+      manager.add_upload(self.server.entry('u%i' % i),
+                         os.path.join(self.temp_dir, 'u%i' % i))
+    report = manager.run()
+    self.assertEqual([os.path.basename(file_path)
+                      for entry, file_path, size in report.uploaded],
+                     ['u1', 'u2'])
+    self.assertEqual([os.path.basename(file_path)
+                      for entry, file_path in report.skipped], ['u0'])
+    self.assertEqual(self.server.photos['u2'][1], 'upload 2')
+
+  def test_upload_conflict(self):
+    open(os.path.join(self.temp_dir, 'u0'), 'wb').write('upload')
+    self.server.set_photo('u0', 'server photo')
+    entry = self.server.entry('u0')
+    self.server.set_photo('u0', 'changed by someone else')
+    manager = self.manager()
+    manager.add_upload(entry, os.path.join(self.temp_dir, 'u0'))
+    report = manager.run()
+    self.assertEqual(report.failed[0][2].status, 412)
+    self.assertEqual(self.server.photos['u0'][1], 'changed by someone else')
+
+
+class ContactsQueryTest(unittest.TestCase):
+
+  def test_require_all_deleted(self):
+    query = gdata.contacts.client.ContactsQuery(
+        showdeleted='true', requirealldeleted='true',
+        updated_min='2011-01-01T00:00:00Z')
+    http_request = atom.http_core.HttpRequest()
+    query.modify_request(http_request)
+    self.assertEqual(http_request.uri.query['requirealldeleted'], 'true')
+    self.assertEqual(http_request.uri.query['showdeleted'], 'true')
+
+
+def suite():
+  return conf.build_suite([ContactsSyncTest, BulkContactsTest,
+                           PhotoManagerTest, ContactsQueryTest])
+
+
+if __name__ == '__main__':
+  unittest.main()
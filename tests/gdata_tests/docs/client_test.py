@@ -0,0 +1,341 @@
+#!/usr/bin/python
+#
+# Copyright 2009 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+
+import os
+import shutil
+import tempfile
+import unittest
+import StringIO
+import atom.data
+import atom.http_core
+import atom.mock_http_core
+import gdata.client
+import gdata.docs.client
+import gdata.docs.data
+import gdata.test_config as conf
+
+
+CHANGE_ENTRY = """<entry xmlns="http://www.w3.org/2005/Atom"
+    xmlns:docs="http://schemas.google.com/docs/2007"
+    xmlns:gd="http://schemas.google.com/g/2005" gd:etag='%(etag)s'>
+  <id>https://docs.google.com/feeds/default/private/changes/%(changestamp)i</id>
+  <category scheme="http://schemas.google.com/g/2005#kind"
+    term="http://schemas.google.com/docs/2007#%(type)s" label="%(type)s"/>
+  <title>%(title)s</title>
+  <gd:resourceId>%(id)s</gd:resourceId>
+  <docs:changestamp value="%(changestamp)i"/>
+  %(extra)s
+</entry>"""
+
+PARENT_LINK = ('<link rel="http://schemas.google.com/docs/2007#parent" '
+               'type="application/atom+xml" href="https://docs.google.com/'
+               'feeds/default/private/full/%s"/>')
+
+
+class ChangesServer(atom.mock_http_core.FakeHttpServer):
+  """Serves the changes feed from a list of changes made to resources."""
+
+  def __init__(self):
+    atom.mock_http_core.FakeHttpServer.__init__(self)
+    self.changes = {}
+    self.changestamp = 0
+
+  def change(self, resource_id, title='', parents=(), etag='"e1"',
+             removed=False, trashed=False, resource_type='document'):
+    self.changestamp += 1
+    extra = ''.join([PARENT_LINK % parent.replace(':', '%3A')
+                     for parent in parents])
+    if removed:
+      extra += '<docs:removed/>'
+    if trashed:
+      extra += '<gd:deleted/>'
+    # The feed only lists the latest change to each resource.
+    self.changes[resource_id] = CHANGE_ENTRY % {
+        'etag': etag, 'changestamp': self.changestamp, 'title': title,
+        'id': resource_id, 'extra': extra, 'type': resource_type}, \
+        self.changestamp
+
+  def respond(self, http_request, body):
+    start = int(http_request.uri.query.get('start-index', 1))
+    max_results = int(http_request.uri.query.get('max-results', 100))
+    changes = sorted([(changestamp, xml)
+                      for xml, changestamp in self.changes.itervalues()
+                      if changestamp >= start])
+    next_link = ''
+    if len(changes) > max_results:
+      next_link = ('<link rel="next" href="https://docs.google.com/feeds/'
+                   'default/private/changes?start-index=%i&amp;'
+                   'max-results=%i"/>' % (changes[max_results][0],
+                                          max_results))
+    body = ('<feed xmlns="http://www.w3.org/2005/Atom">%s%s</feed>' % (
+        next_link, ''.join([xml for changestamp, xml
+                            in changes[:max_results]])))
+    return atom.http_core.HttpResponse(200, 'OK', body=body)
+
+
+class ResourceSyncTest(unittest.TestCase):
+
+  def setUp(self):
+    self.state_dir = tempfile.mkdtemp()
+    self.state_path = os.path.join(self.state_dir, 'docs.json')
+    self.server = ChangesServer()
+    self.client = gdata.docs.client.DocsClient(http_client=self.server)
+
+  def tearDown(self):
+    shutil.rmtree(self.state_dir)
+
+  def test_first_sync_reads_all_changes(self):
+    self.server.change('folder:f1', title='Reports', resource_type='folder')
+    for i in xrange(250):
+      self.server.change('document:d%i' % i, title='Doc %i' % i,
+                         parents=['folder:f1'])
+    sync = gdata.docs.client.ResourceSync(self.client)
+    result = sync.sync()
+    self.assertEqual(len(result.added), 251)
+    self.assertEqual(result.changed, [])
+    self.assertEqual(result.changestamp, 251)
+    self.assertEqual(len(self.server.requests), 3)
+    resource = sync.resources['document:d7']
+    self.assertEqual(resource.title, 'Doc 7')
+    self.assertEqual(resource.etag, '"e1"')
+    self.assertEqual(resource.parents, ['folder:f1'])
+    self.assertEqual(resource.resource_type, 'document')
+    self.assertEqual(sync.resources['folder:f1'].resource_type, 'folder')
+
+  def test_later_syncs_read_new_changes(self):
+    self.server.change('document:a', title='A')
+    self.server.change('document:b', title='B')
+    self.server.change('document:c', title='C')
+    sync = gdata.docs.client.ResourceSync(self.client, self.state_path)
+    sync.sync()
+    self.server.change('document:a', title='A2', etag='"e2"')
+    self.server.change('document:b', removed=True)
+    self.server.change('document:d', title='D')
+    self.server.change('document:c', title='C', trashed=True)
+    result = sync.sync()
+    self.assertEqual(self.server.requests[-1].uri.query['start-index'], '4')
+    self.assertEqual(result.added, ['document:d'])
+    self.assertEqual(result.changed, ['document:a', 'document:c'])
+    self.assertEqual(result.removed, ['document:b'])
+    self.assertTrue(sync.resources['document:c'].trashed)
+    result = sync.sync()
+    self.assertEqual((result.added, result.changed, result.removed),
+                     ([], [], []))
+    self.assertEqual(result.changestamp, 7)
+
+  def test_state_is_saved(self):
+    self.server.change('document:a', title=u'\xc5 doc')
+    gdata.docs.client.ResourceSync(self.client, self.state_path).sync()
+    self.server.change('document:b', title='B')
+    sync = gdata.docs.client.ResourceSync(self.client, self.state_path)
+    self.assertEqual(sync.changestamp, 1)
+    self.assertEqual(sync.resources['document:a'].title, u'\xc5 doc')
+    result = sync.Sync()
+    self.assertEqual(result.added, ['document:b'])
+    self.assertEqual(
+        len(gdata.docs.client.ResourceSync(self.client,
+                                           self.state_path).resources), 2)
+
+
+class FilesServer(atom.mock_http_core.FakeHttpServer):
+  """Serves files by path, honoring Range requests with a matching If-Range.
+
+  The ETag of each file is its length.
+  """
+
+  def __init__(self, files):
+    atom.mock_http_core.FakeHttpServer.__init__(self)
+    self.files = files
+
+  def respond(self, http_request, body):
+    content = self.files.get(http_request.uri.path)
+    if content is None:
+      return atom.http_core.HttpResponse(404, 'Not Found', body='')
+    etag = '"%i"' % len(content)
+    range_header = http_request.headers.get('Range')
+    if range_header and http_request.headers.get('If-Range') == etag:
+      start = int(range_header[len('bytes='):-1])
+      if start >= len(content):
+        return atom.http_core.HttpResponse(416, 'Not satisfiable', body='')
+      return atom.http_core.HttpResponse(
+          206, 'Partial Content', {'ETag': etag},
+          StringIO.StringIO(content[start:]))
+    return atom.http_core.HttpResponse(200, 'OK', {'ETag': etag},
+                                       StringIO.StringIO(content))
+
+
+class DownloadTest(unittest.TestCase):
+
+  def test_download_resource_to_writer(self):
+    server = FilesServer(
+        {'/feeds/download/spreadsheets/Export': 'a,b\n1,2\n'})
+    client = gdata.docs.client.DocsClient(http_client=server)
+    entry = gdata.docs.data.Resource(
+        type='spreadsheet', content=atom.data.Content(
+            src='https://spreadsheets.google.com/feeds/download/'
+                'spreadsheets/Export?key=abc'))
+    output = StringIO.StringIO()
+    self.assertEqual(client.download_resource(
+        entry, output, extra_params={'exportFormat': 'csv'}), 8)
+    self.assertEqual(output.getvalue(), 'a,b\n1,2\n')
+    self.assertEqual(server.requests[0].uri.query['exportFormat'], 'csv')
+
+  def test_download_error(self):
+    client = gdata.docs.client.DocsClient(http_client=FilesServer({}))
+    self.assertRaises(gdata.client.RequestError, client._download_file,
+                      'https://docs.google.com/file', StringIO.StringIO())
+
+
+class DownloadManagerTest(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.temp_dir)
+
+  def resource(self, resource_id, resource_type, path):
+    entry = gdata.docs.data.Resource(
+        type=resource_type, content=atom.data.Content(
+            src='https://docs.google.com%s?id=%s' % (path, resource_id)))
+    entry.resource_id = gdata.docs.data.ResourceId(text=resource_id)
+    return entry
+
+  def read(self, name):
+    return open(os.path.join(self.temp_dir, name), 'rb').read()
+
+  def test_download_resources(self):
+    server = FilesServer({'/file': 'x' * 1000, '/Export': 'pdf data'})
+    client = gdata.docs.client.DocsClient(http_client=server)
+    entries = [self.resource('file:f%i' % i, 'file', '/file')
+               for i in xrange(10)]
+    entries.append(self.resource('document:d1', 'document', '/Export'))
+    entries.append(self.resource('folder:c1', 'folder', '/folder'))
+    manager = gdata.docs.client.DownloadManager(client, max_concurrent=3)
+    manager.add_resources(entries, self.temp_dir, {'document': 'pdf'})
+    report = manager.run()
+    self.assertEqual(report.failed, [])
+    self.assertEqual(len(report.completed), 11)
+    self.assertEqual(report.completed[0],
+                     (os.path.join(self.temp_dir, 'file_f0'), 1000))
+    self.assertEqual(report.bytes_downloaded, 10008)
+    self.assertTrue(report.get_throughput() > 0)
+    self.assertEqual(self.read('file_f9'), 'x' * 1000)
+    self.assertEqual(self.read('document_d1.pdf'), 'pdf data')
+    self.assertEqual(len(server.requests), 11)
+    self.assertTrue([http_request for http_request in server.requests
+                     if http_request.uri.query.get('exportFormat') == 'pdf'])
+
+  def test_duplicate_uris_are_downloaded_once(self):
+    server = FilesServer({'/file': 'content'})
+    client = gdata.docs.client.DocsClient(http_client=server)
+    entry = self.resource('file:f1', 'file', '/file')
+    manager = gdata.docs.client.DownloadManager(client)
+    manager.add(entry, os.path.join(self.temp_dir, 'a'))
+    manager.add(entry, os.path.join(self.temp_dir, 'b'))
+    report = manager.Run()
+    self.assertEqual(len(server.requests), 1)
+    self.assertEqual([path for path, size in report.completed],
+                     [os.path.join(self.temp_dir, 'a'),
+                      os.path.join(self.temp_dir, 'b')])
+    self.assertEqual(self.read('b'), 'content')
+
+  def write_partial(self, name, content, etag):
+    path = os.path.join(self.temp_dir, name)
+    open(path, 'wb').write(content)
+    open(path + '.etag', 'wb').write(etag)
+
+  def test_partial_files_are_resumed(self):
+    server = FilesServer({'/file': '0123456789'})
+    client = gdata.docs.client.DocsClient(http_client=server)
+    self.write_partial('file_f1', '0123', '"10"')
+    manager = gdata.docs.client.DownloadManager(client, resume=True)
+    manager.add_resources([self.resource('file:f1', 'file', '/file')],
+                          self.temp_dir)
+    report = manager.run()
+    self.assertEqual(server.requests[0].headers.get('Range'), 'bytes=4-')
+    self.assertEqual(self.read('file_f1'), '0123456789')
+    self.assertEqual(report.bytes_downloaded, 6)
+    self.assertEqual(report.completed[0][1], 10)
+
+  def test_changed_files_are_downloaded_again(self):
+    server = FilesServer({'/file': '012'})
+    client = gdata.docs.client.DocsClient(http_client=server)
+    self.write_partial('file_f1', '0123', '"10"')
+    manager = gdata.docs.client.DownloadManager(client, resume=True)
+    manager.add_resources([self.resource('file:f1', 'file', '/file')],
+                          self.temp_dir)
+    report = manager.run()
+    self.assertEqual(self.read('file_f1'), '012')
+    self.assertEqual(report.completed[0][1], 3)
+
+  def test_existing_files_are_overwritten_by_default(self):
+    server = FilesServer({'/file': '0123456789'})
+    client = gdata.docs.client.DocsClient(http_client=server)
+    self.write_partial('file_f1', '0123', '"10"')
+    manager = gdata.docs.client.DownloadManager(client)
+    manager.add_resources([self.resource('file:f1', 'file', '/file')],
+                          self.temp_dir)
+    report = manager.run()
+    self.assertEqual(server.requests[0].headers.get('Range'), None)
+    self.assertEqual(self.read('file_f1'), '0123456789')
+    self.assertEqual(report.bytes_downloaded, 10)
+
+  def test_exports_are_not_resumed(self):
+    server = FilesServer({'/Export': 'pdf data'})
+    client = gdata.docs.client.DocsClient(http_client=server)
+    self.write_partial('document_d1.pdf', 'pdf', '"8"')
+    manager = gdata.docs.client.DownloadManager(client, resume=True)
+    manager.add_resources(
+        [self.resource('document:d1', 'document', '/Export')],
+        self.temp_dir, {'document': 'pdf'})
+    report = manager.run()
+    self.assertEqual(server.requests[0].headers.get('Range'), None)
+    self.assertEqual(self.read('document_d1.pdf'), 'pdf data')
+    self.assertEqual(report.bytes_downloaded, 8)
+
+  def test_errors_are_reported(self):
+    server = FilesServer({'/file': 'content'})
+    client = gdata.docs.client.DocsClient(http_client=server)
+    missing = self.resource('file:f2', 'file', '/missing')
+    manager = gdata.docs.client.DownloadManager(client)
+    manager.add(self.resource('file:f1', 'file', '/file'),
+                os.path.join(self.temp_dir, 'a'))
+    manager.add(missing, os.path.join(self.temp_dir, 'b'))
+    report = manager.run()
+    self.assertEqual(len(report.completed), 1)
+    self.assertEqual(len(report.failed), 1)
+    entry, file_path, error = report.failed[0]
+    self.assertTrue(entry is missing)
+    self.assertEqual(error.status, 404)
+
+  def test_plain_http_client_is_pooled(self):
+    client = gdata.docs.client.DocsClient()
+    http_client = client.http_client
+    manager = gdata.docs.client.DownloadManager(client)
+    self.assertEqual(manager.run().completed, [])
+    self.assertTrue(client.http_client is http_client)
+
+
+def suite():
+  return conf.build_suite([ResourceSyncTest, DownloadTest,
+                           DownloadManagerTest])
+
+
+if __name__ == '__main__':
+  unittest.main()
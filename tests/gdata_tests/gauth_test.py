@@ -22,6 +22,7 @@ __author__ = 'j.s@google.com (Jeff Scudder)'
 
 
 import unittest
+import urllib
 import gdata.gauth
 import atom.http_core
 import gdata.test_config as conf
@@ -346,6 +347,55 @@ class TokensToAndFromBlobsTest(unittest.TestCase):
     self.assert_(copy.access_token is None)
     self.assert_(copy.refresh_token is None)
 
+  def test_dump_and_load_tokens(self):
+    tokens = [
+        gdata.gauth.ClientLoginToken('test|key,1'),
+        gdata.gauth.AuthSubToken('key-=', ['http://example.com', '']),
+        gdata.gauth.OAuthHmacToken('consumer', 'secret', 'token', '',
+                                   gdata.gauth.ACCESS_TOKEN),
+        gdata.gauth.TwoLeggedOAuthHmacToken('example.com', 'secret',
+                                            'liz@example.com'),
+        gdata.gauth.TwoLeggedOAuthHmacToken('example.com', 'secret',
+                                            'jo@example.com')]
+    blob = gdata.gauth.dump_tokens(tokens)
+    # The shared consumer key and secret are only stored once.
+    self.assertEqual(blob.count('"example.com"'), 1)
+    self.assertEqual(blob.count('"secret"'), 1)
+    copies = gdata.gauth.load_tokens(blob)
+    self.assertEqual(len(copies), 5)
+    self.assertEqual(copies[0].token_string, 'test|key,1')
+    self.assert_(isinstance(copies[0].token_string, str))
+    self.assertEqual(copies[1].scopes, ['http://example.com', ''])
+    self.assert_(isinstance(copies[2], gdata.gauth.OAuthHmacToken))
+    self.assertEqual(copies[2].token_secret, '')
+    self.assertEqual(copies[2].auth_state, gdata.gauth.ACCESS_TOKEN)
+    self.assert_(copies[2].next is None)
+    for token, copy in zip(tokens[3:], copies[3:]):
+      self.assert_(isinstance(copy, gdata.gauth.TwoLeggedOAuthHmacToken))
+      self.assertEqual(copy.consumer_key, 'example.com')
+      self.assertEqual(copy.consumer_secret, 'secret')
+      self.assertEqual(copy.requestor_id, token.requestor_id)
+
+  def test_load_version_1_tokens(self):
+    tokens = [gdata.gauth.ClientLoginToken('test|key,1'),
+              gdata.gauth.TwoLeggedOAuthHmacToken('example.com', 'secret',
+                                                  'liz@example.com')]
+    blob = gdata.gauth.dump_tokens(tokens, version=1)
+    self.assertEqual(blob, ','.join([gdata.gauth.token_to_blob(t)
+                                     for t in tokens]))
+    copies = gdata.gauth.load_tokens(blob)
+    self.assertEqual(copies[0].token_string, 'test|key,1')
+    self.assertEqual(copies[1].requestor_id, 'liz@example.com')
+
+  def test_token_subclass_conversion(self):
+    class MyToken(gdata.gauth.TwoLeggedOAuthHmacToken):
+      pass
+
+    copy = gdata.gauth.token_from_blob(gdata.gauth.token_to_blob(
+        MyToken('example.com', 'secret', 'liz@example.com')))
+    self.assert_(isinstance(copy, gdata.gauth.TwoLeggedOAuthHmacToken))
+    self.assertEqual(copy.requestor_id, 'liz@example.com')
+
   def test_illegal_token_types(self):
     class MyToken(object):
       pass
@@ -484,6 +534,51 @@ class OAuthHmacTokenTests(unittest.TestCase):
         next='http://googlecodesamples.com/oauth_playground/index.php')
     self.assertEqual(signature, 'kFAgTTFDIWz4/xAabIlrcZZMTq8=')
 
+  def _header_params(self, request):
+    header = request.headers['Authorization']
+    self.assert_(header.startswith('OAuth '))
+    params = {}
+    for pair in header[len('OAuth '):].split(', '):
+      key, value = pair.split('=', 1)
+      params[key] = urllib.unquote(value.strip('"'))
+    return params
+
+  def test_token_signature_matches_generated_signature(self):
+    token = gdata.gauth.OAuthHmacToken(
+        'consumer', 'consumer secret', 'token', 'token/secret',
+        gdata.gauth.ACCESS_TOKEN)
+    for i in xrange(3):
+      request = atom.http_core.HttpRequest(
+          'http://www.google.com/m8/feeds/contacts/default/full?max-results=5',
+          'GET')
+      token.modify_request(request)
+      params = self._header_params(request)
+      self.assertEqual(len(params['oauth_nonce']), 15)
+      self.assertEqual(
+          params['oauth_signature'],
+          gdata.gauth.generate_hmac_signature(
+              request, 'consumer', 'consumer secret',
+              params['oauth_timestamp'], params['oauth_nonce'], '1.0',
+              next=None, token='token', token_secret='token/secret'))
+
+  def test_two_legged_token_uses_changed_secret(self):
+    token = gdata.gauth.TwoLeggedOAuthHmacToken(
+        'example.com', 'secret', 'user@example.com')
+    token.modify_request(atom.http_core.HttpRequest(
+        'https://apps-apis.google.com/a/feeds/user/', 'GET'))
+    token.consumer_secret = 'new secret'
+    request = atom.http_core.HttpRequest(
+        'https://apps-apis.google.com/a/feeds/user/', 'GET')
+    token.modify_request(request)
+    params = self._header_params(request)
+    self.assertEqual(request.uri.query['xoauth_requestor_id'],
+                     'user@example.com')
+    self.assertEqual(
+        params['oauth_signature'],
+        gdata.gauth.generate_hmac_signature(
+            request, 'example.com', 'new secret', params['oauth_timestamp'],
+            params['oauth_nonce'], '1.0', next=None))
+
 
 class OAuthRsaTokenTests(unittest.TestCase):
 
@@ -0,0 +1,319 @@
+#!/usr/bin/python
+#
+# Copyright (C) 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests for text_db which do not need a server."""
+
+
+import unittest
+import atom
+import atom.http_core
+import atom.mock_http_core
+import gdata.spreadsheet
+import gdata.spreadsheet.text_db
+import gdata.spreadsheet.service
+
+
+ROW_URL = 'https://spreadsheets.google.com/feeds/list/key/od6/private/full/%s'
+
+
+class SpreadsheetServer(atom.mock_http_core.FakeHttpServer):
+  """Serves a list feed from rows stored in memory.
+
+  Inserted, updated and deleted rows are recorded in calls. Updates to rows
+  in stale are rejected as conflicts.
+  """
+
+  def __init__(self):
+    atom.mock_http_core.FakeHttpServer.__init__(self)
+    self.rows = []
+    self.clock = 0
+    self.calls = []
+    self.stale = set()
+    self.row_count = 0
+
+  def SetRow(self, row_id, content, position=None):
+    """Changes a row, or adds it at position or after the last row."""
+    self.clock += 1
+    updated = '2010-01-01T00:00:%02d.000Z' % self.clock
+    for i, row in enumerate(self.rows):
+      if row[0] == row_id:
+        self.rows[i] = (row_id, content, updated)
+        return
+    if position is None:
+      position = len(self.rows)
+    self.rows.insert(position, (row_id, content, updated))
+
+  def DeleteRow(self, row_id):
+    self.rows = [row for row in self.rows if row[0] != row_id]
+
+  def respond(self, http_request, body):
+    # Paths look like /feeds/list/<key>/<worksheet>/private/full/<row>/<version>
+    path = http_request.uri.path.split('/')
+    wksht_id = path[4]
+    if http_request.method == 'GET':
+      return self.ListFeed(path[3], wksht_id, http_request.uri.query)
+    if http_request.method == 'POST':
+      self.row_count += 1
+      row_id = 'new%i' % self.row_count
+      name = gdata.spreadsheet.SpreadsheetsListFromString(body).custom['name']
+      self.calls.append(('insert', wksht_id, name.text))
+      return atom.http_core.HttpResponse(201, 'Created',
+                                         body=str(RowEntry(row_id)))
+    row_id = path[7]
+    if http_request.method == 'DELETE':
+      self.calls.append(('delete', row_id))
+      return atom.http_core.HttpResponse(200, 'OK', body='')
+    if row_id in self.stale:
+      return atom.http_core.HttpResponse(409, 'Conflict', body='')
+    name = gdata.spreadsheet.SpreadsheetsListFromString(body).custom['name']
+    self.calls.append(('update', row_id, name.text))
+    return atom.http_core.HttpResponse(200, 'OK',
+                                       body=str(RowEntry(row_id, 2)))
+
+  def ListFeed(self, key, wksht_id, query):
+    rows = [row for row in self.rows
+            if row[2] >= query.get('updated-min', '')]
+    total = len(rows)
+    if 'max-results' in query:
+      rows = rows[:int(query['max-results'])]
+    entries = []
+    for row_id, content, updated in rows:
+      values = ''.join(['<gsx:%s>%s</gsx:%s>' % (name, value, name)
+                        for name, value in content.iteritems()])
+      entries.append('<entry><id>http://example.com/%s/%s/%s</id>'
+                     '<updated>%s</updated>%s</entry>' % (
+                         key, wksht_id, row_id, updated, values))
+    return atom.http_core.HttpResponse(200, 'OK', body=(
+        '<feed xmlns="http://www.w3.org/2005/Atom" '
+        'xmlns:openSearch="http://a9.com/-/spec/opensearchrss/1.0/" '
+        'xmlns:gsx="http://schemas.google.com/spreadsheets/2006/extended">'
+        '<updated>2010-01-01T00:00:%02d.000Z</updated>'
+        '<openSearch:totalResults>%i</openSearch:totalResults>%s</feed>' % (
+            self.clock, total, ''.join(entries))))
+
+
+def RowEntry(row_id, version=1):
+  return gdata.spreadsheet.SpreadsheetsList(
+      atom_id=atom.Id(text=ROW_URL % row_id),
+      link=[atom.Link(rel='edit', href='%s/%i' % (ROW_URL % row_id, version))])
+
+
+def DatabaseClient(server):
+  """Returns a DatabaseClient which sends its requests to server."""
+  client = gdata.spreadsheet.text_db.DatabaseClient()
+  client._GetSpreadsheetsClient().http_client = server
+  return client
+
+
+class TableSnapshotTest(unittest.TestCase):
+
+  def setUp(self):
+    self.server = SpreadsheetServer()
+    for i, (name, cost) in enumerate([('toy', '5'), ('book', '19.50'),
+                                      ('lamp', '40'), ('sofa', '900'),
+                                      ('rug', 'n/a')]):
+      self.server.SetRow('r%i' % i, {'name': name, 'cost': cost})
+    self.table = gdata.spreadsheet.text_db.Table(
+        name='items',
+        worksheet_entry=atom.Entry(atom_id=atom.Id(text='http://x/od6')),
+        database_client=DatabaseClient(self.server),
+        spreadsheet_key='key')
+
+  def names(self, records):
+    return [record.content['name'] for record in records]
+
+  def check_queries(self, snapshot):
+    self.assertEqual(self.names(snapshot.FindRecords('name == lamp')),
+                     ['lamp'])
+    self.assertEqual(self.names(snapshot.FindRecords('cost < 19.5')),
+                     ['toy'])
+    self.assertEqual(self.names(snapshot.FindRecords('cost <= 19.5')),
+                     ['toy', 'book'])
+    self.assertEqual(self.names(snapshot.FindRecords('cost > 40')),
+                     ['sofa', 'rug'])
+    self.assertEqual(self.names(snapshot.FindRecords('cost >= 40')),
+                     ['lamp', 'sofa', 'rug'])
+    self.assertEqual(self.names(snapshot.FindRecords(
+        '(cost < 19.50 and name != toy) or cost > 500')), ['sofa', 'rug'])
+    self.assertEqual(self.names(snapshot.FindRecords(
+        'cost > 1 && name = "book" || name == sofa')), ['book', 'sofa'])
+    self.assertEqual(snapshot.FindRecords('cost == 19.5')[0].row_id, 'r1')
+    self.assertEqual(snapshot.FindRecords('color == red'), [])
+
+  def testQueriesWithoutIndexes(self):
+    snapshot = self.table.Snapshot()
+    self.check_queries(snapshot)
+
+  def testQueriesWithIndexes(self):
+    snapshot = self.table.Snapshot(['name', 'cost'])
+    self.check_queries(snapshot)
+
+  def testQueriesAreAnsweredLocally(self):
+    snapshot = self.table.Snapshot(['name'])
+    request_count = len(self.server.requests)
+    snapshot.FindRecords('name == toy')
+    snapshot.GetRecords(1, 3)
+    snapshot.GetRecord(row_id='r2')
+    self.assertEqual(len(self.server.requests), request_count)
+    self.assertEqual(self.names(snapshot.GetRecords(2, 3)), ['book', 'lamp'])
+    self.assertEqual(snapshot.GetRecord(row_id='r2').content['name'], 'lamp')
+    self.assertEqual(snapshot.GetRecord(row_number=1).content['name'], 'toy')
+    self.assertEqual(snapshot.GetRecord(row_number=6), None)
+
+  def testInvalidQuery(self):
+    snapshot = self.table.Snapshot()
+    for query in ('name ==', 'name toy', '(name == toy', 'name == toy)'):
+      self.assertRaises(gdata.spreadsheet.text_db.Error,
+                        snapshot.FindRecords, query)
+
+  def testRefreshFetchesChangedRows(self):
+    snapshot = self.table.Snapshot(['name'])
+    self.server.SetRow('r0', {'name': 'kite', 'cost': '7'})
+    request_count = len(self.server.requests)
+    snapshot.Refresh()
+    # The changed rows and the row count are requested, without a reload.
+    self.assertEqual(len(self.server.requests), request_count + 2)
+    self.assertEqual(self.server.requests[-2].uri.query['updated-min'],
+                     '2010-01-01T00:00:05.000Z')
+    self.assertEqual(self.names(snapshot.records),
+                     ['kite', 'book', 'lamp', 'sofa', 'rug'])
+    self.assertEqual(snapshot.FindRecords('name == toy'), [])
+    self.assertEqual(self.names(snapshot.FindRecords('name == kite')),
+                     ['kite'])
+
+  def testRefreshPlacesInsertedRows(self):
+    snapshot = self.table.Snapshot(['name'])
+    self.server.SetRow('r5', {'name': 'desk', 'cost': '120'}, position=2)
+    self.server.SetRow('r6', {'name': 'vase', 'cost': '15'})
+    snapshot.Refresh()
+    self.assertEqual(self.names(snapshot.records),
+                     ['toy', 'book', 'desk', 'lamp', 'sofa', 'rug', 'vase'])
+    self.assertEqual(snapshot.GetRecord(row_number=3).content['name'], 'desk')
+    self.assertEqual(self.names(snapshot.GetRecords(3, 4)), ['desk', 'lamp'])
+    self.assertEqual(snapshot.GetRecord(row_id='r2').content['name'], 'lamp')
+
+  def testRefreshReloadsAfterDelete(self):
+    snapshot = self.table.Snapshot(['name'])
+    self.server.DeleteRow('r1')
+    snapshot.Refresh()
+    self.assertEqual(self.names(snapshot.records),
+                     ['toy', 'lamp', 'sofa', 'rug'])
+    self.assertEqual(snapshot.FindRecords('name == book'), [])
+
+  def testRefreshAfterDeleteAndInsert(self):
+    snapshot = self.table.Snapshot(['name'])
+    self.server.DeleteRow('r1')
+    self.server.SetRow('r5', {'name': 'desk', 'cost': '120'})
+    snapshot.Refresh()
+    self.assertEqual(self.names(snapshot.records),
+                     ['toy', 'lamp', 'sofa', 'rug', 'desk'])
+    self.assertEqual(snapshot.FindRecords('name == book'), [])
+
+
+class SessionTest(unittest.TestCase):
+
+  def setUp(self):
+    self.server = SpreadsheetServer()
+    self.client = DatabaseClient(self.server)
+    self.table = gdata.spreadsheet.text_db.Table(
+        name='items',
+        worksheet_entry=atom.Entry(atom_id=atom.Id(text='http://x/od6')),
+        database_client=self.client, spreadsheet_key='key')
+
+  def ExistingRecord(self, row_id, name):
+    return gdata.spreadsheet.text_db.Record(
+        content={'name': name}, row_entry=RowEntry(row_id),
+        spreadsheet_key='key', worksheet_id='od6', database_client=self.client)
+
+  def testNothingIsSentBeforeCommit(self):
+    session = self.table.StartSession()
+    record = session.AddRecord({'name': 'toy'})
+    session.UpdateRecord(self.ExistingRecord('r1', 'book'))
+    session.DeleteRecord(self.ExistingRecord('r2', 'lamp'))
+    self.assertEqual(self.server.calls, [])
+    self.assertEqual(record.entry, None)
+    self.assertEqual(session.Commit(), [])
+    self.assertEqual(sorted(self.server.calls), [
+        ('delete', 'r2'), ('insert', 'od6', 'toy'), ('update', 'r1', 'book')])
+    self.assertEqual(record.row_id, 'new1')
+    self.assertEqual(session.Commit(), [])
+    self.assertEqual(len(self.server.calls), 3)
+
+  def testInsertsKeepTheirOrder(self):
+    session = self.table.StartSession(max_concurrent=8)
+    for i in xrange(20):
+      session.AddRecord({'name': str(i)})
+    session.Commit()
+    self.assertEqual([call[2] for call in self.server.calls],
+                     [str(i) for i in xrange(20)])
+
+  def testChangesToOneRecordAreCombined(self):
+    session = self.table.StartSession()
+    record = self.ExistingRecord('r1', 'book')
+    session.UpdateRecord(record)
+    record.content['name'] = 'novel'
+    session.UpdateRecord(record)
+    added = session.AddRecord({'name': 'toy'})
+    added.content['name'] = 'kite'
+    session.UpdateRecord(added)
+    removed = session.AddRecord({'name': 'lamp'})
+    session.DeleteRecord(removed)
+    deleted = self.ExistingRecord('r3', 'sofa')
+    session.UpdateRecord(deleted)
+    session.DeleteRecord(deleted)
+    self.assertRaises(gdata.spreadsheet.text_db.Error,
+                      session.UpdateRecord, deleted)
+    session.Commit()
+    self.assertEqual(sorted(self.server.calls), [
+        ('delete', 'r3'), ('insert', 'od6', 'kite'),
+        ('update', 'r1', 'novel')])
+    self.assertEqual(record.entry.GetEditLink().href, ROW_URL % 'r1' + '/2')
+
+  def testConflictsAreReported(self):
+    self.server.stale.add('r2')
+    session = self.table.StartSession()
+    stale = self.ExistingRecord('r2', 'lamp')
+    session.UpdateRecord(self.ExistingRecord('r1', 'book'))
+    session.UpdateRecord(stale)
+    failures = session.Commit()
+    self.assertEqual(len(failures), 1)
+    operation, record, error = failures[0]
+    self.assertEqual(operation, gdata.spreadsheet.text_db.UPDATE)
+    self.assert_(record is stale)
+    self.assertEqual(error.args[0]['status'], 409)
+    self.assertEqual(self.server.calls, [('update', 'r1', 'book')])
+
+  def testDatabaseSessionNeedsTable(self):
+    database = gdata.spreadsheet.text_db.Database(database_client=self.client)
+    session = database.StartSession()
+    self.assertRaises(gdata.spreadsheet.text_db.Error, session.AddRecord,
+                      {'name': 'toy'})
+    self.assertRaises(gdata.spreadsheet.text_db.Error, session.UpdateRecord,
+                      gdata.spreadsheet.text_db.Record(content={'a': 'b'}))
+    session.AddRecord({'name': 'toy'}, table=self.table)
+    session.Discard()
+    self.assertEqual(session.Commit(), [])
+    self.assertEqual(self.server.calls, [])
+
+
+def suite():
+  return unittest.TestSuite((unittest.makeSuite(TableSnapshotTest, 'test'),
+                             unittest.makeSuite(SessionTest, 'test')))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2009 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+# This module is used for version 2 of the Google Data APIs.
+
+
+import unittest
+import atom.core
+import atom.http_core
+import atom.mock_http_core
+import gdata.data
+import gdata.spreadsheets.client
+import gdata.spreadsheets.data
+import gdata.test_config as conf
+
+
+class CellsServer(atom.mock_http_core.FakeHttpServer):
+  """Serves a cells feed and applies batch cell updates to it."""
+
+  def __init__(self, cells=None, rejected=()):
+    atom.mock_http_core.FakeHttpServer.__init__(self)
+    self.cells = dict(cells or {})
+    self.rejected = set(rejected)
+    self.batch_sizes = []
+
+  def respond(self, http_request, body):
+    if http_request.method == 'GET':
+      feed = gdata.spreadsheets.data.CellsFeed()
+      for (row, col), value in sorted(self.cells.items()):
+        feed.entry.append(gdata.spreadsheets.data.CellEntry(
+            cell=gdata.spreadsheets.data.Cell(
+                row=str(row), col=str(col), input_value=value)))
+      return atom.http_core.HttpResponse(200, 'OK', body=feed.to_string())
+    request_feed = atom.core.parse(body, gdata.spreadsheets.data.CellsFeed)
+    result = gdata.spreadsheets.data.CellsFeed()
+    self.batch_sizes.append(len(request_feed.entry))
+    for entry in request_feed.entry:
+      position = (int(entry.cell.row), int(entry.cell.col))
+      if position in self.rejected:
+        status = gdata.data.BatchStatus(code='403', reason='Protected')
+      else:
+        self.cells[position] = entry.cell.input_value
+        status = gdata.data.BatchStatus(code='200', reason='Success')
+      result.entry.append(gdata.spreadsheets.data.CellEntry(
+          batch_id=entry.batch_id, batch_status=status, cell=entry.cell))
+    return atom.http_core.HttpResponse(200, 'OK', body=result.to_string())
+
+
+class WriteRangeTest(unittest.TestCase):
+
+  def create_client(self, server):
+    return gdata.spreadsheets.client.SpreadsheetsClient(http_client=server)
+
+  def test_only_changed_cells_are_sent(self):
+    server = CellsServer({(2, 2): 'Name', (2, 3): 'Hours', (3, 2): 'Joe'})
+    client = self.create_client(server)
+    failures = client.write_range('key', 'od6', 'B2',
+                                  [['Name', 'Hours'], ['Joe', 8, None]])
+    self.assertEqual(failures, [])
+    self.assertEqual(server.batch_sizes, [1])
+    self.assertEqual(server.cells[(3, 3)], '8')
+    self.assertFalse((3, 4) in server.cells)
+
+  def test_cleared_cells_are_sent(self):
+    server = CellsServer({(1, 1): 'x'})
+    client = self.create_client(server)
+    client.write_range('key', 'od6', (1, 1), [[None, '']])
+    self.assertEqual(server.batch_sizes, [1])
+    self.assertEqual(server.cells[(1, 1)], None)
+
+  def test_all_cells_sent_without_compare(self):
+    server = CellsServer({(1, 1): 'a'})
+    client = self.create_client(server)
+    client.write_range('key', 'od6', 'R1C1', [['a', 'b']], compare=False)
+    self.assertEqual(server.batch_sizes, [2])
+
+  def test_batches_are_split(self):
+    server = CellsServer()
+    client = self.create_client(server)
+    rows = [[str(row * 10 + col) for col in range(10)] for row in range(25)]
+    failures = client.write_range('key', 'od6', (1, 1), rows, batch_size=40,
+                                  max_concurrent=3)
+    self.assertEqual(failures, [])
+    self.assertEqual(sorted(server.batch_sizes), [10] + [40] * 6)
+    self.assertEqual(len(server.cells), 250)
+    self.assertEqual(server.cells[(25, 10)], '249')
+
+  def test_failed_cells_are_reported(self):
+    server = CellsServer(rejected=[(1, 2), (3, 1)])
+    client = self.create_client(server)
+    failures = client.write_range('key', 'od6', 'A1',
+                                  [['a', 'b'], ['c', 'd'], ['e', 'f']],
+                                  batch_size=2)
+    self.assertEqual([(f.cell.row, f.cell.col) for f in failures],
+                     [('1', '2'), ('3', '1')])
+    self.assertEqual(failures[0].cell.input_value, 'b')
+    self.assertEqual(failures[0].batch_status.code, '403')
+    self.assertEqual(len(server.cells), 4)
+
+  def test_failed_batches_are_reported(self):
+    server = CellsServer()
+    server.fail_requests(method='POST')
+    client = self.create_client(server)
+    failures = client.write_range('key', 'od6', 'A1', [['a', 'b']])
+    self.assertEqual(len(failures), 2)
+    self.assertEqual(failures[0].batch_status.code, '503')
+
+  def test_cell_position(self):
+    self.assertEqual(gdata.spreadsheets.client._cell_position('A1'), (1, 1))
+    self.assertEqual(gdata.spreadsheets.client._cell_position('ab12'),
+                     (12, 28))
+    self.assertEqual(gdata.spreadsheets.client._cell_position('R3C4'), (3, 4))
+    self.assertEqual(gdata.spreadsheets.client._cell_position((2, 5)), (2, 5))
+    self.assertRaises(ValueError, gdata.spreadsheets.client._cell_position,
+                      'B')
+
+
+def suite():
+  return conf.build_suite([WriteRangeTest])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -21,6 +21,8 @@
 __author__ = 'j.s@google.com (Jeff Scudder)'
 
 
+import math
+import StringIO
 import unittest
 import gdata.spreadsheets.data
 import gdata.test_config as conf
@@ -477,6 +479,27 @@ CELLS_FEED = """<feed xmlns="http://www.w3.org/2005/Atom"
 </feed>"""
 
 
+VALUES_FEED = """<feed xmlns="http://www.w3.org/2005/Atom"
+    xmlns:gs="http://schemas.google.com/spreadsheets/2006">
+  <id>http://spreadsheets.google.com/feeds/cells/k/w/private/full</id>
+  <link rel="next" type="application/atom+xml"
+    href="http://spreadsheets.google.com/feeds/cells/k/w/private/full?start-index=4"/>
+  <entry>
+    <title type="text">A1</title>
+    <gs:cell row="1" col="1" inputValue="Name">Name</gs:cell>
+  </entry>
+  <entry>
+    <title type="text">B1</title>
+    <gs:cell row="1" col="2" inputValue="Hours">Hours</gs:cell>
+  </entry>
+  <entry>
+    <title type="text">C3</title>
+    <gs:cell row="3" col="3" inputValue="=B3*2"
+      numericValue="5.0">5</gs:cell>
+  </entry>
+</feed>"""
+
+
 BATCH_CELLS = """<feed xmlns="http://www.w3.org/2005/Atom"
       xmlns:batch="http://schemas.google.com/gdata/batch"
       xmlns:gs="http://schemas.google.com/spreadsheets/2006">
@@ -599,6 +622,59 @@ class ListEntryTest(unittest.TestCase):
     self.assertEqual(row.updated.text, '2006-11-17T18:23:45.173Z')
     self.assertEqual(row.content.text, 'Hours: 10, Items: 2, IPM: 0.0033')
 
+  def test_values_follow_changes_to_elements(self):
+    row = atom.core.parse(NEW_ROW, gdata.spreadsheets.data.ListEntry)
+    self.assertEqual(row.get_value('hours'), '1')
+    extra = gdata.spreadsheets.data.ListRow(text='spam')
+    extra._qname = extra._qname % 'extra'
+    row._other_elements.append(extra)
+    self.assertEqual(row.get_value('extra'), 'spam')
+    row.extension_elements = []
+    self.assertEqual(row.get_value('hours'), None)
+    row.from_dict({'hours': '5', 'name': 'Jane'})
+    self.assertEqual(row.get_value('hours'), '5')
+    self.assertEqual(len(row._other_elements), 2)
+    self.assertEqual(row.to_dict(), {'hours': '5', 'name': 'Jane'})
+
+  def test_values_follow_replaced_elements(self):
+    row = atom.core.parse(NEW_ROW, gdata.spreadsheets.data.ListEntry)
+    self.assertEqual(row.get_value('hours'), '1')
+    position = [i for i, element in enumerate(row._other_elements)
+                if element._qname.endswith('}hours')][0]
+    replacement = gdata.spreadsheets.data.ListRow(text='7')
+    replacement._qname = replacement._qname % 'hours'
+    row._other_elements[position] = replacement
+    self.assertEqual(row.get_value('hours'), '7')
+    row.set_value('hours', '8')
+    self.assertEqual(replacement.text, '8')
+    # A delete followed by an append keeps the length unchanged.
+    del row._other_elements[position]
+    duplicate = gdata.spreadsheets.data.ListRow(text='9')
+    duplicate._qname = duplicate._qname % 'name'
+    row._other_elements.append(duplicate)
+    self.assertEqual(row.get_value('hours'), None)
+    self.assertEqual(row.get_value('name'), 'Elizabeth Bennet')
+    self.assertEqual(row.to_dict()['name'], 'Elizabeth Bennet')
+
+  def test_index_is_kept_up_to_date(self):
+    row = atom.core.parse(NEW_ROW, gdata.spreadsheets.data.ListEntry)
+    index = row._other_elements.get_column_index()
+    row.set_value('hours', '2')
+    row.set_value('new', 'value')
+    self.assert_(row._other_elements.get_column_index() is index)
+    self.assertEqual(index['new'].text, 'value')
+    row._other_elements.pop()
+    self.assert_(row._other_elements.get_column_index() is not index)
+    self.assertEqual(row.get_value('new'), None)
+
+  def test_feed_to_rows(self):
+    feed = atom.core.parse(LIST_FEED, gdata.spreadsheets.data.ListsFeed)
+    self.assertEqual(feed.to_rows(), [
+        {'name': 'Bingley', 'hours': '10', 'items': '2', 'ipm': '0.0033'},
+        {'name': 'Charlotte', 'hours': '60', 'items': '18000', 'ipm': '5'}])
+    self.assertEqual(feed.ToRows(['name', 'ipm', 'missing']),
+                     [('Bingley', '0.0033', None), ('Charlotte', '5', None)])
+
 
 class RecordEntryTest(unittest.TestCase):
 
@@ -662,6 +738,44 @@ class BatchRequestTest(unittest.TestCase):
     self.assertEqual(self.feed.entry[1].batch_id.text, '1')
 
 
+class ParseCellValuesTest(unittest.TestCase):
+
+  def test_input_values(self):
+    rows = []
+    next_uri = gdata.spreadsheets.data.parse_cell_values(
+        StringIO.StringIO(VALUES_FEED), rows)
+    self.assertEqual(next_uri, 'http://spreadsheets.google.com/feeds/cells/'
+                     'k/w/private/full?start-index=4')
+    self.assertEqual(rows, [['Name', 'Hours'], [], [None, None, '=B3*2']])
+
+  def test_displayed_values(self):
+    rows = []
+    gdata.spreadsheets.data.ParseCellValues(
+        StringIO.StringIO(VALUES_FEED), rows,
+        gdata.spreadsheets.data.DISPLAYED_VALUE)
+    self.assertEqual(rows, [['Name', 'Hours'], [], [None, None, '5']])
+
+  def test_numeric_values(self):
+    rows = []
+    gdata.spreadsheets.data.parse_cell_values(
+        StringIO.StringIO(VALUES_FEED), rows,
+        gdata.spreadsheets.data.NUMERIC_VALUE)
+    self.assertEqual(len(rows), 3)
+    self.assertEqual(len(rows[0]), 2)
+    self.assertTrue(math.isnan(rows[0][0]))
+    self.assertEqual(len(rows[1]), 0)
+    self.assertTrue(math.isnan(rows[2][1]))
+    self.assertEqual(rows[2][2], 5.0)
+
+  def test_values_are_added_to_existing_rows(self):
+    rows = [['Name']]
+    next_uri = gdata.spreadsheets.data.parse_cell_values(
+        StringIO.StringIO(VALUES_FEED.replace('rel="next"', 'rel="self"')),
+        rows)
+    self.assertEqual(next_uri, None)
+    self.assertEqual(rows[0], ['Name', 'Hours'])
+
+
 class DataClassSanityTest(unittest.TestCase):
 
   def test_basic_element_structure(self):
@@ -687,7 +801,8 @@ class DataClassSanityTest(unittest.TestCase):
 
 def suite():
   return conf.build_suite([SpreadsheetEntryTest, DataClassSanityTest,
-                           ListEntryTest, RecordEntryTest])
+                           ListEntryTest, RecordEntryTest,
+                           ParseCellValuesTest])
 
 
 if __name__ == '__main__':
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2009 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Compares memory and time used to read a large worksheet's cells.
+
+Parses a generated cells feed either into a CellsFeed, as get_cells does,
+or into rows of values, as get_worksheet_values does. Each run uses a new
+process so that the peak memory use can be compared. Usage:
+
+  python spreadsheets_benchmark.py [--rows=2500] [--cols=20]
+"""
+
+
+import getopt
+import resource
+import StringIO
+import subprocess
+import sys
+import time
+import atom.core
+import gdata.spreadsheets.data
+
+
+CELL_ENTRY = """<entry gd:etag='"ImA9D1APFyp7"'>
+  <id>https://spreadsheets.google.com/feeds/cells/k/w/private/full/R%(row)iC%(col)i</id>
+  <updated>2011-11-17T18:27:32.543Z</updated>
+  <category scheme="http://schemas.google.com/spreadsheets/2006"
+    term="http://schemas.google.com/spreadsheets/2006#cell"/>
+  <title type="text">R%(row)iC%(col)i</title>
+  <content type="text">%(value)i</content>
+  <link rel="self" type="application/atom+xml"
+    href="https://spreadsheets.google.com/feeds/cells/k/w/private/full/R%(row)iC%(col)i"/>
+  <link rel="edit" type="application/atom+xml"
+    href="https://spreadsheets.google.com/feeds/cells/k/w/private/full/R%(row)iC%(col)i/bgvjf"/>
+  <gs:cell row="%(row)i" col="%(col)i" inputValue="%(value)i"
+    numericValue="%(value)i.0">%(value)i</gs:cell>
+</entry>
+"""
+
+
+def build_feed(row_count, col_count):
+  parts = ['<feed xmlns="http://www.w3.org/2005/Atom" '
+           'xmlns:gs="http://schemas.google.com/spreadsheets/2006" '
+           'xmlns:gd="http://schemas.google.com/g/2005">']
+  for row in xrange(1, row_count + 1):
+    for col in xrange(1, col_count + 1):
+      parts.append(CELL_ENTRY % {'row': row, 'col': col,
+                                 'value': row * col})
+  parts.append('</feed>')
+  return ''.join(parts)
+
+
+def run(mode, row_count, col_count):
+  """Parses the feed in this process and prints the time and peak memory."""
+  xml = build_feed(row_count, col_count)
+  base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  start = time.time()
+  if mode == 'cells_feed':
+    result = atom.core.parse(xml, gdata.spreadsheets.data.CellsFeed)
+  else:
+    result = []
+    gdata.spreadsheets.data.parse_cell_values(
+        StringIO.StringIO(xml), result, mode)
+  elapsed = time.time() - start
+  peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  print '%-10s %8.2fs %8.1fMB' % (mode, elapsed,
+                                  (peak_rss - base_rss) / 1024.0)
+
+
+def main():
+  row_count = 2500
+  col_count = 20
+  opts, args = getopt.getopt(sys.argv[1:], '', ['rows=', 'cols=', 'mode='])
+  mode = None
+  for option, value in opts:
+    if option == '--rows':
+      row_count = int(value)
+    elif option == '--cols':
+      col_count = int(value)
+    elif option == '--mode':
+      mode = value
+  if mode is not None:
+    run(mode, row_count, col_count)
+    return
+  print '%i cells' % (row_count * col_count)
+  for mode in ('cells_feed', gdata.spreadsheets.data.INPUT_VALUE,
+               gdata.spreadsheets.data.NUMERIC_VALUE):
+    subprocess.call([sys.executable, sys.argv[0], '--rows=%i' % row_count,
+                     '--cols=%i' % col_count, '--mode=%s' % mode])
+
+
+if __name__ == '__main__':
+  main()